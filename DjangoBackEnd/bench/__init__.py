@@ -0,0 +1,15 @@
+"""
+Benchmarks and load tests for the RTM-VTS backend.
+
+Run them from the DjangoBackEnd directory as modules, e.g.
+`python -m bench.trip_load`. They use local stubs instead of the real
+upstream APIs, so results are reproducible and need no credentials.
+"""
+import os
+
+
+def setup_django():
+    """Configure Django for a standalone bench script."""
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "univ.settings")
+    import django
+    django.setup()
@@ -0,0 +1,174 @@
+"""
+Benchmark: DATEX II snapshot parsing.
+
+Compares the previous per-field extraction in `fetch_vts_situations`
+(`ET.fromstring` of the whole snapshot, then a `find`/`findtext` path lookup
+for every field of every record) with the shared streaming parser in
+`map.datex`, using both its ElementTree and (when installed) lxml backends,
+over one or more recorded snapshots or a synthetic one. For the full national
+snapshot, save a `pullsnapshotdata` response without filters and pass it with
+`--snapshot`. Run from DjangoBackEnd:
+
+    python -m bench.datex_parse --snapshot debug_response.xml other_snapshot.xml
+    python -m bench.datex_parse --situations 5000 --records 2
+"""
+import argparse
+import json
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from bench.datex_snapshot import load_snapshot
+from map import datex
+
+NAMESPACES = {
+    'ns12': 'http://datex2.eu/schema/3/situation',
+    'ns8': 'http://datex2.eu/schema/3/locationReferencing',
+    'common': 'http://datex2.eu/schema/3/common',
+}
+
+
+def legacy_records(xml_data):
+    """The extraction as `fetch_vts_situations` did it before `map.datex`, kept for comparison."""
+    ns = NAMESPACES
+    records = []
+    root = ET.fromstring(xml_data)
+    for situation in root.findall(".//ns12:situationRecord", ns):
+        xsi_type = situation.attrib.get('{http://www.w3.org/2001/XMLSchema-instance}type')
+        fields = {
+            'record_id': situation.get("id"),
+            'version': situation.get("version"),
+            'record_type': xsi_type.split(':')[-1] if xsi_type else 'Unknown',
+            'creation_time': situation.findtext("ns12:situationRecordCreationTime", namespaces=ns),
+            'version_time': situation.findtext("ns12:situationRecordVersionTime", namespaces=ns),
+            'probability_of_occurrence': situation.findtext("ns12:probabilityOfOccurrence", namespaces=ns),
+            'severity': situation.findtext("ns12:severity", namespaces=ns),
+        }
+        comment = situation.find("ns12:generalPublicComment", namespaces=ns)
+        if comment is not None:
+            fields['comments'] = [cv.text for cv in comment.findall(".//common:value", namespaces=ns) if cv.text]
+        source = situation.find("ns12:source", namespaces=ns)
+        if source is not None:
+            fields['source_country'] = source.findtext("common:sourceCountry", namespaces=ns)
+            fields['source_identification'] = source.findtext("common:sourceIdentification", namespaces=ns)
+            fields['source_name'] = source.findtext("common:sourceName/common:values/common:value", namespaces=ns)
+            fields['source_type'] = source.findtext("common:sourceType", namespaces=ns)
+        validity = situation.find("ns12:validity", namespaces=ns)
+        if validity is not None:
+            fields['validity_status'] = validity.findtext("common:validityStatus", namespaces=ns)
+            fields['overall_start_time'] = validity.findtext("common:validityTimeSpecification/common:overallStartTime", namespaces=ns)
+            fields['overall_end_time'] = validity.findtext("common:validityTimeSpecification/common:overallEndTime", namespaces=ns)
+        location = situation.find("ns12:locationReference", namespaces=ns)
+        if location is not None:
+            fields['latitude'] = location.findtext(".//ns8:latitude", namespaces=ns)
+            fields['longitude'] = location.findtext(".//ns8:longitude", namespaces=ns)
+            fields['location_description'] = location.findtext(".//ns8:locationDescription/common:values/common:value", namespaces=ns)
+            fields['road_number'] = location.findtext(".//ns8:roadInformation/ns8:roadNumber", namespaces=ns)
+            area = location.find(".//ns8:areaName", namespaces=ns)
+            if area is not None:
+                fields['area_names'] = [v.text for v in area.findall("common:values/common:value", namespaces=ns) if v.text]
+            line = location.find(".//ns8:gmlLineString", namespaces=ns)
+            if line is not None:
+                fields['pos_list'] = line.findtext("ns8:posList", namespaces=ns)
+        records.append(fields)
+    return records
+
+
+def legacy_view(record, keys):
+    """The fields of a `SituationRecord` in the shape `legacy_records` returns them."""
+    view = {}
+    for key in keys:
+        if key in ('comments', 'area_names'):
+            view[key] = list(getattr(record, key))
+        elif key == 'location_description':
+            view[key] = record.location_descriptions[0] if record.location_descriptions else None
+        else:
+            view[key] = getattr(record, key)
+    return view
+
+
+def matches_legacy(legacy, records):
+    """Whether the parser gives every record the field values the legacy extraction did."""
+    return len(legacy) == len(records) and all(
+        legacy_view(record, fields) == fields for fields, record in zip(legacy, records)
+    )
+
+
+def etree_records(xml_data):
+    return list(datex.iter_records(xml_data, backend='etree'))
+
+
+def lxml_records(xml_data):
+    return list(datex.iter_records(xml_data, backend='lxml'))
+
+
+def measure(repeat, fn, xml_data):
+    """Best wall time over `repeat` runs, plus the peak traced memory of one run."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(xml_data)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn(xml_data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak, result
+
+
+def bench_snapshot(name, xml_data, repeat):
+    legacy_s, legacy_peak, legacy = measure(repeat, legacy_records, xml_data)
+    etree_s, etree_peak, records = measure(repeat, etree_records, xml_data)
+    result = {
+        "snapshot": name,
+        "bytes": len(xml_data),
+        "records": len(records),
+        "legacy_records": len(legacy),
+        "etree_matches_legacy": matches_legacy(legacy, records),
+        "legacy_s": round(legacy_s, 4),
+        "etree_s": round(etree_s, 4),
+        "etree_speedup": round(legacy_s / etree_s, 2) if etree_s else None,
+        "etree_records_per_s": round(len(records) / etree_s) if etree_s else None,
+        "legacy_peak_mb": round(legacy_peak / 2**20, 1),
+        "etree_peak_mb": round(etree_peak / 2**20, 1),
+    }
+    if datex._lxml is not None:
+        lxml_s, lxml_peak, lxml_result = measure(repeat, lxml_records, xml_data)
+        result.update({
+            "lxml_s": round(lxml_s, 4),
+            "lxml_speedup": round(legacy_s / lxml_s, 2) if lxml_s else None,
+            "lxml_records_per_s": round(len(lxml_result) / lxml_s) if lxml_s else None,
+            "lxml_peak_mb": round(lxml_peak / 2**20, 1),
+            "lxml_matches_etree": lxml_result == records,
+        })
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--snapshot', nargs='*', default=[], help='Recorded DATEX snapshots (default: synthetic).')
+    parser.add_argument('--situations', type=int, default=2000, help='Synthetic situations.')
+    parser.add_argument('--records', type=int, default=1, help='situationRecords per synthetic situation.')
+    parser.add_argument('--points', type=int, default=60, help='Vertices per synthetic posList.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per variant; the best is reported.')
+    args = parser.parse_args(argv)
+
+    if args.snapshot:
+        snapshots = [(path, Path(path).read_bytes()) for path in args.snapshot]
+    else:
+        name = f"synthetic({args.situations}x{args.records}x{args.points})"
+        snapshots = [(name, load_snapshot(
+            situations=args.situations, records_per_situation=args.records, points_per_line=args.points,
+        ))]
+
+    results = {
+        "benchmark": "datex_parse",
+        "snapshots": [bench_snapshot(name, xml_data, args.repeat) for name, xml_data in snapshots],
+    }
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
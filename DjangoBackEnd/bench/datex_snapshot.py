@@ -0,0 +1,136 @@
+"""
+Synthetic DATEX II (v3) situation snapshots for benchmarks and tests.
+
+The layout follows what `pullsnapshotdata` returns: a messageContainer with a
+SituationPublication payload, one `situation` per event and one or more
+`situationRecord`s with source, validity, comments and a location reference.
+Line geometries are written either as WGS84 "lat lon" pairs or as
+EPSG:25833 "easting northing" pairs, like the real feed.
+
+Prefer a recorded snapshot when you have one (`fetch_vts_situations` writes
+the last response to `debug_response.xml`); every bench script accepts
+`--snapshot PATH`.
+"""
+import random
+from xml.sax.saxutils import escape
+
+from pyproj import Transformer
+
+TROMS_BBOX_COORDS = (14.0, 68.2, 22.0, 70.5)  # Same area as map.utils.TROMS_BBOX_COORDS
+
+# Where most roads, routes and situations are: Tromsø, Harstad, Finnsnes, Bardufoss, Narvik (lon, lat)
+TOWNS = [(18.955, 69.649), (16.541, 68.798), (17.981, 69.229), (18.520, 69.063), (17.427, 68.438)]
+
+RECORD_TYPES = ["MaintenanceWorks", "Accident", "AbnormalTraffic", "ConstructionWorks", "GeneralObstruction"]
+SEVERITIES = ["low", "medium", "high", "highest", "unknown"]
+COUNTIES = ["Troms", "Finnmark", "Nordland"]
+
+_NAMESPACES = (
+    'xmlns:ns2="http://datex2.eu/schema/3/messageContainer" '
+    'xmlns:com="http://datex2.eu/schema/3/common" '
+    'xmlns:loc="http://datex2.eu/schema/3/locationReferencing" '
+    'xmlns:sit="http://datex2.eu/schema/3/situation" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+)
+
+
+def _random_walk(rng, points, town_fraction=0.0):
+    """
+    A lon/lat polyline of `points` vertices (~30 m steps) inside the Troms bbox.
+
+    With probability `town_fraction` it starts within ~10 km of one of `TOWNS`.
+    """
+    min_lon, min_lat, max_lon, max_lat = TROMS_BBOX_COORDS
+    if town_fraction and rng.random() < town_fraction:
+        town_lon, town_lat = rng.choice(TOWNS)
+        lon = town_lon + rng.uniform(-0.25, 0.25)
+        lat = town_lat + rng.uniform(-0.09, 0.09)
+    else:
+        lon = rng.uniform(min_lon + 0.5, max_lon - 0.5)
+        lat = rng.uniform(min_lat + 0.2, max_lat - 0.2)
+    coords = []
+    for _ in range(points):
+        coords.append((lon, lat))
+        lon += rng.uniform(-0.0008, 0.0008)
+        lat += rng.uniform(-0.0003, 0.0003)
+    return coords
+
+
+def synthetic_snapshot(situations=500, points_per_line=60, utm_fraction=0.5, records_per_situation=1, seed=42,
+                       town_fraction=0.0):
+    """
+    Return a DATEX II snapshot as UTF-8 bytes.
+
+    Args:
+        situations: Number of `situation` elements.
+        points_per_line: Vertices in each posList.
+        utm_fraction: Share of posLists written in EPSG:25833 instead of WGS84.
+        records_per_situation: situationRecords per situation.
+        seed: Random seed, so runs are reproducible.
+        town_fraction: Share of situations placed near one of `TOWNS` rather than anywhere in the bbox.
+    """
+    rng = random.Random(seed)
+    to_utm = Transformer.from_crs("EPSG:4326", "EPSG:25833", always_xy=True)
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        f'<ns2:messageContainer {_NAMESPACES} modelBaseVersion="3">',
+        '<ns2:payload xsi:type="sit:SituationPublication" lang="no" modelBaseVersion="3">',
+        '<com:publicationTime>2025-04-24T08:00:00Z</com:publicationTime>',
+    ]
+    for s in range(situations):
+        parts.append(f'<sit:situation id="NPRA_HBT_{s}">')
+        parts.append(f'<sit:overallSeverity>{rng.choice(SEVERITIES)}</sit:overallSeverity>')
+        for r in range(records_per_situation):
+            coords = _random_walk(rng, points_per_line, town_fraction)
+            if rng.random() < utm_fraction:
+                xs, ys = to_utm.transform([c[0] for c in coords], [c[1] for c in coords])
+                pos_list = ' '.join(f'{x:.2f} {y:.2f}' for x, y in zip(xs, ys))
+            else:
+                pos_list = ' '.join(f'{lat:.6f} {lon:.6f}' for lon, lat in coords)
+            display_lon, display_lat = coords[len(coords) // 2]
+            record_type = rng.choice(RECORD_TYPES)
+            road_number = f"E{rng.choice([6, 8, 10, 45])}" if rng.random() < 0.5 else f"Fv{rng.randint(1, 999)}"
+            county = rng.choice(COUNTIES)
+            closure = '<sit:roadOrCarriagewayOrLaneManagementType>roadClosed</sit:roadOrCarriagewayOrLaneManagementType>' if rng.random() < 0.2 else ''
+            ferry = ('<sit:transitServiceInformation>cancellations</sit:transitServiceInformation>'
+                     '<sit:transitServiceType>ferry</sit:transitServiceType>') if rng.random() < 0.1 else ''
+            parts.append(
+                f'<sit:situationRecord xsi:type="sit:{record_type}" id="NPRA_HBT_{s}_{r}" version="{rng.randint(1, 9)}">'
+                '<sit:situationRecordCreationTime>2025-04-23T10:00:00+02:00</sit:situationRecordCreationTime>'
+                '<sit:situationRecordVersionTime>2025-04-24T07:55:00+02:00</sit:situationRecordVersionTime>'
+                '<sit:probabilityOfOccurrence>certain</sit:probabilityOfOccurrence>'
+                f'<sit:severity>{rng.choice(SEVERITIES)}</sit:severity>'
+                '<sit:source><com:sourceCountry>no</com:sourceCountry>'
+                '<com:sourceIdentification>NPRA</com:sourceIdentification>'
+                '<com:sourceName><com:values><com:value lang="no">Statens vegvesen</com:value></com:values></com:sourceName>'
+                '<com:sourceType>roadOperator</com:sourceType></sit:source>'
+                '<sit:validity><com:validityStatus>definedByValidityTimeSpec</com:validityStatus>'
+                '<com:validityTimeSpecification><com:overallStartTime>2025-04-23T10:00:00+02:00</com:overallStartTime>'
+                '<com:overallEndTime>2025-05-30T16:00:00+02:00</com:overallEndTime></com:validityTimeSpecification></sit:validity>'
+                '<sit:generalPublicComment><sit:comment><com:values>'
+                f'<com:value lang="no">{escape(f"{record_type} på {road_number}, situasjon {s}.")}</com:value>'
+                '</com:values></sit:comment></sit:generalPublicComment>'
+                '<sit:locationReference xsi:type="loc:SingleRoadLinearLocation">'
+                f'<loc:gmlLineString srsDimension="2"><loc:posList>{pos_list}</loc:posList></loc:gmlLineString>'
+                f'<loc:coordinatesForDisplay><loc:latitude>{display_lat:.6f}</loc:latitude>'
+                f'<loc:longitude>{display_lon:.6f}</loc:longitude></loc:coordinatesForDisplay>'
+                f'<loc:locationDescription><com:values><com:value lang="no">{escape(f"{road_number} ved km {rng.randint(1, 300)}")}</com:value>'
+                '</com:values></loc:locationDescription>'
+                f'<loc:roadInformation><loc:roadName>{escape(road_number)}</loc:roadName><loc:roadNumber>{road_number}</loc:roadNumber></loc:roadInformation>'
+                f'<loc:areaExtension><loc:namedArea><loc:areaName><com:values><com:value lang="no">{county}</com:value>'
+                '</com:values></loc:areaName></loc:namedArea></loc:areaExtension>'
+                '</sit:locationReference>'
+                f'{closure}{ferry}'
+                '</sit:situationRecord>'
+            )
+        parts.append('</sit:situation>')
+    parts.append('</ns2:payload></ns2:messageContainer>')
+    return ''.join(parts).encode('utf-8')
+
+
+def load_snapshot(path=None, **synthetic_options):
+    """Read a recorded snapshot from `path`, or build a synthetic one when no path is given."""
+    if path:
+        with open(path, 'rb') as f:
+            return f.read()
+    return synthetic_snapshot(**synthetic_options)
@@ -0,0 +1,213 @@
+"""
+Benchmark: the whole pipeline on synthetic Troms-like data.
+
+Creates a throwaway test database, then times
+
+1. ingest:  parsing a synthetic DATEX snapshot and storing its records,
+2. routes:  inserting synthetic bus routes,
+3. detect:  calculate_and_store_collisions at several tolerances, then
+            once with them as tiers (one pass, every pair classified),
+4. publish: publish_new_collisions to a local fake broker (LocalMqttSink),
+5. views:   every JSON API view through the Django test client,
+
+and prints the results as JSON (also written to `--output`), tagged with the
+git commit so runs can be compared across commits. The trip view's journey
+planner is a local stub. Run from DjangoBackEnd:
+
+    python -m bench.pipeline --routes 60 --situations 500 --output bench_results.json
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from io import StringIO
+
+from bench import setup_django
+from bench.datex_snapshot import synthetic_snapshot
+from bench.synthetic import DEFAULT_ROUTE_POINTS, create_bus_routes, synthetic_routes
+
+DEFAULT_TOLERANCES = [50, 100, 300, 1000]
+
+# (name, method, path, data); streaming endpoints (api/live/) are not timed here.
+VIEWS = [
+    ("map", "get", "/", None),
+    ("filter_options", "get", "/api/filter-options/", None),
+    ("location_geojson", "get", "/api/location_geojson/", None),
+    ("location_geojson_filtered", "get", "/api/location_geojson/", {"county": "Troms", "severity": "high"}),
+    ("busroute", "get", "/api/busroute/", None),
+    ("stored_collisions", "get", "/api/stored_collisions/", None),
+    ("serve_geojson", "get", "/api/serve_geojson/", None),
+    ("serve_bus", "get", "/api/serve_bus/", None),
+    ("trip", "post", "/trip/", {"from": "NSR:StopPlace:1"}),
+    ("trip_cache_stats", "get", "/api/trip-cache/stats/", None),
+]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def bench_ingest(snapshot):
+    from map.datex import iter_records
+    from map.management.commands.fetch_vts_situations import Command as FetchCommand
+
+    parse_s, records = timed(lambda: list(iter_records(snapshot)))
+    store_s, _ = timed(FetchCommand().store_records, records)
+    return {
+        "snapshot_bytes": len(snapshot),
+        "records": len(records),
+        "parse_s": round(parse_s, 4),
+        "store_s": round(store_s, 4),
+        "records_per_s": round(len(records) / (parse_s + store_s)) if parse_s + store_s else None,
+    }
+
+
+def bench_detect(tolerances):
+    from django.core.management import call_command
+    from map.models import DetectedCollision
+
+    results = []
+    for tolerance in tolerances:
+        seconds, _ = timed(call_command, 'calculate_and_store_collisions', tolerance=tolerance, stdout=StringIO())
+        results.append({
+            "tolerance_m": tolerance,
+            "seconds": round(seconds, 4),
+            "collisions": DetectedCollision.objects.count(),
+        })
+    seconds, _ = timed(call_command, 'calculate_and_store_collisions', tiers=tolerances, stdout=StringIO())
+    results.append({
+        "tiers_m": tolerances,
+        "seconds": round(seconds, 4),
+        "collisions": DetectedCollision.objects.count(),
+    })
+    return results
+
+
+def bench_publish():
+    from django.core.management import call_command
+    from map.mqtt_sink import LocalMqttSink
+
+    sink = LocalMqttSink(keep_messages=False)
+    seconds, _ = timed(call_command, 'publish_new_collisions', sink=sink, stdout=StringIO())
+    return {
+        "messages": sink.count,
+        "seconds": round(seconds, 4),
+        "messages_per_s": round(sink.count / seconds) if seconds else None,
+    }
+
+
+def bench_views(repeat):
+    from django.test import Client, override_settings
+    from map.testing import StubUpstream, json_responder, journey_planner_trip_response
+    from map.trip_cache import trip_cache
+
+    client = Client()
+    results = {}
+    with StubUpstream(json_responder(journey_planner_trip_response())) as stub, \
+            override_settings(ENTUR_JOURNEY_PLANNER_URL=stub.url):
+        trip_cache.clear()
+        for name, method, path, data in VIEWS:
+            timings = []
+            response = None
+            for n in range(repeat + 1):  # The first call warms caches and is not counted
+                request_data = dict(data or {})
+                if name == "trip":
+                    request_data["to"] = f"NSR:StopPlace:{n}"  # A new trip every time, so no cache hits
+                start = time.perf_counter()
+                response = getattr(client, method)(path, request_data)
+                if n:
+                    timings.append(time.perf_counter() - start)
+            results[name] = {
+                "status": response.status_code,
+                "bytes": len(response.content),
+                "median_ms": round(statistics.median(timings) * 1000, 2),
+                "p95_ms": round(statistics.quantiles(timings, n=20)[-1] * 1000, 2) if len(timings) > 1 else None,
+            }
+    return results
+
+
+def run(args):
+    from django.db import connection
+
+    snapshot = synthetic_snapshot(
+        situations=args.situations, points_per_line=args.points, utm_fraction=0.0,
+        seed=args.seed, town_fraction=args.town_fraction,
+    )
+    routes = synthetic_routes(args.routes, tuple(args.route_points), seed=args.seed, town_fraction=args.town_fraction)
+
+    results = {
+        "benchmark": "pipeline",
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "database": connection.vendor,
+        "parameters": {
+            "routes": args.routes, "route_points": args.route_points, "situations": args.situations,
+            "points_per_situation": args.points, "tolerances": args.tolerances, "view_repeat": args.view_repeat,
+            "seed": args.seed,
+        },
+    }
+    results["ingest"] = bench_ingest(snapshot)
+    routes_s, _ = timed(create_bus_routes, routes)
+    results["routes"] = {
+        "routes": len(routes),
+        "vertices": sum(len(coords) for _, coords in routes),
+        "seconds": round(routes_s, 4),
+    }
+    results["detect"] = bench_detect(sorted(args.tolerances))
+    results["publish"] = bench_publish()  # Collisions of the largest tolerance
+    results["views"] = bench_views(args.view_repeat)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--routes', type=int, default=60, help='Synthetic bus routes.')
+    parser.add_argument('--route-points', type=int, nargs=2, default=list(DEFAULT_ROUTE_POINTS),
+                        metavar=('MIN', 'MAX'), help='Vertex count range per route.')
+    parser.add_argument('--situations', type=int, default=500, help='Synthetic situations.')
+    parser.add_argument('--points', type=int, default=60, help='Vertices per situation path.')
+    parser.add_argument('--town-fraction', type=float, default=0.8, help='Share of routes/situations near towns.')
+    parser.add_argument('--tolerances', type=int, nargs='+', default=DEFAULT_TOLERANCES, help='Collision tolerances (m).')
+    parser.add_argument('--view-repeat', type=int, default=20, help='Timed requests per view.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Also write the JSON results to this file.')
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    # Never touch the real database: run against a throwaway test database
+    setup_test_environment(debug=False)
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        results = run(args)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    return results
+
+
+if __name__ == "__main__":
+    main()
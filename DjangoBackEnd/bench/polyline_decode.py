@@ -0,0 +1,103 @@
+"""
+Benchmark: decoding Entur encoded polylines.
+
+Compares `polyline.decode` followed by the lat/lon swap comprehension (what
+`get_trip_geojson` and fetch-coordinates did) with `map.polylines.decode`
+per polyline and `map.polylines.decode_many` over the whole set. The set is
+the full TRO service journey set when a route file written by
+fetch-coordinates is given (its shapes are re-encoded), otherwise synthetic
+Troms-like routes of the same size. Run from DjangoBackEnd:
+
+    python -m bench.polyline_decode --routes data/route_coordinates.ndjson
+    python -m bench.polyline_decode --journeys 3000
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy as np
+import polyline
+
+from bench.synthetic import synthetic_routes
+from map import polylines
+from map.route_shapes import iter_features
+
+# Roughly the number of TRO serviceJourneys fetch-coordinates sees in a day
+DEFAULT_JOURNEYS = 3000
+
+
+def legacy_decode(encoded):
+    return [[[lon, lat] for lat, lon in polyline.decode(points)] for points in encoded]
+
+
+def per_polyline_decode(encoded):
+    return [polylines.decode(points) for points in encoded]
+
+
+def batched_decode(encoded):
+    return polylines.decode_many(encoded)
+
+
+def measure(repeat, fn, encoded):
+    """Best wall time over `repeat` runs, plus the peak traced memory of one run."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(encoded)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn(encoded)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak, result
+
+
+def load_encoded(routes_path=None, journeys=DEFAULT_JOURNEYS):
+    """Encoded polylines of a fetch-coordinates route file, or of synthetic routes."""
+    if routes_path:
+        return [
+            polyline.encode([(lat, lon) for lon, lat in feature['geometry']['coordinates']])
+            for feature in iter_features(routes_path)
+        ]
+    return [polyline.encode([(lat, lon) for lon, lat in coords]) for _, coords in synthetic_routes(journeys)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--routes', help='Route file written by fetch-coordinates (default: synthetic routes).')
+    parser.add_argument('--journeys', type=int, default=DEFAULT_JOURNEYS, help='Synthetic journeys.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per variant; the best is reported.')
+    args = parser.parse_args(argv)
+
+    encoded = load_encoded(args.routes, args.journeys)
+    legacy_s, legacy_peak, legacy = measure(args.repeat, legacy_decode, encoded)
+    single_s, single_peak, _ = measure(args.repeat, per_polyline_decode, encoded)
+    batched_s, batched_peak, (coords, offsets) = measure(args.repeat, batched_decode, encoded)
+    points = len(coords)
+
+    results = {
+        "benchmark": "polyline_decode",
+        "source": args.routes or f"synthetic({args.journeys})",
+        "polylines": len(encoded),
+        "points": points,
+        "encoded_bytes": sum(len(points) for points in encoded),
+        "legacy_s": round(legacy_s, 4),
+        "per_polyline_s": round(single_s, 4),
+        "batched_s": round(batched_s, 4),
+        "batched_speedup": round(legacy_s / batched_s, 2) if batched_s else None,
+        "batched_points_per_s": round(points / batched_s) if batched_s else None,
+        "legacy_peak_mb": round(legacy_peak / 2**20, 1),
+        "per_polyline_peak_mb": round(single_peak / 2**20, 1),
+        "batched_peak_mb": round(batched_peak / 2**20, 1),
+        "matches_legacy": all(
+            np.array_equal(np.asarray(expected).reshape(-1, 2), actual)
+            for expected, actual in zip(legacy, polylines.split(coords, offsets))
+        ),
+    }
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark: opening the memory-mapped route index versus rebuilding route
+geometry per process.
+
+Without the index every worker or cron run would project and simplify
+every route (`RouteGeometry.from_lonlat`) before it can check a point;
+with it a process maps the file written by import_bus_routes. Also compares
+finding the routes near a set of situation points through the index grid
+with checking every route's bbox and segments. Synthetic Troms-like routes;
+run from DjangoBackEnd:
+
+    python -m bench.route_index --routes 3000 --points 300
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from bench.synthetic import synthetic_routes
+from map.geometry import project_lonlat
+from map.route_geometry import DEFAULT_SIMPLIFY_TOLERANCE_METERS, RouteGeometry
+from map.route_index import DEFAULT_CELL_METERS, RouteIndex, write_route_index
+
+DEFAULT_ROUTES = 3000
+DEFAULT_POINTS = 300
+TOLERANCE_METERS = 300
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--routes', type=int, default=DEFAULT_ROUTES, help='Synthetic route shapes.')
+    parser.add_argument('--points', type=int, default=DEFAULT_POINTS, help='Situation points to check.')
+    args = parser.parse_args(argv)
+
+    shapes = synthetic_routes(args.routes)
+    start = time.perf_counter()
+    geometries = [
+        (n, route_id, RouteGeometry.from_lonlat(coords, DEFAULT_SIMPLIFY_TOLERANCE_METERS))
+        for n, (route_id, coords) in enumerate(shapes)
+    ]
+    rebuild_s = time.perf_counter() - start
+
+    rng = np.random.default_rng(7)
+    picks = rng.integers(0, len(shapes), args.points)
+    points = project_lonlat([shapes[i][1][len(shapes[i][1]) // 2] for i in picks]) + rng.normal(0, 150, (args.points, 2))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "route_index.bin")
+        start = time.perf_counter()
+        write_route_index(path, geometries, cell_size=DEFAULT_CELL_METERS)
+        write_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = RouteIndex.open(path)
+        open_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        point_index, route_index, _ = index.pairs_within(points, TOLERANCE_METERS)
+        index_query_s = time.perf_counter() - start
+        index_pairs = set(zip(point_index.tolist(), route_index.tolist()))
+
+        start = time.perf_counter()
+        scan_pairs = set()
+        for r, (_, _, geometry) in enumerate(geometries):
+            distances = geometry.points_distance(points, TOLERANCE_METERS)
+            scan_pairs.update((int(i), r) for i in np.flatnonzero(distances <= TOLERANCE_METERS))
+        scan_query_s = time.perf_counter() - start
+
+        results = {
+            "benchmark": "route_index",
+            "routes": len(shapes),
+            "input_points": sum(len(coords) for _, coords in shapes),
+            "index_segments": len(index.segments),
+            "index_bytes": os.path.getsize(path),
+            "rebuild_geometry_s": round(rebuild_s, 4),
+            "write_index_s": round(write_s, 4),
+            "open_index_s": round(open_s, 6),
+            "situation_points": args.points,
+            "pairs": len(index_pairs),
+            "index_query_s": round(index_query_s, 4),
+            "per_route_scan_s": round(scan_query_s, 4),
+            "matches_scan": index_pairs == scan_pairs,
+        }
+        del index, point_index, route_index
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
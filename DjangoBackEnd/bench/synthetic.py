@@ -0,0 +1,61 @@
+"""
+Synthetic Troms-like bus routes for the pipeline benchmark.
+
+Routes are random walks with a persistent heading (so they look like roads,
+not noise), ~25 m between vertices, mostly around the towns in
+`bench.datex_snapshot.TOWNS` where the synthetic situations also cluster.
+Situations come from `bench.datex_snapshot.synthetic_snapshot`.
+"""
+import math
+import random
+
+from bench.datex_snapshot import TOWNS, TROMS_BBOX_COORDS
+
+# Real TRO serviceJourney shapes have a few hundred to a few thousand vertices.
+DEFAULT_ROUTE_POINTS = (300, 2500)
+
+
+def synthetic_route_coords(rng, points, town_fraction=0.9):
+    """A lon/lat polyline of `points` vertices that stays inside `TROMS_BBOX_COORDS`."""
+    min_lon, min_lat, max_lon, max_lat = TROMS_BBOX_COORDS
+    if rng.random() < town_fraction:
+        lon, lat = rng.choice(TOWNS)
+        lon += rng.uniform(-0.1, 0.1)
+        lat += rng.uniform(-0.04, 0.04)
+    else:
+        lon = rng.uniform(min_lon + 0.5, max_lon - 0.5)
+        lat = rng.uniform(min_lat + 0.2, max_lat - 0.2)
+    heading = rng.uniform(0, 2 * math.pi)
+    step = 25 / 111_320  # ~25 m in degrees of latitude
+    coords = []
+    for _ in range(points):
+        coords.append((lon, lat))
+        heading += rng.gauss(0, 0.15)
+        lon += step * math.cos(heading) / math.cos(math.radians(lat))
+        lat += step * math.sin(heading)
+        # Turn back instead of leaving the area
+        if not (min_lon < lon < max_lon and min_lat < lat < max_lat):
+            heading += math.pi
+            lon = min(max(lon, min_lon), max_lon)
+            lat = min(max(lat, min_lat), max_lat)
+    return coords
+
+
+def synthetic_routes(count=60, points=DEFAULT_ROUTE_POINTS, seed=7, town_fraction=0.9):
+    """Return `count` (route_id, coords) pairs with vertex counts drawn from the `points` range."""
+    rng = random.Random(seed)
+    return [
+        (str(100 + n), synthetic_route_coords(rng, rng.randint(*points), town_fraction))
+        for n in range(count)
+    ]
+
+
+def create_bus_routes(routes):
+    """Bulk-insert `synthetic_routes()` output as BusRoute rows (Django must be set up)."""
+    from django.contrib.gis.geos import LineString
+    from map.models import BusRoute
+
+    return BusRoute.objects.bulk_create(
+        BusRoute(route_id=route_id, path=LineString(coords, srid=4326), version="synthetic")
+        for route_id, coords in routes
+    )
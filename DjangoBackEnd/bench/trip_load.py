@@ -0,0 +1,92 @@
+"""
+Load test: trip planning throughput while the journey planner is slow.
+
+A sync view holds its worker for the whole upstream call, so throughput is
+capped at `workers / latency`. The async `trip` view only holds a coroutine,
+so one process keeps serving while requests wait on Entur.
+
+The journey planner is replaced by a local stub with configurable latency.
+Every request asks for a different destination and the trip cache is
+cleared between scenarios, so each request really waits on the upstream.
+Run from DjangoBackEnd:
+
+    python -m bench.trip_load --requests 200 --latency 0.5 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench import setup_django
+
+
+def run_sync(get_trip_geojson, total, workers):
+    """Emulate `workers` sync worker threads each serving trip requests."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda n: get_trip_geojson("NSR:StopPlace:1", f"NSR:StopPlace:{n}", 1), range(total)))
+    elapsed = time.perf_counter() - start
+    return elapsed, sum(1 for result in results if result is not None)
+
+
+async def run_async(trip_view, total, concurrency):
+    """Send `total` POSTs to the async trip view on a single event loop."""
+    from django.test import AsyncRequestFactory
+    from map.upstream import close_async_clients
+
+    factory = AsyncRequestFactory()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(n):
+        async with semaphore:
+            request = factory.post('/trip/', {'from': "NSR:StopPlace:1", 'to': f"NSR:StopPlace:{n}"})
+            response = await trip_view(request)
+            return json.loads(response.content)['trip_data'] is not None
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(n) for n in range(total)))
+    elapsed = time.perf_counter() - start
+    await close_async_clients()
+    return elapsed, sum(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=100, help='Trip requests per scenario.')
+    parser.add_argument('--latency', type=float, default=0.5, help='Simulated upstream latency in seconds.')
+    parser.add_argument('--workers', type=int, default=4, help='Sync worker threads for the baseline.')
+    parser.add_argument('--concurrency', type=int, default=None, help='In-flight async requests (default: all).')
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from django.test import override_settings
+    from map.testing import StubUpstream, json_responder, journey_planner_trip_response
+    from map.trip_cache import trip_cache
+    from map.utils import get_trip_geojson
+    from map.views import trip
+
+    concurrency = args.concurrency or args.requests
+    responder = json_responder(journey_planner_trip_response())
+    with StubUpstream(responder, delay=args.latency) as stub, \
+            override_settings(ENTUR_JOURNEY_PLANNER_URL=stub.url, UPSTREAM_MAX_CONNECTIONS=concurrency):
+        trip_cache.clear()
+        sync_elapsed, sync_ok = run_sync(get_trip_geojson, args.requests, args.workers)
+        trip_cache.clear()
+        async_elapsed, async_ok = asyncio.run(run_async(trip, args.requests, concurrency))
+
+    results = {
+        "benchmark": "trip_load",
+        "requests": args.requests,
+        "upstream_latency_s": args.latency,
+        "sync": {"workers": args.workers, "elapsed_s": round(sync_elapsed, 3),
+                 "ok": sync_ok, "requests_per_s": round(args.requests / sync_elapsed, 1)},
+        "async": {"concurrency": concurrency, "elapsed_s": round(async_elapsed, 3),
+                  "ok": async_ok, "requests_per_s": round(args.requests / async_elapsed, 1)},
+    }
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
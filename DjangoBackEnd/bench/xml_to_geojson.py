@@ -0,0 +1,103 @@
+"""
+Benchmark: posList coordinate conversion in xml-to-geojson.py.
+
+Compares the previous per-pair loop (`is_epsg_4326` + one `transformer.transform`
+call per coordinate pair) with the vectorized `pos_lists_to_lonlat`, over every
+posList in a snapshot, and times the full `parse_xml_to_geojson` as well.
+Run from DjangoBackEnd:
+
+    python -m bench.xml_to_geojson --snapshot debug_response.xml
+    python -m bench.xml_to_geojson --situations 2000 --points 80
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import numpy as np
+
+from bench.datex_snapshot import load_snapshot
+
+SCRIPT_PATH = Path(__file__).resolve().parent.parent / "xml-to-geojson.py"
+LOC_NS = "{http://datex2.eu/schema/3/locationReferencing}"
+
+
+def load_exporter():
+    """Import xml-to-geojson.py (its file name is not a valid module name)."""
+    spec = importlib.util.spec_from_file_location("xml_to_geojson", SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def legacy_convert(exporter, pos_texts):
+    """The conversion loop as it was before vectorization, kept for comparison."""
+    transformer = exporter.get_transformer()
+    converted = []
+    for text in pos_texts:
+        coord_list = list(map(float, text.split()))
+        extracted_coords = [(coord_list[i], coord_list[i+1]) for i in range(0, len(coord_list), 2)]
+        transformed_coords = []
+        for lat, lon in extracted_coords:
+            if exporter.is_epsg_4326(lat, lon):
+                transformed_coords.append((lon, lat))
+            else:
+                new_lat, new_lon = transformer.transform(lat, lon)
+                transformed_coords.append((new_lat, new_lon))
+        converted.append(transformed_coords)
+    return converted
+
+
+def vectorized_convert(exporter, pos_texts):
+    return exporter.pos_lists_to_lonlat([exporter.parse_pos_list(text) for text in pos_texts])
+
+
+def best_of(repeat, fn, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--snapshot', help='Recorded DATEX snapshot (default: synthetic).')
+    parser.add_argument('--situations', type=int, default=1000, help='Synthetic situations.')
+    parser.add_argument('--points', type=int, default=60, help='Vertices per synthetic posList.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per variant; the best is reported.')
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)  # The exporter logs every situation
+    exporter = load_exporter()
+    xml_data = load_snapshot(args.snapshot, situations=args.situations, points_per_line=args.points)
+    pos_texts = [el.text for el in ET.fromstring(xml_data).iter(f"{LOC_NS}posList") if el.text]
+    exporter.get_transformer()  # Do not time transformer creation
+
+    legacy_s, legacy = best_of(args.repeat, legacy_convert, exporter, pos_texts)
+    vector_s, vector = best_of(args.repeat, vectorized_convert, exporter, pos_texts)
+    max_diff = max((float(np.max(np.abs(np.asarray(a) - np.asarray(b)))) for a, b in zip(legacy, vector) if a), default=0.0)
+    parse_s, geojson = best_of(args.repeat, exporter.parse_xml_to_geojson, xml_data)
+
+    results = {
+        "benchmark": "xml_to_geojson",
+        "snapshot": args.snapshot or f"synthetic({args.situations}x{args.points})",
+        "pos_lists": len(pos_texts),
+        "pairs": sum(len(c) for c in vector),
+        "legacy_convert_s": round(legacy_s, 4),
+        "vectorized_convert_s": round(vector_s, 4),
+        "speedup": round(legacy_s / vector_s, 1) if vector_s else None,
+        "max_abs_difference_deg": max_diff,
+        "parse_xml_to_geojson_s": round(parse_s, 4),
+        "features": len(geojson["features"]) if geojson else 0,
+    }
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
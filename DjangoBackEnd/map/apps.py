@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MapConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'map'
+
+    def ready(self):
+        # Registers the delete receivers that keep the route collision summary current
+        from . import route_summary  # noqa: F401
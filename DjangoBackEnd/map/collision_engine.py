@@ -0,0 +1,211 @@
+"""
+In-memory collision engine.
+
+`SituationIndex` holds the projected geometry of the current VTS situations
+as NumPy arrays plus one bounding box per situation. Checking a line against
+it is a vectorized bbox filter followed by exact distances for the few
+candidates, which takes milliseconds, instead of a SpatiaLite join.
+
+The web process keeps one prebuilt index (`get_situation_index`) and only
+rebuilds it when the situation table has changed, or when the first of its
+situations has ended: the table does not change when time passes.
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .geometry import bbox, bboxes_overlap, geometry_distance, points_to_segments_distance, project_lonlat
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REFRESH_SECONDS = 30
+
+
+class SituationIndex:
+    """
+    Projected geometries of situations with per-situation bounding boxes.
+
+    Each entry keeps its point (1, 2) and/or path (n, 2) in metres and a
+    small dict of properties returned with matches. `expires_at` is the
+    earliest end time of the indexed situations (None when none ends).
+    """
+
+    def __init__(self, entries, expires_at=None):
+        self.entries = entries  # list of (properties, [geometry arrays])
+        self.bboxes = np.array([bbox(np.vstack(geoms)) for _, geoms in entries]).reshape(-1, 4)
+        self.expires_at = expires_at
+
+    def __len__(self):
+        return len(self.entries)
+
+    def expired(self, now=None):
+        """True once one of the indexed situations has ended."""
+        return self.expires_at is not None and (now or timezone.now()) >= self.expires_at
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Build from dicts with `location` (Point or None), `path` (LineString or None),
+        optionally `overall_end_time`, and any other keys, which are kept as properties.
+        """
+        entries = []
+        expires_at = None
+        for row in rows:
+            row = dict(row)
+            location = row.pop('location', None)
+            path = row.pop('path', None)
+            end_time = row.pop('overall_end_time', None)
+            geoms = []
+            if location is not None:
+                geoms.append(project_lonlat([location.coords]))
+            if path is not None and len(path.coords) >= 2:
+                geoms.append(project_lonlat(path.coords))
+            if geoms:
+                entries.append((row, geoms))
+                if end_time is not None and (expires_at is None or end_time < expires_at):
+                    expires_at = end_time
+        return cls(entries, expires_at)
+
+    @classmethod
+    def from_database(cls):
+        """Index the situations that are currently active (no end time, or ending in the future)."""
+        from .models import VtsSituation
+
+        rows = VtsSituation.objects.filter(
+            Q(location__isnull=False) | Q(path__isnull=False),
+            Q(overall_end_time__isnull=True) | Q(overall_end_time__gt=timezone.now()),
+        ).values(
+            'id', 'situation_id', 'severity', 'filter_used', 'area_name',
+            'road_number', 'location_description', 'location', 'path', 'overall_end_time',
+        )
+        return cls.from_rows(rows.iterator())
+
+    def near(self, line_xy, tolerance_meters):
+        """
+        Situations within `tolerance_meters` of a projected point/polyline.
+
+        Returns:
+            list of (properties, distance_meters), nearest first.
+        """
+        if not self.entries or len(line_xy) == 0:
+            return []
+        candidates = np.flatnonzero(bboxes_overlap(self.bboxes, bbox(line_xy), tolerance_meters))
+        matches = []
+        for i in candidates:
+            properties, geoms = self.entries[i]
+            distance = min(geometry_distance(line_xy, geom) for geom in geoms)
+            if distance <= tolerance_meters:
+                matches.append((properties, distance))
+        matches.sort(key=lambda match: match[1])
+        return matches
+
+    def points_near(self, points_xy, tolerance_meters):
+        """
+        The nearest situation within `tolerance_meters` of each of many projected points.
+
+        Loops over the situations whose bbox overlaps the points, not over the
+        points, so thousands of vehicles cost one vectorized pass per nearby situation.
+
+        Returns:
+            (entry index, distance) arrays of len(points_xy); index -1 (distance inf) when none is near.
+        """
+        points_xy = np.asarray(points_xy, dtype=np.float64).reshape(-1, 2)
+        nearest = np.full(len(points_xy), -1, dtype=np.int32)
+        distances = np.full(len(points_xy), np.inf)
+        if not self.entries or len(points_xy) == 0:
+            return nearest, distances
+        margin = tolerance_meters
+        for i in np.flatnonzero(bboxes_overlap(self.bboxes, bbox(points_xy), margin)):
+            box = self.bboxes[i]
+            inside = np.flatnonzero(
+                (points_xy[:, 0] >= box[0] - margin) & (points_xy[:, 0] <= box[2] + margin) &
+                (points_xy[:, 1] >= box[1] - margin) & (points_xy[:, 1] <= box[3] + margin)
+            )
+            if len(inside) == 0:
+                continue
+            candidates = points_xy[inside]
+            distance = np.full(len(inside), np.inf)
+            for geom in self.entries[i][1]:
+                if len(geom) == 1:
+                    distance = np.minimum(distance, np.hypot(*(candidates - geom[0]).T))
+                else:
+                    distance = np.minimum(distance, points_to_segments_distance(candidates, geom[:-1], geom[1:]))
+            closer = (distance <= tolerance_meters) & (distance < distances[inside])
+            nearest[inside[closer]] = i
+            distances[inside[closer]] = distance[closer]
+        return nearest, distances
+
+
+_index = None
+_index_signature = None
+_index_checked_at = 0.0
+_index_lock = threading.Lock()
+
+
+def _situation_signature():
+    from .models import VtsSituation
+    return tuple(VtsSituation.objects.aggregate(
+        count=Count('id'), max_id=Max('id'), max_version=Max('version_time'), max_end=Max('overall_end_time'),
+    ).values())
+
+
+def get_situation_index():
+    """
+    The process-wide prebuilt `SituationIndex`.
+
+    The database is checked for changes at most every
+    `SITUATION_INDEX_REFRESH_SECONDS` with one aggregate query; the index is
+    only rebuilt when that signature changes, or right away once one of the
+    indexed situations has ended.
+    """
+    global _index, _index_signature, _index_checked_at
+    refresh = getattr(settings, 'SITUATION_INDEX_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS)
+    with _index_lock:
+        now = time.monotonic()
+        expired = _index is not None and _index.expired()
+        if _index is not None and now - _index_checked_at < refresh and not expired:
+            return _index
+        signature = _situation_signature()
+        _index_checked_at = now
+        if _index is None or signature != _index_signature or expired:
+            start = time.perf_counter()
+            _index = SituationIndex.from_database()
+            _index_signature = signature
+            logger.info(f"Built situation index with {len(_index)} situations in {time.perf_counter() - start:.3f}s.")
+        return _index
+
+
+def annotate_trip_impacts(trip_geojson, tolerance_meters, index=None):
+    """
+    Return a copy of a trip FeatureCollection where every leg lists the
+    active situations within `tolerance_meters` of it.
+
+    The input (usually shared with the trip cache) is not modified. Each leg
+    gets `properties.situations`, and the collection gets `impacted_situation_ids`.
+    """
+    if not trip_geojson:
+        return trip_geojson
+    if index is None:
+        index = get_situation_index()
+    impacted = {}
+    features = []
+    for feature in trip_geojson.get('features', []):
+        coords = feature.get('geometry', {}).get('coordinates') or []
+        matches = index.near(project_lonlat(coords), tolerance_meters) if coords else []
+        situations = []
+        for properties, distance in matches:
+            situation = dict(properties, distance_meters=round(distance, 1))
+            situations.append(situation)
+            impacted[properties['situation_id']] = True
+        features.append(dict(feature, properties=dict(feature.get('properties', {}), situations=situations)))
+    return dict(
+        trip_geojson,
+        features=features,
+        impacted_situation_ids=list(impacted),
+        impact_tolerance_meters=tolerance_meters,
+    )
@@ -0,0 +1,296 @@
+"""
+DATEX II (v3) situation snapshot parser.
+
+Shared by the `fetch_vts_situations` command and the `xml-to-geojson.py`
+exporter. The snapshot is streamed with `iterparse`: each `situationRecord`
+is walked exactly once when it is complete, its fields are picked out through
+lookup tables of fully qualified tag names (built once at import), and the
+element is then cleared so memory stays flat for large snapshots.
+
+Records are yielded as `SituationRecord` namedtuples holding the raw text
+values, unstripped; converting dates and geometry, stripping and choosing
+between the first and the display coordinates is up to the caller.
+
+When lxml is installed it is used instead of ElementTree (`BACKEND`): its
+iterparse is told which tags matter, so libxml2 skips everything else and
+only those elements become Python objects. Both backends return identical
+records.
+
+This module does not import Django, so it can be used from plain scripts.
+"""
+import io
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+try:
+    from lxml import etree as _lxml
+except ImportError:  # lxml is optional; ElementTree is used without it
+    _lxml = None
+
+SITUATION_NS = 'http://datex2.eu/schema/3/situation'
+COMMON_NS = 'http://datex2.eu/schema/3/common'
+LOCATION_NS = 'http://datex2.eu/schema/3/locationReferencing'
+XSI_NS = 'http://www.w3.org/2001/XMLSchema-instance'
+
+_SIT = f'{{{SITUATION_NS}}}'
+_COM = f'{{{COMMON_NS}}}'
+_LOC = f'{{{LOCATION_NS}}}'
+
+SITUATION_TAG = f'{_SIT}situation'
+RECORD_TAG = f'{_SIT}situationRecord'
+PUBLICATION_TIME_TAG = f'{_COM}publicationTime'
+XSI_TYPE = f'{{{XSI_NS}}}type'
+
+BACKEND = 'lxml' if _lxml is not None else 'etree'
+
+SituationRecord = namedtuple('SituationRecord', [
+    'situation_id',
+    'record_id',
+    'version',
+    'record_type',            # xsi:type without prefix, e.g. "MaintenanceWorks"
+    'creation_time',
+    'version_time',
+    'probability_of_occurrence',
+    'severity',
+    'source_country',
+    'source_identification',
+    'source_name',
+    'source_type',
+    'validity_status',
+    'overall_start_time',
+    'overall_end_time',
+    'comments',               # tuple of comment texts
+    'latitude',               # first latitude in the record's location reference
+    'longitude',
+    'display_latitude',       # from coordinatesForDisplay, or None
+    'display_longitude',
+    'pos_list',               # text of the first gml posList
+    'location_descriptions',  # tuple
+    'road_name',
+    'road_number',
+    'area_names',             # tuple of the first areaName's values
+    'road_management_type',   # roadOrCarriagewayOrLaneManagementType, e.g. "roadClosed"
+    'transit_service_information',
+    'transit_service_type',
+])
+
+# Elements whose text is taken as-is; the first occurrence in the record wins.
+_TEXT_FIELDS = {
+    f'{_SIT}situationRecordCreationTime': 'creation_time',
+    f'{_SIT}situationRecordVersionTime': 'version_time',
+    f'{_SIT}probabilityOfOccurrence': 'probability_of_occurrence',
+    f'{_SIT}severity': 'severity',
+    f'{_COM}sourceCountry': 'source_country',
+    f'{_COM}sourceIdentification': 'source_identification',
+    f'{_COM}sourceType': 'source_type',
+    f'{_COM}validityStatus': 'validity_status',
+    f'{_COM}overallStartTime': 'overall_start_time',
+    f'{_COM}overallEndTime': 'overall_end_time',
+    f'{_LOC}latitude': 'latitude',
+    f'{_LOC}longitude': 'longitude',
+    f'{_LOC}posList': 'pos_list',
+    f'{_LOC}roadName': 'road_name',
+    f'{_LOC}roadNumber': 'road_number',
+    f'{_SIT}roadOrCarriagewayOrLaneManagementType': 'road_management_type',
+    f'{_SIT}transitServiceInformation': 'transit_service_information',
+    f'{_SIT}transitServiceType': 'transit_service_type',
+}
+
+# Multilingual containers: every common:value below them is collected.
+_VALUE_CONTAINERS = {
+    f'{_SIT}generalPublicComment': 'comments',
+    f'{_LOC}locationDescription': 'location_descriptions',
+    f'{_LOC}areaName': 'area_names',
+    f'{_COM}sourceName': 'source_name',
+}
+_VALUE_TAG = f'{_COM}value'
+_AREA_NAME_TAG = f'{_LOC}areaName'
+_DISPLAY_TAG = f'{_LOC}coordinatesForDisplay'
+_DISPLAY_FIELDS = {f'{_LOC}latitude': 'display_latitude', f'{_LOC}longitude': 'display_longitude'}
+
+
+class DatexParseError(ValueError):
+    """The snapshot is not well-formed XML."""
+
+
+def _walk(element, fields, container, in_display):
+    """Single depth-first pass over a record's subtree, filling `fields`."""
+    for child in element:
+        tag = child.tag
+        name = _TEXT_FIELDS.get(tag)
+        if name is not None:
+            if fields.get(name) is None:
+                fields[name] = child.text
+            if in_display and tag in _DISPLAY_FIELDS:
+                fields[_DISPLAY_FIELDS[tag]] = child.text
+        elif tag == _VALUE_TAG:
+            if container is not None and child.text:
+                fields[container].append(child.text)
+        if len(child):
+            child_container = _VALUE_CONTAINERS.get(tag, container)
+            if tag == _AREA_NAME_TAG and fields['area_names']:
+                child_container = None  # Only the first named area, as the county filter expects one name
+            _walk(child, fields, child_container, in_display or tag == _DISPLAY_TAG)
+
+
+def _etree_fields(record):
+    fields = {'comments': [], 'location_descriptions': [], 'area_names': [], 'source_name': []}
+    _walk(record, fields, None, False)
+    return fields
+
+
+def _build_record(record, fields, situation_id):
+    xsi_type = record.get(XSI_TYPE)
+    source_names = fields['source_name']
+    return SituationRecord(
+        situation_id=situation_id,
+        record_id=record.get('id'),
+        version=record.get('version'),
+        record_type=xsi_type.split(':')[-1] if xsi_type else 'Unknown',
+        creation_time=fields.get('creation_time'),
+        version_time=fields.get('version_time'),
+        probability_of_occurrence=fields.get('probability_of_occurrence'),
+        severity=fields.get('severity'),
+        source_country=fields.get('source_country'),
+        source_identification=fields.get('source_identification'),
+        source_name=source_names[0] if source_names else None,
+        source_type=fields.get('source_type'),
+        validity_status=fields.get('validity_status'),
+        overall_start_time=fields.get('overall_start_time'),
+        overall_end_time=fields.get('overall_end_time'),
+        comments=tuple(fields['comments']),
+        latitude=fields.get('latitude'),
+        longitude=fields.get('longitude'),
+        display_latitude=fields.get('display_latitude'),
+        display_longitude=fields.get('display_longitude'),
+        pos_list=fields.get('pos_list'),
+        location_descriptions=tuple(fields['location_descriptions']),
+        road_name=fields.get('road_name'),
+        road_number=fields.get('road_number'),
+        area_names=tuple(fields['area_names']),
+        road_management_type=fields.get('road_management_type'),
+        transit_service_information=fields.get('transit_service_information'),
+        transit_service_type=fields.get('transit_service_type'),
+    )
+
+
+def record_from_element(record, situation_id):
+    """Build a `SituationRecord` from a parsed situationRecord element."""
+    return _build_record(record, _etree_fields(record), situation_id)
+
+
+def _as_stream(source):
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    if isinstance(source, str):
+        return io.BytesIO(source.encode('utf-8'))
+    return source  # Already a binary file-like object
+
+
+def iter_records(source, backend=None):
+    """
+    Yield a `SituationRecord` for every situationRecord in a snapshot.
+
+    Args:
+        source: XML as bytes/str, or a binary file-like object (read incrementally).
+        backend: 'lxml' or 'etree'; defaults to `BACKEND` (lxml when installed).
+
+    Raises:
+        DatexParseError: If the XML is malformed (records before the error are still yielded).
+    """
+    if (backend or BACKEND) == 'lxml':
+        if _lxml is None:
+            raise ImportError("The lxml DATEX backend was requested but lxml is not installed.")
+        return _iter_records_lxml(source)
+    return _iter_records_etree(source)
+
+
+def _iter_records_etree(source):
+    situation_id = None
+    try:
+        for event, element in ET.iterparse(_as_stream(source), events=('start', 'end')):
+            if event == 'start':
+                if element.tag == SITUATION_TAG:
+                    situation_id = element.get('id')
+                continue
+            if element.tag == RECORD_TAG:
+                yield _build_record(element, _etree_fields(element), situation_id)
+                element.clear()
+            elif element.tag == SITUATION_TAG:
+                element.clear()
+    except ET.ParseError as e:
+        raise DatexParseError(str(e)) from e
+
+
+# Every element the lxml backend needs to see; libxml2 skips events for the rest.
+_LXML_TAGS = (
+    list(_TEXT_FIELDS) + list(_VALUE_CONTAINERS) + [_VALUE_TAG, _DISPLAY_TAG, RECORD_TAG, SITUATION_TAG]
+)
+
+
+def _iter_records_lxml(source):
+    """
+    Same records as `_iter_records_etree`, but driven by lxml's tag-filtered
+    iterparse: only the elements in `_LXML_TAGS` become Python objects, and
+    their start/end events stand in for the recursive walk.
+    """
+    situation_id = None
+    fields = None
+    containers = [None]  # Innermost value container on top
+    in_display = False
+    try:
+        for event, element in _lxml.iterparse(_as_stream(source), events=('start', 'end'), tag=_LXML_TAGS):
+            tag = element.tag
+            if event == 'start':
+                if tag in _VALUE_CONTAINERS:
+                    skip = tag == _AREA_NAME_TAG and fields is not None and fields['area_names']
+                    containers.append(None if skip else _VALUE_CONTAINERS[tag])
+                elif tag == _DISPLAY_TAG:
+                    in_display = True
+                elif tag == RECORD_TAG:
+                    fields = {'comments': [], 'location_descriptions': [], 'area_names': [], 'source_name': []}
+                elif tag == SITUATION_TAG:
+                    situation_id = element.get('id')
+                continue
+            if fields is None:
+                continue  # Outside a situationRecord
+            name = _TEXT_FIELDS.get(tag)
+            if name is not None:
+                if fields.get(name) is None:
+                    fields[name] = element.text
+                if in_display and tag in _DISPLAY_FIELDS:
+                    fields[_DISPLAY_FIELDS[tag]] = element.text
+            elif tag == _VALUE_TAG:
+                container = containers[-1]
+                if container is not None and element.text:
+                    fields[container].append(element.text)
+            elif tag in _VALUE_CONTAINERS:
+                containers.pop()
+            elif tag == _DISPLAY_TAG:
+                in_display = False
+            elif tag == RECORD_TAG:
+                yield _build_record(element, fields, situation_id)
+                fields = None
+                element.clear(keep_tail=True)
+                # Drop finished siblings so memory stays flat
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+            elif tag == SITUATION_TAG:
+                element.clear(keep_tail=True)
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+    except _lxml.XMLSyntaxError as e:
+        raise DatexParseError(str(e)) from e
+
+
+def read_publication_time(source):
+    """Return the payload's common:publicationTime text, or None. Stops reading once found."""
+    try:
+        for _, element in ET.iterparse(_as_stream(source), events=('end',)):
+            if element.tag == PUBLICATION_TIME_TAG:
+                return element.text
+            if element.tag == RECORD_TAG:
+                return None  # publicationTime precedes the situations
+    except ET.ParseError as e:
+        raise DatexParseError(str(e)) from e
+    return None
@@ -0,0 +1,115 @@
+"""
+Filter options (facets) of the situation map, computed once per ingest.
+
+fetch_vts_situations stores the distinct counties, situation types and
+severities with their situation counts in `ApiMetadata` (key
+`filter_facets`), together with a version that only changes when the
+facets do. The web process keeps the current facets in memory
+(`filter_facets`), rereads the stored row at most every
+`FILTER_OPTIONS_REFRESH_SECONDS`, and `/api/filter-options/` serves them with
+the version as ETag.
+"""
+import json
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+METADATA_KEY = 'filter_facets'
+DEFAULT_REFRESH_SECONDS = 30
+
+# Response key -> VtsSituation field
+FACETS = (
+    ('counties', 'area_name'),
+    ('situation_types', 'filter_used'),
+    ('severities', 'severity'),
+)
+
+FacetSnapshot = namedtuple('FacetSnapshot', ['payload', 'etag'])
+
+
+def compute_facets():
+    """Situation counts per value of every facet, from one GROUP BY query. Empty values are left out."""
+    from .models import VtsSituation
+
+    counts = {name: {} for name, _ in FACETS}
+    fields = [field for _, field in FACETS]
+    for *values, count in VtsSituation.objects.values_list(*fields).annotate(count=Count('id')).order_by():
+        for (name, _), value in zip(FACETS, values):
+            if value:
+                counts[name][value] = counts[name].get(value, 0) + count
+    return {name: dict(sorted(values.items())) for name, values in counts.items()}
+
+
+def store_facets():
+    """Recompute the facets after an ingest; the version is bumped only when they changed."""
+    from .models import ApiMetadata
+
+    counts = compute_facets()
+    with transaction.atomic():
+        entry = ApiMetadata.objects.select_for_update().filter(key=METADATA_KEY).first()
+        previous = json.loads(entry.value) if entry else None
+        if previous and previous.get('counts') == counts:
+            return previous
+        data = {
+            'version': (previous['version'] if previous else 0) + 1,
+            'computed_at': timezone.now().isoformat(),
+            'counts': counts,
+        }
+        ApiMetadata.objects.update_or_create(key=METADATA_KEY, defaults={'value': json.dumps(data)})
+    return data
+
+
+def options_payload(data):
+    """The `/api/filter-options/` response: sorted value lists (as before), plus counts and version."""
+    counts = data['counts']
+    return {
+        **{name: list(counts.get(name, {})) for name, _ in FACETS},
+        'counts': counts,
+        'version': data['version'],
+    }
+
+
+class FacetCache:
+    """Process-wide in-memory copy of the stored facets."""
+
+    def __init__(self, refresh_seconds=None, clock=time.monotonic):
+        self.refresh_seconds = refresh_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._raw = None
+        self._snapshot = None
+        self._checked_at = 0.0
+
+    def get(self):
+        """The current `FacetSnapshot`; reads one ApiMetadata row at most every refresh interval."""
+        from .models import ApiMetadata
+
+        refresh = self.refresh_seconds
+        if refresh is None:
+            refresh = getattr(settings, 'FILTER_OPTIONS_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS)
+        with self._lock:
+            now = self._clock()
+            if self._snapshot is not None and now - self._checked_at < refresh:
+                return self._snapshot
+            raw = ApiMetadata.objects.filter(key=METADATA_KEY).values_list('value', flat=True).first()
+            self._checked_at = now
+            if raw is None:
+                # Nothing ingested since this was deployed: compute, but without a version to cache on
+                self._raw = None
+                self._snapshot = FacetSnapshot(options_payload({'version': 0, 'counts': compute_facets()}), None)
+            elif raw != self._raw:
+                data = json.loads(raw)
+                self._raw = raw
+                self._snapshot = FacetSnapshot(options_payload(data), f'"filter-options-{data["version"]}"')
+            return self._snapshot
+
+
+filter_facets = FacetCache()
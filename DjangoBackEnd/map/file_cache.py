@@ -0,0 +1,177 @@
+"""
+In-memory cache for the file-backed endpoints (serve_geojson, serve_bus, busroute_json).
+
+The files are written by other processes (xml-to-geojson.py, the bus
+position fetcher). Instead of opening and `json.load`-ing them on every
+request, `FileResponseCache` keeps each file's raw bytes and a gzip copy,
+keyed by path and (mtime, size). A request costs one `stat()`, or none while
+`FILE_CACHE_STAT_INTERVAL_SECONDS` has not passed since the last one, and the
+bytes are sent as they are, without parsing.
+
+`file_response` also answers conditional requests (ETag / If-Modified-Since,
+304) and single byte ranges (206 / 416).
+"""
+import gzip
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+DEFAULT_STAT_INTERVAL_SECONDS = 0
+GZIP_LEVEL = 6
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+_ACCEPTS_GZIP_RE = re.compile(r'\bgzip\b')
+
+
+class CachedFile:
+    """The bytes of one file version, with its gzip copy and validators."""
+    __slots__ = ('path', 'mtime_ns', 'size', 'body', 'gzip_body', 'etag', 'gzip_etag', 'last_modified', 'checked_at')
+
+    def __init__(self, path, stat, body, checked_at):
+        self.path = path
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.body = body
+        self.gzip_body = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+        self.etag = f'"{self.mtime_ns:x}-{self.size:x}"'
+        self.gzip_etag = f'"{self.mtime_ns:x}-{self.size:x}-gz"'  # Another representation, another ETag
+        self.last_modified = stat.st_mtime
+        self.checked_at = checked_at
+
+    def matches(self, stat):
+        return stat.st_mtime_ns == self.mtime_ns and stat.st_size == self.size
+
+
+class FileResponseCache:
+    """
+    Thread-safe path -> `CachedFile` map.
+
+    Counters:
+        hits: served from memory.
+        loads: (re)read from disk because the file is new or changed.
+    """
+
+    def __init__(self, stat_interval_seconds=None, clock=time.monotonic):
+        self.stat_interval_seconds = stat_interval_seconds
+        self._clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+
+    def _interval(self):
+        if self.stat_interval_seconds is not None:
+            return self.stat_interval_seconds
+        return getattr(settings, 'FILE_CACHE_STAT_INTERVAL_SECONDS', DEFAULT_STAT_INTERVAL_SECONDS)
+
+    def get(self, path):
+        """The current `CachedFile` for `path`, or None when the file does not exist."""
+        now = self._clock()
+        entry = self._entries.get(path)
+        if entry is not None and now - entry.checked_at < self._interval():
+            self.hits += 1
+            return entry
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._entries.pop(path, None)
+            return None
+        if entry is not None and entry.matches(stat):
+            entry.checked_at = now
+            self.hits += 1
+            return entry
+        with self._lock:
+            # Another thread may have loaded this version meanwhile
+            entry = self._entries.get(path)
+            if entry is not None and entry.matches(stat):
+                entry.checked_at = now
+                return entry
+            with open(path, 'rb') as f:
+                body = f.read()
+                # Writers os.replace() the file, so stat the one that was read, not whatever the path names now
+                stat = os.fstat(f.fileno())
+            entry = CachedFile(path, stat, body, now)
+            self._entries[path] = entry
+            self.loads += 1
+            return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+file_cache = FileResponseCache()
+
+
+def byte_range(header, size):
+    """
+    The (start, end) of a single `Range: bytes=` header, inclusive.
+
+    Returns None when the header should be ignored (absent, malformed or
+    several ranges) and raises ValueError when the range is unsatisfiable.
+    """
+    match = _RANGE_RE.match((header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        suffix = int(end)
+        if suffix == 0:
+            raise ValueError("Empty suffix range.")
+        return max(size - suffix, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(f"Range starts beyond the {size} bytes of the file.")
+    return start, end
+
+
+def file_response(request, path, content_type='application/json', not_found="File not found", cache=None):
+    """Serve `path` from `cache` (default: the process-wide `file_cache`)."""
+    entry = (cache or file_cache).get(path)
+    if entry is None:
+        return JsonResponse({"error": not_found}, status=404)
+
+    range_header = request.headers.get('Range')
+    use_gzip = not range_header and _ACCEPTS_GZIP_RE.search(request.headers.get('Accept-Encoding', ''))
+    etag = entry.gzip_etag if use_gzip else entry.etag
+
+    conditional = get_conditional_response(request, etag=etag, last_modified=int(entry.last_modified))
+    if conditional is not None:
+        return _with_validators(conditional, entry, etag)
+
+    if_range = request.headers.get('If-Range')
+    if range_header and (not if_range or if_range == entry.etag):
+        try:
+            span = byte_range(range_header, entry.size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{entry.size}"
+            return response
+        if span is not None:
+            start, end = span
+            response = HttpResponse(entry.body[start:end + 1], status=206, content_type=content_type)
+            response['Content-Range'] = f"bytes {start}-{end}/{entry.size}"
+            return _with_validators(response, entry, etag)
+
+    if use_gzip:
+        response = HttpResponse(entry.gzip_body, content_type=content_type)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(entry.body, content_type=content_type)
+    return _with_validators(response, entry, etag)
+
+
+def _with_validators(response, entry, etag):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(entry.last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -0,0 +1,194 @@
+"""
+Planar geometry kernels used by the in-memory collision engine.
+
+Coordinates are projected once from WGS84 lon/lat (SRID 4326) to UTM zone 33N
+(the same PROJECTED_SRID the SpatiaLite queries use), so distances are plain
+Euclidean metres. All functions work on NumPy arrays of shape (n, 2) and avoid
+per-point Python objects.
+"""
+from functools import lru_cache
+
+import numpy as np
+from pyproj import Transformer
+
+WGS84_SRID = 4326
+PROJECTED_SRID = 32633  # UTM zone 33N, metres; matches map.utils.PROJECTED_SRID
+
+# Bound the (points x segments) matrices built at once, in elements.
+_MAX_BLOCK = 1 << 20
+
+
+@lru_cache(maxsize=None)
+def get_transformer(from_srid=WGS84_SRID, to_srid=PROJECTED_SRID):
+    """Cached pyproj transformer (creating one costs milliseconds, so never do it per call)."""
+    return Transformer.from_crs(f"EPSG:{from_srid}", f"EPSG:{to_srid}", always_xy=True)
+
+
+def project_lonlat(coords):
+    """Project an (n, 2) array-like of lon/lat to an (n, 2) float64 array in metres."""
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    x, y = get_transformer().transform(coords[:, 0], coords[:, 1])
+    return np.column_stack((x, y))
+
+
+def unproject_xy(coords):
+    """Inverse of `project_lonlat`."""
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    lon, lat = get_transformer(PROJECTED_SRID, WGS84_SRID).transform(coords[:, 0], coords[:, 1])
+    return np.column_stack((lon, lat))
+
+
+def bbox(coords):
+    """(min_x, min_y, max_x, max_y) of an (n, 2) array."""
+    return np.concatenate((coords.min(axis=0), coords.max(axis=0)))
+
+
+def bboxes_overlap(boxes, box, margin=0.0):
+    """Boolean mask of the rows of `boxes` (k, 4) that overlap `box` grown by `margin`."""
+    return (
+        (boxes[:, 0] <= box[2] + margin) & (boxes[:, 2] >= box[0] - margin) &
+        (boxes[:, 1] <= box[3] + margin) & (boxes[:, 3] >= box[1] - margin)
+    )
+
+
+def points_to_segments_distance(points, starts, ends):
+    """
+    Minimum distance from each point to any of the segments.
+
+    Args:
+        points: (n, 2) array.
+        starts, ends: (m, 2) arrays of segment end points.
+
+    Returns:
+        (n,) array of distances.
+    """
+    if len(starts) == 0:
+        return np.full(len(points), np.inf)
+    direction = ends - starts
+    length_sq = np.einsum('ij,ij->i', direction, direction)
+    # Degenerate (zero-length) segments behave like points.
+    safe_length_sq = np.where(length_sq > 0, length_sq, 1.0)
+
+    result = np.empty(len(points))
+    step = max(1, _MAX_BLOCK // len(starts))
+    for offset in range(0, len(points), step):
+        block = points[offset:offset + step]
+        rel_x = block[:, 0, None] - starts[None, :, 0]
+        rel_y = block[:, 1, None] - starts[None, :, 1]
+        t = (rel_x * direction[None, :, 0] + rel_y * direction[None, :, 1]) / safe_length_sq
+        t = np.clip(np.where(length_sq > 0, t, 0.0), 0.0, 1.0)
+        dx = rel_x - t * direction[None, :, 0]
+        dy = rel_y - t * direction[None, :, 1]
+        result[offset:offset + step] = np.sqrt((dx * dx + dy * dy).min(axis=1))
+    return result
+
+
+def segment_distances(point, starts, ends):
+    """Distance from one point (2,) to each of the segments given by (m, 2) `starts` and `ends`."""
+    direction = ends - starts
+    length_sq = np.einsum('ij,ij->i', direction, direction)
+    rel = point - starts
+    t = np.einsum('ij,ij->i', rel, direction) / np.where(length_sq > 0, length_sq, 1.0)
+    t = np.clip(np.where(length_sq > 0, t, 0.0), 0.0, 1.0)
+    offset = rel - t[:, None] * direction
+    return np.sqrt(np.einsum('ij,ij->i', offset, offset))
+
+
+def _segments_cross(a_starts, a_ends, b_starts, b_ends):
+    """True if any segment of A properly intersects any segment of B."""
+    def orientation(p, q, r):
+        return np.sign(
+            (q[..., 0] - p[..., 0]) * (r[..., 1] - p[..., 1]) -
+            (q[..., 1] - p[..., 1]) * (r[..., 0] - p[..., 0])
+        )
+    step = max(1, _MAX_BLOCK // len(b_starts))
+    for offset in range(0, len(a_starts), step):
+        p1 = a_starts[offset:offset + step, None, :]
+        p2 = a_ends[offset:offset + step, None, :]
+        q1 = b_starts[None, :, :]
+        q2 = b_ends[None, :, :]
+        crosses = (
+            (orientation(p1, p2, q1) * orientation(p1, p2, q2) < 0) &
+            (orientation(q1, q2, p1) * orientation(q1, q2, p2) < 0)
+        )
+        if crosses.any():
+            return True
+    return False
+
+
+def geometry_distance(a, b):
+    """
+    Minimum distance between two point sets/polylines given as (n, 2) arrays.
+
+    A single-row array is a point, more rows form a polyline. Touching or
+    crossing lines have distance 0 (collinear touching is covered by the
+    vertex-to-segment distances).
+    """
+    if len(a) == 1 and len(b) == 1:
+        return float(np.hypot(*(a[0] - b[0])))
+    if len(b) == 1:
+        a, b = b, a
+    if len(a) == 1:
+        return float(points_to_segments_distance(a, b[:-1], b[1:])[0])
+    if _segments_cross(a[:-1], a[1:], b[:-1], b[1:]):
+        return 0.0
+    return float(min(
+        points_to_segments_distance(a, b[:-1], b[1:]).min(),
+        points_to_segments_distance(b, a[:-1], a[1:]).min(),
+    ))
+
+
+def simplify(coords, tolerance):
+    """
+    Indices of the points of a polyline kept by Douglas–Peucker.
+
+    The recursion is run breadth-first: each round measures the interior
+    points of every open span against that span's chord in one array
+    operation, so the Python loop runs once per recursion level instead of
+    once per span.
+
+    Args:
+        coords: (n, 2) array in metres.
+        tolerance: Maximum distance (metres) of a dropped point from the simplified line.
+
+    Returns:
+        Sorted index array, always including the first and last point.
+    """
+    n = len(coords)
+    if n <= 2:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    starts = np.array([0])
+    ends = np.array([n - 1])
+    while len(starts):
+        # Interior points of all open spans, span by span
+        counts = ends - starts - 1
+        offsets = np.cumsum(counts) - counts
+        span = np.repeat(np.arange(len(starts)), counts)
+        points = starts[span] + 1 + np.arange(len(span)) - offsets[span]
+
+        first = coords[starts]
+        direction = coords[ends] - first
+        length_sq = direction[:, 0] * direction[:, 0] + direction[:, 1] * direction[:, 1]
+        rel_x = coords[points, 0] - first[span, 0]
+        rel_y = coords[points, 1] - first[span, 1]
+        # Degenerate (zero-length) chords behave like points, as in points_to_segments_distance
+        t = (rel_x * direction[span, 0] + rel_y * direction[span, 1]) / np.where(length_sq > 0, length_sq, 1.0)[span]
+        t = np.clip(np.where(length_sq[span] > 0, t, 0.0), 0.0, 1.0)
+        dx = rel_x - t * direction[span, 0]
+        dy = rel_y - t * direction[span, 1]
+        distances = np.sqrt(dx * dx + dy * dy)
+
+        # The first farthest point of each span, like argmax
+        farthest = np.maximum.reduceat(distances, offsets)
+        candidates = np.flatnonzero(distances == farthest[span])
+        splits = points[candidates[np.unique(span[candidates], return_index=True)[1]]]
+
+        split = farthest > tolerance
+        keep[splits[split]] = True
+        starts = np.concatenate((starts[split], splits[split]))
+        ends = np.concatenate((splits[split], ends[split]))
+        still_open = ends - starts >= 2
+        starts, ends = starts[still_open], ends[still_open]
+    return np.flatnonzero(keep)
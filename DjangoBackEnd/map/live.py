@@ -0,0 +1,366 @@
+"""
+In-process broadcast hub for the live map feed.
+
+Map clients connect to the Server-Sent Events endpoint (`/api/live/`) and
+receive new, updated and resolved situations and collisions as they appear in
+the database, instead of polling the REST endpoints.
+
+Ingest and collision detection run in separate management command processes,
+so the web process discovers changes with a lightweight `ChangeWatcher`. After
+one baseline load it only reads situations an ingest stored since its last
+poll (`VtsSituation.ingested_at`) or that ended since, and re-reads the
+collision pairs only when the table's row count or highest id changed.
+Collisions are compared by (situation, bus route), so a clearing collision run
+that re-creates the same pairs sends nothing. The watcher only runs while at
+least one client is connected.
+
+Every client has its own filters (county, severity, route) and a bounded
+buffer. When a slow client falls behind, the oldest buffered events are
+dropped and the client is told how many it missed, so it can resync via REST.
+"""
+import asyncio
+import itertools
+import logging
+import threading
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Event names follow the "new_collision" convention used by the MQTT publisher.
+NEW_SITUATION = 'new_situation'
+UPDATED_SITUATION = 'updated_situation'
+RESOLVED_SITUATION = 'resolved_situation'
+NEW_COLLISION = 'new_collision'
+RESOLVED_COLLISION = 'resolved_collision'
+
+
+class LiveEvent:
+    """A single change pushed to live clients."""
+    __slots__ = ('seq', 'event', 'data', 'county', 'severity', 'routes')
+
+    _counter = itertools.count(1)
+
+    def __init__(self, event, data, county=None, severity=None, routes=()):
+        self.seq = next(self._counter)
+        self.event = event
+        self.data = data
+        self.county = county
+        self.severity = severity
+        self.routes = frozenset(routes)
+
+
+class ClientFilter:
+    """
+    Per-client event filter. Empty criteria match everything.
+
+    A route filter only matches events that are linked to at least one of
+    the requested routes (collisions, or situations with collisions).
+    """
+    __slots__ = ('counties', 'severities', 'routes')
+
+    def __init__(self, counties=(), severities=(), routes=()):
+        self.counties = frozenset(counties)
+        self.severities = frozenset(severities)
+        self.routes = frozenset(routes)
+
+    @classmethod
+    def from_query(cls, query):
+        """Build a filter from `county`, `severity` and `route` query parameters (comma separated)."""
+        def values(name):
+            raw = ','.join(query.getlist(name)) if hasattr(query, 'getlist') else (query.get(name) or '')
+            return [value.strip() for value in raw.split(',') if value.strip()]
+        return cls(values('county'), values('severity'), values('route'))
+
+    def matches(self, event):
+        if self.counties and event.county not in self.counties:
+            return False
+        if self.severities and event.severity not in self.severities:
+            return False
+        if self.routes and not (self.routes & event.routes):
+            return False
+        return True
+
+
+class LiveClient:
+    """
+    A connected client: its filter plus a bounded buffer with drop-oldest semantics.
+
+    Events may be delivered from any thread; they are handed to the client's
+    own event loop so the buffer is only touched from one thread.
+    """
+
+    def __init__(self, filters, max_buffer, loop=None):
+        self.filters = filters
+        self.buffer = deque(maxlen=max_buffer)
+        self.dropped = 0
+        self._loop = loop or asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+
+    def deliver(self, event):
+        if not self.filters.matches(event):
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._offer(event)
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._offer, event)
+        except RuntimeError:
+            # The client's loop is closed; it will be unsubscribed shortly.
+            pass
+
+    def _offer(self, event):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1  # deque(maxlen) discards the oldest entry on append
+        self.buffer.append(event)
+        self._wakeup.set()
+
+    async def next_batch(self, timeout=None):
+        """Wait for buffered events and return them all; returns [] on timeout."""
+        if not self.buffer:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        batch = list(self.buffer)
+        self.buffer.clear()
+        return batch
+
+    def take_dropped(self):
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class BroadcastHub:
+    """Fans out `LiveEvent`s to every subscribed `LiveClient`."""
+
+    def __init__(self):
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._watcher_task = None
+
+    @property
+    def client_count(self):
+        return len(self._clients)
+
+    def subscribe(self, filters=None, max_buffer=None):
+        if max_buffer is None:
+            max_buffer = getattr(settings, 'LIVE_FEED_CLIENT_BUFFER', 256)
+        client = LiveClient(filters or ClientFilter(), max_buffer)
+        with self._lock:
+            self._clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def publish(self, event):
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.deliver(event)
+
+    def ensure_watcher(self):
+        """Start the database change watcher on the current loop if it is not running."""
+        if self._watcher_task is None or self._watcher_task.done():
+            self._watcher_task = asyncio.get_running_loop().create_task(ChangeWatcher(self).run())
+
+
+class ChangeWatcher:
+    """
+    Polls the database and publishes what changed since the previous poll.
+
+    The first poll only establishes a baseline; clients load the current state
+    through the REST endpoints and use the feed for changes from then on.
+    """
+
+    SITUATION_FIELDS = (
+        'id', 'situation_id', 'version', 'severity', 'area_name', 'filter_used',
+        'road_number', 'location_description', 'comment', 'overall_end_time', 'ingested_at', 'location',
+    )
+    COLLISION_FIELDS = (
+        'id', 'transit_information_id', 'bus_route_id', 'bus_route__route_id',
+        'transit_lon', 'transit_lat', 'tolerance_meters', 'distance_meters', 'detection_timestamp',
+    )
+
+    def __init__(self, hub, interval=None):
+        self.hub = hub
+        self.interval = interval or getattr(settings, 'LIVE_FEED_POLL_SECONDS', 5)
+        self.situations = None  # pk -> situation row
+        self.collisions = None  # (transit_information_id, bus_route_id) -> collision row
+        self.collision_signature = None  # Row count, highest id and tier/distance sums of DetectedCollision
+        self.ingested_at = None  # Highest VtsSituation.ingested_at seen
+        self.polled_at = None
+
+    async def run(self):
+        logger.info("Live feed watcher started.")
+        while self.hub.client_count:
+            try:
+                events = await sync_to_async(self.poll, thread_sensitive=True)()
+                for event in events:
+                    self.hub.publish(event)
+            except Exception as e:
+                logger.error(f"Live feed poll failed: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+        logger.info("Live feed watcher stopped (no clients).")
+
+    def poll(self):
+        from .models import DetectedCollision, VtsSituation
+
+        now = timezone.now()
+        if self.situations is None:
+            self.situations = {row['id']: row for row in self._situation_rows(VtsSituation.objects.all(), now)}
+            self.collisions = {
+                _collision_pair(row): row for row in DetectedCollision.objects.values(*self.COLLISION_FIELDS).iterator()
+            }
+            self.collision_signature = self._collision_signature()
+            self.polled_at = now
+            return []
+
+        changes = self._situation_changes(now)
+        deleted = self._deleted_situations()
+        changes.extend((RESOLVED_SITUATION, row) for row in deleted if not row['resolved'])
+        collision_events = list(self._collision_events())
+        for row in deleted:
+            del self.situations[row['id']]
+        self.polled_at = now
+
+        routes_by_situation = {}
+        if changes:
+            for (transit_id, _), row in self.collisions.items():
+                routes_by_situation.setdefault(transit_id, set()).add(row['bus_route__route_id'])
+        events = [
+            _situation_event(event, row, routes_by_situation.get(row['id'], ()) if row['id'] in self.situations else ())
+            for event, row in changes
+        ]
+        return events + collision_events
+
+    def _situation_rows(self, queryset, now):
+        for row in queryset.values(*self.SITUATION_FIELDS).iterator():
+            location = row.pop('location')
+            row['lon'] = location.x if location else None
+            row['lat'] = location.y if location else None
+            row['resolved'] = bool(row['overall_end_time'] and row['overall_end_time'] <= now)
+            if row['ingested_at'] and (self.ingested_at is None or row['ingested_at'] > self.ingested_at):
+                self.ingested_at = row['ingested_at']
+            yield row
+
+    def _situation_changes(self, now):
+        """(event, row) for situations an ingest stored since the last poll, or that ended since."""
+        from .models import VtsSituation
+
+        # An ingest stamps all its rows with one time but commits them one by one, so rows
+        # stamped with the last seen time are read again; unchanged ones produce no event
+        ingested = Q(ingested_at__gte=self.ingested_at) if self.ingested_at else Q(ingested_at__isnull=False)
+        ended = Q(overall_end_time__gt=self.polled_at, overall_end_time__lte=now)
+        changes = []
+        for row in self._situation_rows(VtsSituation.objects.filter(ingested | ended), now):
+            previous = self.situations.get(row['id'])
+            self.situations[row['id']] = row
+            if row['resolved']:
+                event = RESOLVED_SITUATION if previous is None or not previous['resolved'] else None
+            elif previous is None:
+                event = NEW_SITUATION
+            elif previous['version'] != row['version'] or previous['resolved']:
+                event = UPDATED_SITUATION
+            else:
+                event = None
+            if event:
+                changes.append((event, row))
+        return changes
+
+    def _deleted_situations(self):
+        from .models import VtsSituation
+
+        if VtsSituation.objects.count() == len(self.situations):
+            return []
+        stored = set(VtsSituation.objects.values_list('id', flat=True))
+        return [row for pk, row in self.situations.items() if pk not in stored]
+
+    def _collision_signature(self):
+        from .models import DetectedCollision
+
+        # The sums change when a --no-clear run updates the tier or distance of a pair in place
+        totals = DetectedCollision.objects.aggregate(
+            count=Count('id'), last_id=Max('id'), tiers=Sum('tolerance_meters'), distances=Sum('distance_meters'),
+        )
+        return totals['count'], totals['last_id'], totals['tiers'], totals['distances']
+
+    def _collision_events(self):
+        """New and resolved collisions; only read when the table changed since the last poll."""
+        from .models import DetectedCollision
+
+        signature = self._collision_signature()
+        if signature == self.collision_signature:
+            return
+        self.collision_signature = signature
+
+        # Whole rows: pairs re-created by a clearing run or updated in place keep their event
+        # state but take the current id, tier and distance
+        current = {_collision_pair(row): row for row in DetectedCollision.objects.values(*self.COLLISION_FIELDS).iterator()}
+        for pair in [pair for pair in self.collisions if pair not in current]:
+            previous = self.collisions.pop(pair)
+            yield _collision_event(RESOLVED_COLLISION, previous, self.situations.get(pair[0]))
+        for pair, row in current.items():
+            is_new = pair not in self.collisions
+            self.collisions[pair] = row
+            if is_new:
+                yield _collision_event(NEW_COLLISION, row, self.situations.get(row['transit_information_id']))
+
+
+def _collision_pair(row):
+    return row['transit_information_id'], row['bus_route_id']
+
+
+def _situation_event(event, row, routes):
+    data = {
+        "id": row['id'],
+        "situation_id": row['situation_id'],
+        "version": row['version'],
+        "severity": row['severity'],
+        "county": row['area_name'],
+        "situation_type": row['filter_used'],
+        "name": row['road_number'],
+        "description": row['location_description'],
+        "comment": row['comment'],
+        "lon": row['lon'],
+        "lat": row['lat'],
+        "routes": sorted(route for route in routes if route),
+    }
+    return LiveEvent(event, data, county=row['area_name'], severity=row['severity'], routes=routes)
+
+
+def _collision_event(event, row, situation):
+    route = row['bus_route__route_id']
+    data = {
+        "collision_id": row['id'],
+        "transit_id": row['transit_information_id'],
+        "situation_id": situation['situation_id'] if situation else None,
+        "Bus_number": route,
+        "lon": row['transit_lon'],
+        "lat": row['transit_lat'],
+        "tolerance": row['tolerance_meters'],
+        "distance_meters": row['distance_meters'],
+        "detected_at": row['detection_timestamp'].isoformat() if row['detection_timestamp'] else None,
+        "severity": situation['severity'] if situation else None,
+    }
+    return LiveEvent(
+        event, data,
+        county=situation['area_name'] if situation else None,
+        severity=situation['severity'] if situation else None,
+        routes=(route,) if route else (),
+    )
+
+
+# One hub per web process.
+hub = BroadcastHub()
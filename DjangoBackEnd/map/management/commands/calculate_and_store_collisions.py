@@ -2,18 +2,31 @@
 Django Management Command: update_collisions
 
 This command recalculates potential collisions between VTS and defined
-bus routes based on a specified proximity tolerance. It then updates the
-`DetectedCollision` table in the database with the results.
+bus routes in one pass at the largest of the proximity tiers
+(settings.COLLISION_TIERS_METERS, e.g. 50/150/300 m). Each (situation,
+route) pair is stored once in the `DetectedCollision` table with its
+distance (`distance_meters`) and the smallest tier it is within
+(`tolerance_meters`), so consumers filter by proximity instead of the join
+being re-run per tolerance. `--tolerance` detects within that single tier
+only.
 
 By default, it clears all existing detected collisions before inserting the
 newly calculated ones. An option exists to prevent clearing and only add
-newly detected collisions not already present.
+newly detected collisions not already present; pairs already present get
+their distance and tier updated when they changed.
+
+`--bus-routes` recomputes only the given routes (import_bus_routes passes the
+shapes it inserted or changed): their collisions that no longer hold are
+deleted, the ones that still hold keep their row (and MQTT published flag)
+and new ones are inserted.
 """
 import time
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from map.models import DetectedCollision
-from map.utils import calculate_collisions_for_storage # Import the calculation function
+from map.utils import calculate_collisions_for_storage, collision_tier, collision_tiers # Import the calculation function
+from map import metrics
+from map.route_summary import CHUNK_SIZE, update_route_summaries
 import logging
 logger = logging.getLogger(__name__)
 
@@ -22,11 +35,12 @@ class Command(BaseCommand):
     Handles the recalculation and storage of detected collisions.
 
     It calls an external function `calculate_collisions_for_storage` to
-    perform the geographic proximity analysis based on the provided tolerance.
-    The results are then processed and stored in the `DetectedCollision` model.
+    perform the geographic proximity analysis at the largest tier.
+    The results are then classified into tiers and stored in the
+    `DetectedCollision` model.
 
     Key features:
-    - Customizable proximity tolerance via command-line argument.
+    - Configurable proximity tiers (settings, `--tiers`, or a single `--tolerance`).
     - Option to clear existing collision data before inserting new results (default).
     - Option to preserve existing data and only insert new, unique collision pairs.
     - Uses `transaction.atomic` for database operations to ensure consistency.
@@ -40,38 +54,75 @@ class Command(BaseCommand):
         parser.add_argument(
             '--tolerance',
             type=int,
+            default=None,
+            help='Only detect collisions within this distance in meters (a single tier). Default: all tiers.',
+        )
+        parser.add_argument(
+            '--tiers',
+            type=int,
+            nargs='+',
+            default=None,
             # 300 meters can detect ferry abnormalies
-            default=300, # Default tolerance if not specified
-            help='Distance tolerance in meters for collision detection.',
+            help='Proximity tiers in meters (default: settings.COLLISION_TIERS_METERS, e.g. 50 150 300).',
         )
         parser.add_argument(
             '--no-clear',
             action='store_true',
             help='Do not clear existing collision data before inserting new data (use with caution).',
         )
+        parser.add_argument(
+            '--bus-routes',
+            type=int,
+            nargs='+',
+            default=None,
+            help='Only recompute the collisions of these BusRoute ids (primary keys); other routes are left alone.',
+        )
 
+    @metrics.flush_after('calculate_and_store_collisions')
     def handle(self, *args, **options):
-        tolerance = options['tolerance']
-        clear_existing = not options['no_clear']
+        try:
+            tiers = collision_tiers([options['tolerance']] if options['tolerance'] else options.get('tiers'))
+        except ValueError as e:
+            raise CommandError(str(e))
+        tolerance = tiers[-1]  # One pass at the largest tier
+        bus_route_ids = options.get('bus_routes')
+        # A per-route recompute never clears the collisions of other routes
+        clear_existing = not options['no_clear'] and bus_route_ids is None
         start_time = time.time()
 
-        logger.info(f"Running update_collisions. Tolerance={tolerance}, Clear Existing Data={clear_existing}")
+        logger.info(f"Running update_collisions. Tiers={tiers}, Clear Existing Data={clear_existing}")
         self.stdout.write(f"Option --no-clear specified: {options['no_clear']}. Clear Existing Data set to: {clear_existing}")
 
         # --- Calculate New Collisions ---
-        calculated_data = calculate_collisions_for_storage(tolerance)
+        calculated_data = calculate_collisions_for_storage(tolerance, bus_route_ids)
         # ... (error checking for calculated_data) ...
         calculation_time = time.time()
         self.stdout.write(f"Calculation finished in {calculation_time - start_time:.2f} seconds. Found {len(calculated_data)} potential collisions.")
 
         created_count = 0
+        updated_count = 0 # Existing pairs whose distance or tier changed
         skipped_count = 0 # For duplicates within calculation OR already existing
+        tier_counts = dict.fromkeys(tiers, 0)
 
         # --- Database Operations ---
         try:
             with transaction.atomic():
-                existing_pairs_set = set() # Initialize
-                if clear_existing:
+                existing = {} # (transit_id, route_id) -> (pk, tolerance_meters, distance_meters)
+                if bus_route_ids is not None:
+                    self.stdout.write(f"Recomputing the collisions of {len(bus_route_ids)} bus routes only...")
+                    calculated_pairs = {(data['transit_id'], data['route_id']) for data in calculated_data}
+                    for start in range(0, len(bus_route_ids), CHUNK_SIZE):
+                        existing.update(
+                            ((transit_id, route_id), (pk, tier, distance))
+                            for pk, transit_id, route_id, tier, distance in DetectedCollision.objects.filter(
+                                bus_route_id__in=bus_route_ids[start:start + CHUNK_SIZE],
+                            ).values_list('id', 'transit_information_id', 'bus_route_id', 'tolerance_meters', 'distance_meters')
+                        )
+                    stale = [row[0] for pair, row in existing.items() if pair not in calculated_pairs]
+                    for start in range(0, len(stale), CHUNK_SIZE):
+                        DetectedCollision.objects.filter(pk__in=stale[start:start + CHUNK_SIZE]).delete()
+                    self.stdout.write(f"Deleted {len(stale)} collisions that no longer hold, kept {len(existing) - len(stale)}.")
+                elif clear_existing:
                     self.stdout.write("Clearing existing collision data...")
                     deleted_count, _ = DetectedCollision.objects.all().delete()
                     self.stdout.write(f"Deleted {deleted_count} old collision records.")
@@ -79,27 +130,45 @@ class Command(BaseCommand):
                     # --- If not clearing, get existing pairs to avoid re-inserting ---
                     self.stdout.write(self.style.WARNING("Skipping clearing. Fetching existing collision pairs..."))
                     # Fetch tuple pairs for efficient lookup
-                    existing_pairs = DetectedCollision.objects.values_list(
+                    existing_rows = DetectedCollision.objects.values_list(
+                        'id',
                         'transit_information_id',
-                        'bus_route_id'
+                        'bus_route_id',
+                        'tolerance_meters',
+                        'distance_meters',
                     )
-                    existing_pairs_set = set(existing_pairs)
-                    self.stdout.write(f"Found {len(existing_pairs_set)} existing pairs in the database.")
+                    existing = {
+                        (transit_id, route_id): (pk, tier, distance)
+                        for pk, transit_id, route_id, tier, distance in existing_rows.iterator()
+                    }
+                    self.stdout.write(f"Found {len(existing)} existing pairs in the database.")
                     # --- End fetching existing pairs ---
 
                 self.stdout.write("Preparing new collision data for storage...")
                 collisions_to_create = []
+                collisions_to_update = []
                 # Use a separate set to track pairs added *in this specific run*
                 # to handle potential duplicates within calculated_data itself.
                 seen_in_this_run = set()
 
                 for data in calculated_data:
                     pair = (data['transit_id'], data['route_id'])
+                    distance = round(data['distance'], 1)
+                    tier = collision_tier(distance, tiers)
+                    if tier is None:
+                        continue # Rounded past the largest tier
 
                     # --- Check 1: Already exists in DB (only if not clearing) ---
-                    if not clear_existing and pair in existing_pairs_set:
-                        skipped_count += 1
-                        continue # Skip if it already exists in the database
+                    if pair in existing:
+                        pk, stored_tier, stored_distance = existing[pair]
+                        if pair not in seen_in_this_run and (stored_tier, stored_distance) != (tier, distance):
+                            collisions_to_update.append(
+                                DetectedCollision(pk=pk, tolerance_meters=tier, distance_meters=distance)
+                            )
+                        else:
+                            skipped_count += 1
+                        seen_in_this_run.add(pair)
+                        continue # Keep the row (and its published flag)
 
                     # --- Check 2: Already added in this calculation run ---
                     if pair in seen_in_this_run:
@@ -116,20 +185,39 @@ class Command(BaseCommand):
                             bus_route_id=data['route_id'],
                             transit_lon=data['transit_lon'],
                             transit_lat=data['transit_lat'],
-                            tolerance_meters=tolerance
+                            tolerance_meters=tier,
+                            distance_meters=distance,
                             # published_to_mqtt defaults to False
                         )
                     )
+                    tier_counts[tier] += 1
                     seen_in_this_run.add(pair) # Track pair added in this run
 
                 if collisions_to_create:
                     self.stdout.write(f"Bulk creating {len(collisions_to_create)} genuinely new collision records...")
                     created_objects = DetectedCollision.objects.bulk_create(collisions_to_create)
                     created_count = len(created_objects)
+                    metrics.ROWS_UPSERTED.observe(created_count, table=DetectedCollision._meta.db_table)
                     self.stdout.write(f"Successfully stored {created_count} new collision records (marked as unpublished).")
+                    self.stdout.write("New collisions per tier: " + ", ".join(
+                        f"{tier} m: {count}" for tier, count in tier_counts.items()
+                    ) + ".")
                 else:
                      self.stdout.write("No genuinely new collision records found to store.")
 
+                if collisions_to_update:
+                    DetectedCollision.objects.bulk_update(
+                        collisions_to_update, ['tolerance_meters', 'distance_meters'], batch_size=CHUNK_SIZE,
+                    )
+                    updated_count = len(collisions_to_update)
+                    self.stdout.write(f"Updated the distance and tier of {updated_count} existing collision records.")
+
+            # --- Per-route summary (served by /api/routes/affected/) ---
+            changed_routes = {collision.bus_route_id for collision in collisions_to_create}
+            changed_routes.update(bus_route_ids or ())  # Their stale collisions may have been deleted
+            refreshed = update_route_summaries(changed_routes, full=clear_existing)
+            self.stdout.write(f"Refreshed the collision summary of {refreshed} routes.")
+
         except Exception as e:
             logger.error(f"Database operation failed: {e}", exc_info=True) # Log traceback
             self.stderr.write(self.style.ERROR(f"Database operation failed: {e}"))
@@ -137,5 +225,5 @@ class Command(BaseCommand):
         end_time = time.time()
         self.stdout.write(self.style.SUCCESS(
             f"Collision update finished in {end_time - start_time:.2f} seconds. "
-            f"Stored: {created_count}. Skipped existing/duplicates: {skipped_count}."
+            f"Stored: {created_count}. Updated: {updated_count}. Skipped existing/duplicates: {skipped_count}."
         ))
\ No newline at end of file
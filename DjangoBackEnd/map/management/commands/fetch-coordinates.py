@@ -1,88 +1,153 @@
+import hashlib
 import json
-import polyline
-import re
+import logging
 import os
+import time
 from gql import Client, gql
-from gql.transport.requests import RequestsHTTPTransport
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
+from map.upstream import graphql_transport
+from map.polylines import decode_many, split
+from map.route_shapes import FeatureWriter, route_feature, route_id_from_journey
+from map.vehicles import VEHICLES_URL, DEFAULT_CODESPACE
+
+logger = logging.getLogger(__name__)
 
 OUTPUT_DIRECTORY = settings.BASE_DIR / "data"
-JSON_FILE_PATH = OUTPUT_DIRECTORY / "route_coordinates.geojson"
+NDJSON_FILE_PATH = OUTPUT_DIRECTORY / "route_coordinates.ndjson"
+SCHEMA_FILE_PATH = OUTPUT_DIRECTORY / "vehicles_schema.json"
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_SCHEMA_MAX_AGE_HOURS = 24 * 7
+
+LINES_QUERY = """
+query {
+  lines(codespaceId: %s) {
+    lineRef
+  }
+}
+"""
+
+# One aliased serviceJourneys field per line of the batch
+JOURNEYS_FIELD = """
+  l%d: serviceJourneys(lineRef: %s) {
+    id
+    pointsOnLink {
+      length
+      points
+    }
+  }
+"""
+
+
+def journeys_query(line_refs):
+    fields = ''.join(JOURNEYS_FIELD % (n, json.dumps(line_ref)) for n, line_ref in enumerate(line_refs))
+    return f"query {{{fields}}}"
 
-class Command(BaseCommand):
-    help = "Fetch static bus route coordinates for all bus lines in Troms"
 
-    def fetch_route_coordinates(self):
-        uri = "https://api.entur.io/realtime/v2/vehicles/graphql"
+class Command(BaseCommand):
+    help = (
+        "Fetch static bus route coordinates for all bus lines in Troms, a batch of lines per request, "
+        "into a newline-delimited GeoJSON file for import_bus_routes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help=f"NDJSON file to write (default: {NDJSON_FILE_PATH}).")
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help=f"Lines per GraphQL request (default: settings.ROUTE_FETCH_BATCH_SIZE or {DEFAULT_BATCH_SIZE}).",
+        )
+        parser.add_argument(
+            '--refresh-schema', action='store_true',
+            help="Download the GraphQL schema even if the cached copy is recent enough.",
+        )
+
+    def graphql_client(self, transport, refresh_schema=False):
+        """
+        gql Client validating against the cached introspection schema, when it
+        is younger than ENTUR_SCHEMA_MAX_AGE_HOURS; otherwise the schema is
+        fetched (and saved by `save_schema`).
+        """
+        schema_path = getattr(settings, 'ENTUR_VEHICLES_SCHEMA_PATH', None) or SCHEMA_FILE_PATH
+        max_age = getattr(settings, 'ENTUR_SCHEMA_MAX_AGE_HOURS', DEFAULT_SCHEMA_MAX_AGE_HOURS) * 3600
+        if not refresh_schema:
+            try:
+                if time.time() - os.path.getmtime(schema_path) < max_age:
+                    with open(schema_path, 'r', encoding='utf-8') as f:
+                        return Client(transport=transport, introspection=json.load(f))
+            except (OSError, ValueError) as e:
+                logger.info(f"No usable cached GraphQL schema at {schema_path} ({e}), fetching it.")
+        return Client(transport=transport, fetch_schema_from_transport=True)
+
+    def save_schema(self, client):
+        schema_path = getattr(settings, 'ENTUR_VEHICLES_SCHEMA_PATH', None) or SCHEMA_FILE_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(schema_path)), exist_ok=True)
+        with open(schema_path, 'w', encoding='utf-8') as f:
+            json.dump(client.introspection, f, separators=(',', ':'))
+
+    def fetch_route_coordinates(self, output_path, batch_size, refresh_schema=False):
+        uri = getattr(settings, 'ENTUR_VEHICLES_URL', VEHICLES_URL)
+        codespace = getattr(settings, 'VEHICLE_CODESPACE', DEFAULT_CODESPACE)
 
         headers = {
             "ET-Client-Name": "troms-fylkeskommune-studenter",
         }
 
-        route_query = gql("""
-        query {
-          serviceJourneys(codespaceId: "TRO") {
-            id
-            pointsOnLink {
-              length
-              points
-            }
-          }
-        }
-        """)
-
-        transport = RequestsHTTPTransport(url=uri, headers=headers)
-        client = Client(transport=transport, fetch_schema_from_transport=True)
-
-        result = client.execute(route_query)
-        print(f"Received data: {result}")
-
-        geojson_data = {
-            "type": "FeatureCollection",
-            "features": []
-        }
-
-        if "serviceJourneys" in result and result["serviceJourneys"]:
-            for route_data in result["serviceJourneys"]:
-                points_on_link = route_data.get("pointsOnLink", None)
-
-                # Check if pointsOnLink is None or doesn't contain points
-                if points_on_link and points_on_link.get("points"):
-                    encoded_points = points_on_link["points"]
-                    decoded_coordinates = polyline.decode(encoded_points)
-
-                    # Extract the desired part of the ID using regex
-                    match = re.search(r":(\d+)_", route_data.get("id", ""))
-                    if match:
-                        trimmed_id = match.group(0)[1:-1]  # Get the part after ':' and before '_'
-
-                        # Create a feature for the bus route
-                        feature = {
-                            "type": "Feature",
-                            "geometry": {
-                                "type": "LineString",
-                                "coordinates": [[lon, lat] for lat, lon in decoded_coordinates]  # Ensure [longitude, latitude] order
-                            },
-                            "properties": {
-                                "route_id": trimmed_id  # Add the trimmed ID to the properties
-                            }
-                        }
-
-                        geojson_data["features"].append(feature)
-                    else:
-                        self.stdout.write(self.style.WARNING(f"Could not extract route ID for journey {route_data.get('id')}"))
-                else:
-                    # Handle the case where no points are available for this route
-                    self.stdout.write(self.style.WARNING(f"No points data found for journey ID {route_data.get('id')}"))
-
-            # Save all routes to a GeoJSON file
-            with open(JSON_FILE_PATH, "w") as f:
-                json.dump(geojson_data, f, indent=4)
-
-            self.stdout.write(self.style.SUCCESS("Successfully fetched and saved all route coordinates as GeoJSON"))
-        else:
-            self.stdout.write(self.style.ERROR("No route data found for any bus line in Troms"))
-
-    def handle(self, *args, **kwargs):
-        self.fetch_route_coordinates()
+        transport = graphql_transport(uri, headers)
+        client = self.graphql_client(transport, refresh_schema)
+        fetched_schema = client.introspection is None
+
+        written = skipped = duplicates = 0
+        seen = set()  # Journeys of one line mostly share a shape; write each (route, shape) once
+        # One connection for all batches; the output replaces the old file only when everything was fetched
+        with client as session, FeatureWriter(output_path) as writer:
+            if fetched_schema:
+                self.save_schema(client)
+            lines = session.execute(gql(LINES_QUERY % json.dumps(codespace))).get("lines") or []
+            line_refs = sorted({line["lineRef"] for line in lines if line.get("lineRef")})
+            if not line_refs:
+                raise CommandError("No route data found for any bus line in Troms")
+
+            for start in range(0, len(line_refs), batch_size):
+                batch = line_refs[start:start + batch_size]
+                result = session.execute(gql(journeys_query(batch)))
+                shapes = []  # (route_id, journey_id, encoded points) of the new shapes in this batch
+                for journeys in result.values():
+                    for route_data in journeys or []:
+                        points_on_link = route_data.get("pointsOnLink", None)
+
+                        # Check if pointsOnLink is None or doesn't contain points
+                        if not (points_on_link and points_on_link.get("points")):
+                            skipped += 1
+                            logger.debug(f"No points data found for journey ID {route_data.get('id')}")
+                            continue
+                        route_id = route_id_from_journey(route_data.get("id"))
+                        if route_id is None:
+                            skipped += 1
+                            self.stdout.write(self.style.WARNING(f"Could not extract route ID for journey {route_data.get('id')}"))
+                            continue
+
+                        encoded_points = points_on_link["points"]
+                        key = hashlib.blake2b(f"{route_id}|{encoded_points}".encode(), digest_size=16).digest()
+                        if key in seen:
+                            duplicates += 1
+                            continue
+                        seen.add(key)
+                        shapes.append((route_id, route_data.get("id"), encoded_points))
+
+                # The batch's polylines are decoded together, straight to [longitude, latitude] rows
+                coords, offsets = decode_many(points for _, _, points in shapes)
+                for (route_id, journey_id, _), coordinates in zip(shapes, split(coords, offsets)):
+                    writer.write(route_feature(route_id, coordinates.tolist(), journey_id=journey_id))
+                written += len(shapes)
+                self.stdout.write(f"Lines {start + 1}-{start + len(batch)} of {len(line_refs)}: {written} shapes so far.")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved {written} route shapes to {output_path} "
+            f"({duplicates} duplicate shapes and {skipped} journeys without usable points skipped)."
+        ))
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size'] or getattr(settings, 'ROUTE_FETCH_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        self.fetch_route_coordinates(options['output'] or NDJSON_FILE_PATH, batch_size, options['refresh_schema'])
@@ -0,0 +1,106 @@
+"""
+Django Management Command: fetch_vehicle_positions
+
+Polls the Entur vehicles GraphQL API for the live positions of the buses of
+one codespace (settings.VEHICLE_CODESPACE, "TRO"), keeps the latest position
+per vehicle in memory (map.vehicles.VehicleStore), flags vehicles within
+settings.VEHICLE_SITUATION_TOLERANCE_METERS of an active situation, and
+writes the result to settings.VEHICLE_POSITIONS_PATH for /api/serve_bus/.
+The last VEHICLE_TRACK_MINUTES of positions per vehicle are kept in a ring
+buffer and written to settings.VEHICLE_TRACKS_PATH for /api/vehicles/tracks/.
+
+Runs as a daemon by default (one poll every VEHICLE_POLL_SECONDS); `--once`
+polls a single time, e.g. from cron.
+"""
+import logging
+import math
+import time
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from map import metrics
+from map.collision_engine import get_situation_index
+from map.upstream import get_session, upstream_timeout_seconds
+from map.vehicles import (
+    DEFAULT_CODESPACE, VEHICLES_URL, TrackBuffer, VehicleStore, fetch_vehicles, parse_vehicles, write_snapshot,
+)
+
+logger = logging.getLogger(__name__)
+
+PROCESS = 'fetch_vehicle_positions'
+
+
+class Command(BaseCommand):
+    help = "Poll live bus positions from Entur and flag buses near active situations"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Poll once and exit instead of running as a daemon.")
+        parser.add_argument(
+            '--interval', type=float, default=None,
+            help="Seconds between polls (default: settings.VEHICLE_POLL_SECONDS).",
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=None,
+            help="Distance in meters for flagging a vehicle near a situation "
+                 "(default: settings.VEHICLE_SITUATION_TOLERANCE_METERS).",
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or getattr(settings, 'VEHICLE_POLL_SECONDS', 10)
+        tolerance = options['tolerance'] or getattr(settings, 'VEHICLE_SITUATION_TOLERANCE_METERS', 100)
+        self.store = VehicleStore()
+        self.track_seconds = getattr(settings, 'VEHICLE_TRACK_MINUTES', 30) * 60
+        # One position per poll at most, so this many rows cover the track window
+        self.tracks = TrackBuffer(math.ceil(self.track_seconds / interval) + 1)
+        while True:
+            start = time.monotonic()
+            try:
+                self.poll(tolerance)
+            except Exception as e:
+                # A bad response or a database hiccup must not stop the daemon; try again next interval
+                metrics.POLL_FAILURES.inc(process=PROCESS)
+                logger.exception(f"Polling vehicle positions failed: {e}")
+            try:
+                metrics.flush(PROCESS)
+            except OSError as e:
+                logger.warning(f"Could not write metrics for {PROCESS}: {e}")
+            if options['once']:
+                return
+            time.sleep(max(0.0, interval - (time.monotonic() - start)))
+
+    def poll(self, tolerance):
+        """Fetch, update the store, flag and write the snapshot. Returns the number of vehicles written."""
+        url = getattr(settings, 'ENTUR_VEHICLES_URL', VEHICLES_URL)
+        headers = {'ET-Client-Name': getattr(settings, 'ENTUR_CLIENT_NAME', 'TromsøFylkeskommune-svipper-Studenter')}
+        start = time.perf_counter()
+        try:
+            data = fetch_vehicles(
+                get_session(), url, getattr(settings, 'VEHICLE_CODESPACE', DEFAULT_CODESPACE),
+                headers=headers, timeout=upstream_timeout_seconds(),
+            )
+        except (requests.RequestException, ValueError) as e:
+            metrics.FETCH_SECONDS.observe(time.perf_counter() - start, feed='vehicles', status='error')
+            logger.error(f"Fetching vehicle positions failed: {e}")
+            return None
+        metrics.FETCH_SECONDS.observe(time.perf_counter() - start, feed='vehicles', status=200)
+
+        updated = self.store.update(parse_vehicles(data))
+        max_age = getattr(settings, 'VEHICLE_MAX_AGE_SECONDS', 600)
+        expired = self.store.expire(time.time() - max_age)
+        flagged = self.store.flag(get_situation_index(), tolerance)
+        records = self.store.records()
+        write_snapshot(getattr(settings, 'VEHICLE_POSITIONS_PATH', None) or settings.BASE_DIR / "bus_positions.json", records)
+
+        self.tracks.append_store(self.store)
+        since = time.time() - self.track_seconds
+        self.tracks.expire(since)
+        tracks_path = getattr(settings, 'VEHICLE_TRACKS_PATH', None) or settings.BASE_DIR / "vehicle_tracks.json"
+        write_snapshot(tracks_path, self.tracks.snapshot(since))
+        metrics.ROWS_UPSERTED.observe(updated, table='vehicle_positions')
+        logger.info(
+            f"Vehicle positions: {updated} updated, {expired} expired, {len(records)} live, "
+            f"{flagged} within {tolerance:g} m of a situation."
+        )
+        return len(records)
@@ -1,16 +1,25 @@
 import os
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
+import urllib3
 import django
+from django.conf import settings
 from dateutil.parser import isoparse
 from datetime import timezone as dt_timezone
-import xml.etree.ElementTree as ET
 from django.core.management.base import BaseCommand
+from django.utils import timezone
 # --- GeoDjango Imports ---
 from django.contrib.gis.geos import Point, LineString
 from django.core.exceptions import ValidationError
 # --- End GeoDjango Imports ---
 from map.models import VtsSituation, ApiMetadata
+from map.datex import iter_records, read_publication_time, DatexParseError
+from map.upstream import get_session, decoded_stream, upstream_timeout_seconds, TeeReader
+from map.snapshot_archive import get_archive
+from map import metrics
+from map.facets import store_facets
 from config import UserName_DATEX, Password_DATEX
 from email.utils import format_datetime
 
@@ -21,17 +30,6 @@ django.setup()
 BaseURL = "https://datex-server-get-v3-1.atlas.vegvesen.no/datexapi/GetSituation/pullsnapshotdata/"
 logger = logging.getLogger(__name__)
 
-# Define namespaces (assuming these remain correct)
-namespaces = {
-    'ns0': 'http://datex2.eu/schema/3/messageContainer',
-    'ns2': 'http://datex2.eu/schema/3/messageContainer',
-    'ns12': 'http://datex2.eu/schema/3/situation',
-    'ns8': 'http://datex2.eu/schema/3/locationReferencing',
-    'common': 'http://datex2.eu/schema/3/common',
-    'xsi': 'http://www.w3.org/2001/XMLSchema-instance',
-    'def': 'http://datex2.eu/schema/3/common',
-}
-
 # Docstring remains largely the same, but mention GeoDjango usage
 """
 This script is a Django management command that fetches transit situation data from the VTS (Vegtrafikksentralen) API,
@@ -39,7 +37,12 @@ processes the XML response, and stores the relevant information in the database
 
 Key functionalities:
 - ... (existing functionalities) ...
-- Parses XML and extracts data including location details.
+- Fetches the unfiltered snapshot, or the `filter/<Type>` feeds listed in settings.DATEX_FILTERS (or --filters),
+  concurrently over one keep-alive session. Each feed keeps its own If-Modified-Since in ApiMetadata,
+  and records from all feeds are merged by situation_id before they are stored.
+- Optionally archives every raw snapshot (settings.DATEX_ARCHIVE_DIR, see map/snapshot_archive.py)
+  for the replay_snapshots command.
+- Parses XML with the shared `map.datex` parser and extracts data including location details.
 - Creates GeoDjango Point objects from latitude/longitude.
 - Creates GeoDjango LineString objects from 'posList' data.
 - Stores extracted information in the 'VtsSituation' model, using spatial fields.
@@ -51,34 +54,165 @@ Requirements: ...
 - Necessary Python packages (requests, python-dateutil, Django, GDAL bindings if needed) must be installed.
 """
 
+def feed_url(base_url, filter_name):
+    """URL of the unfiltered snapshot (filter_name None) or of one `filter/<Type>` feed."""
+    return f"{base_url}filter/{filter_name}" if filter_name else base_url
+
+
+def metadata_key(filter_name):
+    """ApiMetadata key holding a feed's Last-Modified; the unfiltered feed keeps the original key."""
+    return f"last_modified_date:{filter_name}" if filter_name else 'last_modified_date'
+
+
+def record_sort_key(record):
+    """Order two copies of the same record: higher version, then later version time, wins."""
+    try:
+        version = int(record.version)
+    except (TypeError, ValueError):
+        version = -1
+    return version, record.version_time or ''
+
+
+class FeedResult:
+    """What one feed returned: its response (None on failure) and parsed records."""
+    __slots__ = ('filter_name', 'response', 'records', 'error', 'body_path')
+
+    def __init__(self, filter_name, response=None, records=(), error=None):
+        self.filter_name = filter_name
+        self.response = response
+        self.records = records
+        self.error = error
+        self.body_path = None  # Decompressed copy of the body
+
+    @property
+    def label(self):
+        return self.filter_name or 'snapshot'
+
+
 class Command(BaseCommand):
     help = "Fetch transit information and store it in the database using GeoDjango"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--filters', nargs='*', default=None,
+            help="DATEX filter feeds to fetch, e.g. Accident MaintenanceWorks (default: settings.DATEX_FILTERS; "
+                 "none means the unfiltered snapshot).",
+        )
+
+    @metrics.flush_after('fetch_vts_situations')
     def handle(self, *args, **kwargs):
-        # Retrieve the last modified date (same as before)
-        last_modified_entry = ApiMetadata.objects.filter(key='last_modified_date').first()
-        headers = {}
-        if last_modified_entry:
-            last_modified_date = last_modified_entry.value
-            headers['If-Modified-Since'] = last_modified_date
-            logger.info(f"Using If-Modified-Since header: {last_modified_date}")
+        filters = kwargs.get('filters')
+        if filters is None:
+            filters = getattr(settings, 'DATEX_FILTERS', [])
+        feeds = list(dict.fromkeys(filters)) or [None]  # None is the unfiltered snapshot
+        base_url = getattr(settings, 'DATEX_BASE_URL', BaseURL)
+        workers = max(1, min(len(feeds), getattr(settings, 'DATEX_FETCH_WORKERS', 8)))
+
+        # Retrieve the last modified date of every feed in one query
+        keys = {metadata_key(name): name for name in feeds}
+        last_modified = {
+            keys[entry.key]: entry.value for entry in ApiMetadata.objects.filter(key__in=keys)
+        }
+
+        # The shared keep-alive session serves all feeds; the feeds are fetched (and parsed) concurrently,
+        # so the wall-clock time is that of the slowest feed
+        start = time.perf_counter()
+        session = get_session()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='datex-feed') as executor:
+            results = list(executor.map(
+                lambda name: self.fetch_feed(session, feed_url(base_url, name), name, last_modified.get(name)),
+                feeds,
+            ))
+        logger.info(f"Fetched {len(feeds)} DATEX feed(s) in {time.perf_counter() - start:.2f}s.")
+
+        updated = [result for result in results if result.response is not None]
+        if not updated:
+            return
 
-        url = BaseURL # Removed f-string as no variable is used here
+        # Merge by situation_id (the record id); the same record can come from several feeds
+        merged = {}
+        for result in updated:
+            for record in result.records:
+                current = merged.get(record.record_id)
+                if current is None or record_sort_key(record) > record_sort_key(current):
+                    merged[record.record_id] = record
+        self.store_records(merged.values())
+
+        # Update last modified only for feeds that were fetched and stored successfully
+        for result in updated:
+            if result.error is None:
+                self.update_last_modified_date(result.response, metadata_key(result.filter_name), result.body_path)
+
+    def fetch_feed(self, session, url, filter_name, if_modified_since):
+        """
+        Fetch and parse one feed. Runs in a worker thread, so it does not touch the database.
+
+        Any error fails this feed only (`result.error` is set, so its
+        Last-Modified is kept); the other feeds are still stored.
+        """
+        result = FeedResult(filter_name)
         try:
-            response = requests.get(url, auth=(UserName_DATEX, Password_DATEX), headers=headers)
+            self._fetch_feed(result, session, url, if_modified_since)
+        except Exception as e:
+            logger.exception(f"[{result.label}] Fetching the feed failed: {e}")
+            result.error = e
+        return result
+
+    def _fetch_feed(self, result, session, url, if_modified_since):
+        headers = {}
+        if if_modified_since:
+            headers['If-Modified-Since'] = if_modified_since
+            logger.info(f"[{result.label}] Using If-Modified-Since header: {if_modified_since}")
+        start = time.perf_counter()
+        try:
+            response = session.get(
+                url, headers=headers, auth=(UserName_DATEX, Password_DATEX),
+                timeout=upstream_timeout_seconds(), stream=True,
+            )
+            metrics.FETCH_SECONDS.observe(time.perf_counter() - start, feed=result.label, status=response.status_code)
             response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
         except requests.RequestException as e:
-            logger.error(f"HTTP request failed: {e}")
+            if e.response is None:
+                metrics.FETCH_SECONDS.observe(time.perf_counter() - start, feed=result.label, status='error')
+            logger.error(f"[{result.label}] HTTP request failed: {e}")
             return
 
-        # Only process if status code was 200
-        if response.status_code == 200:
-             logger.info("Received new data (HTTP 200). Processing...")
-             self.process_response(response)
-             self.update_last_modified_date(response) # Update last modified only on successful fetch
-        # The 304 case is handled by the HTTPError exception check above.
-
-    # Removed to_float as direct conversion happens during Point creation
+        with response:
+            # Only process if status code was 200; 304 means the feed has not changed
+            if response.status_code != 200:
+                logger.info(f"[{result.label}] Not modified (HTTP {response.status_code}).")
+                return
+
+            logger.info(f"[{result.label}] Received new data (HTTP 200). Processing...")
+            result.response = response
+            # The body is gunzipped as the parser reads it; a copy goes to the debug file
+            # (and to the snapshot archive, when enabled) on the way
+            result.body_path = f"debug_response_{result.filter_name}.xml" if result.filter_name else "debug_response.xml"
+            archive = get_archive()
+            archive_writer = archive.writer(result.label) if archive else None
+            try:
+                with open(result.body_path, "wb") as debug_file, metrics.PARSE_SECONDS.time(feed=result.label):
+                    sinks = (debug_file, archive_writer) if archive_writer else (debug_file,)
+                    result.records = list(iter_records(TeeReader(decoded_stream(response), *sinks)))
+            except DatexParseError as e:
+                logger.error(f"[{result.label}] Error parsing XML: {e}")
+                result.error = e
+            except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+                logger.error(f"[{result.label}] Download failed: {e}")
+                result.error = e
+            except OSError as e:  # Writing the debug copy or the archive
+                logger.error(f"[{result.label}] Could not write the response body: {e}")
+                result.error = e
+            if archive_writer:
+                if result.error is None:
+                    archive_writer.commit(last_modified=response.headers.get('Last-Modified'))
+                else:
+                    archive_writer.discard()
+            metrics.FETCH_BYTES.observe(response.raw.tell(), feed=result.label)
+            logger.info(
+                f"[{result.label}] {response.raw.tell()} bytes over the wire "
+                f"({response.headers.get('Content-Encoding', 'identity')}), {len(result.records)} records."
+            )
 
     def safe_parse_datetime(self, datetime_str):
         # (same as before)
@@ -92,168 +226,143 @@ class Command(BaseCommand):
             logger.error(f"Could not parse datetime '{datetime_str}': {e}")
             return None
 
-    def process_response(self, response):
-        """Parse the XML response, process situation records, create geometry objects, and update the database."""
-        # Optional: Save debug response (same as before)
-        with open("debug_response.xml", "w", encoding="utf-8") as f:
-            f.write(response.content.decode('utf-8'))
-        try:
-            root = ET.fromstring(response.content)
-        except ET.ParseError as e:
-            logger.error(f"Error parsing XML: {e}")
-            return
+    def store_records(self, records):
+        """
+        Store parsed records; the shared parser walks each record once.
+
+        Only new records and records with a new version, severity or end time
+        get a new `ingested_at`, so the route summary and the live feed can
+        find the situations an ingest changed by the local clock.
+        """
+        records = list(records)
+        record_ids = [record.record_id for record in records]
+        stored = {}
+        for start in range(0, len(record_ids), 500):  # Well below SQLite's variable limit
+            stored.update(
+                (situation_id, tuple(state)) for situation_id, *state in VtsSituation.objects.filter(
+                    situation_id__in=record_ids[start:start + 500],
+                ).values_list('situation_id', 'version', 'version_time', 'severity', 'overall_end_time')
+            )
+        ingested_at = timezone.now()
 
         processed_count = 0
         skipped_count = 0
-
-        # Iterate over each situation record
-        for situation in root.findall(".//ns12:situationRecord", namespaces):
-            situation_id = situation.get("id") # Get ID early for logging errors
-            try:
-                # Extract comment (same as before)
-                comment = None
-                general_public_comment = situation.find("ns12:generalPublicComment", namespaces=namespaces)
-                if general_public_comment is not None:
-                    comment_values = general_public_comment.findall(".//common:value", namespaces=namespaces)
-                    comments = [cv.text for cv in comment_values if cv.text]
-                    comment = ' '.join(comments) if comments else None
-
-                # Extract xsi:type (same as before)
-                xsi_type = situation.attrib.get('{http://www.w3.org/2001/XMLSchema-instance}type')
-                situation_type = xsi_type.split(':')[-1] if xsi_type else 'Unknown'
-
-                # Extract basic information (same as before)
-                version = situation.get("version")
-                creation_time = self.safe_parse_datetime(situation.findtext("ns12:situationRecordCreationTime", namespaces=namespaces))
-                version_time = self.safe_parse_datetime(situation.findtext("ns12:situationRecordVersionTime", namespaces=namespaces))
-                probability_of_occurrence = situation.findtext("ns12:probabilityOfOccurrence", namespaces=namespaces)
-                severity = situation.findtext("ns12:severity", namespaces=namespaces)
-
-                # Extract source information (same as before)
-                source = situation.find("ns12:source", namespaces=namespaces)
-                source_country = source.findtext("common:sourceCountry", namespaces=namespaces) if source is not None else None
-                source_identification = source.findtext("common:sourceIdentification", namespaces=namespaces) if source is not None else None
-                source_name = source.findtext("common:sourceName/common:values/common:value", namespaces=namespaces) if source is not None else None
-                source_type = source.findtext("common:sourceType", namespaces=namespaces) if source is not None else None
-
-                # Extract validity information (same as before)
-                validity = situation.find("ns12:validity", namespaces=namespaces)
-                validity_status = validity.findtext("common:validityStatus", namespaces=namespaces) if validity is not None else None
-                overall_start_time = self.safe_parse_datetime(validity.findtext("common:validityTimeSpecification/common:overallStartTime", namespaces=namespaces)) if validity is not None else None
-                overall_end_time = self.safe_parse_datetime(validity.findtext("common:validityTimeSpecification/common:overallEndTime", namespaces=namespaces)) if validity is not None else None
-
-                # --- Process Location and Geometry ---
-                point_location = None
-                line_path = None
-                location_description = None
-                road_number = None
-                area_name = None
-                pos_list_raw = None # Keep for reference
-
-                location_reference = situation.find("ns12:locationReference", namespaces=namespaces)
-                if location_reference is not None:
-                    # Extract Lat/Lon for Point
-                    latitude_str = location_reference.findtext(".//ns8:latitude", namespaces=namespaces)
-                    longitude_str = location_reference.findtext(".//ns8:longitude", namespaces=namespaces)
-                    if latitude_str and longitude_str:
-                        try:
-                            lat = float(latitude_str)
-                            lon = float(longitude_str)
-                            # Create Point(x, y) -> Point(longitude, latitude) with SRID 4326
-                            point_location = Point(lon, lat, srid=4326)
-                        except (ValueError, TypeError) as e:
-                            logger.warning(f"Invalid coordinates for situation {situation_id}: lat='{latitude_str}', lon='{longitude_str}'. Error: {e}")
-                            point_location = None # Ensure it's None if conversion fails
-
-                    # Extract other location info
-                    location_description = location_reference.findtext(".//ns8:locationDescription/common:values/common:value", namespaces=namespaces)
-                    road_number = location_reference.findtext(".//ns8:roadInformation/ns8:roadNumber", namespaces=namespaces)
-                    area_name_element = location_reference.find(".//ns8:areaName", namespaces=namespaces)
-                    area_name = None
-                    if area_name_element is not None:
-                        area_name_values = area_name_element.findall("common:values/common:value", namespaces=namespaces)
-                        area_name_texts = [v.text for v in area_name_values if v.text]
-                        area_name = ' '.join(area_name_texts) if area_name_texts else None
-
-                    # Extract posList data for LineString
-                    gml_line_string = location_reference.find(".//ns8:gmlLineString", namespaces=namespaces)
-                    if gml_line_string is not None:
-                        pos_list_raw = gml_line_string.findtext("ns8:posList", namespaces=namespaces)
-                        if pos_list_raw:
-                            try:
-                                # Parse the posList into coordinate pairs (lat lon lat lon...)
-                                coords_flat = list(map(float, pos_list_raw.strip().split()))
-                                # Ensure even number of coordinates
-                                if len(coords_flat) % 2 == 0 and len(coords_flat) >= 4: # Need at least 2 points for a line
-                                    # Create list of (lon, lat) tuples for LineString
-                                    positions_lon_lat = list(zip(coords_flat[1::2], coords_flat[::2])) # lon is second, lat is first in each pair
-                                    # Create LineString object with SRID 4326
-                                    line_path = LineString(positions_lon_lat, srid=4326)
-                                else:
-                                     logger.warning(f"Invalid number of coordinates ({len(coords_flat)}) in posList for situation {situation_id}. Minimum 4 required.")
-                                     line_path = None
-                            except (ValueError, TypeError) as e:
-                                logger.warning(f"Could not parse posList '{pos_list_raw[:50]}...' for situation {situation_id}: {e}")
-                                line_path = None
-                            except ValidationError as e: # Catch potential LineString validation errors
-                                logger.warning(f"Could not create LineString for situation {situation_id} from posList '{pos_list_raw[:50]}...': {e}")
-                                line_path = None
-
-                # Extract transit service information (same as before)
-                transit_service_information = situation.findtext("ns12:transitServiceInformation", namespaces=namespaces)
-                transit_service_type = situation.findtext("ns12:transitServiceType", namespaces=namespaces)
-
-                # --- Create and save the VtsSituation object ---
-                VtsSituation.objects.update_or_create(
-                    situation_id=situation_id,
-                    defaults={
-                        'version': version,
-                        'creation_time': creation_time,
-                        'version_time': version_time,
-                        'probability_of_occurrence': probability_of_occurrence,
-                        'severity': severity,
-                        'source_country': source_country,
-                        'source_identification': source_identification,
-                        'source_name': source_name,
-                        'source_type': source_type,
-                        'validity_status': validity_status,
-                        'overall_start_time': overall_start_time,
-                        'overall_end_time': overall_end_time,
-                        'location': point_location,
-                        'path': line_path,
-                        'location_description': location_description,
-                        'road_number': road_number,
-                        'area_name': area_name,
-                        'transit_service_information': transit_service_information,
-                        'transit_service_type': transit_service_type,
-                        'pos_list_raw': pos_list_raw, # Store raw string for reference
-                        'comment': comment,
-                        'filter_used': situation_type,
-                    }
-                )
+        for record in records:
+            if self.store_record(record, stored, ingested_at):
                 processed_count += 1
-                # Update log message
-                log_msg = f"Processed: {situation_id}"
-                if point_location:
-                    log_msg += f" (Loc: Point({point_location.x:.4f}, {point_location.y:.4f})"
-                else:
-                     log_msg += f" (Loc: None"
-                if line_path:
-                     log_msg += f", Path: {len(line_path.coords)} pts)"
-                else:
-                     log_msg += f", Path: None)"
-
-                logger.info(log_msg)
-
-            except Exception as e:
-                logger.exception(f"FATAL Error processing situation record ID {situation_id}: {e}")
+            else:
                 skipped_count += 1
 
+        metrics.ROWS_UPSERTED.observe(processed_count, table=VtsSituation._meta.db_table)
         logger.info(f"Finished processing. Processed: {processed_count}, Skipped due to errors: {skipped_count}")
 
+        # Filter options for the map are computed once per ingest, not per page load
+        facets = store_facets()
+        logger.info(f"Filter options version {facets['version']}.")
+
+    def store_record(self, record, stored=None, ingested_at=None):
+        """
+        Create geometry for one parsed `SituationRecord` and upsert it. Returns False on error.
+
+        `stored` maps situation_id to the stored (version, version_time,
+        severity, overall_end_time); records that match it keep their
+        `ingested_at`. Without it every record counts as changed.
+        """
+        situation_id = record.record_id # Get ID early for logging errors
+        try:
+            # Comments and area names can have several values; join them
+            comment = ' '.join(record.comments) if record.comments else None
+            area_name = ' '.join(record.area_names) if record.area_names else None
+            location_description = record.location_descriptions[0] if record.location_descriptions else None
+
+            # --- Process Location and Geometry ---
+            point_location = None
+            line_path = None
+            pos_list_raw = record.pos_list # Keep for reference
+
+            # Extract Lat/Lon for Point
+            latitude_str, longitude_str = record.latitude, record.longitude
+            if latitude_str and longitude_str:
+                try:
+                    lat = float(latitude_str)
+                    lon = float(longitude_str)
+                    # Create Point(x, y) -> Point(longitude, latitude) with SRID 4326
+                    point_location = Point(lon, lat, srid=4326)
+                except (ValueError, TypeError) as e:
+                    logger.warning(f"Invalid coordinates for situation {situation_id}: lat='{latitude_str}', lon='{longitude_str}'. Error: {e}")
+                    point_location = None # Ensure it's None if conversion fails
+
+            # Extract posList data for LineString
+            if pos_list_raw:
+                try:
+                    # Parse the posList into coordinate pairs (lat lon lat lon...)
+                    coords_flat = list(map(float, pos_list_raw.strip().split()))
+                    # Ensure even number of coordinates
+                    if len(coords_flat) % 2 == 0 and len(coords_flat) >= 4: # Need at least 2 points for a line
+                        # Create list of (lon, lat) tuples for LineString
+                        positions_lon_lat = list(zip(coords_flat[1::2], coords_flat[::2])) # lon is second, lat is first in each pair
+                        # Create LineString object with SRID 4326
+                        line_path = LineString(positions_lon_lat, srid=4326)
+                    else:
+                         logger.warning(f"Invalid number of coordinates ({len(coords_flat)}) in posList for situation {situation_id}. Minimum 4 required.")
+                         line_path = None
+                except (ValueError, TypeError) as e:
+                    logger.warning(f"Could not parse posList '{pos_list_raw[:50]}...' for situation {situation_id}: {e}")
+                    line_path = None
+                except ValidationError as e: # Catch potential LineString validation errors
+                    logger.warning(f"Could not create LineString for situation {situation_id} from posList '{pos_list_raw[:50]}...': {e}")
+                    line_path = None
+
+            # --- Create and save the VtsSituation object ---
+            defaults = {
+                'version': record.version,
+                'creation_time': self.safe_parse_datetime(record.creation_time),
+                'version_time': self.safe_parse_datetime(record.version_time),
+                'probability_of_occurrence': record.probability_of_occurrence,
+                'severity': record.severity,
+                'source_country': record.source_country,
+                'source_identification': record.source_identification,
+                'source_name': record.source_name,
+                'source_type': record.source_type,
+                'validity_status': record.validity_status,
+                'overall_start_time': self.safe_parse_datetime(record.overall_start_time),
+                'overall_end_time': self.safe_parse_datetime(record.overall_end_time),
+                'location': point_location,
+                'path': line_path,
+                'location_description': location_description,
+                'road_number': record.road_number,
+                'area_name': area_name,
+                'transit_service_information': record.transit_service_information,
+                'transit_service_type': record.transit_service_type,
+                'pos_list_raw': pos_list_raw, # Store raw string for reference
+                'comment': comment,
+                'filter_used': record.record_type,
+            }
+            state = (defaults['version'], defaults['version_time'], defaults['severity'], defaults['overall_end_time'])
+            if stored is None or stored.get(situation_id) != state:
+                defaults['ingested_at'] = ingested_at or timezone.now()
+            VtsSituation.objects.update_or_create(situation_id=situation_id, defaults=defaults)
+            # Update log message
+            log_msg = f"Processed: {situation_id}"
+            if point_location:
+                log_msg += f" (Loc: Point({point_location.x:.4f}, {point_location.y:.4f})"
+            else:
+                 log_msg += f" (Loc: None"
+            if line_path:
+                 log_msg += f", Path: {len(line_path.coords)} pts)"
+            else:
+                 log_msg += f", Path: None)"
 
-    def update_last_modified_date(self, response):
-        """Update the last modified date in the database (same logic as before)."""
+            logger.info(log_msg)
+            return True
+
+        except Exception as e:
+            logger.exception(f"FATAL Error processing situation record ID {situation_id}: {e}")
+            return False
+
+
+    def update_last_modified_date(self, response, key='last_modified_date', body_path=None):
+        """Update the last modified date of one feed in the database (same logic as before)."""
         try:
             # Get the Last-Modified header from the response
             last_modified = response.headers.get('Last-Modified')
@@ -267,10 +376,11 @@ class Command(BaseCommand):
                 logger.warning("No Last-Modified header found. Attempting to use publicationTime from XML.")
                 # Attempt to extract publicationTime from the XML
                 try:
-                    root = ET.fromstring(response.content)
-                    publication_time_str = root.findtext('.//def:publicationTime', namespaces=namespaces) # Simplified path might work
-                    if not publication_time_str: # Try original path if simplified fails
-                         publication_time_str = root.findtext('./ns2:payload/def:publicationTime', namespaces=namespaces)
+                    if body_path:
+                        with open(body_path, 'rb') as body:
+                            publication_time_str = read_publication_time(body)
+                    else:
+                        publication_time_str = read_publication_time(response.content)
 
                     if publication_time_str:
                         logger.debug(f"Extracted publicationTime: {publication_time_str}")
@@ -284,7 +394,7 @@ class Command(BaseCommand):
                             logger.warning("Could not parse publicationTime from XML.")
                     else:
                         logger.warning("publicationTime not found in XML.")
-                except ET.ParseError as e:
+                except DatexParseError as e:
                      logger.error(f"Error parsing XML while looking for publicationTime: {e}")
                 except Exception as e: # Catch other potential errors during fallback
                      logger.error(f"Error processing publicationTime fallback: {e}")
@@ -293,10 +403,10 @@ class Command(BaseCommand):
             # Save the last modified date if we found one
             if last_modified_date_to_save:
                 ApiMetadata.objects.update_or_create(
-                    key='last_modified_date',
+                    key=key,
                     defaults={'value': last_modified_date_to_save}
                 )
-                logger.info(f"Last modified date updated in database: {last_modified_date_to_save}")
+                logger.info(f"Last modified date updated in database ({key}): {last_modified_date_to_save}")
             else:
                 logger.error("Could not determine Last-Modified date from headers or XML. Database record not updated.")
 
@@ -3,6 +3,7 @@ import json
 from django.core.management.base import BaseCommand
 from django.conf import settings
 import polyline
+from map.upstream import get_session, upstream_timeout_seconds
 
 class Command(BaseCommand):
     help = "Fetch trip information from Entur API"
@@ -72,7 +73,7 @@ class Command(BaseCommand):
         
         try:
             # Make the API call
-            response = requests.post(url, json=payload, headers=headers)
+            response = get_session().post(url, json=payload, headers=headers, timeout=upstream_timeout_seconds())
             response.raise_for_status()  # Raise exception for HTTP errors
             
             # Process the response
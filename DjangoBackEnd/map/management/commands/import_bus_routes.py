@@ -1,6 +1,8 @@
 import os
-import json
 import logging
+from collections import defaultdict
+from datetime import timezone as dt_timezone
+from django.core.management import call_command
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from django.contrib.gis.geos import LineString, GEOSException
@@ -8,33 +10,51 @@ from django.core.exceptions import ValidationError
 from django.utils import timezone
 from dateutil.parser import isoparse # For parsing ISO 8601 timestamps
 from django.db import transaction, IntegrityError
+from django.db.models import Q
 
 # Adjust the import path if your model is elsewhere
 from map.models import BusRoute
+from map.route_geometry import route_geometry_blob
+from map.route_index import build_route_index
+from map.route_shapes import iter_features, shape_hash
+from map.route_summary import CHUNK_SIZE, mark_routes_dirty, update_route_summaries
+from map import metrics
 
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
     help = (
-        "Imports bus route shapes from a GeoJSON FeatureCollection file. "
-        "Each feature creates a *new* BusRoute record."
+        "Imports bus route shapes from a newline-delimited GeoJSON file (as written by fetch-coordinates) "
+        "or a GeoJSON FeatureCollection file. "
+        "Shapes are matched to the stored routes by shape hash: only new, changed and removed shapes are written, "
+        "and only the changed routes get their collisions recomputed."
     )
 
     def add_arguments(self, parser):
         parser.add_argument(
             'geojson_file_path',
             type=str,
-            help='Path to the GeoJSON file containing bus route features (e.g., bus_coordinates.geojson)',
+            help='Path to the file containing bus route features (e.g., data/route_coordinates.ndjson)',
         )
         parser.add_argument(
             '--clear-existing',
             action='store_true',
-            help='Delete all existing BusRoute entries before importing.',
+            help='Delete all existing BusRoute entries (and their collisions) before importing.',
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=int,
+            default=None,
+            help='Only recompute collisions within this distance in meters (default: all of settings.COLLISION_TIERS_METERS).',
+        )
+        parser.add_argument(
+            '--no-collisions',
+            action='store_true',
+            help='Do not recompute the collisions of new and changed routes afterwards.',
         )
         # Optional: Add arguments for default version if not in GeoJSON
         # parser.add_argument('--default-version', type=str, help='Default version if not in properties')
 
-    @transaction.atomic # Process the import within a single database transaction
     def handle(self, *args, **options):
         geojson_file_path = options['geojson_file_path']
         clear_existing = options['clear_existing']
@@ -46,124 +66,238 @@ class Command(BaseCommand):
 
         self.stdout.write(f"Starting import from '{geojson_file_path}'...")
 
+        # Process the import within a single database transaction
+        with transaction.atomic():
+            result = self.sync_routes(geojson_file_path, clear_existing)
+        metrics.ROWS_UPSERTED.observe(result['created'] + result['updated'], table=BusRoute._meta.db_table)
+
+        # --- Final Report ---
+        self.stdout.write(self.style.SUCCESS(
+            f"Import finished. Created: {result['created']}, Skipped: {result['skipped']}. "
+            f"Updated: {result['updated']}, Deleted: {result['deleted']}, Unchanged: {result['unchanged']}."
+        ))
+
+        # --- Route index for the collision stage and the web workers ---
+        try:
+            version = build_route_index()
+            self.stdout.write(f"Route index {version:016x} is up to date.")
+        except OSError as e:
+            logger.error(f"Could not write the route index: {e}")
+            self.stderr.write(self.style.WARNING(f"Could not write the route index, collisions fall back to BusRoute rows: {e}"))
+
+        # --- Collisions of the new and changed shapes only ---
+        if result['changed'] and not options['no_collisions']:
+            call_command(
+                'calculate_and_store_collisions', tolerance=options['tolerance'],
+                bus_routes=sorted(result['changed']), stdout=self.stdout, stderr=self.stderr,
+            )
+        if result['removed_route_ids']:
+            # Deleting those shapes cascaded to their collisions (a collision run above may have refreshed them already)
+            update_route_summaries()
+
+    def sync_routes(self, geojson_file_path, clear_existing):
+        """
+        Make the BusRoute table match the file.
+
+        Shapes whose hash is already stored are left alone. A new shape of a
+        stored route takes over (updates in place) one of that route's shapes
+        that is no longer in the file, so its collisions that still hold keep
+        their row and MQTT published flag. The remaining new shapes are
+        inserted and the remaining old ones deleted.
+
+        Returns:
+            dict with the created/updated/deleted/unchanged/skipped counts, the
+            `changed` BusRoute primary keys (inserted or updated) and the
+            `removed_route_ids` of the deleted shapes (all stored routes with
+            `clear_existing`).
+        """
         # --- Clear Existing Data (Optional) ---
+        removed_route_ids = set()
         if clear_existing:
             self.stdout.write(self.style.WARNING("Deleting existing bus routes..."))
+            # Their collisions go with them, so their summaries need a refresh too
+            removed_route_ids.update(BusRoute.objects.values_list('route_id', flat=True).distinct())
             deleted_count, _ = BusRoute.objects.all().delete()
             self.stdout.write(f"Deleted {deleted_count} existing routes.")
+        else:
+            self.backfill_shape_hashes()
 
-        # --- Read and Parse GeoJSON ---
-        try:
-            with open(geojson_file_path, 'r', encoding='utf-8') as f:
-                geojson_data = json.load(f)
+        # Stored shapes by hash; imports before shape hashing could store a shape several times
+        stored = defaultdict(list)
+        route_of = {}
+        for pk, route_id, stored_hash in BusRoute.objects.values_list('id', 'route_id', 'shape_hash'):
+            stored[stored_hash].append(pk)
+            route_of[pk] = route_id
+        stored_route_ids = set(route_of.values())
 
-            # Validate basic GeoJSON structure
-            if not isinstance(geojson_data, dict) or geojson_data.get('type') != 'FeatureCollection':
-                raise ValueError("JSON root must be a GeoJSON FeatureCollection object.")
-            if 'features' not in geojson_data or not isinstance(geojson_data['features'], list):
-                 raise ValueError("FeatureCollection must contain a 'features' list.")
+        # --- Read GeoJSON ---
+        # NDJSON files (from fetch-coordinates) are read one feature at a time;
+        # FeatureCollection files are still loaded whole.
+        features = iter_features(geojson_file_path)
 
-            features = geojson_data['features'] # Get the list of features
+        result = {
+            'created': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'skipped': 0,
+            'changed': set(), 'removed_route_ids': removed_route_ids,
+        }
+        seen = set()
+        # New shapes of stored routes wait until it is known which old shapes they replace;
+        # shapes of routes not stored yet are inserted right away.
+        pending = []
+        feature_index = 0 # For better logging
 
-        except json.JSONDecodeError as e:
-            raise CommandError(f"Error parsing GeoJSON file: {e}")
-        except ValueError as e:
-             raise CommandError(f"Invalid GeoJSON structure: {e}")
-        except Exception as e:
+        self.stdout.write("Processing features...")
+        try:
+            for feature in features:
+                feature_index += 1
+                fields = self.route_fields(feature, feature_index)
+                if fields is None:
+                    result['skipped'] += 1
+                elif fields['shape_hash'] in seen:
+                    logger.debug(f"Skipping feature {feature_index}: same shape as an earlier feature of route {fields['route_id']}.")
+                    result['skipped'] += 1
+                elif stored.get(fields['shape_hash']):
+                    seen.add(fields['shape_hash'])
+                    stored[fields['shape_hash']].pop()
+                    result['unchanged'] += 1
+                elif fields['route_id'] in stored_route_ids:
+                    seen.add(fields['shape_hash'])
+                    pending.append((feature_index, fields))
+                else:
+                    seen.add(fields['shape_hash'])
+                    self.save_route(BusRoute(**fields), feature_index, result, 'created')
+        except ValueError as e:  # Includes json.JSONDecodeError
+            raise CommandError(f"Invalid GeoJSON in '{geojson_file_path}': {e}")
+        except OSError as e:
             raise CommandError(f"Error reading file: {e}")
 
-        self.stdout.write(f"Found {len(features)} features in the GeoJSON file.")
+        # Stored shapes not in the file, per route
+        stale = defaultdict(list)
+        for pks in stored.values():
+            for pk in pks:
+                stale[route_of[pk]].append(pk)
 
-        # --- Process Each Feature and Save to DB ---
-        created_count = 0
-        skipped_count = 0
-        feature_index = 0 # For better logging
+        for feature_index, fields in pending:
+            if stale[fields['route_id']]:
+                route = BusRoute(pk=stale[fields['route_id']].pop(), **fields)
+                self.save_route(route, feature_index, result, 'updated')
+            else:
+                self.save_route(BusRoute(**fields), feature_index, result, 'created')
+
+        removed = [pk for pks in stale.values() for pk in pks]
+        for start in range(0, len(removed), CHUNK_SIZE):
+            chunk = removed[start:start + CHUNK_SIZE]
+            BusRoute.objects.filter(pk__in=chunk).delete()
+            result['removed_route_ids'].update(route_of[pk] for pk in chunk)
+        result['deleted'] = len(removed)
+        # Marked in the import transaction, so the summaries are refreshed even if this command stops here
+        mark_routes_dirty(result['removed_route_ids'])
+        return result
+
+    def backfill_shape_hashes(self):
+        """
+        Compute the shape hash and simplified geometry of stored routes that
+        lack them (imported before they existed, or written with bulk_create).
+        """
+        missing = BusRoute.objects.filter(Q(shape_hash__isnull=True) | Q(simplified_geometry__isnull=True))
+        batch, filled = [], 0
+        for route in missing.only('id', 'route_id', 'path').iterator():
+            route.shape_hash = shape_hash(route.route_id, route.path.coords)
+            route.simplified_geometry = route_geometry_blob(route.path.coords)
+            batch.append(route)
+            if len(batch) >= CHUNK_SIZE:
+                BusRoute.objects.bulk_update(batch, ['shape_hash', 'simplified_geometry'])
+                filled += len(batch)
+                batch = []
+        if batch:
+            BusRoute.objects.bulk_update(batch, ['shape_hash', 'simplified_geometry'])
+            filled += len(batch)
+        if filled:
+            self.stdout.write(f"Computed the shape hash and simplified geometry of {filled} stored routes.")
+
+    def route_fields(self, feature, feature_index):
+        """Validate one feature and return its BusRoute field values, or None when it is skipped."""
+        if not isinstance(feature, dict) or feature.get('type') != 'Feature':
+            logger.warning(f"Skipping invalid item at index {feature_index} (not a Feature object): {feature}")
+            return None
+
+        properties = feature.get('properties', {}) or {} # Ensure properties is a dict
+        geometry = feature.get('geometry', {}) or {} # Ensure geometry is a dict
+
+        # --- Extract Geometry ---
+        geom_type = geometry.get('type')
+        coords = geometry.get('coordinates')
+
+        if geom_type != 'LineString':
+             logger.warning(f"Skipping feature {feature_index}: Geometry type is '{geom_type}', expected 'LineString'.")
+             return None
 
-        self.stdout.write("Processing features and creating new routes...")
-        for feature in features:
-            feature_index += 1
-            if not isinstance(feature, dict) or feature.get('type') != 'Feature':
-                logger.warning(f"Skipping invalid item at index {feature_index} (not a Feature object): {feature}")
-                skipped_count += 1
-                continue
-
-            properties = feature.get('properties', {}) or {} # Ensure properties is a dict
-            geometry = feature.get('geometry', {}) or {} # Ensure geometry is a dict
-
-            # --- Extract Geometry ---
-            geom_type = geometry.get('type')
-            coords = geometry.get('coordinates')
-
-            if geom_type != 'LineString':
-                 logger.warning(f"Skipping feature {feature_index}: Geometry type is '{geom_type}', expected 'LineString'.")
-                 skipped_count += 1
-                 continue
-
-            if not coords or not isinstance(coords, list) or len(coords) < 2:
-                 logger.warning(f"Skipping feature {feature_index}: Invalid or insufficient coordinates for LineString. Coords: {coords}")
-                 skipped_count += 1
-                 continue
-            route_id_str = properties.get('route_id')
-            # Check if route_id is present (since we made it required in the model)
-            if not route_id_str:
-                logger.warning(f"Skipping feature {feature_index}: Missing required 'route_id' in properties.")
-                skipped_count += 1
-                continue
-            # Convert to string explicitly in case it's a number in JSON
-            route_id_str = str(route_id_str)
-            # --- Extract Properties ---
-            # Use properties.get('key', default_value)
-            route_version = properties.get('version') # Or use default_version if provided via args
-            last_updated_str = properties.get('last_updated') # Timestamp for the data point
-
-            # --- Create Geometry and Prepare Data ---
+        if not coords or not isinstance(coords, list) or len(coords) < 2:
+             logger.warning(f"Skipping feature {feature_index}: Invalid or insufficient coordinates for LineString. Coords: {coords}")
+             return None
+        route_id_str = properties.get('route_id')
+        # Check if route_id is present (since we made it required in the model)
+        if not route_id_str:
+            logger.warning(f"Skipping feature {feature_index}: Missing required 'route_id' in properties.")
+            return None
+        # Convert to string explicitly in case it's a number in JSON
+        route_id_str = str(route_id_str)
+        # --- Extract Properties ---
+        # Use properties.get('key', default_value)
+        route_version = properties.get('version') # Or use default_version if provided via args
+        last_updated_str = properties.get('last_updated') # Timestamp for the data point
+
+        # --- Create Geometry and Prepare Data ---
+        try:
+            # Create the LineString geometry object
+            # Assumes coordinates are [lon, lat] as is standard in GeoJSON
+            route_path = LineString(coords, srid=4326) # GeoJSON uses WGS84
+            route_hash = shape_hash(route_id_str, route_path.coords)
+        except (GEOSException, TypeError, ValueError, IndexError) as e:
+            logger.error(f"Skipping feature {feature_index}: Geometry error - {e}. Coordinates start: {str(coords)[:100]}...")
+            return None
+
+        # Parse the last_updated timestamp if available, otherwise use current time
+        update_time = timezone.now() # Default to now
+        if last_updated_str:
             try:
-                # Create the LineString geometry object
-                # Assumes coordinates are [lon, lat] as is standard in GeoJSON
-                route_path = LineString(coords, srid=4326) # GeoJSON uses WGS84
-
-                # Parse the last_updated timestamp if available, otherwise use current time
-                update_time = timezone.now() # Default to now
-                if last_updated_str:
-                    try:
-                        parsed_time = isoparse(last_updated_str)
-                        # Ensure it's timezone-aware (assume UTC if not specified, make it aware using Django settings)
-                        if timezone.is_naive(parsed_time):
-                             # Use settings.TIME_ZONE if needed, but UTC is often safer for backend storage
-                             update_time = timezone.make_aware(parsed_time, timezone.utc)
-                        else:
-                            update_time = parsed_time # Already aware
-                    except (ValueError, TypeError) as ts_err:
-                         logger.warning(f"Feature {feature_index}: Could not parse timestamp '{last_updated_str}'. Using current time. Error: {ts_err}")
-                         # Keep update_time as timezone.now()
-
-                # --- Create new BusRoute instance ---
-                # Since we don't have a unique key other than PK, we create a new entry for each feature.
-                new_route = BusRoute(
-                    route_id=route_id_str,
-                    path=route_path,
-                    version=route_version, # Will be None if not in properties or defaulted
-                    last_updated=update_time,
-                )
-                new_route.full_clean() # Run model validation
-                new_route.save() # Save to database
-
-                created_count += 1
-                # self.stdout.write(f"Created route: {new_route.pk}") # Can be noisy
-
-            except (ValidationError, GEOSException) as e:
-                logger.error(f"Skipping feature {feature_index}: Validation or Geometry error - {e}. Coordinates start: {str(coords)[:100]}...")
-                skipped_count += 1
-            except IntegrityError as e:
-                 # Specifically catch IntegrityError, likely due to duplicate unique route_id
-                 logger.error(f"Skipping feature {feature_index} (Route ID: {route_id_str}): Database integrity error (likely duplicate route_id) - {e}")
-                 skipped_count += 1
-            except Exception as e:
-                # Catch other unexpected errors during processing/saving a single feature
-                logger.exception(f"Skipping feature {feature_index}: Unexpected error - {e}") # Use logger.exception to include traceback
-                skipped_count += 1
+                parsed_time = isoparse(last_updated_str)
+                # Ensure it's timezone-aware (assume UTC if not specified, make it aware using Django settings)
+                if timezone.is_naive(parsed_time):
+                     # Use settings.TIME_ZONE if needed, but UTC is often safer for backend storage
+                     update_time = timezone.make_aware(parsed_time, dt_timezone.utc)
+                else:
+                    update_time = parsed_time # Already aware
+            except (ValueError, TypeError) as ts_err:
+                 logger.warning(f"Feature {feature_index}: Could not parse timestamp '{last_updated_str}'. Using current time. Error: {ts_err}")
+                 # Keep update_time as timezone.now()
 
-        # --- Final Report ---
-        self.stdout.write(self.style.SUCCESS(
-            f"Import finished. Created: {created_count}, Skipped: {skipped_count}"
-        ))
\ No newline at end of file
+        return {
+            'route_id': route_id_str,
+            'path': route_path,
+            'version': route_version, # Will be None if not in properties or defaulted
+            'last_updated': update_time,
+            'shape_hash': route_hash,
+        }
+
+    def save_route(self, route, feature_index, result, outcome):
+        """Validate and save `route`, counting it as `outcome` ('created' or 'updated') or as skipped."""
+        try:
+            # A savepoint, so one failing row does not break the import's transaction
+            with transaction.atomic():
+                route.full_clean() # Run model validation
+                route.save() # Save to database
+        except ValidationError as e:
+            logger.error(f"Skipping feature {feature_index}: Validation error - {e}.")
+            result['skipped'] += 1
+            return
+        except IntegrityError as e:
+             logger.error(f"Skipping feature {feature_index} (Route ID: {route.route_id}): Database integrity error - {e}")
+             result['skipped'] += 1
+             return
+        except Exception as e:
+            # Catch other unexpected errors while saving a single feature
+            logger.exception(f"Skipping feature {feature_index}: Unexpected error - {e}") # Use logger.exception to include traceback
+            result['skipped'] += 1
+            return
+        result[outcome] += 1
+        result['changed'].add(route.pk)
@@ -15,6 +15,8 @@ from django.core.management.base import BaseCommand
 from django.conf import settings
 from django.db import transaction
 from map.models import DetectedCollision # Assuming your model is in the 'map' app
+from map.mqtt_sink import LocalMqttSink
+from map import metrics
 
 try:
     import paho.mqtt.client as mqtt
@@ -49,6 +51,13 @@ class Command(BaseCommand):
     """
     help = 'Checks for unpublished collisions and publishes them via MQTT.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sink',
+            help='Publish to a local sink instead of the MQTT broker, appending messages as JSON lines to this file. '
+                 'From code, a map.mqtt_sink.LocalMqttSink instance can be passed.',
+        )
+
     def _sanitize_topic_segment(self, segment_value, placeholder='_unknown_'):
         """
         Sanitizes a string value to be safely used as an MQTT topic segment.
@@ -73,6 +82,7 @@ class Command(BaseCommand):
         # Ensure it's not empty after replacements if the original was just forbidden chars
         return sanitized if sanitized else placeholder
 
+    @metrics.flush_after('publish_new_collisions')
     def handle(self, *args, **options):
         """
         The main execution method called by Django's manage.py.
@@ -83,9 +93,12 @@ class Command(BaseCommand):
         """
         start_time = time.time()
         self.stdout.write("Starting MQTT collision publisher...")
+        sink = options.get('sink')
+        if isinstance(sink, str):
+            sink = LocalMqttSink(sink)
 
         # --- Prerequisite Checks ---
-        if not mqtt_available:
+        if not mqtt_available and sink is None:
             self.stderr.write(self.style.ERROR(
                 "CRITICAL: 'paho-mqtt' library not found. "
                 "Please install it (`pip install paho-mqtt`). Cannot publish."
@@ -99,7 +112,7 @@ class Command(BaseCommand):
         mqtt_password = getattr(settings, 'MQTT_PASSWORD', None)
         base_topic = getattr(settings, 'MQTT_BASE_COLLISION_TOPIC', 'vts/collisions')
 
-        if not mqtt_broker_host:
+        if not mqtt_broker_host and sink is None:
             self.stderr.write(self.style.ERROR(
                 "CRITICAL: MQTT_BROKER_HOST setting is not configured in settings.py. Cannot connect."
             ))
@@ -135,44 +148,50 @@ class Command(BaseCommand):
             return
 
         # --- Connect to MQTT ---
-        try:
-            # Use V1 API for compatibility as shown in the original code
-            mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
-
-            # Set credentials if provided
-            if mqtt_username and mqtt_password:
-                mqtt_client.username_pw_set(mqtt_username, mqtt_password)
-                self.stdout.write("Using MQTT username/password authentication.")
-            elif mqtt_username:
-                 self.stdout.write("Using MQTT username authentication (no password provided).")
-            else:
-                 self.stdout.write("Connecting to MQTT without authentication.")
-
-            # Set connection timeout (default is often short)
-            connect_timeout = 10 # seconds
-            mqtt_client.connect(mqtt_broker_host, mqtt_broker_port, keepalive=60) # keepalive interval
-            mqtt_client.loop_start() # Start background thread for network traffic & callbacks
-            # Note: Actual connect timeout isn't directly settable here in paho V1 connect,
-            # it's handled internally. loop_start handles reconnect logic.
-            # We rely on the connect call raising an exception if immediate connection fails.
-            # A short sleep might help confirm connection, but loop_start handles it.
-            time.sleep(1) # Give a moment for the connection background thread
-            if not mqtt_client.is_connected():
-                 # Check connection status after starting loop
-                 raise ConnectionRefusedError("MQTT client failed to connect after loop_start.")
-
-            self.stdout.write(f"Successfully connected to MQTT Broker {mqtt_broker_host}:{mqtt_broker_port}")
-
-        except ConnectionRefusedError as e:
-            logger.error(f"MQTT Connection Refused: {e}", exc_info=True)
-            self.stderr.write(self.style.ERROR(f"MQTT Connection Refused: {e}. Check host, port, credentials, and firewall."))
-            if mqtt_client: mqtt_client.loop_stop() # Ensure loop stops if started partially
-            return
-        except Exception as e:
-            logger.error(f"Could not connect to MQTT Broker: {e}", exc_info=True)
-            self.stderr.write(self.style.ERROR(f"Could not connect to MQTT Broker: {e}. Aborting publish cycle."))
-            if mqtt_client: mqtt_client.loop_stop() # Ensure loop stops
-            return
+        if sink is not None:
+            # Local sink (tests, replay_snapshots): no broker, every publish is confirmed at once
+            mqtt_client = sink
+            mqtt_client.connect()
+            self.stdout.write("Publishing to local sink instead of the MQTT broker.")
+        else:
+            try:
+                # Use V1 API for compatibility as shown in the original code
+                mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+
+                # Set credentials if provided
+                if mqtt_username and mqtt_password:
+                    mqtt_client.username_pw_set(mqtt_username, mqtt_password)
+                    self.stdout.write("Using MQTT username/password authentication.")
+                elif mqtt_username:
+                     self.stdout.write("Using MQTT username authentication (no password provided).")
+                else:
+                     self.stdout.write("Connecting to MQTT without authentication.")
+
+                # Set connection timeout (default is often short)
+                connect_timeout = 10 # seconds
+                mqtt_client.connect(mqtt_broker_host, mqtt_broker_port, keepalive=60) # keepalive interval
+                mqtt_client.loop_start() # Start background thread for network traffic & callbacks
+                # Note: Actual connect timeout isn't directly settable here in paho V1 connect,
+                # it's handled internally. loop_start handles reconnect logic.
+                # We rely on the connect call raising an exception if immediate connection fails.
+                # A short sleep might help confirm connection, but loop_start handles it.
+                time.sleep(1) # Give a moment for the connection background thread
+                if not mqtt_client.is_connected():
+                     # Check connection status after starting loop
+                     raise ConnectionRefusedError("MQTT client failed to connect after loop_start.")
+
+                self.stdout.write(f"Successfully connected to MQTT Broker {mqtt_broker_host}:{mqtt_broker_port}")
+
+            except ConnectionRefusedError as e:
+                logger.error(f"MQTT Connection Refused: {e}", exc_info=True)
+                self.stderr.write(self.style.ERROR(f"MQTT Connection Refused: {e}. Check host, port, credentials, and firewall."))
+                if mqtt_client: mqtt_client.loop_stop() # Ensure loop stops if started partially
+                return
+            except Exception as e:
+                logger.error(f"Could not connect to MQTT Broker: {e}", exc_info=True)
+                self.stderr.write(self.style.ERROR(f"Could not connect to MQTT Broker: {e}. Aborting publish cycle."))
+                if mqtt_client: mqtt_client.loop_stop() # Ensure loop stops
+                return
 
         # --- Publish Loop ---
         ids_to_mark_published = [] # Store IDs confirmed published by the broker
@@ -193,6 +212,7 @@ class Command(BaseCommand):
                     "lon": collision.transit_lon,
                     "lat": collision.transit_lat,
                     "tolerance": collision.tolerance_meters,
+                    "distance_meters": collision.distance_meters,
                     "detected_at": collision.detection_timestamp.isoformat() if collision.detection_timestamp else None,
                     # Safely access related fields
                     "severity": transit_info.severity if transit_info else None,
@@ -224,6 +244,7 @@ class Command(BaseCommand):
                 # Publish with QoS 1 (at least once delivery) for better reliability
                 # QoS 2 (exactly once) is safer but higher overhead. QoS 0 (at most once) is fire-and-forget.
                 qos = 1
+                publish_start = time.perf_counter()
                 result_info = mqtt_client.publish(topic, payload_json, qos=qos)
 
                 # Wait for acknowledgment for QoS 1 or 2
@@ -246,6 +267,7 @@ class Command(BaseCommand):
 
                 # Explicitly check if published after waiting
                 if result_info.is_published():
+                    metrics.PUBLISH_ACK_SECONDS.observe(time.perf_counter() - publish_start)
                     published_count += 1
                     ids_to_mark_published.append(collision.id) # Add ID to list for bulk update later
                     logger.debug(f"Successfully published collision {collision.id} to {topic} (QoS {qos}, MID: {result_info.mid})")
@@ -267,6 +289,9 @@ class Command(BaseCommand):
                 publish_failures += 1
                 # DO NOT add to ids_to_mark_published on error
 
+        metrics.PUBLISH_MESSAGES.inc(published_count, result='published')
+        metrics.PUBLISH_MESSAGES.inc(publish_failures, result='failed')
+
         # --- Mark as Published in DB ---
         if ids_to_mark_published:
             self.stdout.write(f"Attempting to mark {len(ids_to_mark_published)} collisions as published in the database...")
@@ -0,0 +1,109 @@
+"""
+Django Management Command: replay_snapshots
+
+Feeds archived DATEX II snapshots (see map/snapshot_archive.py) through the
+same pipeline as run_cron, as fast as possible and without network access:
+
+1. ingest:  parse the snapshot and store its records (fetch_vts_situations).
+2. detect:  calculate_and_store_collisions --no-clear.
+3. publish: publish_new_collisions, with the MQTT broker replaced by a
+            local sink (map/mqtt_sink.py).
+
+It prints a JSON summary with per-stage timings, which makes it a
+reproducible benchmark on real traffic, and can also be used to backfill a
+fresh database from the archive.
+
+Usage:
+    python manage.py replay_snapshots --archive-dir data/datex_archive --since 2025-04-24T00:00:00Z
+"""
+import json
+import logging
+import time
+from io import StringIO
+
+from django.conf import settings
+from django.core import management
+from django.core.management.base import BaseCommand, CommandError
+
+from map.datex import iter_records, DatexParseError
+from map.mqtt_sink import LocalMqttSink
+from map.snapshot_archive import SnapshotArchive
+from map.management.commands.fetch_vts_situations import Command as FetchCommand
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Replays archived DATEX snapshots through ingest, collision detection and publishing (to a local sink).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--archive-dir', help='Snapshot archive directory (default: settings.DATEX_ARCHIVE_DIR).')
+        parser.add_argument('--feed', help='Only replay this feed ("snapshot" or a filter name).')
+        parser.add_argument('--since', help='Only snapshots fetched at or after this ISO 8601 time.')
+        parser.add_argument('--until', help='Only snapshots fetched at or before this ISO 8601 time.')
+        parser.add_argument('--limit', type=int, help='Replay at most this many snapshots.')
+        parser.add_argument('--tolerance', type=int, help='Only detect collisions within this distance in meters (default: all tiers).')
+        parser.add_argument('--sink-file', help='Also write published messages as JSON lines to this file.')
+        parser.add_argument('--skip-detect', action='store_true', help='Only ingest (e.g. for backfill).')
+        parser.add_argument('--skip-publish', action='store_true', help='Ingest and detect, but do not publish.')
+
+    def handle(self, *args, **options):
+        directory = options['archive_dir'] or getattr(settings, 'DATEX_ARCHIVE_DIR', None)
+        if not directory:
+            raise CommandError("No archive directory: pass --archive-dir or set DATEX_ARCHIVE_DIR.")
+        archive = SnapshotArchive(directory)
+        entries = archive.entries(feed=options['feed'], since=options['since'], until=options['until'])
+        if options['limit']:
+            entries = entries[:options['limit']]
+        if not entries:
+            self.stdout.write(self.style.WARNING(f"No archived snapshots to replay in {directory}."))
+            return
+
+        sink = LocalMqttSink(options['sink_file'], keep_messages=False)
+        fetcher = FetchCommand()
+        totals = {'ingest_s': 0.0, 'detect_s': 0.0, 'publish_s': 0.0}
+        record_count = 0
+        failed = 0
+        start = time.perf_counter()
+
+        for number, entry in enumerate(entries, 1):
+            # --- Ingest ---
+            stage_start = time.perf_counter()
+            try:
+                with archive.open(entry) as snapshot:
+                    records = list(iter_records(snapshot))
+            except (DatexParseError, OSError) as e:
+                logger.error(f"Skipping {entry.path}: {e}")
+                failed += 1
+                continue
+            fetcher.store_records(records)
+            record_count += len(records)
+            totals['ingest_s'] += time.perf_counter() - stage_start
+
+            # --- Detect ---
+            if not options['skip_detect']:
+                stage_start = time.perf_counter()
+                management.call_command(
+                    'calculate_and_store_collisions', tolerance=options['tolerance'], no_clear=True, stdout=StringIO(),
+                )
+                totals['detect_s'] += time.perf_counter() - stage_start
+
+                # --- Publish ---
+                if not options['skip_publish']:
+                    stage_start = time.perf_counter()
+                    management.call_command('publish_new_collisions', sink=sink, stdout=StringIO())
+                    totals['publish_s'] += time.perf_counter() - stage_start
+
+            self.stdout.write(f"[{number}/{len(entries)}] {entry.fetched_at} {entry.feed}: {len(records)} records")
+
+        elapsed = time.perf_counter() - start
+        summary = {
+            "snapshots": len(entries) - failed,
+            "failed": failed,
+            "records": record_count,
+            "published_messages": sink.count,
+            "elapsed_s": round(elapsed, 3),
+            "snapshots_per_s": round((len(entries) - failed) / elapsed, 2) if elapsed else None,
+            **{stage: round(seconds, 3) for stage, seconds in totals.items()},
+        }
+        self.stdout.write(json.dumps(summary, indent=2))
@@ -2,6 +2,7 @@
 from django.core.management.base import BaseCommand, CommandError
 from django.core import management
 import time
+from map import metrics
 
 class Command(BaseCommand):
     """
@@ -12,6 +13,7 @@ class Command(BaseCommand):
     """
     help = 'Runs fetch_vts_situations, calculate_and_store_collisions --no-clear, and publish_new_collisions sequentially.'
 
+    @metrics.flush_after('run_cron')
     def handle(self, *args, **options):
         start_time = time.time()
         self.stdout.write(self.style.SUCCESS("Starting periodic VTS update sequence..."))
@@ -28,10 +30,13 @@ class Command(BaseCommand):
             arg_string = ' '.join([f'--{k}' for k, v in cmd_args.items() if v is True]) # Just for logging display
 
             self.stdout.write(f"\nRunning: {cmd_name} {arg_string}...")
+            stage_start = time.perf_counter()
+            stage_result = 'error'
             try:
                 # Use django.core.management.call_command to run other commands
                 # Pass boolean flags like --no-clear as keyword arguments set to True
                 management.call_command(cmd_name, **cmd_args)
+                stage_result = 'ok'
                 self.stdout.write(self.style.SUCCESS(f"-> {cmd_name} completed successfully."))
 
             except CommandError as e:
@@ -56,6 +61,8 @@ class Command(BaseCommand):
                     raise CommandError(f"Unexpected error in {cmd_name}") from e
                 else:
                      self.stderr.write(self.style.WARNING(f"Continuing sequence despite unexpected error in {cmd_name}."))
+            finally:
+                metrics.STAGE_SECONDS.observe(time.perf_counter() - stage_start, stage=cmd_name, result=stage_result)
 
 
         end_time = time.time()
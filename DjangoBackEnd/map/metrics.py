@@ -0,0 +1,432 @@
+"""
+Pipeline and view metrics in the Prometheus text format, served at `/metrics`.
+
+Counters and histograms are kept in memory per process. Set
+`METRICS_ENABLED = False` for a no-op mode: every `inc()`/`observe()` returns
+at once and `time()` hands out a shared do-nothing context manager.
+
+Ingest, collision detection and publishing run in short-lived management
+command processes (run_cron), whose metrics would be lost when they exit.
+With `METRICS_DIR` set, each command adds its metrics to
+`<METRICS_DIR>/<command>.json` when it finishes (counters and histograms keep
+accumulating across runs), and `/metrics` in the web process serves those
+next to its own, with a `process` label telling them apart.
+"""
+import bisect
+import functools
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; snapshot files are then written without a lock
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+WEB_PROCESS = 'web'
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = (1_000, 10_000, 100_000, 500_000, 1_000_000, 5_000_000, 10_000_000, 50_000_000, 100_000_000)
+COUNT_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1_000, 5_000, 10_000, 50_000)
+
+_NULL_TIMER = nullcontext()
+_enabled = None
+
+
+def enabled():
+    """Whether metrics are recorded (settings.METRICS_ENABLED, default True)."""
+    global _enabled
+    if _enabled is None:
+        _enabled = bool(getattr(settings, 'METRICS_ENABLED', True))
+    return _enabled
+
+
+@receiver(setting_changed)
+def _reset_enabled(setting, **kwargs):
+    global _enabled
+    if setting == 'METRICS_ENABLED':
+        _enabled = None
+
+
+class Registry:
+    """The metrics of one process, by name."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self):
+        """JSON-serializable copy of every metric that has samples."""
+        families = {}
+        for name, metric in self.metrics.items():
+            family = metric.snapshot()
+            if family['series']:
+                families[name] = family
+        return families
+
+    def reset(self):
+        for metric in self.metrics.values():
+            metric.reset()
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}  # label values -> value
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}.")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _family(self):
+        return {'type': self.type, 'help': self.documentation, 'labelnames': list(self.labelnames)}
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Counter(_Metric):
+    """A monotonically increasing count, e.g. `Counter('x_total', '...', ['result']).inc(result='ok')`."""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not enabled():
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._series.get(self._key(labels), 0)
+
+    def snapshot(self):
+        with self._lock:
+            series = [[list(key), value] for key, value in self._series.items()]
+        return {**self._family(), 'series': series}
+
+
+class Histogram(_Metric):
+    """
+    Observations counted into fixed buckets, plus their sum and count.
+
+    `observe(value, **labels)` records one observation; `time(**labels)` is a
+    context manager that observes the seconds spent inside it.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(float(bound) for bound in sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        if not enabled():
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)  # Upper bounds are inclusive
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket (not cumulative) counts, the last one is +Inf; then the sum
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, **labels):
+        if not enabled():
+            return _NULL_TIMER
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        series = self._series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def sum(self, **labels):
+        series = self._series.get(self._key(labels))
+        return series[1] if series else 0.0
+
+    def snapshot(self):
+        with self._lock:
+            series = [[list(key), {'counts': list(counts), 'sum': total}] for key, (counts, total) in self._series.items()]
+        return {**self._family(), 'buckets': list(self.buckets), 'series': series}
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+# --- Pipeline metrics ---
+
+FETCH_SECONDS = Histogram(
+    'rtm_fetch_seconds', 'DATEX feed request latency until the response headers arrive.', ['feed', 'status'],
+)
+FETCH_BYTES = Histogram(
+    'rtm_fetch_bytes', 'DATEX feed bytes received over the wire per fetch.', ['feed'], buckets=BYTES_BUCKETS,
+)
+PARSE_SECONDS = Histogram(
+    'rtm_parse_seconds', 'Time to stream and parse one DATEX feed body.', ['feed'],
+)
+ROWS_UPSERTED = Histogram(
+    'rtm_rows_upserted', 'Rows written per pipeline run.', ['table'], buckets=COUNT_BUCKETS,
+)
+COLLISION_CANDIDATES = Histogram(
+    'rtm_collision_candidates', 'Situation/route pairs within the tolerance per collision calculation.',
+    ['tolerance'], buckets=COUNT_BUCKETS,
+)
+COLLISION_SECONDS = Histogram(
+    'rtm_collision_seconds', 'Collision calculation time.', ['tolerance'],
+)
+PUBLISH_MESSAGES = Counter(
+    'rtm_publish_messages_total', 'Collision messages handed to the MQTT broker, by outcome.', ['result'],
+)
+PUBLISH_ACK_SECONDS = Histogram(
+    'rtm_publish_ack_seconds', 'Time from publishing a collision message until the broker acknowledged it.',
+)
+POLL_FAILURES = Counter(
+    'rtm_poll_failures_total', 'Daemon poll iterations that raised and were skipped.', ['process'],
+)
+STAGE_SECONDS = Histogram(
+    'rtm_stage_seconds', 'Duration of each run_cron stage.', ['stage', 'result'],
+)
+
+# --- Web metrics ---
+
+VIEW_SECONDS = Histogram(
+    'rtm_view_seconds', 'Time until a view returned its response.', ['view', 'method', 'status'],
+)
+VIEW_RESPONSE_BYTES = Histogram(
+    'rtm_view_response_bytes', 'Response payload size per view (streaming responses are not counted).',
+    ['view'], buckets=BYTES_BUCKETS,
+)
+
+
+# --- Exposition ---
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _number(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def render(sources):
+    """
+    Prometheus text exposition of `(process, snapshot)` pairs.
+
+    A snapshot is `Registry.snapshot()` output; every sample gets a `process`
+    label with its source's name.
+    """
+    families = {}
+    for process, snapshot in sources:
+        for name, family in snapshot.items():
+            families.setdefault(name, (family, []))[1].append((process, family))
+
+    lines = []
+    for name in sorted(families):
+        first, parts = families[name]
+        lines.append(f"# HELP {name} {first['help']}")
+        lines.append(f"# TYPE {name} {first['type']}")
+        for process, family in parts:
+            labelnames = ['process', *family['labelnames']]
+            for label_values, value in family['series']:
+                pairs = list(zip(labelnames, [process, *label_values]))
+                if family['type'] == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip([*family['buckets'], math.inf], value['counts']):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_labels(pairs + [('le', _number(float(bound)))])} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(pairs)} {_number(float(value['sum']))}")
+                    lines.append(f"{name}_count{_labels(pairs)} {cumulative}")
+                else:
+                    lines.append(f"{name}{_labels(pairs)} {_number(value)}")
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def merge_snapshots(old, new):
+    """Add `new` to `old`: counts and sums accumulate; a histogram with changed buckets starts over."""
+    merged = dict(old)
+    for name, family in new.items():
+        previous = merged.get(name)
+        if (previous is None or previous['type'] != family['type']
+                or previous['labelnames'] != family['labelnames'] or previous.get('buckets') != family.get('buckets')):
+            merged[name] = family
+            continue
+        series = {tuple(labels): value for labels, value in previous['series']}
+        for labels, value in family['series']:
+            current = series.get(tuple(labels))
+            if current is None:
+                series[tuple(labels)] = value
+            elif family['type'] == 'histogram':
+                series[tuple(labels)] = {
+                    'counts': [a + b for a, b in zip(current['counts'], value['counts'])],
+                    'sum': current['sum'] + value['sum'],
+                }
+            else:
+                series[tuple(labels)] = current + value
+        merged[name] = {**family, 'series': [[list(labels), value] for labels, value in series.items()]}
+    return merged
+
+
+def metrics_dir():
+    directory = getattr(settings, 'METRICS_DIR', None)
+    return Path(directory) if directory else None
+
+
+def flush(process, registry=REGISTRY):
+    """
+    Add this process' metrics to `<METRICS_DIR>/<process>.json` and reset them.
+
+    Does nothing when metrics are disabled or `METRICS_DIR` is not set.
+    """
+    directory = metrics_dir()
+    if not enabled() or directory is None:
+        return
+    snapshot = registry.snapshot()
+    registry.reset()
+    if not snapshot:
+        return
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{process}.json"
+    with open(directory / f"{process}.lock", 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)  # Overlapping runs of the same command add up instead of racing
+        try:
+            previous = json.loads(path.read_text(encoding='utf-8')) if path.exists() else {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Discarding unreadable metrics file {path}: {e}")
+            previous = {}
+        temporary = path.with_name(path.name + '.part')
+        temporary.write_text(json.dumps(merge_snapshots(previous, snapshot)), encoding='utf-8')
+        os.replace(temporary, path)
+
+
+def flush_after(process):
+    """Decorator for a management command's `handle()`: `flush(process)` once it returns or fails."""
+    def decorator(handle):
+        @functools.wraps(handle)
+        def wrapper(*args, **kwargs):
+            try:
+                return handle(*args, **kwargs)
+            finally:
+                try:
+                    flush(process)
+                except OSError as e:
+                    logger.warning(f"Could not write metrics for {process}: {e}")
+        return wrapper
+    return decorator
+
+
+def stored_snapshots():
+    """`(process, snapshot)` pairs of the command metrics in METRICS_DIR."""
+    directory = metrics_dir()
+    if directory is None or not directory.is_dir():
+        return []
+    sources = []
+    for path in sorted(directory.glob('*.json')):
+        try:
+            sources.append((path.stem, json.loads(path.read_text(encoding='utf-8'))))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable metrics file {path}: {e}")
+    return sources
+
+
+def exposition(registry=REGISTRY):
+    """Everything `/metrics` serves: this process' metrics and the stored command metrics."""
+    return render([(WEB_PROCESS, registry.snapshot()), *stored_snapshots()])
+
+
+# --- Views ---
+
+def view_name(request):
+    """Label for the view that handled `request` (its function name), or 'unmatched'."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return getattr(match.func, '__name__', None) or match.view_name
+
+
+class MetricsMiddleware:
+    """Records the response time and payload size of every view."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not enabled():
+            return self.get_response(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self._observe(request, response, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        if not enabled():
+            return await self.get_response(request)
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self._observe(request, response, time.perf_counter() - start)
+        return response
+
+    def _observe(self, request, response, seconds):
+        view = view_name(request)
+        VIEW_SECONDS.observe(seconds, view=view, method=request.method, status=response.status_code)
+        if not response.streaming:
+            VIEW_RESPONSE_BYTES.observe(len(response.content), view=view)
@@ -0,0 +1,71 @@
+# Generated by Django 5.1.4 on 2025-04-28 09:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("map", "0005_alter_busroute_route_id"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RouteCollisionSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "route_id",
+                    models.CharField(
+                        help_text="BusRoute.route_id (all shapes of the route)",
+                        max_length=50,
+                        unique=True,
+                    ),
+                ),
+                (
+                    "active_collisions",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Number of active situations (no end time, or ending in the future) colliding with the route",
+                    ),
+                ),
+                (
+                    "max_severity",
+                    models.CharField(blank=True, max_length=255, null=True),
+                ),
+                (
+                    "latest_situation_ids",
+                    models.JSONField(
+                        default=list,
+                        help_text="situation_id of the most recently detected active collisions, newest first",
+                    ),
+                ),
+                (
+                    "next_expiry",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="Earliest end time of the active situations; the row is refreshed after it",
+                        null=True,
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+            ],
+            options={
+                "verbose_name": "Route Collision Summary",
+                "verbose_name_plural": "Route Collision Summaries",
+                "ordering": ["route_id"],
+            },
+        ),
+    ]
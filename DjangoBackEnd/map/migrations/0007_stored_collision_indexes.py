@@ -0,0 +1,31 @@
+# Generated by Django 5.1.4 on 2025-04-29 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("map", "0006_routecollisionsummary"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="vtssituation",
+            name="severity",
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="detectedcollision",
+            index=models.Index(
+                fields=["-detection_timestamp", "-id"], name="collision_keyset_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="detectedcollision",
+            index=models.Index(
+                fields=["tolerance_meters", "-detection_timestamp"],
+                name="collision_tolerance_idx",
+            ),
+        ),
+    ]
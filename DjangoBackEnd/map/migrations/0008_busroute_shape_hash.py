@@ -0,0 +1,24 @@
+# Generated by Django 5.1.4 on 2025-05-06 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("map", "0007_stored_collision_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="busroute",
+            name="shape_hash",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                help_text="Hash of route_id and path (map.route_shapes.shape_hash), used by import_bus_routes to skip unchanged shapes",
+                max_length=32,
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.4 on 2025-05-07 10:41
+
+from django.db import migrations, models
+
+from map.route_geometry import route_geometry_blob
+
+BATCH_SIZE = 500
+
+
+def compute_simplified_geometry(apps, schema_editor):
+    BusRoute = apps.get_model("map", "BusRoute")
+    batch = []
+    for route in BusRoute.objects.filter(path__isnull=False).only("id", "path").iterator():
+        route.simplified_geometry = route_geometry_blob(route.path.coords)
+        batch.append(route)
+        if len(batch) >= BATCH_SIZE:
+            BusRoute.objects.bulk_update(batch, ["simplified_geometry"])
+            batch = []
+    if batch:
+        BusRoute.objects.bulk_update(batch, ["simplified_geometry"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("map", "0008_busroute_shape_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="busroute",
+            name="simplified_geometry",
+            field=models.BinaryField(
+                blank=True,
+                editable=False,
+                help_text="Simplified projected path with segment bounding boxes (map.route_geometry), computed on save",
+                null=True,
+            ),
+        ),
+        migrations.RunPython(compute_simplified_geometry, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2025-05-09 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("map", "0009_busroute_simplified_geometry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="detectedcollision",
+            name="distance_meters",
+            field=models.FloatField(
+                blank=True,
+                db_index=True,
+                help_text="Distance in meters from the situation point to the (simplified) route when detected.",
+                null=True,
+            ),
+        ),
+    ]
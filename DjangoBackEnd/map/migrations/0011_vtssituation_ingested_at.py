@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2025-05-12 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("map", "0010_detectedcollision_distance_meters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="vtssituation",
+            name="ingested_at",
+            field=models.DateTimeField(
+                blank=True,
+                db_index=True,
+                help_text="When an ingest last stored a new version of this situation (local clock)",
+                null=True,
+            ),
+        ),
+    ]
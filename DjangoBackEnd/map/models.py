@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.gis.db import models as gis_models # Import GeoDjango models
 from django.utils import timezone
+from .route_geometry import route_geometry_blob
 
 class ApiMetadata(models.Model):
     """
@@ -23,7 +24,7 @@ class VtsSituation(models.Model):
     creation_time = models.DateTimeField(default=timezone.now)
     version_time = models.DateTimeField(null=True, blank=True)
     probability_of_occurrence = models.CharField(max_length=255, null=True, blank=True)
-    severity = models.CharField(max_length=255, null=True, blank=True)
+    severity = models.CharField(max_length=255, null=True, blank=True, db_index=True)
     source_country = models.CharField(max_length=255, null=True, blank=True)
     source_identification = models.CharField(max_length=255, null=True, blank=True)
     source_name = models.CharField(max_length=255, null=True, blank=True)
@@ -41,6 +42,12 @@ class VtsSituation(models.Model):
     pos_list_raw = models.TextField(null=True, blank=True, help_text="Raw posList string from XML for reference/debugging")
     comment = models.TextField(null=True, blank=True)
     filter_used=models.TextField(null=True,blank=True)
+    ingested_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        db_index=True,
+        help_text="When an ingest last stored a new version of this situation (local clock)"
+    )
 
     def __str__(self):
         service_info = f"{self.road_number} - {self.transit_service_type}" if self.road_number else f"{self.transit_service_type}"
@@ -75,6 +82,27 @@ class BusRoute(models.Model):
         default=timezone.now,
         help_text="When this route information was last updated/imported"
     )
+    shape_hash = models.CharField(
+        max_length=32,
+        db_index=True,
+        null=True,
+        blank=True,
+        help_text="Hash of route_id and path (map.route_shapes.shape_hash), used by import_bus_routes to skip unchanged shapes"
+    )
+    simplified_geometry = models.BinaryField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Simplified projected path with segment bounding boxes (map.route_geometry), computed on save"
+    )
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if self.path is not None and (update_fields is None or 'path' in update_fields):
+            self.simplified_geometry = route_geometry_blob(self.path.coords)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'simplified_geometry'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         # Using the primary key as a simple identifier
@@ -107,7 +135,14 @@ class DetectedCollision(models.Model):
     transit_lat = models.FloatField()
     # Store when this collision record was created (when the check was run)
     detection_timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Smallest proximity tier (settings.COLLISION_TIERS_METERS) the collision is within
     tolerance_meters = models.IntegerField(default=50)
+    distance_meters = models.FloatField(
+        null=True,
+        blank=True,
+        db_index=True,
+        help_text="Distance in meters from the situation point to the (simplified) route when detected."
+    )
     unique_together = ('transit_information', 'bus_route')
     published_to_mqtt = models.BooleanField(
         default=False,
@@ -122,7 +157,39 @@ class DetectedCollision(models.Model):
         # If updating, you might need a different constraint or logic.
         unique_together = ('transit_information', 'bus_route')
         ordering = ['-detection_timestamp', 'transit_information']
+        indexes = [
+            # Keyset pagination of /api/stored_collisions/ (newest first)
+            models.Index(fields=['-detection_timestamp', '-id'], name='collision_keyset_idx'),
+            models.Index(fields=['tolerance_meters', '-detection_timestamp'], name='collision_tolerance_idx'),
+        ]
 
     def __str__(self):
         published_status = "[Published]" if self.published_to_mqtt else "[New]"
-        return f"Collision {published_status}: Transit {self.transit_information_id} near Route {self.bus_route_id} detected at {self.detection_timestamp}"
\ No newline at end of file
+        return f"Collision {published_status}: Transit {self.transit_information_id} near Route {self.bus_route_id} detected at {self.detection_timestamp}"
+
+class RouteCollisionSummary(models.Model):
+    """
+    Active collisions per BusRoute.route_id, maintained by calculate_and_store_collisions
+    (see map/route_summary.py). Only routes with at least one active collision have a row.
+    """
+    route_id = models.CharField(max_length=50, unique=True, help_text="BusRoute.route_id (all shapes of the route)")
+    active_collisions = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of active situations (no end time, or ending in the future) colliding with the route",
+    )
+    max_severity = models.CharField(max_length=255, null=True, blank=True)
+    latest_situation_ids = models.JSONField(
+        default=list, help_text="situation_id of the most recently detected active collisions, newest first",
+    )
+    next_expiry = models.DateTimeField(
+        null=True, blank=True, help_text="Earliest end time of the active situations; the row is refreshed after it",
+    )
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Route Collision Summary"
+        verbose_name_plural = "Route Collision Summaries"
+        ordering = ['route_id']
+
+    def __str__(self):
+        return f"Route {self.route_id}: {self.active_collisions} active collisions (max severity {self.max_severity})"
@@ -0,0 +1,68 @@
+"""
+In-process stand-in for the paho MQTT client.
+
+`publish_new_collisions --sink` publishes to a `LocalMqttSink` instead of a
+broker, so the publish step can run in tests, replays and benchmarks without
+network or broker latency. It implements only the part of the paho client API
+the publisher uses, and every publish is confirmed immediately.
+"""
+import json
+import threading
+
+
+class LocalPublishInfo:
+    """Mirrors `paho.mqtt.client.MQTTMessageInfo` for an already delivered message."""
+    __slots__ = ('mid',)
+
+    def __init__(self, mid):
+        self.mid = mid
+
+    def wait_for_publish(self, timeout=None):
+        return None
+
+    def is_published(self):
+        return True
+
+
+class LocalMqttSink:
+    """
+    Records published messages as (topic, payload) in `messages`, and also
+    appends them as JSON lines to `path` when one is given.
+    """
+
+    def __init__(self, path=None, keep_messages=True):
+        self.path = path
+        self.keep_messages = keep_messages
+        self.messages = []
+        self.count = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    # --- paho client API used by publish_new_collisions ---
+
+    def connect(self, *args, **kwargs):
+        if self.path and self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def disconnect(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        with self._lock:
+            self.count += 1
+            if self.keep_messages:
+                self.messages.append((topic, payload))
+            if self._file is not None:
+                self._file.write(json.dumps({"topic": topic, "payload": payload}, ensure_ascii=False) + '\n')
+            return LocalPublishInfo(self.count)
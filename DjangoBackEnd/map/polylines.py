@@ -0,0 +1,100 @@
+"""
+Vectorized decoding of Google encoded polylines (Entur's `pointsOnLink.points`).
+
+`polyline.decode` builds a (lat, lon) tuple per point in Python, and every
+caller then swapped them into [lon, lat] with another comprehension.
+`decode_many` decodes any number of polylines in one pass of NumPy
+operations over their concatenated bytes and returns a single (n, 2) float
+array that is already in lon/lat order, ready for `project_lonlat`,
+`LineString` or `.tolist()` into GeoJSON, plus the offsets of each polyline.
+
+Benchmark: `python -m bench.polyline_decode`.
+"""
+import numpy as np
+
+DEFAULT_PRECISION = 5
+BLOCK_BYTES = 1 << 20  # Encoded text decoded per block of `decode_many`
+
+
+def _decode_block(encoded, precision):
+    """`decode_many` for a list of polylines small enough to decode in one go."""
+    lengths = np.fromiter((len(points) for points in encoded), dtype=np.int64, count=len(encoded))
+    string_ends = np.cumsum(lengths)
+    # int32 is plenty: a value has at most 7 chunks, so a chunk is shifted by at most 30 bits
+    data = np.frombuffer(''.join(encoded).encode('ascii'), dtype=np.uint8).astype(np.int32) - 63
+    if len(data) == 0:
+        return np.empty((0, 2)), np.zeros(len(encoded), dtype=np.int64)
+    if data.min() < 0 or data.max() > 0x3f:
+        raise ValueError("Encoded polyline contains characters outside '?'..'~'.")
+
+    # Every value is a run of 5-bit chunks; the 0x20 bit is set on all but its last chunk
+    is_end = (data & 0x20) == 0
+    value_ends = np.flatnonzero(is_end)
+    if len(value_ends) == 0 or value_ends[-1] != len(data) - 1:
+        raise ValueError("Encoded polyline ends in the middle of a value.")
+    value_starts = np.concatenate(([0], value_ends[:-1] + 1))
+    if (value_ends - value_starts).max() >= 7:
+        raise ValueError("Encoded polyline has a value longer than 32 bits.")
+    chunk_value = np.cumsum(is_end, dtype=np.int32)
+    chunk_value[1:] = chunk_value[:-1]
+    chunk_value[0] = 0
+    shifts = (np.arange(len(data), dtype=np.int32) - value_starts[chunk_value].astype(np.int32)) * 5
+    values = np.add.reduceat((data & 0x1f) << shifts, value_starts, dtype=np.int64)
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+
+    # Values per polyline; a value must not run over the end of its string
+    value_counts = np.diff(np.searchsorted(value_ends, string_ends - 1, side='right'), prepend=0)
+    if not np.isin(string_ends[lengths > 0] - 1, value_ends).all() or (value_counts % 2).any():
+        raise ValueError("Encoded polyline has an incomplete coordinate.")
+    point_counts = value_counts // 2
+
+    # Deltas accumulate within each polyline only: subtract the running total at its start
+    totals = np.cumsum(deltas.reshape(-1, 2), axis=0)
+    starts = (np.cumsum(point_counts) - point_counts)[point_counts > 0]
+    base = np.where(starts[:, None] > 0, totals[np.maximum(starts - 1, 0)], 0)
+    totals -= np.repeat(base, point_counts[point_counts > 0], axis=0)
+    return totals[:, ::-1] / 10 ** precision, point_counts
+
+
+def decode_many(encoded, precision=DEFAULT_PRECISION, block_bytes=BLOCK_BYTES):
+    """
+    Decode several encoded polylines at once.
+
+    The polylines are decoded `block_bytes` of encoded text at a time, which
+    bounds the temporary arrays; the result holds all points.
+
+    Returns:
+        (coords, offsets): an (n, 2) float64 array of [lon, lat] rows of all
+        polylines, and an int64 array of len(encoded) + 1 offsets, so polyline
+        `i` is `coords[offsets[i]:offsets[i + 1]]`.
+
+    Raises:
+        ValueError: A polyline is not a valid encoding.
+    """
+    blocks, counts = [], []
+    block, size = [], 0
+    for points in encoded:
+        block.append(points)
+        size += len(points)
+        if size >= block_bytes:
+            coords, point_counts = _decode_block(block, precision)
+            blocks.append(coords)
+            counts.append(point_counts)
+            block, size = [], 0
+    if block or not blocks:
+        coords, point_counts = _decode_block(block, precision)
+        blocks.append(coords)
+        counts.append(point_counts)
+    coords = blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+    offsets = np.concatenate(([0], np.cumsum(np.concatenate(counts)))).astype(np.int64)
+    return coords, offsets
+
+
+def decode(encoded, precision=DEFAULT_PRECISION):
+    """One encoded polyline as an (n, 2) [lon, lat] float64 array."""
+    return decode_many([encoded], precision)[0]
+
+
+def split(coords, offsets):
+    """The per-polyline views of `decode_many` output."""
+    return [coords[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
@@ -0,0 +1,218 @@
+"""
+Opt-in SQL profiling of the map views.
+
+With `QUERY_PROFILING = True`, `QueryProfilingMiddleware` hooks every
+database connection with `connection.execute_wrapper` for the duration of a
+request and records the number of statements, their total time and the
+slowest ones. Each response gets a `Server-Timing` header (shown in the
+browser's network panel), e.g.
+
+    Server-Timing: db;dur=12.3;desc="4 queries"
+
+The numbers are also aggregated per view. Every
+`QUERY_PROFILING_REPORT_SECONDS` the aggregate is logged to the
+`map.query_profiler` logger (and appended as a JSON line to
+`QUERY_PROFILING_REPORT_PATH` when set), then reset. Single statements slower
+than `QUERY_PROFILING_SLOW_MS` are logged as warnings right away.
+
+Queries run while a streaming response is being consumed are not counted.
+Under ASGI every request has its own thread-sensitive executor thread; if
+requests share one (e.g. concurrent requests from the async test client),
+their statements are counted for each of them.
+Query budgets for tests: `map.testing.query_budget`.
+"""
+import heapq
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack
+from datetime import datetime, timezone
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from map.metrics import view_name
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SLOWEST = 5
+DEFAULT_SLOW_MS = 500
+DEFAULT_REPORT_SECONDS = 300
+
+
+class RequestProfile:
+    """
+    `execute_wrapper` that times every statement of one request.
+
+    Keeps the `top` slowest statements as (seconds, sql) pairs; `sql` is the
+    statement with its placeholders, so repeated statements look alike.
+    """
+    __slots__ = ('count', 'seconds', 'slowest', 'top', 'slow_seconds', '_lock')
+
+    def __init__(self, top=DEFAULT_SLOWEST, slow_ms=DEFAULT_SLOW_MS):
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest = []  # min-heap of (seconds, sql)
+        self.top = top
+        self.slow_seconds = slow_ms / 1000
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add(time.perf_counter() - start, sql)
+
+    def add(self, seconds, sql):
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+            if len(self.slowest) < self.top:
+                heapq.heappush(self.slowest, (seconds, sql))
+            elif seconds > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (seconds, sql))
+        if seconds >= self.slow_seconds:
+            logger.warning(f"Slow query ({seconds * 1000:.0f} ms): {sql[:500]}")
+
+    def server_timing(self):
+        return f'db;dur={self.seconds * 1000:.1f};desc="{self.count} queries"'
+
+
+class ProfileReport:
+    """Per-view aggregate of `RequestProfile`s, dumped and reset every `interval` seconds."""
+
+    def __init__(self, interval=DEFAULT_REPORT_SECONDS, top=DEFAULT_SLOWEST, clock=time.monotonic):
+        self.interval = interval
+        self.top = top
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._reset_locked()
+
+    def _reset_locked(self):
+        self.views = {}  # view -> {'requests', 'queries', 'max_queries', 'db_seconds', 'max_db_seconds'}
+        self.slowest = []  # min-heap of (seconds, view, sql) over all requests
+        self.started = self._clock()
+
+    def add(self, view, profile):
+        with self._lock:
+            stats = self.views.setdefault(view, {
+                'requests': 0, 'queries': 0, 'max_queries': 0, 'db_seconds': 0.0, 'max_db_seconds': 0.0,
+            })
+            stats['requests'] += 1
+            stats['queries'] += profile.count
+            stats['max_queries'] = max(stats['max_queries'], profile.count)
+            stats['db_seconds'] += profile.seconds
+            stats['max_db_seconds'] = max(stats['max_db_seconds'], profile.seconds)
+            for seconds, sql in profile.slowest:
+                if len(self.slowest) < self.top:
+                    heapq.heappush(self.slowest, (seconds, view, sql))
+                elif seconds > self.slowest[0][0]:
+                    heapq.heapreplace(self.slowest, (seconds, view, sql))
+
+    def due(self):
+        return self._clock() - self.started >= self.interval
+
+    def take(self):
+        """The aggregate so far, as a JSON-serializable dict; starts a new period."""
+        with self._lock:
+            report = {
+                'generated_at': datetime.now(timezone.utc).isoformat(),
+                'period_s': round(self._clock() - self.started, 1),
+                'views': {
+                    view: {
+                        'requests': stats['requests'],
+                        'avg_queries': round(stats['queries'] / stats['requests'], 1),
+                        'max_queries': stats['max_queries'],
+                        'avg_db_ms': round(stats['db_seconds'] * 1000 / stats['requests'], 1),
+                        'max_db_ms': round(stats['max_db_seconds'] * 1000, 1),
+                    }
+                    for view, stats in sorted(self.views.items(), key=lambda item: -item[1]['db_seconds'])
+                },
+                'slowest': [
+                    {'ms': round(seconds * 1000, 1), 'view': view, 'sql': sql}
+                    for seconds, view, sql in sorted(self.slowest, reverse=True)
+                ],
+            }
+            self._reset_locked()
+        return report
+
+    def dump(self, path=None):
+        """Log the aggregate (and append it to `path` as a JSON line), then start a new period."""
+        report = self.take()
+        if not report['views']:
+            return report
+        lines = [f"Query profile of the last {report['period_s']}s:"]
+        for view, stats in report['views'].items():
+            lines.append(
+                f"  {view}: {stats['requests']} requests, {stats['avg_queries']} queries avg "
+                f"({stats['max_queries']} max), {stats['avg_db_ms']} ms db avg ({stats['max_db_ms']} ms max)"
+            )
+        for statement in report['slowest']:
+            lines.append(f"  slowest: {statement['ms']} ms in {statement['view']}: {statement['sql'][:200]}")
+        logger.info('\n'.join(lines))
+        if path:
+            try:
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(report) + '\n')
+            except OSError as e:
+                logger.warning(f"Could not write the query profile to {path}: {e}")
+        return report
+
+
+class QueryProfilingMiddleware:
+    """Records the SQL of every request; only active with `QUERY_PROFILING = True`."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.top = getattr(settings, 'QUERY_PROFILING_SLOWEST', DEFAULT_SLOWEST)
+        self.slow_ms = getattr(settings, 'QUERY_PROFILING_SLOW_MS', DEFAULT_SLOW_MS)
+        self.report_path = getattr(settings, 'QUERY_PROFILING_REPORT_PATH', None)
+        self.report = ProfileReport(
+            interval=getattr(settings, 'QUERY_PROFILING_REPORT_SECONDS', DEFAULT_REPORT_SECONDS), top=self.top,
+        )
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def _hooks(self, profile):
+        """Install `profile` on every connection of the current thread; close the returned stack to remove it."""
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(profile))
+        return stack
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        profile = RequestProfile(self.top, self.slow_ms)
+        with self._hooks(profile):
+            response = self.get_response(request)
+        return self._finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile = RequestProfile(self.top, self.slow_ms)
+        # Connections are per thread: the ORM of async views (and of sync views under ASGI) runs
+        # in the request's thread-sensitive executor, so the hooks go on that thread's connections
+        hooks = await sync_to_async(self._hooks, thread_sensitive=True)(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(hooks.close, thread_sensitive=True)()
+        return self._finish(request, response, profile)
+
+    def _finish(self, request, response, profile):
+        timing = profile.server_timing()
+        existing = response.get('Server-Timing')
+        response['Server-Timing'] = f"{existing}, {timing}" if existing else timing
+        self.report.add(view_name(request), profile)
+        if self.report.due():
+            self.report.dump(self.report_path)
+        return response
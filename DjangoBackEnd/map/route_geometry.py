@@ -0,0 +1,112 @@
+"""
+Precomputed bus route geometry.
+
+Entur shapes carry a vertex every few metres, far more than a collision
+check at tens to hundreds of metres needs. When a BusRoute is saved, its path
+is projected once, simplified with Douglas–Peucker to within
+ROUTE_SIMPLIFY_TOLERANCE_METERS, and stored in `BusRoute.simplified_geometry`
+as one binary blob:
+
+    header   magic, point count, simplify tolerance, bbox (min_x, min_y, max_x, max_y)
+    xy       (n, 2) float64 projected points (metres, PROJECTED_SRID)
+    lonlat   (n, 2) float64 the same points in WGS84, for GeoJSON output
+    boxes    (n - 1, 4) float64 bbox per segment
+
+`RouteGeometry.from_blob` maps the arrays onto the blob without copying.
+Distances to the simplified line are within the simplify tolerance of the
+distances to the original path.
+"""
+import struct
+
+import numpy as np
+from django.conf import settings
+
+from .geometry import bbox, bboxes_overlap, points_to_segments_distance, project_lonlat, simplify
+
+DEFAULT_SIMPLIFY_TOLERANCE_METERS = 5.0
+MAGIC = b'RTG1'
+_HEADER = struct.Struct('<4sId4d')
+
+
+def simplify_tolerance():
+    return float(getattr(settings, 'ROUTE_SIMPLIFY_TOLERANCE_METERS', DEFAULT_SIMPLIFY_TOLERANCE_METERS))
+
+
+class RouteGeometry:
+    """The simplified projected points of a route with its segment bounding boxes."""
+
+    def __init__(self, xy, lonlat, segment_bboxes, tolerance):
+        self.xy = xy
+        self.lonlat = lonlat
+        self.segment_bboxes = segment_bboxes
+        self.tolerance = tolerance
+        self.bbox = bbox(xy)
+
+    def __len__(self):
+        return len(self.xy)
+
+    @classmethod
+    def from_lonlat(cls, coords, tolerance=None):
+        """Project and simplify [lon, lat] coordinates (two points at least)."""
+        tolerance = simplify_tolerance() if tolerance is None else tolerance
+        lonlat = np.asarray(coords, dtype=np.float64)[:, :2]
+        xy = project_lonlat(lonlat)
+        keep = simplify(xy, tolerance)
+        xy = xy[keep]
+        starts, ends = xy[:-1], xy[1:]
+        segment_bboxes = np.hstack((np.minimum(starts, ends), np.maximum(starts, ends)))
+        return cls(xy, np.ascontiguousarray(lonlat[keep]), segment_bboxes, tolerance)
+
+    @classmethod
+    def from_blob(cls, blob):
+        """
+        Raises:
+            ValueError: `blob` was not written by `to_blob`.
+        """
+        blob = bytes(blob)  # SQLite returns memoryview
+        if len(blob) < _HEADER.size:
+            raise ValueError("Route geometry blob is too short.")
+        magic, n, tolerance, *_ = _HEADER.unpack_from(blob)
+        if magic != MAGIC or len(blob) != _HEADER.size + 8 * (4 * n + 4 * max(n - 1, 0)):
+            raise ValueError("Not a route geometry blob.")
+        offset = _HEADER.size
+        xy = np.frombuffer(blob, dtype='<f8', count=2 * n, offset=offset).reshape(n, 2)
+        offset += 16 * n
+        lonlat = np.frombuffer(blob, dtype='<f8', count=2 * n, offset=offset).reshape(n, 2)
+        offset += 16 * n
+        segment_bboxes = np.frombuffer(blob, dtype='<f8', count=4 * max(n - 1, 0), offset=offset).reshape(-1, 4)
+        return cls(xy, lonlat, segment_bboxes, tolerance)
+
+    def to_blob(self):
+        return b''.join((
+            _HEADER.pack(MAGIC, len(self.xy), self.tolerance, *self.bbox),
+            self.xy.astype('<f8').tobytes(),
+            self.lonlat.astype('<f8').tobytes(),
+            self.segment_bboxes.astype('<f8').tobytes(),
+        ))
+
+    def points_distance(self, points_xy, max_distance):
+        """
+        Distance from each projected point to the route. Points farther than
+        `max_distance` may get inf instead: only points within `max_distance`
+        of the route's bbox are checked, against the segments whose bbox is
+        within `max_distance` of those points.
+        """
+        points_xy = np.asarray(points_xy, dtype=np.float64).reshape(-1, 2)
+        distances = np.full(len(points_xy), np.inf)
+        box = self.bbox
+        inside = np.flatnonzero(
+            (points_xy[:, 0] >= box[0] - max_distance) & (points_xy[:, 0] <= box[2] + max_distance) &
+            (points_xy[:, 1] >= box[1] - max_distance) & (points_xy[:, 1] <= box[3] + max_distance)
+        )
+        if len(inside) == 0 or len(self.xy) < 2:
+            return distances
+        candidates = points_xy[inside]
+        segments = np.flatnonzero(bboxes_overlap(self.segment_bboxes, bbox(candidates), max_distance))
+        distances[inside] = points_to_segments_distance(candidates, self.xy[segments], self.xy[segments + 1])
+        return distances
+
+
+def route_geometry_blob(coords, tolerance=None):
+    """The `BusRoute.simplified_geometry` blob of a path's [lon, lat] coordinates."""
+    return RouteGeometry.from_lonlat(coords, tolerance).to_blob()
@@ -0,0 +1,334 @@
+"""
+Memory-mapped spatial index of all bus route segments.
+
+import_bus_routes writes the simplified projected segments of every
+BusRoute (map/route_geometry.py) to one binary file, ROUTE_INDEX_PATH, with
+the route ids, per-route bounding boxes and a uniform grid (cells of
+ROUTE_INDEX_CELL_METERS, listing the segments whose bbox touches them).
+Processes open it with `mmap` and read the arrays in place, so opening costs
+a header parse, and the pages are shared through the OS page cache by every
+web worker and cron process instead of each one rebuilding an index from
+BusRoute rows.
+
+Layout (little-endian, sections 8-byte aligned):
+
+    header            magic, format version, index version, counts, grid origin/size
+    route_pks         int64 (routes)
+    route_bboxes      float64 (routes, 4), projected
+    route_lonlat      float64 (routes, 4), WGS84 bbox
+    name_offsets      int64 (routes + 1) into `names`
+    segments          float64 (segments, 4): x0, y0, x1, y1
+    segment_routes    int32 (segments): route of each segment
+    cell_starts       int64 (cells + 1) into `cell_segments`
+    cell_segments     int32 (entries)
+    names             utf-8 route_id values
+
+The index version is a hash of the contents. The file is replaced
+atomically, so a process keeps reading its old mapping until
+`get_route_index` notices the new file (checked at most every
+ROUTE_INDEX_REFRESH_SECONDS) and swaps in a mapping of it.
+"""
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .geometry import bbox, segment_distances
+from .route_geometry import RouteGeometry
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'RTIX'
+FORMAT_VERSION = 1
+DEFAULT_CELL_METERS = 1000.0
+DEFAULT_REFRESH_SECONDS = 30
+VERSION_KEY = 'route_index_version'  # ApiMetadata key: version of the index matching BusRoute
+# magic, format version, reserved, index version, routes, segments, cell entries, name bytes,
+# cell size, origin x, origin y, columns, rows
+_HEADER = struct.Struct('<4sHHQQQQQdddII')
+
+
+def route_index_path():
+    return getattr(settings, 'ROUTE_INDEX_PATH', None) or settings.BASE_DIR / "data" / "route_index.bin"
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def _grid(segments, cell_size):
+    """(origin_x, origin_y, columns, rows, cell_starts, cell_segments) of a uniform grid over the segments."""
+    if len(segments) == 0:
+        return 0.0, 0.0, 1, 1, np.zeros(2, dtype=np.int64), np.empty(0, dtype=np.int32)
+    lo = np.minimum(segments[:, :2], segments[:, 2:])
+    hi = np.maximum(segments[:, :2], segments[:, 2:])
+    origin = lo.min(axis=0)
+    first = np.floor((lo - origin) / cell_size).astype(np.int64)
+    last = np.floor((hi - origin) / cell_size).astype(np.int64)
+    columns, rows = (last.max(axis=0) + 1).tolist()
+
+    # One entry per (segment, cell its bbox touches)
+    width = last[:, 0] - first[:, 0] + 1
+    counts = width * (last[:, 1] - first[:, 1] + 1)
+    entry_segments = np.repeat(np.arange(len(segments), dtype=np.int32), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    width = np.repeat(width, counts)
+    cells = (np.repeat(first[:, 1], counts) + k // width) * columns + np.repeat(first[:, 0], counts) + k % width
+    order = np.argsort(cells, kind='stable')
+    cell_starts = np.concatenate(([0], np.cumsum(np.bincount(cells, minlength=columns * rows)))).astype(np.int64)
+    return float(origin[0]), float(origin[1]), columns, rows, cell_starts, entry_segments[order]
+
+
+def pack_route_index(routes, cell_size=None):
+    """
+    The index file contents for `routes`, (pk, route_id, RouteGeometry) tuples.
+    """
+    cell_size = float(cell_size or getattr(settings, 'ROUTE_INDEX_CELL_METERS', DEFAULT_CELL_METERS))
+    pks, names, bboxes, lonlat_bboxes, segments, segment_routes = [], [], [], [], [], []
+    for n, (pk, route_id, geometry) in enumerate(routes):
+        pks.append(pk)
+        names.append((route_id or '').encode('utf-8'))
+        bboxes.append(geometry.bbox)
+        lonlat_bboxes.append(bbox(geometry.lonlat))
+        segments.append(np.hstack((geometry.xy[:-1], geometry.xy[1:])))
+        segment_routes.append(np.full(len(geometry.xy) - 1, n, dtype=np.int32))
+    segments = np.vstack(segments) if segments else np.empty((0, 4))
+    segment_routes = np.concatenate(segment_routes) if segment_routes else np.empty(0, dtype=np.int32)
+    origin_x, origin_y, columns, rows, cell_starts, cell_segments = _grid(segments, cell_size)
+    name_offsets = np.concatenate(([0], np.cumsum([len(name) for name in names]))).astype(np.int64)
+
+    sections = [
+        np.asarray(pks, dtype='<i8'),
+        np.asarray(bboxes, dtype='<f8').reshape(-1, 4),
+        np.asarray(lonlat_bboxes, dtype='<f8').reshape(-1, 4),
+        name_offsets.astype('<i8'),
+        segments.astype('<f8'),
+        segment_routes.astype('<i4'),
+        cell_starts.astype('<i8'),
+        cell_segments.astype('<i4'),
+        np.frombuffer(b''.join(names), dtype=np.uint8),
+    ]
+    body = b''.join(
+        section.tobytes() + b'\0' * (_align(section.nbytes) - section.nbytes) for section in sections
+    )
+    version = int.from_bytes(hashlib.blake2b(body, digest_size=8).digest(), 'little')
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, 0, version, len(pks), len(segments), len(cell_segments), int(name_offsets[-1]),
+        cell_size, origin_x, origin_y, columns, rows,
+    )
+    return header + body
+
+
+class RouteIndex:
+    """
+    Read-only view of a route index file (or bytes). The arrays point into
+    the buffer; nothing is copied.
+    """
+
+    def __init__(self, buffer, path=None):
+        if len(buffer) < _HEADER.size:
+            raise ValueError("Route index is too short.")
+        (magic, format_version, _, self.version, routes, segments, entries, name_bytes,
+         self.cell_size, self.origin_x, self.origin_y, self.columns, self.rows) = _HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError("Not a route index.")
+        if format_version != FORMAT_VERSION:
+            raise ValueError(f"Route index format {format_version} is not supported (expected {FORMAT_VERSION}).")
+        self.buffer = buffer
+        self.path = path
+
+        offset = _HEADER.size
+
+        def section(dtype, count, shape=None):
+            nonlocal offset
+            array = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+            offset += _align(array.nbytes)
+            return array.reshape(shape) if shape else array
+
+        cells = self.columns * self.rows
+        try:
+            self.route_pks = section('<i8', routes)
+            self.route_bboxes = section('<f8', routes * 4, (-1, 4))
+            self.route_lonlat_bboxes = section('<f8', routes * 4, (-1, 4))
+            self.name_offsets = section('<i8', routes + 1)
+            self.segments = section('<f8', segments * 4, (-1, 4))
+            self.segment_routes = section('<i4', segments)
+            self.cell_starts = section('<i8', cells + 1)
+            self.cell_segments = section('<i4', entries)
+            self.names = section(np.uint8, name_bytes)
+        except ValueError as e:  # Buffer shorter than its header says
+            raise ValueError(f"Truncated route index: {e}") from e
+
+    @classmethod
+    def open(cls, path):
+        """Map the file at `path` read-only."""
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, path)
+
+    def __len__(self):
+        return len(self.route_pks)
+
+    def route_id(self, i):
+        """BusRoute.route_id of route `i` of the index."""
+        return bytes(self.names[self.name_offsets[i]:self.name_offsets[i + 1]]).decode('utf-8')
+
+    def _segments_near(self, x, y, max_distance):
+        """Indices of the segments in the grid cells within `max_distance` of (x, y)."""
+        cx0 = max(int(np.floor((x - max_distance - self.origin_x) / self.cell_size)), 0)
+        cx1 = min(int(np.floor((x + max_distance - self.origin_x) / self.cell_size)), self.columns - 1)
+        cy0 = max(int(np.floor((y - max_distance - self.origin_y) / self.cell_size)), 0)
+        cy1 = min(int(np.floor((y + max_distance - self.origin_y) / self.cell_size)), self.rows - 1)
+        if cx0 > cx1 or cy0 > cy1:
+            return np.empty(0, dtype=np.int32)
+        slices = [
+            self.cell_segments[self.cell_starts[row * self.columns + cx0]:self.cell_starts[row * self.columns + cx1 + 1]]
+            for row in range(cy0, cy1 + 1)
+        ]
+        return np.unique(np.concatenate(slices))
+
+    def pairs_within(self, points_xy, max_distance):
+        """
+        The routes within `max_distance` of each projected point.
+
+        Returns:
+            (point index, route index, distance) arrays with one row per
+            (point, route) pair, at the route's nearest segment.
+        """
+        points_xy = np.asarray(points_xy, dtype=np.float64).reshape(-1, 2)
+        point_index, route_index, distances = [], [], []
+        for i, (x, y) in enumerate(points_xy):
+            near = self._segments_near(x, y, max_distance)
+            if len(near) == 0:
+                continue
+            segments = self.segments[near]
+            distance = segment_distances(np.array((x, y)), segments[:, :2], segments[:, 2:])
+            routes = self.segment_routes[near]
+            within = distance <= max_distance
+            if not within.any():
+                continue
+            routes, distance = routes[within], distance[within]
+            # Minimum per route
+            order = np.lexsort((distance, routes))
+            routes, distance = routes[order], distance[order]
+            first = np.concatenate(([True], routes[1:] != routes[:-1]))
+            route_index.append(routes[first])
+            distances.append(distance[first])
+            point_index.append(np.full(first.sum(), i, dtype=np.int64))
+        if not point_index:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32), np.empty(0)
+        return np.concatenate(point_index), np.concatenate(route_index), np.concatenate(distances)
+
+
+def write_route_index(path, routes, cell_size=None):
+    """
+    Write the index of `routes` to `path` through a temporary file, unless
+    the file already holds the same version. Returns the index version.
+    """
+    data = pack_route_index(routes, cell_size)
+    version = _HEADER.unpack_from(data)[3]
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+        if len(header) == _HEADER.size and _HEADER.unpack(header)[:4] == (MAGIC, FORMAT_VERSION, 0, version):
+            return version
+    except OSError:
+        pass
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.route_index-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)  # Readers keep their mapping of the old file
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return version
+
+
+def build_route_index(path=None):
+    """
+    Write the index of all BusRoute rows and record its version in
+    ApiMetadata. Returns the index version.
+    """
+    from .models import ApiMetadata, BusRoute
+
+    def routes():
+        for pk, route_id, blob, path_ in BusRoute.objects.filter(path__isnull=False).values_list(
+            'id', 'route_id', 'simplified_geometry', 'path',
+        ).iterator():
+            geometry = RouteGeometry.from_blob(blob) if blob is not None else RouteGeometry.from_lonlat(path_.coords)
+            if len(geometry) >= 2:
+                yield pk, route_id, geometry
+
+    start = time.perf_counter()
+    path = path or route_index_path()
+    version = write_route_index(path, routes())
+    ApiMetadata.objects.update_or_create(key=VERSION_KEY, defaults={'value': str(version)})
+    logger.info(f"Route index {version:016x} written to {path} in {time.perf_counter() - start:.2f}s.")
+    return version
+
+
+_index = None
+_index_stat = None
+_index_path = None
+_index_checked_at = None
+_index_lock = threading.Lock()
+
+
+def get_route_index():
+    """
+    The process-wide mapping of ROUTE_INDEX_PATH, or None when there is no
+    usable index file.
+
+    The file is stat()ed at most every ROUTE_INDEX_REFRESH_SECONDS; when it
+    was replaced, the new file is mapped and swapped in. Callers holding the
+    previous index keep a valid mapping of the old file.
+    """
+    global _index, _index_stat, _index_path, _index_checked_at
+    refresh = getattr(settings, 'ROUTE_INDEX_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS)
+    path = route_index_path()
+    with _index_lock:
+        now = time.monotonic()
+        if _index_checked_at is not None and path == _index_path and now - _index_checked_at < refresh:
+            return _index
+        _index_checked_at = now
+        _index_path = path
+        try:
+            stat = os.stat(path)
+        except OSError:
+            _index, _index_stat = None, None
+            return None
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature != _index_stat:
+            _index_stat = signature
+            try:
+                _index = RouteIndex.open(path)
+                logger.info(f"Mapped route index {_index.version:016x} ({len(_index)} routes) from {path}.")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not open route index {path}: {e}")
+                _index = None
+        return _index
+
+
+def current_route_index():
+    """
+    `get_route_index`, only when its version is the one recorded for the
+    current BusRoute table (so it is never used when it is stale).
+    """
+    from .models import ApiMetadata
+
+    index = get_route_index()
+    if index is None:
+        return None
+    expected = ApiMetadata.objects.filter(key=VERSION_KEY).values_list('value', flat=True).first()
+    return index if expected == str(index.version) else None
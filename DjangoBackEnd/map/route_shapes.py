@@ -0,0 +1,119 @@
+"""
+Bus route shapes as newline-delimited GeoJSON.
+
+fetch-coordinates writes one compact GeoJSON Feature (a LineString with
+`route_id` and `journey_id` properties) per line, as the shapes arrive batch
+by batch, and import_bus_routes reads them back one line at a time, so
+neither ever holds more than a batch of routes in memory.
+
+`iter_features` also still reads a regular FeatureCollection file (which is
+loaded whole).
+
+`shape_hash` identifies a shape by its route id and coordinates, so a
+re-import can tell unchanged shapes from new and removed ones.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+import numpy as np
+
+# "TRO:ServiceJourney:1_26_..." -> "1"; the line number in the journey id
+ROUTE_ID_RE = re.compile(r":(\d+)_")
+
+
+def route_id_from_journey(journey_id):
+    match = ROUTE_ID_RE.search(journey_id or '')
+    return match.group(1) if match else None
+
+
+def route_feature(route_id, coordinates, **properties):
+    """A route LineString Feature; `coordinates` are [lon, lat] pairs."""
+    return {
+        "type": "Feature",
+        "geometry": {"type": "LineString", "coordinates": coordinates},
+        "properties": {"route_id": route_id, **properties},
+    }
+
+
+def shape_hash(route_id, coordinates):
+    """
+    Hex digest of a route shape: its route id and its [lon, lat] coordinates
+    rounded to 1e-7 degrees (about a centimetre), so the same shape hashes the
+    same whether it comes from a route file or back from the database.
+    """
+    points = np.round(np.asarray(coordinates, dtype=np.float64)[:, :2], 7) + 0.0  # + 0.0 turns -0.0 into 0.0
+    digest = hashlib.blake2b(str(route_id).encode(), digest_size=16)
+    digest.update(b'|')
+    digest.update(np.ascontiguousarray(points).tobytes())
+    return digest.hexdigest()
+
+
+class FeatureWriter:
+    """
+    Writes features to `path` as NDJSON through a temporary file that replaces
+    `path` only when the block completes, so a failed fetch keeps the old file.
+
+        with FeatureWriter(path) as writer:
+            writer.write(feature)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = None
+        self._tmp_path = None
+
+    def __enter__(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=directory, prefix='.routes-', suffix='.ndjson')
+        self._file = os.fdopen(fd, 'w', encoding='utf-8')
+        return self
+
+    def write(self, feature):
+        self._file.write(json.dumps(feature, separators=(',', ':')))
+        self._file.write('\n')
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.close()
+        if exc_type is None:
+            os.chmod(self._tmp_path, 0o644)
+            os.replace(self._tmp_path, self.path)
+        else:
+            os.unlink(self._tmp_path)
+
+
+def iter_features(path):
+    """
+    Yield the features of an NDJSON route file, line by line, or of a GeoJSON FeatureCollection file.
+
+    Raises:
+        ValueError: The file is neither (JSONDecodeError is a ValueError).
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        first = f.readline()
+        try:
+            head = json.loads(first) if first.strip() else None
+        except ValueError:
+            head = None
+        if isinstance(head, dict) and head.get('type') == 'Feature':
+            yield head
+            for number, line in enumerate(f, 2):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"Line {number}: {e}") from e
+            return
+        f.seek(0)
+        data = json.load(f)
+    if not isinstance(data, dict) or data.get('type') != 'FeatureCollection':
+        raise ValueError("JSON root must be a GeoJSON FeatureCollection object.")
+    if not isinstance(data.get('features'), list):
+        raise ValueError("FeatureCollection must contain a 'features' list.")
+    yield from data['features']
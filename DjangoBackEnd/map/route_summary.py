@@ -0,0 +1,211 @@
+"""
+Per-route collision summary, for route-centric questions ("which routes are
+affected right now, and by what?") without shipping every DetectedCollision.
+
+`RouteCollisionSummary` has one row per affected `BusRoute.route_id` with the
+number of active situations colliding with the route, their highest severity
+and the most recently detected situation IDs. Active means the same as in the
+collision engine: no end time, or ending in the future.
+
+calculate_and_store_collisions keeps it up to date incrementally: only routes
+that got new collisions, routes whose earliest active situation has ended
+since, routes of situations an ingest changed since the last refresh
+(`VtsSituation.ingested_at`, the local clock) and routes whose collisions were
+deleted (with their situation or route) are recomputed (everything after
+clearing). Deletes record the affected route ids in a dirty set
+(`mark_routes_dirty`, kept in ApiMetadata) when they happen: import_bus_routes
+for the routes it removes, and a pre_delete receiver for situations.
+`/api/routes/affected/` reads the table with one query.
+"""
+import json
+import logging
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import ApiMetadata, BusRoute, DetectedCollision, RouteCollisionSummary, VtsSituation
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+REFRESHED_AT_KEY = 'route_summary_refreshed_at'
+DIRTY_ROUTES_KEY = 'route_summary_dirty_routes'
+LATEST_SITUATIONS = 10
+CHUNK_SIZE = 500  # Route ids per IN (...) query, well below SQLite's variable limit
+
+# DATEX II severities, lowest first; anything else ranks below them
+SEVERITY_ORDER = ['none', 'lowest', 'low', 'medium', 'high', 'highest']
+SEVERITY_RANK = {severity: rank for rank, severity in enumerate(SEVERITY_ORDER, 1)}
+
+
+def severity_rank(severity):
+    return SEVERITY_RANK.get((severity or '').lower(), 0)
+
+
+def _chunks(values, size=CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def summarize(rows, latest=LATEST_SITUATIONS):
+    """
+    Fold collision rows into summary fields per route_id.
+
+    Args:
+        rows: (route_id, situation_id, severity, overall_end_time) tuples, newest detection first.
+
+    Returns:
+        dict route_id -> dict of RouteCollisionSummary field values.
+    """
+    summaries = {}
+    for route_id, situation_id, severity, end_time in rows:
+        summary = summaries.get(route_id)
+        if summary is None:
+            summary = summaries[route_id] = {
+                'situations': set(), 'max_severity': None, 'latest_situation_ids': [], 'next_expiry': None,
+            }
+        if situation_id in summary['situations']:
+            continue  # The same situation near several shapes of one route counts once
+        summary['situations'].add(situation_id)
+        if len(summary['latest_situation_ids']) < latest:
+            summary['latest_situation_ids'].append(situation_id)
+        if summary['max_severity'] is None or severity_rank(severity) > severity_rank(summary['max_severity']):
+            summary['max_severity'] = severity
+        if end_time is not None and (summary['next_expiry'] is None or end_time < summary['next_expiry']):
+            summary['next_expiry'] = end_time
+    for summary in summaries.values():
+        summary['active_collisions'] = len(summary.pop('situations'))
+    return summaries
+
+
+def refresh_route_summaries(route_ids, now=None):
+    """Recompute the summary rows of `route_ids` (BusRoute.route_id values). Returns the number of rows written."""
+    now = now or timezone.now()
+    route_ids = {route_id for route_id in route_ids if route_id}
+    written = 0
+    for chunk in _chunks(sorted(route_ids)):
+        rows = DetectedCollision.objects.filter(
+            Q(transit_information__overall_end_time__isnull=True) | Q(transit_information__overall_end_time__gt=now),
+            bus_route__route_id__in=chunk,
+        ).order_by('-detection_timestamp', '-id').values_list(
+            'bus_route__route_id', 'transit_information__situation_id',
+            'transit_information__severity', 'transit_information__overall_end_time',
+        )
+        summaries = summarize(rows.iterator())
+        with transaction.atomic():
+            RouteCollisionSummary.objects.filter(route_id__in=chunk).delete()
+            RouteCollisionSummary.objects.bulk_create(
+                RouteCollisionSummary(route_id=route_id, updated_at=now, **fields)
+                for route_id, fields in summaries.items()
+            )
+        written += len(summaries)
+    return written
+
+
+def _refreshed_at():
+    entry = ApiMetadata.objects.filter(key=REFRESHED_AT_KEY).first()
+    if entry is None:
+        return None
+    try:
+        return datetime.fromisoformat(entry.value)
+    except ValueError:
+        return None
+
+
+def _dirty_routes():
+    entry = ApiMetadata.objects.filter(key=DIRTY_ROUTES_KEY).first()
+    if entry is None:
+        return set()
+    try:
+        return set(json.loads(entry.value))
+    except ValueError:
+        return set()
+
+
+def _store_dirty_routes(route_ids):
+    if route_ids:
+        ApiMetadata.objects.update_or_create(key=DIRTY_ROUTES_KEY, defaults={'value': json.dumps(sorted(route_ids))})
+    else:
+        ApiMetadata.objects.filter(key=DIRTY_ROUTES_KEY).delete()
+
+
+def mark_routes_dirty(route_ids):
+    """
+    Record that collisions of `route_ids` (BusRoute.route_id values) were deleted,
+    so the next `update_route_summaries` recomputes them. Call it in the
+    transaction of the delete.
+    """
+    route_ids = {route_id for route_id in route_ids if route_id}
+    if not route_ids:
+        return
+    with transaction.atomic():
+        dirty = _dirty_routes()
+        if not route_ids <= dirty:
+            _store_dirty_routes(dirty | route_ids)
+
+
+@receiver(pre_delete, sender=VtsSituation)
+def _situation_deleted(sender, instance, **kwargs):
+    # Sent before the cascade removes the situation's collisions, so their routes can still be read
+    mark_routes_dirty(DetectedCollision.objects.filter(
+        transit_information_id=instance.pk,
+    ).values_list('bus_route__route_id', flat=True).distinct())
+
+
+def update_route_summaries(new_bus_route_ids=(), full=False, now=None):
+    """
+    Bring the summary up to date after a collision run.
+
+    Args:
+        new_bus_route_ids: BusRoute primary keys that got new collisions.
+        full: Recompute every route (after the collisions were cleared).
+
+    Returns:
+        The number of routes recomputed.
+    """
+    now = now or timezone.now()
+    dirty = _dirty_routes()
+    refreshed_at = None if full else _refreshed_at()
+    if refreshed_at is None:
+        # First run, or everything changed
+        route_ids = set(DetectedCollision.objects.values_list('bus_route__route_id', flat=True).distinct())
+        route_ids.update(RouteCollisionSummary.objects.values_list('route_id', flat=True))
+    else:
+        route_ids = set()
+        for chunk in _chunks(set(new_bus_route_ids)):
+            route_ids.update(BusRoute.objects.filter(pk__in=chunk).values_list('route_id', flat=True))
+        # Rows whose earliest active situation has ended
+        route_ids.update(RouteCollisionSummary.objects.filter(next_expiry__lte=now).values_list('route_id', flat=True))
+        # Routes of situations an ingest changed (e.g. new severity or end time) since the last refresh.
+        # The ingest time, not the upstream version time: delayed or replayed records are versioned earlier.
+        route_ids.update(DetectedCollision.objects.filter(
+            transit_information__ingested_at__gt=refreshed_at,
+        ).values_list('bus_route__route_id', flat=True).distinct())
+        # Routes whose collisions were deleted since
+        route_ids.update(dirty)
+
+    route_ids.discard(None)
+    written = refresh_route_summaries(route_ids, now)
+    with transaction.atomic():
+        ApiMetadata.objects.update_or_create(key=REFRESHED_AT_KEY, defaults={'value': now.isoformat()})
+        if dirty:
+            # Keep routes marked by deletes that happened during the refresh
+            _store_dirty_routes(_dirty_routes() - dirty)
+    metrics.ROWS_UPSERTED.observe(written, table=RouteCollisionSummary._meta.db_table)
+    logger.info(f"Route collision summary: recomputed {len(route_ids)} routes, {written} affected.")
+    return len(route_ids)
+
+
+def affected_routes(route_ids=None):
+    """The summary rows as dicts, optionally only for the given BusRoute.route_id values."""
+    queryset = RouteCollisionSummary.objects.all()
+    if route_ids:
+        queryset = queryset.filter(route_id__in=route_ids)
+    return list(queryset.values(
+        'route_id', 'active_collisions', 'max_severity', 'latest_situation_ids', 'next_expiry', 'updated_at',
+    ))
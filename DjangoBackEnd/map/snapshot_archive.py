@@ -0,0 +1,181 @@
+"""
+Archive of raw DATEX II snapshots, for replay, benchmarking and backfill.
+
+Opt-in: `fetch_vts_situations` only archives when `DATEX_ARCHIVE_DIR` is set.
+Each snapshot is written compressed while it is being downloaded (zstd when
+the `zstandard` package is installed, gzip otherwise) to
+
+    <DATEX_ARCHIVE_DIR>/<YYYY>/<MM>/<DD>/<fetched_at>_<feed>.xml.<zst|gz>
+
+and gets one JSON line in `<DATEX_ARCHIVE_DIR>/index.jsonl` once the snapshot
+has been parsed successfully. The index is the timestamp index that
+`replay_snapshots` reads; files without an index line are ignored.
+"""
+import gzip
+import json
+import logging
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dateutil.parser import isoparse
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; gzip is always available
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = 'index.jsonl'
+CODEC_SUFFIXES = {'zstd': 'zst', 'gzip': 'gz'}
+
+ArchiveEntry = namedtuple('ArchiveEntry', [
+    'path',              # relative to the archive directory
+    'feed',              # "snapshot" or the filter name
+    'fetched_at',        # ISO 8601 UTC, e.g. "2025-04-24T08:00:00.123456Z"
+    'codec',
+    'bytes',             # uncompressed size
+    'compressed_bytes',
+    'last_modified',     # Last-Modified header of the response, if any
+])
+
+_index_lock = threading.Lock()
+
+
+def default_codec():
+    return 'zstd' if zstandard is not None else 'gzip'
+
+
+def _utc_iso(moment):
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+class ArchiveWriter:
+    """
+    Binary sink for one snapshot; `write()` compresses on the fly.
+
+    Call `commit()` once the snapshot was processed, or `discard()` to drop it.
+    """
+
+    def __init__(self, archive, feed, fetched_at, codec):
+        self.archive = archive
+        self.feed = feed
+        self.fetched_at = _utc_iso(fetched_at)
+        self.codec = codec
+        utc = fetched_at.astimezone(timezone.utc)
+        stamp = utc.strftime('%Y%m%dT%H%M%S%fZ')
+        self.relative_path = Path(utc.strftime('%Y/%m/%d')) / f"{stamp}_{feed}.xml.{CODEC_SUFFIXES[codec]}"
+        self.path = archive.directory / self.relative_path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._part_path = self.path.with_name(self.path.name + '.part')
+        self._raw = open(self._part_path, 'wb')
+        if codec == 'zstd':
+            self._stream = zstandard.ZstdCompressor(level=archive.level).stream_writer(self._raw)
+        else:
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=archive.level)
+        self.bytes = 0
+        self._closed = False
+
+    def write(self, data):
+        self.bytes += len(data)
+        return self._stream.write(data)
+
+    def _close(self):
+        if not self._closed:
+            self._closed = True
+            self._stream.close()
+            if not self._raw.closed:
+                self._raw.close()
+
+    def commit(self, last_modified=None):
+        """Finish the file and add it to the index. Returns the `ArchiveEntry`."""
+        self._close()
+        os.replace(self._part_path, self.path)
+        entry = ArchiveEntry(
+            path=self.relative_path.as_posix(),
+            feed=self.feed,
+            fetched_at=self.fetched_at,
+            codec=self.codec,
+            bytes=self.bytes,
+            compressed_bytes=self.path.stat().st_size,
+            last_modified=last_modified,
+        )
+        self.archive._append_index(entry)
+        logger.info(f"Archived {entry.feed} snapshot: {entry.bytes} bytes, {entry.compressed_bytes} compressed ({entry.path}).")
+        return entry
+
+    def discard(self):
+        self._close()
+        self._part_path.unlink(missing_ok=True)
+
+
+class SnapshotArchive:
+    """A directory of compressed snapshots with a JSON-lines timestamp index."""
+
+    def __init__(self, directory, codec=None, level=None):
+        self.directory = Path(directory)
+        self.codec = codec or default_codec()
+        if self.codec == 'zstd' and zstandard is None:
+            logger.warning("zstd archive codec requested but the zstandard package is not installed; using gzip.")
+            self.codec = 'gzip'
+        self.level = level or (3 if self.codec == 'zstd' else 6)
+        self.index_path = self.directory / INDEX_NAME
+
+    def writer(self, feed, fetched_at=None):
+        """Start archiving a snapshot of `feed` fetched at `fetched_at` (default: now)."""
+        return ArchiveWriter(self, feed, fetched_at or datetime.now(timezone.utc), self.codec)
+
+    def _append_index(self, entry):
+        line = json.dumps(entry._asdict()) + '\n'
+        with _index_lock, open(self.index_path, 'a', encoding='utf-8') as index:
+            index.write(line)
+
+    def entries(self, feed=None, since=None, until=None):
+        """
+        Indexed snapshots in fetch order.
+
+        Args:
+            feed: Only this feed ("snapshot" or a filter name).
+            since, until: Inclusive bounds, as datetimes or ISO 8601 strings.
+        """
+        if not self.index_path.exists():
+            return []
+        since = isoparse(since) if isinstance(since, str) else since
+        until = isoparse(until) if isinstance(until, str) else until
+        entries = []
+        with open(self.index_path, encoding='utf-8') as index:
+            for line in index:
+                if not line.strip():
+                    continue
+                entry = ArchiveEntry(**json.loads(line))
+                fetched_at = isoparse(entry.fetched_at)
+                if feed and entry.feed != feed:
+                    continue
+                if since and fetched_at < since:
+                    continue
+                if until and fetched_at > until:
+                    continue
+                entries.append(entry)
+        entries.sort(key=lambda entry: entry.fetched_at)
+        return entries
+
+    def open(self, entry):
+        """Binary stream of the decompressed snapshot."""
+        path = self.directory / entry.path
+        if entry.codec == 'zstd':
+            if zstandard is None:
+                raise RuntimeError(f"{entry.path} is zstd-compressed but the zstandard package is not installed.")
+            return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return gzip.open(path, 'rb')
+
+
+def get_archive():
+    """The archive configured in settings, or None when archiving is off."""
+    directory = getattr(settings, 'DATEX_ARCHIVE_DIR', None)
+    if not directory:
+        return None
+    return SnapshotArchive(directory, codec=getattr(settings, 'DATEX_ARCHIVE_CODEC', None))
@@ -0,0 +1,135 @@
+"""
+Helpers shared by map/tests.py and the bench scripts.
+
+`StubUpstream` is a small local HTTP server that stands in for Entur or the
+VTS DATEX II API, so tests and load tests never touch the network.
+`query_budget` fails a test when a block runs more SQL statements than allowed.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import polyline
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+class StubUpstream:
+    """
+    Local HTTP server answering every request with `responder(method, path, headers, body)`.
+
+    The responder returns `(status, headers, body_bytes)`. An optional `delay`
+    (seconds) simulates a slow upstream. Every request is recorded in
+    `self.requests` as `(method, path, headers, body)`.
+
+    Usage:
+        with StubUpstream(responder, delay=0.2) as stub:
+            requests.post(stub.url, ...)
+    """
+
+    def __init__(self, responder, delay=0.0):
+        self.responder = responder
+        self.delay = delay
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real upstreams
+
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                with stub._lock:
+                    stub.requests.append((self.command, self.path, dict(self.headers), body))
+                if stub.delay:
+                    time.sleep(stub.delay)
+                status, headers, payload = stub.responder(self.command, self.path, self.headers, body)
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, format, *args):
+                pass  # Keep test output quiet
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+def journey_planner_trip_response(legs=None):
+    """
+    Canned Entur journey-planner `trip` response with encoded `pointsOnLink`.
+
+    `legs` is a list of (mode, line_name, [(lat, lon), ...]); defaults to a
+    single bus leg through Tromsø.
+    """
+    if legs is None:
+        legs = [("BUS", "34", [(69.6496, 18.9553), (69.6510, 18.9600), (69.6530, 18.9700)])]
+    return {
+        "data": {
+            "trip": {
+                "tripPatterns": [{
+                    "legs": [{
+                        "mode": mode,
+                        "distance": 1000.0,
+                        "line": {"id": f"TRO:Line:{line_name}", "name": line_name} if line_name else None,
+                        "fromPlace": {"name": "From", "quay": None, "latitude": points[0][0], "longitude": points[0][1]},
+                        "toPlace": {"name": "To", "quay": None, "latitude": points[-1][0], "longitude": points[-1][1]},
+                        "pointsOnLink": {"points": polyline.encode(points)},
+                    } for mode, line_name, points in legs]
+                }]
+            }
+        }
+    }
+
+
+def json_responder(data, status=200):
+    """Responder for `StubUpstream` that always returns `data` as JSON."""
+    body = json.dumps(data).encode('utf-8')
+
+    def responder(method, path, headers, request_body):
+        return status, {'Content-Type': 'application/json'}, body
+    return responder
+
+
+@contextmanager
+def query_budget(max_queries, label='Block', using=DEFAULT_DB_ALIAS):
+    """
+    Fail with the list of statements when the block runs more than `max_queries` queries.
+
+    Unlike `assertNumQueries` it allows fewer queries, so a budget only has to
+    change when a view gets slower. Usage:
+
+        with query_budget(1, 'stored_collisions'):
+            client.get('/api/stored_collisions/')
+    """
+    with CaptureQueriesContext(connections[using]) as captured:
+        yield captured
+    if len(captured) > max_queries:
+        statements = '\n'.join(f"{n}. {query['sql']}" for n, query in enumerate(captured.captured_queries, 1))
+        raise AssertionError(f"{label} ran {len(captured)} queries, the budget is {max_queries}:\n{statements}")
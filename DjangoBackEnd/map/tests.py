@@ -1,10 +1,51 @@
-from django.test import TestCase, Client
+import asyncio
+import gzip
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from unittest import skipUnless
 from unittest.mock import patch, MagicMock
-from django.core.management import call_command
-from map.models import VtsSituation, ApiMetadata, BusRoute
-from .utils import get_trip_geojson
-from .views import trip, find_all_collisions
+
+import numpy as np
+import polyline
 from django.contrib.gis.geos import Point, LineString
+from django.core.management import call_command
+from django.test import TestCase, SimpleTestCase, Client, AsyncRequestFactory, RequestFactory, override_settings
+from django.utils import timezone
+
+from map.models import VtsSituation, ApiMetadata, BusRoute, DetectedCollision, RouteCollisionSummary
+from . import collision_engine, datex, metrics
+from .collision_engine import SituationIndex, annotate_trip_impacts
+from .datex import iter_records, read_publication_time, DatexParseError
+from .facets import filter_facets, store_facets
+from .file_cache import FileResponseCache, file_response
+from .geometry import points_to_segments_distance, project_lonlat, simplify
+from .live import (
+    BroadcastHub, ChangeWatcher, ClientFilter, LiveEvent, NEW_COLLISION, NEW_SITUATION, RESOLVED_COLLISION,
+    RESOLVED_SITUATION, UPDATED_SITUATION, hub as live_hub,
+)
+from .mqtt_sink import LocalMqttSink
+from .polylines import decode as decode_polyline, decode_many, split
+from .route_geometry import RouteGeometry
+from .route_index import RouteIndex, current_route_index, get_route_index, pack_route_index, write_route_index
+from .route_shapes import FeatureWriter, iter_features, route_feature, shape_hash
+from .route_summary import DIRTY_ROUTES_KEY, refresh_route_summaries, update_route_summaries
+from .snapshot_archive import SnapshotArchive
+from .testing import StubUpstream, json_responder, journey_planner_trip_response, query_budget
+from .trip_cache import TripCache, trip_cache
+from .upstream import close_async_clients, close_session, get_async_client, get_session, decoded_stream, request_async
+from .utils import (
+    calculate_collisions_for_storage, collision_tier, collision_tiers, get_trip_geojson, get_trip_geojson_async,
+)
+from .vehicles import TrackBuffer, VehicleStore, parse_vehicles
+from .views import trip, find_all_collisions, live_events
+
 
 class FetchVtsSituationTest(TestCase):
 
@@ -170,3 +211,1451 @@ class FetchVtsSituationTest(TestCase):
 #         response = client.post('/trip/', {'from': "", 'to': ""})  # Empty values
 #         self.assertEqual(response.status_code, 200)  # Or appropriate error code
 #         self.assertIn('error', response.context)  # Check for error message in context
+
+
+class LiveFeedHubTest(SimpleTestCase):
+
+    async def test_filters_by_county_severity_and_route(self):
+        hub = BroadcastHub()
+        client = hub.subscribe(ClientFilter(counties=["Troms"], routes=["34"]), max_buffer=10)
+        hub.publish(LiveEvent("new_collision", {"n": 1}, county="Troms", severity="high", routes=["34"]))
+        hub.publish(LiveEvent("new_collision", {"n": 2}, county="Nordland", severity="high", routes=["34"]))
+        hub.publish(LiveEvent("new_situation", {"n": 3}, county="Troms", severity="low"))
+        batch = await client.next_batch(timeout=1)
+        self.assertEqual([event.data["n"] for event in batch], [1])
+
+    async def test_slow_client_drops_oldest_events(self):
+        hub = BroadcastHub()
+        client = hub.subscribe(max_buffer=2)
+        for n in range(5):
+            hub.publish(LiveEvent("new_situation", {"n": n}))
+        batch = await client.next_batch(timeout=1)
+        self.assertEqual([event.data["n"] for event in batch], [3, 4])
+        self.assertEqual(client.take_dropped(), 3)
+        self.assertEqual(client.take_dropped(), 0)
+
+    async def test_unsubscribed_client_receives_nothing(self):
+        hub = BroadcastHub()
+        client = hub.subscribe(max_buffer=4)
+        hub.unsubscribe(client)
+        hub.publish(LiveEvent("new_situation", {}))
+        self.assertEqual(await client.next_batch(timeout=0.01), [])
+        self.assertEqual(hub.client_count, 0)
+
+
+class LiveFeedWatcherTest(TestCase):
+
+    def test_poll_reports_situation_and_collision_changes(self):
+        route = BusRoute.objects.create(route_id="34", path=LineString((18.96, 69.64), (18.96, 69.66), srid=4326))
+        watcher = ChangeWatcher(BroadcastHub())
+        self.assertEqual(watcher.poll(), [])  # Baseline
+
+        def kinds():
+            return [(event.event, sorted(event.routes)) for event in watcher.poll()]
+
+        situation = VtsSituation.objects.create(
+            situation_id="SIT_1", version="1", severity="high", area_name="Troms",
+            location=Point(18.96, 69.65, srid=4326), ingested_at=timezone.now(),
+        )
+        DetectedCollision.objects.create(transit_information=situation, bus_route=route, transit_lon=18.96, transit_lat=69.65)
+        self.assertEqual(kinds(), [(NEW_SITUATION, ["34"]), (NEW_COLLISION, ["34"])])
+        self.assertEqual(kinds(), [])
+
+        VtsSituation.objects.filter(pk=situation.pk).update(version="2", ingested_at=timezone.now())
+        self.assertEqual(kinds(), [(UPDATED_SITUATION, ["34"])])
+
+        # A clearing collision run re-creates the same pair: nothing to report
+        DetectedCollision.objects.all().delete()
+        DetectedCollision.objects.create(
+            transit_information=situation, bus_route=route, transit_lon=18.96, transit_lat=69.65,
+            tolerance_meters=300, distance_meters=200,
+        )
+        self.assertEqual(kinds(), [])
+        # A --no-clear run updates its tier and distance in place
+        DetectedCollision.objects.update(tolerance_meters=50, distance_meters=30)
+        self.assertEqual(kinds(), [])
+
+        VtsSituation.objects.filter(pk=situation.pk).update(
+            version="3", overall_end_time=timezone.now(), ingested_at=timezone.now(),
+        )
+        self.assertEqual(kinds(), [(RESOLVED_SITUATION, ["34"])])
+
+        collision_id = DetectedCollision.objects.get().pk
+        situation.delete()  # Cascades to the collision
+        (resolved,) = watcher.poll()
+        self.assertEqual((resolved.event, sorted(resolved.routes)), (RESOLVED_COLLISION, ["34"]))
+        # The last stored values, not those of the first poll
+        self.assertEqual(
+            (resolved.data["collision_id"], resolved.data["tolerance"], resolved.data["distance_meters"]),
+            (collision_id, 50, 30),
+        )
+
+    async def test_sse_view_streams_matching_events(self):
+        request = AsyncRequestFactory().get('/api/live/', {'county': 'Troms'})
+        with patch.object(live_hub, 'ensure_watcher'):
+            response = await live_events(request)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b"retry: 5000\n\n")
+
+        live_hub.publish(LiveEvent(NEW_SITUATION, {"n": 1}, county="Nordland"))
+        live_hub.publish(LiveEvent(UPDATED_SITUATION, {"n": 2}, county="Troms"))
+        message = (await anext(stream)).decode()
+        self.assertIn(f"event: {UPDATED_SITUATION}\ndata: {{\"n\": 2}}\n\n", message)
+        self.assertNotIn(NEW_SITUATION, message)
+        await stream.aclose()
+
+
+class AsyncTripViewTest(TestCase):
+
+    def setUp(self):
+        trip_cache.clear()
+
+    async def test_trip_post_returns_leg_geojson_from_upstream(self):
+        responder = json_responder(journey_planner_trip_response())
+        with StubUpstream(responder) as stub, override_settings(ENTUR_JOURNEY_PLANNER_URL=stub.url):
+            request = AsyncRequestFactory().post('/trip/', {'from': "NSR:StopPlace:1", 'to': "NSR:StopPlace:2"})
+            response = await trip(request)
+            await close_async_clients()
+        trip_data = json.loads(response.content)['trip_data']
+        self.assertEqual(trip_data['type'], "FeatureCollection")
+        self.assertEqual(trip_data['features'][0]['properties']['lineName'], "34")
+        # Coordinates come back in GeoJSON [lon, lat] order
+        self.assertAlmostEqual(trip_data['features'][0]['geometry']['coordinates'][0][0], 18.9553)
+        self.assertEqual(len(stub.requests), 1)
+
+    async def test_trip_returns_none_when_upstream_fails(self):
+        with StubUpstream(json_responder({"error": "boom"}, status=502)) as stub, \
+                override_settings(ENTUR_JOURNEY_PLANNER_URL=stub.url):
+            response = await trip(AsyncRequestFactory().post('/trip/', {'from': "a", 'to': "b"}))
+            await close_async_clients()
+        self.assertIsNone(json.loads(response.content)['trip_data'])
+
+
+class TripCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        trip_cache.clear()
+
+    def test_repeated_trip_is_served_from_cache(self):
+        with StubUpstream(json_responder(journey_planner_trip_response())) as stub, \
+                override_settings(ENTUR_JOURNEY_PLANNER_URL=stub.url):
+            first = get_trip_geojson("NSR:StopPlace:1", "NSR:StopPlace:2", 1)
+            second = get_trip_geojson("NSR:StopPlace:1", "NSR:StopPlace:2", 1)
+        self.assertEqual(first, second)
+        self.assertEqual(len(stub.requests), 1)
+        self.assertEqual(trip_cache.stats()["hits"], 1)
+        self.assertEqual(trip_cache.stats()["misses"], 1)
+
+    async def test_concurrent_identical_requests_are_coalesced(self):
+        with StubUpstream(json_responder(journey_planner_trip_response()), delay=0.2) as stub, \
+                override_settings(ENTUR_JOURNEY_PLANNER_URL=stub.url):
+            results = await asyncio.gather(*(
+                get_trip_geojson_async("NSR:StopPlace:1", "NSR:StopPlace:2", 1) for _ in range(5)
+            ))
+            await close_async_clients()
+        self.assertEqual(len(stub.requests), 1)
+        self.assertTrue(all(result == results[0] for result in results))
+        self.assertEqual(trip_cache.stats()["coalesced"], 4)
+
+    def test_identical_calls_on_different_event_loops_share_one_fetch(self):
+        # Async views under WSGI each run on their own event loop, in their own thread
+        cache = TripCache(bucket_seconds=300)
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        async def fetch():
+            calls.append(1)
+            started.set()
+            await asyncio.get_running_loop().run_in_executor(None, release.wait, 5)
+            return {"trip": 1}
+
+        def request():
+            results.append(asyncio.run(cache.get_or_fetch_async("key", fetch)))
+
+        threads = [threading.Thread(target=request) for _ in range(2)]
+        threads[0].start()
+        started.wait(5)
+        threads[1].start()
+        deadline = time.monotonic() + 5
+        while not cache.stats()["coalesced"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, [{"trip": 1}] * 2)
+        self.assertEqual(len(calls), 1)
+
+    async def test_waiting_callers_get_the_exception_of_the_call(self):
+        cache = TripCache()
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            raise RuntimeError("upstream down")
+
+        results = await asyncio.gather(*(cache.get_or_fetch_async("key", fetch) for _ in range(2)), return_exceptions=True)
+        self.assertEqual([type(result) for result in results], [RuntimeError, RuntimeError])
+        self.assertIsNone(cache.get("key"))
+
+    async def test_leader_disconnecting_does_not_cancel_the_call(self):
+        cache = TripCache()
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return "trip"
+
+        leader = asyncio.create_task(cache.get_or_fetch_async("key", fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.get_or_fetch_async("key", fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        self.assertEqual(await follower, "trip")
+        self.assertEqual(cache.get("key"), "trip")
+
+    def test_failures_are_not_cached(self):
+        with StubUpstream(json_responder({}, status=500)) as stub, \
+                override_settings(ENTUR_JOURNEY_PLANNER_URL=stub.url):
+            self.assertIsNone(get_trip_geojson("a", "b", 1))
+            self.assertIsNone(get_trip_geojson("a", "b", 1))
+        self.assertEqual(len(stub.requests), 2)
+
+    def test_entries_expire_and_least_recently_used_is_evicted(self):
+        now = [0.0]
+        cache = TripCache(max_entries=2, ttl_seconds=10, bucket_seconds=300, clock=lambda: now[0])
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")        # "b" is now least recently used
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        now[0] = 11.0
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_key_uses_time_bucket(self):
+        cache = TripCache(bucket_seconds=300)
+        self.assertEqual(cache.key("a", "b", 1, now=600), cache.key("a", "b", 1, now=899))
+        self.assertNotEqual(cache.key("a", "b", 1, now=899), cache.key("a", "b", 1, now=900))
+
+
+class TripImpactTest(TestCase):
+
+    def setUp(self):
+        trip_cache.clear()
+        # The canned trip leg runs from (18.9553, 69.6496) to (18.9700, 69.6530)
+        VtsSituation.objects.create(situation_id="ON_ROUTE", version="1", severity="high",
+                                    location=Point(18.9601, 69.6511, srid=4326))
+        VtsSituation.objects.create(situation_id="FAR_AWAY", version="1", severity="low",
+                                    location=Point(19.5, 69.9, srid=4326))
+        VtsSituation.objects.create(situation_id="CROSSING_PATH", version="1",
+                                    path=LineString((18.962, 69.64), (18.962, 69.66), srid=4326))
+
+    def test_legs_list_situations_within_tolerance(self):
+        trip_data = {"type": "FeatureCollection", "features": [{
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": [(18.9553, 69.6496), (18.9600, 69.6510), (18.9700, 69.6530)]},
+            "properties": {"mode": "bus"},
+        }]}
+        annotated = annotate_trip_impacts(trip_data, 100, index=SituationIndex.from_database())
+        situations = annotated["features"][0]["properties"]["situations"]
+        self.assertEqual({s["situation_id"] for s in situations}, {"ON_ROUTE", "CROSSING_PATH"})
+        self.assertEqual(situations[0]["distance_meters"], 0.0)  # the crossing path, nearest first
+        self.assertNotIn("situations", trip_data["features"][0]["properties"])  # cached input untouched
+
+    @override_settings(SITUATION_INDEX_REFRESH_SECONDS=3600)
+    def test_index_is_rebuilt_once_a_situation_ends(self):
+        ends = timezone.now() + timedelta(hours=1)
+        VtsSituation.objects.filter(situation_id="ON_ROUTE").update(overall_end_time=ends)
+
+        def indexed(index):
+            return {properties["situation_id"] for properties, _ in index.entries}
+
+        with patch.object(collision_engine, '_index', None):
+            index = collision_engine.get_situation_index()
+            self.assertEqual(index.expires_at, ends)
+            self.assertIn("ON_ROUTE", indexed(index))
+            # Nothing in the table changes when the situation ends
+            with patch('map.collision_engine.timezone') as clock:
+                clock.now.return_value = ends + timedelta(seconds=1)
+                index = collision_engine.get_situation_index()
+        self.assertEqual(indexed(index), {"FAR_AWAY", "CROSSING_PATH"})
+        self.assertIsNone(index.expires_at)
+
+    async def test_trip_view_includes_nearby_situations(self):
+        with StubUpstream(json_responder(journey_planner_trip_response())) as stub, \
+                override_settings(ENTUR_JOURNEY_PLANNER_URL=stub.url, SITUATION_INDEX_REFRESH_SECONDS=0):
+            response = await trip(AsyncRequestFactory().post('/trip/', {'from': "a", 'to': "b", 'tolerance': "100"}))
+            await close_async_clients()
+        trip_data = json.loads(response.content)['trip_data']
+        self.assertIn("ON_ROUTE", trip_data["impacted_situation_ids"])
+        self.assertNotIn("FAR_AWAY", trip_data["impacted_situation_ids"])
+
+    async def test_trip_view_rejects_bad_tolerances(self):
+        for tolerance in ("nan", "inf", "0", "-5", "near"):
+            with self.subTest(tolerance=tolerance):
+                response = await trip(AsyncRequestFactory().post('/trip/', {'from': "a", 'to': "b", 'tolerance': tolerance}))
+                self.assertEqual(response.status_code, 400)
+
+    async def test_trip_view_clamps_the_tolerance(self):
+        with StubUpstream(json_responder(journey_planner_trip_response())) as stub, \
+                override_settings(ENTUR_JOURNEY_PLANNER_URL=stub.url, TRIP_IMPACT_MAX_TOLERANCE_METERS=100), \
+                patch('map.views.annotate_trip_impacts', side_effect=lambda trip_data, tolerance: trip_data) as annotate:
+            await trip(AsyncRequestFactory().post('/trip/', {'from': "a", 'to': "b", 'tolerance': "1e12"}))
+            await close_async_clients()
+        self.assertEqual(annotate.call_args.args[1], 100)
+
+
+DATEX_SNAPSHOT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<ns2:messageContainer xmlns:ns2="http://datex2.eu/schema/3/messageContainer"
+    xmlns:com="http://datex2.eu/schema/3/common" xmlns:loc="http://datex2.eu/schema/3/locationReferencing"
+    xmlns:sit="http://datex2.eu/schema/3/situation" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+  <ns2:payload xsi:type="sit:SituationPublication">
+    <com:publicationTime>2025-04-24T08:00:00Z</com:publicationTime>
+    <sit:situation id="SIT_1">
+      <sit:situationRecord xsi:type="sit:MaintenanceWorks" id="REC_1" version="3">
+        <sit:severity>high</sit:severity>
+        <sit:source><com:sourceName><com:values><com:value>Statens vegvesen</com:value></com:values></com:sourceName></sit:source>
+        <sit:validity><com:validityTimeSpecification><com:overallEndTime>2025-05-30T16:00:00+02:00</com:overallEndTime></com:validityTimeSpecification></sit:validity>
+        <sit:generalPublicComment><sit:comment><com:values><com:value> Vegarbeid </com:value></com:values></sit:comment></sit:generalPublicComment>
+        <sit:locationReference>
+          <loc:gmlLineString><loc:posList>69.64 18.95 69.65 18.97</loc:posList></loc:gmlLineString>
+          <loc:pointByCoordinates><loc:pointCoordinates><loc:latitude>1.0</loc:latitude><loc:longitude>2.0</loc:longitude></loc:pointCoordinates></loc:pointByCoordinates>
+          <loc:coordinatesForDisplay><loc:latitude>69.645</loc:latitude><loc:longitude>18.96</loc:longitude></loc:coordinatesForDisplay>
+          <loc:areaName><com:values><com:value>Troms</com:value></com:values></loc:areaName>
+          <loc:areaName><com:values><com:value>Tromso</com:value></com:values></loc:areaName>
+        </sit:locationReference>
+      </sit:situationRecord>
+      <sit:situationRecord xsi:type="sit:Accident" id="REC_2" version="1"/>
+    </sit:situation>
+  </ns2:payload>
+</ns2:messageContainer>"""
+
+
+class DatexParserTest(SimpleTestCase):
+
+    def test_records_are_read_in_one_pass(self):
+        first, second = iter_records(DATEX_SNAPSHOT)
+        self.assertEqual((first.situation_id, first.record_id, first.version), ("SIT_1", "REC_1", "3"))
+        self.assertEqual(first.record_type, "MaintenanceWorks")
+        self.assertEqual(first.severity, "high")
+        self.assertEqual(first.source_name, "Statens vegvesen")
+        self.assertEqual(first.overall_end_time, "2025-05-30T16:00:00+02:00")
+        self.assertEqual(first.comments, (" Vegarbeid ",))  # raw text; the exporter strips it
+        self.assertEqual(first.pos_list, "69.64 18.95 69.65 18.97")
+        self.assertEqual((first.latitude, first.longitude), ("1.0", "2.0"))  # first found, as fetch_vts_situations stores
+        self.assertEqual((first.display_latitude, first.display_longitude), ("69.645", "18.96"))
+        self.assertEqual(first.area_names, ("Troms",))  # first named area only
+        self.assertEqual((second.situation_id, second.record_type, second.comments), ("SIT_1", "Accident", ()))
+
+    def test_fields_match_the_legacy_extraction(self):
+        from bench.datex_parse import legacy_records, legacy_view
+        legacy = legacy_records(DATEX_SNAPSHOT)
+        records = list(iter_records(DATEX_SNAPSHOT))
+        self.assertEqual(len(records), len(legacy))
+        for fields, record in zip(legacy, records):
+            self.assertEqual(legacy_view(record, fields), fields)
+
+    def test_publication_time_and_malformed_input(self):
+        self.assertEqual(read_publication_time(DATEX_SNAPSHOT), "2025-04-24T08:00:00Z")
+        with self.assertRaises(DatexParseError):
+            list(iter_records(DATEX_SNAPSHOT[:-40]))
+
+
+@skipUnless(datex._lxml is not None, "lxml is not installed")
+class DatexBackendParityTest(SimpleTestCase):
+    """The lxml fast path must return exactly what the ElementTree fallback does."""
+
+    def assertSameRecords(self, xml_data):
+        etree_records = list(iter_records(xml_data, backend='etree'))
+        self.assertTrue(etree_records)
+        self.assertEqual(list(iter_records(xml_data, backend='lxml')), etree_records)
+
+    def test_sample_snapshot(self):
+        self.assertSameRecords(DATEX_SNAPSHOT)
+
+    def test_synthetic_snapshot(self):
+        from bench.datex_snapshot import synthetic_snapshot
+        self.assertSameRecords(synthetic_snapshot(situations=40, records_per_situation=3, points_per_line=5))
+
+    def test_file_object_and_unrelated_elements(self):
+        # Extra elements around and inside records must not shift any field
+        noisy = DATEX_SNAPSHOT.replace(
+            b"<sit:severity>", b"<sit:cause><sit:causeType>roadMaintenance</sit:causeType></sit:cause><sit:severity>",
+        ).replace(b"<com:publicationTime>", b"<com:value>outside records</com:value><com:publicationTime>")
+        self.assertSameRecords(noisy)
+        self.assertEqual(list(iter_records(io.BytesIO(noisy), backend='lxml')), list(iter_records(noisy, backend='etree')))
+
+    def test_malformed_input_raises_the_same_error(self):
+        for backend in ('etree', 'lxml'):
+            with self.subTest(backend=backend), self.assertRaises(DatexParseError):
+                list(iter_records(DATEX_SNAPSHOT[:-40], backend=backend))
+
+
+def datex_feed_snapshot(records):
+    """Minimal DATEX snapshot with (record_id, version, severity) records, one situation each."""
+    body = ''.join(
+        f'<sit:situation id="SIT_{record_id}"><sit:situationRecord xsi:type="sit:Accident" id="{record_id}" '
+        f'version="{version}"><sit:severity>{severity}</sit:severity></sit:situationRecord></sit:situation>'
+        for record_id, version, severity in records
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><ns2:messageContainer xmlns:ns2="http://datex2.eu/schema/3/messageContainer" '
+        'xmlns:sit="http://datex2.eu/schema/3/situation" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+        f'<ns2:payload>{body}</ns2:payload></ns2:messageContainer>'
+    ).encode('utf-8')
+
+
+class DatexMultiFeedFetchTest(TestCase):
+    FEEDS = {
+        'Accident': [("REC_1", 1, "low"), ("REC_2", 1, "low")],
+        'AbnormalTraffic': [("REC_2", 3, "high")],  # Newer version of REC_2
+        'MaintenanceWorks': [("REC_3", 1, "medium")],
+    }
+    LAST_MODIFIED = 'Wed, 21 Oct 2026 07:28:00 GMT'
+
+    def setUp(self):
+        # The command writes debug_response_<filter>.xml to the working directory
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def responder(self, method, path, headers, body):
+        if headers.get('If-Modified-Since') == self.LAST_MODIFIED:
+            return 304, {}, b''
+        return 200, {'Last-Modified': self.LAST_MODIFIED}, datex_feed_snapshot(self.FEEDS[path.rsplit('/', 1)[-1]])
+
+    def test_feeds_are_fetched_concurrently_and_merged(self):
+        delay = 0.3
+        with StubUpstream(self.responder, delay=delay) as stub, override_settings(DATEX_BASE_URL=stub.url):
+            start = time.perf_counter()
+            call_command("fetch_vts_situations", filters=list(self.FEEDS))
+            elapsed = time.perf_counter() - start
+
+        self.assertLess(elapsed, delay * len(self.FEEDS))  # Slowest feed, not the sum
+        self.assertEqual({path for _, path, _, _ in stub.requests}, {f"/filter/{name}" for name in self.FEEDS})
+        self.assertEqual(VtsSituation.objects.count(), 3)
+        self.assertEqual(VtsSituation.objects.get(situation_id="REC_2").severity, "high")
+        for name in self.FEEDS:
+            self.assertEqual(ApiMetadata.objects.get(key=f"last_modified_date:{name}").value, self.LAST_MODIFIED)
+
+    def test_each_feed_sends_its_own_if_modified_since(self):
+        ApiMetadata.objects.create(key="last_modified_date:Accident", value=self.LAST_MODIFIED)
+        with StubUpstream(self.responder) as stub, override_settings(DATEX_BASE_URL=stub.url):
+            call_command("fetch_vts_situations", filters=["Accident", "MaintenanceWorks"])
+
+        sent = {path: headers.get('If-Modified-Since') for _, path, headers, _ in stub.requests}
+        self.assertEqual(sent, {"/filter/Accident": self.LAST_MODIFIED, "/filter/MaintenanceWorks": None})
+        self.assertEqual(list(VtsSituation.objects.values_list('situation_id', flat=True)), ["REC_3"])
+
+    def test_a_failing_feed_does_not_stop_the_others(self):
+        os.mkdir("debug_response_Accident.xml")  # Opening the debug copy of this feed fails
+        with StubUpstream(self.responder) as stub, override_settings(DATEX_BASE_URL=stub.url), \
+                self.assertLogs('map.management.commands.fetch_vts_situations', 'ERROR'):
+            call_command("fetch_vts_situations", filters=["Accident", "MaintenanceWorks"])
+        self.assertEqual(list(VtsSituation.objects.values_list('situation_id', flat=True)), ["REC_3"])
+        self.assertEqual(
+            list(ApiMetadata.objects.filter(key__startswith="last_modified_date").values_list('key', flat=True)),
+            ["last_modified_date:MaintenanceWorks"],
+        )
+
+    def test_only_changed_records_get_a_new_ingest_time(self):
+        with StubUpstream(self.responder) as stub, override_settings(DATEX_BASE_URL=stub.url):
+            call_command("fetch_vts_situations", filters=["Accident"])
+            first = dict(VtsSituation.objects.values_list('situation_id', 'ingested_at'))
+            ApiMetadata.objects.filter(key="last_modified_date:Accident").delete()
+            self.FEEDS = {**self.FEEDS, 'Accident': [("REC_1", 1, "low"), ("REC_2", 2, "low")]}
+            call_command("fetch_vts_situations", filters=["Accident"])
+        second = dict(VtsSituation.objects.values_list('situation_id', 'ingested_at'))
+        self.assertIsNotNone(first["REC_1"])
+        self.assertEqual(second["REC_1"], first["REC_1"])
+        self.assertGreater(second["REC_2"], first["REC_2"])
+
+
+@override_settings(UPSTREAM_RETRIES=2, UPSTREAM_RETRY_BACKOFF_SECONDS=0)
+class UpstreamClientTest(SimpleTestCase):
+
+    def setUp(self):
+        close_session()  # Rebuild with the overridden retry settings
+        self.addCleanup(close_session)
+
+    def flaky_gzip_responder(self, failures):
+        """503 for the first `failures` calls, then the sample snapshot, gzipped when asked for."""
+        calls = []
+
+        def responder(method, path, headers, body):
+            calls.append(path)
+            if len(calls) <= failures:
+                return 503, {}, b''
+            if 'gzip' in headers.get('Accept-Encoding', ''):
+                return 200, {'Content-Encoding': 'gzip'}, gzip.compress(DATEX_SNAPSHOT)
+            return 200, {}, DATEX_SNAPSHOT
+        return responder, calls
+
+    def test_session_retries_and_streams_gzip_into_the_parser(self):
+        responder, calls = self.flaky_gzip_responder(failures=2)
+        with StubUpstream(responder) as stub:
+            with get_session().get(stub.url, stream=True, timeout=(1, 5)) as response:
+                records = list(iter_records(decoded_stream(response)))
+                wire_bytes = response.raw.tell()
+        self.assertEqual(len(calls), 3)
+        self.assertEqual([r.record_id for r in records], ["REC_1", "REC_2"])
+        self.assertLess(wire_bytes, len(DATEX_SNAPSHOT))
+
+    def test_session_gives_up_after_the_configured_retries(self):
+        responder, calls = self.flaky_gzip_responder(failures=10)
+        with StubUpstream(responder) as stub:
+            response = get_session().get(stub.url, timeout=(1, 5))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(calls), 3)
+
+    async def test_async_requests_retry_server_errors(self):
+        responder, calls = self.flaky_gzip_responder(failures=1)
+        with StubUpstream(responder) as stub:
+            response = await request_async('GET', stub.url)
+            await close_async_clients()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, DATEX_SNAPSHOT)  # httpx gunzips transparently
+        self.assertEqual(len(calls), 2)
+
+    def test_async_client_is_closed_with_its_loop(self):
+        # Async views under WSGI run on a new event loop per request
+        client = asyncio.run(get_async_client())
+        self.assertTrue(client.is_closed)
+
+
+class SnapshotArchiveTest(SimpleTestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.archive = SnapshotArchive(self._tmp.name, codec='gzip')
+
+    def archive_snapshot(self, feed, fetched_at, data=DATEX_SNAPSHOT):
+        writer = self.archive.writer(feed, fetched_at)
+        for offset in range(0, len(data), 100):  # Written in chunks, like the streamed download
+            writer.write(data[offset:offset + 100])
+        return writer.commit(last_modified="Thu, 24 Apr 2025 08:00:00 GMT")
+
+    def test_snapshots_round_trip_in_fetch_order(self):
+        later = self.archive_snapshot("Accident", datetime(2025, 4, 24, 9, 0, tzinfo=dt_timezone.utc))
+        earlier = self.archive_snapshot("snapshot", datetime(2025, 4, 24, 8, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(self.archive.entries(), [earlier, later])
+        self.assertEqual(later.bytes, len(DATEX_SNAPSHOT))
+        self.assertLess(later.compressed_bytes, later.bytes)
+        with self.archive.open(earlier) as snapshot:
+            self.assertEqual(snapshot.read(), DATEX_SNAPSHOT)
+
+    def test_filters_and_discarded_snapshots(self):
+        self.archive_snapshot("snapshot", datetime(2025, 4, 24, 8, 0, tzinfo=dt_timezone.utc))
+        self.archive_snapshot("Accident", datetime(2025, 4, 24, 9, 0, tzinfo=dt_timezone.utc))
+        discarded = self.archive.writer("snapshot", datetime(2025, 4, 24, 10, 0, tzinfo=dt_timezone.utc))
+        discarded.write(b"<broken")
+        discarded.discard()
+        self.assertEqual([e.feed for e in self.archive.entries(feed="Accident")], ["Accident"])
+        self.assertEqual([e.feed for e in self.archive.entries(since="2025-04-24T08:30:00Z")], ["Accident"])
+        self.assertEqual(len(self.archive.entries(until="2025-04-24T08:00:00Z")), 1)
+        self.assertFalse(list(Path(self._tmp.name).rglob("*.part")))
+
+
+class ReplaySnapshotsTest(TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        archive = SnapshotArchive(self._tmp.name, codec='gzip')
+        writer = archive.writer("snapshot", datetime(2025, 4, 24, 8, 0, tzinfo=dt_timezone.utc))
+        writer.write(DATEX_SNAPSHOT)
+        writer.commit()
+        # Crosses REC_1's path (69.64 18.95 -> 69.65 18.97)
+        BusRoute.objects.create(route_id="34", path=LineString((18.96, 69.64), (18.96, 69.66), srid=4326))
+
+    def test_replay_runs_ingest_detect_and_publish_to_a_local_sink(self):
+        sink_path = os.path.join(self._tmp.name, "published.jsonl")
+        out = io.StringIO()
+        call_command("replay_snapshots", archive_dir=self._tmp.name, sink_file=sink_path, stdout=out)
+
+        summary = json.loads(out.getvalue()[out.getvalue().index("{"):])
+        self.assertEqual((summary["snapshots"], summary["records"]), (1, 2))
+        self.assertEqual(VtsSituation.objects.count(), 2)
+        self.assertTrue(DetectedCollision.objects.filter(transit_information__situation_id="REC_1").exists())
+        self.assertFalse(DetectedCollision.objects.filter(published_to_mqtt=False).exists())
+        with open(sink_path, encoding="utf-8") as published:
+            messages = [json.loads(line) for line in published]
+        self.assertEqual(summary["published_messages"], len(messages))
+        self.assertEqual(json.loads(messages[0]["payload"])["event"], "new_collision")
+        self.assertTrue(messages[0]["topic"].startswith("vts/collisions/route/34/"))
+
+    def test_local_sink_confirms_every_publish(self):
+        sink = LocalMqttSink()
+        info = sink.publish("vts/collisions/test", "{}", qos=1)
+        info.wait_for_publish(timeout=5.0)
+        self.assertTrue(info.is_published())
+        self.assertEqual(sink.messages, [("vts/collisions/test", "{}")])
+
+
+class MetricsTest(SimpleTestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+        self.latency = metrics.Histogram('test_seconds', 'Latency.', ['view'], buckets=(0.1, 1), registry=self.registry)
+        self.published = metrics.Counter('test_total', 'Published.', ['result'], registry=self.registry)
+
+    def test_prometheus_text_exposition(self):
+        for seconds in (0.05, 0.1, 5):
+            self.latency.observe(seconds, view='a"b')
+        self.published.inc(2, result='ok')
+        self.assertEqual(metrics.render([('web', self.registry.snapshot())]), (
+            '# HELP test_seconds Latency.\n'
+            '# TYPE test_seconds histogram\n'
+            'test_seconds_bucket{process="web",view="a\\"b",le="0.1"} 2\n'
+            'test_seconds_bucket{process="web",view="a\\"b",le="1.0"} 2\n'
+            'test_seconds_bucket{process="web",view="a\\"b",le="+Inf"} 3\n'
+            'test_seconds_sum{process="web",view="a\\"b"} 5.15\n'
+            'test_seconds_count{process="web",view="a\\"b"} 3\n'
+            '# HELP test_total Published.\n'
+            '# TYPE test_total counter\n'
+            'test_total{process="web",result="ok"} 2\n'
+        ))
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled_metrics_are_no_ops(self):
+        self.published.inc(result='ok')
+        with self.latency.time(view='map'):
+            pass
+        self.assertEqual(self.registry.snapshot(), {})
+
+    def test_command_metrics_accumulate_in_metrics_dir(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            self.published.inc(result='ok')
+            metrics.flush('publish_new_collisions', registry=self.registry)
+            self.published.inc(2, result='ok')
+            self.latency.observe(0.5, view='cron')
+            metrics.flush('publish_new_collisions', registry=self.registry)
+
+            self.assertEqual(self.registry.snapshot(), {})
+            [(process, snapshot)] = metrics.stored_snapshots()
+            self.assertEqual(process, 'publish_new_collisions')
+            text = metrics.render([(process, snapshot)])
+            self.assertIn('test_total{process="publish_new_collisions",result="ok"} 3\n', text)
+            self.assertIn('test_seconds_count{process="publish_new_collisions",view="cron"} 1\n', text)
+
+    def test_views_are_timed_and_served_at_metrics(self):
+        client = Client()
+        self.assertEqual(client.get('/api/trip-cache/stats/').status_code, 200)
+        response = client.get('/metrics')
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        text = response.content.decode()
+        self.assertIn('rtm_view_seconds_count{process="web",view="trip_cache_stats",method="GET",status="200"}', text)
+        self.assertIn('rtm_view_response_bytes_count{process="web",view="trip_cache_stats"}', text)
+
+
+class QueryBudgetTest(TestCase):
+    # Queries per request; these must not grow with the number of rows
+    BUDGETS = [
+        ('/', 0),
+        ('/api/filter-options/', 2),
+        ('/api/location_geojson/', 1),
+        ('/api/busroute/', 1),
+        ('/api/stored_collisions/', 1),
+        ('/api/routes/affected/', 1),
+        ('/api/trip-cache/stats/', 0),
+    ]
+
+    def setUp(self):
+        filter_facets.clear()
+        for n in range(3):
+            situation = VtsSituation.objects.create(
+                situation_id=f"SIT_{n}", location=Point(18.95 + n / 100, 69.65, srid=4326),
+                path=LineString((18.95, 69.64), (18.97, 69.65), srid=4326),
+                area_name="Troms", severity="high", filter_used="Accident",
+            )
+            route = BusRoute.objects.create(route_id=str(30 + n), path=LineString((18.96, 69.64), (18.96, 69.66), srid=4326))
+            DetectedCollision.objects.create(
+                transit_information=situation, bus_route=route, transit_lon=18.95, transit_lat=69.65, tolerance_meters=300,
+            )
+
+    def test_views_stay_within_their_query_budget(self):
+        client = Client()
+        for path, budget in self.BUDGETS:
+            with self.subTest(path=path), query_budget(budget, path):
+                self.assertEqual(client.get(path).status_code, 200)
+
+    @override_settings(QUERY_PROFILING=True, QUERY_PROFILING_REPORT_SECONDS=0)
+    def test_profiling_middleware_adds_server_timing_and_reports(self):
+        with self.assertLogs('map.query_profiler', level='INFO') as logs:
+            response = Client().get('/api/filter-options/')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[0-9.]+;desc="2 queries"$')
+        self.assertIn('get_filter_options: 1 requests, 2.0 queries avg (2 max)', logs.output[0])
+
+    def test_query_budget_lists_the_statements_over_budget(self):
+        with self.assertRaisesRegex(AssertionError, r'filter-options ran 2 queries, the budget is 1:\n1\. SELECT'):
+            with query_budget(1, 'filter-options'):
+                Client().get('/api/filter-options/')
+
+
+class RouteCollisionSummaryTest(TestCase):
+
+    def setUp(self):
+        self.route_34 = BusRoute.objects.create(route_id="34", path=LineString((18.96, 69.64), (18.96, 69.66), srid=4326))
+        self.route_34_return = BusRoute.objects.create(route_id="34", path=LineString((18.97, 69.66), (18.97, 69.64), srid=4326))
+        self.route_42 = BusRoute.objects.create(route_id="42", path=LineString((19.0, 69.7), (19.1, 69.7), srid=4326))
+
+    def collide(self, situation, *routes):
+        for route in routes:
+            DetectedCollision.objects.create(
+                transit_information=situation, bus_route=route, transit_lon=18.96, transit_lat=69.65, tolerance_meters=300,
+            )
+
+    def situation(self, situation_id, severity, end=None):
+        return VtsSituation.objects.create(
+            situation_id=situation_id, severity=severity, overall_end_time=end,
+            location=Point(18.96, 69.65, srid=4326),
+        )
+
+    def test_summary_per_route_id(self):
+        now = datetime.now(dt_timezone.utc)
+        ended = self.situation("ENDED", "highest", end=now - timedelta(hours=1))
+        low = self.situation("LOW", "low", end=now + timedelta(hours=1))
+        high = self.situation("HIGH", "high")
+        self.collide(ended, self.route_34)
+        self.collide(low, self.route_34, self.route_34_return)  # Both shapes: counted once
+        self.collide(high, self.route_34)
+        update_route_summaries(full=True)
+
+        summary = RouteCollisionSummary.objects.get()
+        self.assertEqual(summary.route_id, "34")
+        self.assertEqual(summary.active_collisions, 2)
+        self.assertEqual(summary.max_severity, "high")
+        self.assertEqual(summary.latest_situation_ids, ["HIGH", "LOW"])
+        self.assertEqual(summary.next_expiry, low.overall_end_time)
+
+        response = Client().get('/api/routes/affected/', {'route': '34,42'})
+        self.assertEqual([route["route_id"] for route in response.json()["routes"]], ["34"])
+
+    def test_incremental_updates(self):
+        now = datetime.now(dt_timezone.utc)
+        update_route_summaries(full=True, now=now)
+        self.assertFalse(RouteCollisionSummary.objects.exists())
+
+        expiring = self.situation("EXPIRING", "medium", end=now + timedelta(minutes=5))
+        self.collide(expiring, self.route_42)
+        self.assertEqual(update_route_summaries({self.route_42.pk}, now=now), 1)
+        self.assertEqual(RouteCollisionSummary.objects.get(route_id="42").active_collisions, 1)
+
+        # Nothing new: nothing is recomputed until the situation ends
+        self.assertEqual(update_route_summaries(now=now + timedelta(minutes=1)), 0)
+        self.assertEqual(update_route_summaries(now=now + timedelta(minutes=10)), 1)
+        self.assertFalse(RouteCollisionSummary.objects.exists())
+
+    def test_late_ingests_and_deleted_collisions_are_recomputed(self):
+        now = datetime.now(dt_timezone.utc)
+        situation = self.situation("LATE", "low")
+        self.collide(situation, self.route_42)
+        update_route_summaries(full=True, now=now)
+        self.assertEqual(RouteCollisionSummary.objects.get(route_id="42").max_severity, "low")
+
+        # Versioned upstream before the last refresh, but ingested after it
+        VtsSituation.objects.filter(pk=situation.pk).update(
+            severity="high", version_time=now - timedelta(hours=1), ingested_at=now + timedelta(minutes=1),
+        )
+        update_route_summaries(now=now + timedelta(minutes=2))
+        self.assertEqual(RouteCollisionSummary.objects.get(route_id="42").max_severity, "high")
+
+        # Deleting the situation cascades to its collisions; their routes are marked for the next refresh
+        situation.delete()
+        self.assertEqual(json.loads(ApiMetadata.objects.get(key=DIRTY_ROUTES_KEY).value), ["42"])
+        self.assertEqual(update_route_summaries(now=now + timedelta(minutes=3)), 1)
+        self.assertFalse(RouteCollisionSummary.objects.exists())
+        self.assertFalse(ApiMetadata.objects.filter(key=DIRTY_ROUTES_KEY).exists())
+
+    def test_collision_stage_updates_the_summary(self):
+        self.situation("NEAR", "high")
+        call_command('calculate_and_store_collisions', tolerance=300, stdout=io.StringIO())
+        self.assertEqual(list(RouteCollisionSummary.objects.values_list('route_id', 'active_collisions')), [("34", 1)])
+
+
+class CollisionTiersTest(TestCase):
+
+    def setUp(self):
+        self.route = BusRoute.objects.create(route_id="34", path=LineString((18.96, 69.64), (18.96, 69.66), srid=4326))
+
+    def situation(self, situation_id, meters_west):
+        # About 38.7 km per degree of longitude at 69.65° N
+        return VtsSituation.objects.create(
+            situation_id=situation_id, location=Point(18.96 - meters_west / 38_700, 69.65, srid=4326),
+        )
+
+    def stored(self):
+        return {
+            situation_id: (tier, distance) for situation_id, tier, distance in DetectedCollision.objects.values_list(
+                'transit_information__situation_id', 'tolerance_meters', 'distance_meters',
+            )
+        }
+
+    def test_tier_helpers(self):
+        self.assertEqual(collision_tiers([300, 50, 150, 50]), [50, 150, 300])
+        self.assertEqual([collision_tier(d, [50, 150, 300]) for d in (0, 50, 50.1, 299, 301)], [50, 50, 150, 300, None])
+        with self.assertRaises(ValueError):
+            collision_tiers([0, 50])
+
+    @override_settings(COLLISION_TIERS_METERS=[300, 50, 150])
+    def test_one_pass_stores_distance_and_smallest_tier(self):
+        for situation_id, meters in (("NEAR", 30), ("MID", 100), ("FAR", 250), ("OUT", 400)):
+            self.situation(situation_id, meters)
+        out = io.StringIO()
+        call_command('calculate_and_store_collisions', stdout=out)
+        self.assertIn("New collisions per tier: 50 m: 1, 150 m: 1, 300 m: 1.", out.getvalue())
+        stored = self.stored()
+        self.assertEqual({situation_id: tier for situation_id, (tier, _) in stored.items()}, {"NEAR": 50, "MID": 150, "FAR": 300})
+        for situation_id, meters in (("NEAR", 30), ("MID", 100), ("FAR", 250)):
+            self.assertAlmostEqual(stored[situation_id][1], meters, delta=meters * 0.02)
+
+        # A situation that moved closer keeps its row and published flag, with the new distance and tier
+        DetectedCollision.objects.update(published_to_mqtt=True)
+        VtsSituation.objects.filter(situation_id="MID").update(location=Point(18.96 - 20 / 38_700, 69.65, srid=4326))
+        out = io.StringIO()
+        call_command('calculate_and_store_collisions', no_clear=True, stdout=out)
+        self.assertIn("Stored: 0. Updated: 1.", out.getvalue())
+        self.assertEqual(self.stored()["MID"][0], 50)
+        self.assertFalse(DetectedCollision.objects.filter(published_to_mqtt=False).exists())
+
+        # A single tolerance still detects within that distance only
+        call_command('calculate_and_store_collisions', tolerance=50, stdout=io.StringIO())
+        self.assertEqual(sorted(self.stored()), ["MID", "NEAR"])
+
+
+class StoredCollisionsApiTest(TestCase):
+
+    def setUp(self):
+        routes = [
+            BusRoute.objects.create(route_id=route_id, path=LineString((18.96, 69.64), (18.96, 69.66), srid=4326))
+            for route_id in ("34", "42")
+        ]
+        base = datetime(2025, 4, 24, 8, 0, tzinfo=dt_timezone.utc)
+        for n in range(5):
+            situation = VtsSituation.objects.create(
+                situation_id=f"SIT_{n}", severity="high" if n % 2 else "low", area_name="Troms",
+                location=Point(18.96, 69.65, srid=4326),
+            )
+            collision = DetectedCollision.objects.create(
+                transit_information=situation, bus_route=routes[n % 2], transit_lon=18.96, transit_lat=69.65,
+                tolerance_meters=[300, 150, 300, 300, 50][n], distance_meters=[200, 120, 280, 250, 30][n],
+            )
+            # SIT_1 and SIT_2 share a timestamp, so the id breaks the tie
+            DetectedCollision.objects.filter(pk=collision.pk).update(detection_timestamp=base + timedelta(minutes=[0, 1, 1, 2, 3][n]))
+
+    def get(self, **params):
+        response = Client().get('/api/stored_collisions/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_keyset_pages_cover_every_collision_once_newest_first(self):
+        expected = list(DetectedCollision.objects.order_by('-detection_timestamp', '-id').values_list('id', flat=True))
+        seen, cursor = [], None
+        while True:
+            page = self.get(limit=2, **({'cursor': cursor} if cursor else {}))
+            self.assertLessEqual(len(page["stored_collisions"]), 2)
+            seen.extend(collision["id"] for collision in page["stored_collisions"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+
+    def test_filters_and_embedded_situation(self):
+        page = self.get(route="42", severity="high", include="situation,route")
+        self.assertEqual([c["situation"]["situation_id"] for c in page["stored_collisions"]], ["SIT_3", "SIT_1"])
+        self.assertEqual(page["stored_collisions"][0]["route"], {"route_id": "42"})
+        self.assertEqual(page["stored_collisions"][0]["situation"]["severity"], "high")
+
+        self.assertEqual(len(self.get(tolerance=50)["stored_collisions"]), 1)
+        # A larger tier includes the pairs stored with a smaller one
+        self.assertEqual([c["distance_meters"] for c in self.get(tolerance=150)["stored_collisions"]], [30, 120])
+        self.assertEqual(len(self.get(tolerance=300)["stored_collisions"]), 5)
+        self.assertEqual([c["distance_meters"] for c in self.get(max_distance=200)["stored_collisions"]], [30, 120, 200])
+        self.assertEqual(len(self.get(since="2025-04-24T08:02:00Z")["stored_collisions"]), 2)
+        self.assertEqual(len(self.get(until="2025-04-24T08:02:00")["stored_collisions"]), 3)
+        self.assertEqual(len(self.get(situation="SIT_0,SIT_4")["stored_collisions"]), 2)
+
+    def test_invalid_parameters(self):
+        for params in ({'limit': 'x'}, {'limit': 0}, {'cursor': '!!'}, {'since': 'yesterday-ish'}, {'include': 'bus'},
+                       {'max_distance': 'near'}):
+            with self.subTest(params=params):
+                self.assertEqual(Client().get('/api/stored_collisions/', params).status_code, 400)
+
+
+@override_settings(FILTER_OPTIONS_REFRESH_SECONDS=60)
+class FilterFacetsTest(TestCase):
+
+    def setUp(self):
+        filter_facets.clear()
+        for n, (county, severity) in enumerate([("Troms", "high"), ("Troms", "low"), ("Finnmark", None)]):
+            VtsSituation.objects.create(situation_id=f"SIT_{n}", area_name=county, severity=severity, filter_used="Accident")
+
+    def test_version_only_changes_with_the_facets(self):
+        first = store_facets()
+        self.assertEqual(first["version"], 1)
+        self.assertEqual(first["counts"]["counties"], {"Finnmark": 1, "Troms": 2})
+        self.assertEqual(first["counts"]["severities"], {"high": 1, "low": 1})
+        self.assertEqual(store_facets()["version"], 1)
+        VtsSituation.objects.create(situation_id="SIT_NEW", area_name="Nordland")
+        self.assertEqual(store_facets()["version"], 2)
+
+    def test_served_from_memory_with_etag(self):
+        store_facets()
+        client = Client()
+        response = client.get('/api/filter-options/')
+        self.assertEqual(response.json()["counties"], ["Finnmark", "Troms"])
+        self.assertEqual(response.json()["counts"]["situation_types"], {"Accident": 3})
+        self.assertEqual(response['ETag'], '"filter-options-1"')
+
+        with self.assertNumQueries(0):
+            cached = client.get('/api/filter-options/', HTTP_IF_NONE_MATCH='"filter-options-1"')
+        self.assertEqual(cached.status_code, 304)
+
+
+class FileResponseCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "bus_positions.json")
+        self.write(b'{"buses": [1, 2, 3]}')
+        self.now = 0.0
+        self.cache = FileResponseCache(stat_interval_seconds=0, clock=lambda: self.now)
+
+    def write(self, body, mtime=1_700_000_000):
+        with open(self.path, 'wb') as f:
+            f.write(body)
+        os.utime(self.path, (mtime, mtime))
+
+    def get(self, **headers):
+        return file_response(RequestFactory().get('/bus/', **headers), self.path, cache=self.cache)
+
+    def test_serves_raw_and_gzip_bytes(self):
+        response = self.get()
+        self.assertEqual(response.content, b'{"buses": [1, 2, 3]}')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        zipped = self.get(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(zipped['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(zipped.content), response.content)
+        self.assertNotEqual(zipped['ETag'], response['ETag'])
+        self.assertEqual((self.cache.loads, self.cache.hits), (1, 1))
+
+    def test_conditional_and_range_requests(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        partial = self.get(HTTP_RANGE='bytes=1-7')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial.content, b'"buses"')
+        self.assertEqual(partial['Content-Range'], 'bytes 1-7/20')
+        self.assertEqual(self.get(HTTP_RANGE='bytes=-3').content, b'3]}')
+        self.assertEqual(self.get(HTTP_RANGE='bytes=50-').status_code, 416)
+        # A stale If-Range gets the whole file
+        self.assertEqual(self.get(HTTP_RANGE='bytes=1-7', HTTP_IF_RANGE='"old"').status_code, 200)
+
+    def test_reloads_changed_files_only_after_stat_interval(self):
+        self.cache.stat_interval_seconds = 10
+        self.get()
+        self.write(b'{"buses": []}', mtime=1_700_000_060)
+        self.assertEqual(self.get().content, b'{"buses": [1, 2, 3]}')
+        self.now = 11.0
+        self.assertEqual(self.get().content, b'{"buses": []}')
+        self.assertEqual(self.cache.loads, 2)
+
+    def test_file_replaced_while_reading_is_reloaded(self):
+        real_open = open
+        cache_test = self
+
+        class SwappedAfterRead:
+            # The file object of the old file; a writer replaces the path right after it is read
+            def __init__(self, path, mode):
+                self.file = real_open(path, mode)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                self.file.close()
+
+            def read(self):
+                body = self.file.read()
+                replacement = cache_test.path + ".tmp"
+                with real_open(replacement, 'wb') as f:
+                    f.write(b'{"buses": []}')
+                os.utime(replacement, (1_700_000_060, 1_700_000_060))
+                os.replace(replacement, cache_test.path)
+                return body
+
+            def fileno(self):
+                return self.file.fileno()
+
+        with patch('map.file_cache.open', SwappedAfterRead, create=True):
+            self.assertEqual(self.get().content, b'{"buses": [1, 2, 3]}')
+        # The old bytes were cached under the old file's stat, so the new file is loaded
+        self.assertEqual(self.get().content, b'{"buses": []}')
+        self.assertEqual(self.cache.loads, 2)
+
+    def test_missing_file(self):
+        os.remove(self.path)
+        response = self.get()
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.content), {"error": "File not found"})
+
+
+def vehicles_response(vehicles):
+    """Entur vehicles GraphQL response for (vehicle_id, line, lat, lon, last_updated) tuples."""
+    return {"data": {"vehicles": [{
+        "vehicleId": vehicle_id,
+        "line": {"lineRef": line},
+        "lastUpdated": last_updated,
+        "bearing": 90.0,
+        "location": {"latitude": lat, "longitude": lon},
+    } for vehicle_id, line, lat, lon, last_updated in vehicles]}}
+
+
+class VehiclePositionsTest(SimpleTestCase):
+
+    def test_store_keeps_latest_report_per_vehicle(self):
+        store = VehicleStore(capacity=1)
+        store.update(parse_vehicles(vehicles_response([
+            ("bus-1", "TRO:Line:1_26", 69.65, 18.95, "2025-03-20T08:00:00Z"),
+            ("bus-2", "TRO:Line:1_34", 69.66, 18.96, "2025-03-20T08:00:00Z"),
+        ])))
+        # An older report does not overwrite a newer one
+        self.assertEqual(store.update(parse_vehicles(vehicles_response([
+            ("bus-1", "TRO:Line:1_26", 70.0, 19.0, "2025-03-20T07:00:00Z"),
+        ]))), 0)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.records()[0]["latitude"], 69.65)
+        self.assertEqual(store.records()[0]["last_updated"], "2025-03-20T08:00:00Z")
+
+        dropped = store.expire(datetime(2025, 3, 20, 8, 30, tzinfo=dt_timezone.utc).timestamp())
+        self.assertEqual((dropped, len(store)), (2, 0))
+
+    def test_poll_flags_vehicles_near_situations(self):
+        index = SituationIndex([({"situation_id": "ROADWORK"}, [project_lonlat([(18.9553, 69.6496)])])])
+        response = vehicles_response([
+            ("near", "TRO:Line:1_26", 69.6497, 18.9553, "2030-01-01T00:00:00Z"),  # ~11 m away
+            ("far", "TRO:Line:1_26", 69.70, 19.10, "2030-01-01T00:00:00Z"),
+        ])
+        with tempfile.TemporaryDirectory() as tmp, StubUpstream(json_responder(response)) as stub, \
+                override_settings(ENTUR_VEHICLES_URL=stub.url, VEHICLE_POSITIONS_PATH=os.path.join(tmp, "bus.json"),
+                                  VEHICLE_TRACKS_PATH=os.path.join(tmp, "tracks.json")), \
+                patch('map.management.commands.fetch_vehicle_positions.get_situation_index', return_value=index):
+            call_command('fetch_vehicle_positions', once=True, tolerance=50)
+            with open(os.path.join(tmp, "bus.json")) as f:
+                vehicles = {vehicle["vehicleId"]: vehicle for vehicle in json.load(f)}
+        close_session()
+
+        self.assertIn(b'codespaceId: \\"TRO\\"', stub.requests[0][3])
+        self.assertEqual(vehicles["near"]["near_situation_id"], "ROADWORK")
+        self.assertLess(vehicles["near"]["near_situation_distance_meters"], 50)
+        self.assertIsNone(vehicles["far"]["near_situation_id"])
+
+    def test_daemon_keeps_polling_after_a_failed_poll(self):
+        class Stop(Exception):
+            pass
+
+        failures = metrics.POLL_FAILURES.value(process='fetch_vehicle_positions')
+        with patch('map.management.commands.fetch_vehicle_positions.Command.poll',
+                   side_effect=[RuntimeError("database is locked"), 2]) as poll, \
+                patch('map.management.commands.fetch_vehicle_positions.time.sleep', side_effect=[None, Stop]), \
+                self.assertLogs('map.management.commands.fetch_vehicle_positions', 'ERROR'), \
+                self.assertRaises(Stop):
+            call_command('fetch_vehicle_positions', interval=1)
+        self.assertEqual(poll.call_count, 2)
+        self.assertEqual(metrics.POLL_FAILURES.value(process='fetch_vehicle_positions'), failures + 1)
+
+
+class VehicleTracksTest(SimpleTestCase):
+
+    def test_ring_buffer_keeps_the_last_positions(self):
+        tracks = TrackBuffer(points=3, capacity=1)
+        for t in range(5):
+            tracks.append(["bus-1", "bus-2"], ["L1", "L2"], [t, t], [18.9 + t / 1000, 19.0], [69.6, 69.7])
+        tracks.append(["bus-1"], ["L1"], [4], [0.0], [0.0])  # Repeated report
+        self.assertEqual(tracks.track(0)[:, 0].tolist(), [2, 3, 4])
+        self.assertEqual(tracks.data.shape, (2, 3, 3))
+        tracks.append(["bus-1"], ["L1"], [10], [18.9], [69.6])
+        self.assertEqual(tracks.expire(5), 1)
+        self.assertEqual(tracks.ids, ["bus-1"])
+
+    def test_track_endpoint_downsamples_per_line(self):
+        tracks = TrackBuffer(points=100)
+        # A straight drive east with one detour north in the middle
+        for t in range(21):
+            lat = 69.6500 + (0.002 if t == 10 else 0.0)
+            tracks.append(
+                ["bus-1", "bus-2"], ["TRO:Line:1_26", "TRO:Line:1_34"], [t * 10] * 2, [18.90 + t * 0.001] * 2, [lat] * 2,
+            )
+        client = Client()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "tracks.json")
+            with open(path, 'w') as f:
+                json.dump(tracks.snapshot(), f)
+            with override_settings(VEHICLE_TRACKS_PATH=path):
+                simplified = client.get('/api/vehicles/tracks/', {'line': "TRO:Line:1_26"}).json()
+                bucketed = client.get('/api/vehicles/tracks/', {'tolerance': "0", 'bucket': "60", 'minutes': "1"}).json()
+                invalid = [
+                    client.get('/api/vehicles/tracks/', params).status_code
+                    for params in ({'tolerance': "x"}, {'tolerance': "nan"}, {'bucket': "nan"}, {'minutes': "inf"})
+                ]
+
+        self.assertEqual(len(simplified["features"]), 1)
+        track = simplified["features"][0]
+        self.assertEqual(track["properties"]["timestamps"], [0, 90, 100, 110, 200])  # The detour survives
+        self.assertEqual(track["properties"]["positions"], 21)
+        self.assertEqual(len(bucketed["features"]), 2)
+        self.assertEqual(bucketed["features"][0]["properties"]["timestamps"], [170, 200])
+        self.assertEqual(invalid, [400] * 4)
+
+
+VEHICLES_SDL = """
+type Query {
+  lines(codespaceId: String): [Line]
+  serviceJourneys(lineRef: String, codespaceId: String): [ServiceJourney]
+}
+type Line { lineRef: String }
+type ServiceJourney { id: String, pointsOnLink: PointsOnLink }
+type PointsOnLink { length: Float, points: String }
+"""
+
+
+def vehicles_graphql_responder(journeys_by_line):
+    """StubUpstream responder for the `lines` and aliased `serviceJourneys` queries of fetch-coordinates."""
+    def responder(method, path, headers, body):
+        query = json.loads(body)["query"]
+        if "lines(" in query:
+            data = {"lines": [{"lineRef": line_ref} for line_ref in journeys_by_line]}
+        else:
+            aliases = re.findall(r'(l\d+): serviceJourneys\(lineRef: "([^"]+)"', query)
+            data = {alias: journeys_by_line[line_ref] for alias, line_ref in aliases}
+        return 200, {'Content-Type': 'application/json'}, json.dumps({"data": data}).encode()
+    return responder
+
+
+class RouteShapesTest(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def test_reads_ndjson_and_feature_collections(self):
+        features = [route_feature("1", [[18.9, 69.6], [19.0, 69.7]]), route_feature("2", [[18.8, 69.5], [18.9, 69.6]])]
+        ndjson = os.path.join(self.tmp, "routes.ndjson")
+        with FeatureWriter(ndjson) as writer:
+            for feature in features:
+                writer.write(feature)
+        collection = os.path.join(self.tmp, "routes.geojson")
+        with open(collection, 'w') as f:
+            json.dump({"type": "FeatureCollection", "features": features}, f, indent=4)
+
+        self.assertEqual(list(iter_features(ndjson)), features)
+        self.assertEqual(list(iter_features(collection)), features)
+        with open(ndjson, 'a') as f:
+            f.write("{not json\n")
+        with self.assertRaises(ValueError):
+            list(iter_features(ndjson))
+
+    def test_failed_write_keeps_the_old_file(self):
+        path = os.path.join(self.tmp, "routes.ndjson")
+        with open(path, 'w') as f:
+            f.write("old\n")
+        with self.assertRaises(RuntimeError), FeatureWriter(path) as writer:
+            writer.write(route_feature("1", []))
+            raise RuntimeError("upstream failed")
+        with open(path) as f:
+            self.assertEqual(f.read(), "old\n")
+        self.assertEqual(os.listdir(self.tmp), ["routes.ndjson"])
+
+    def test_fetch_coordinates_batches_lines_with_the_cached_schema(self):
+        from graphql import build_schema, introspection_from_schema
+
+        shape = polyline.encode([(69.6496, 18.9553), (69.6510, 18.9600)])
+        journeys = {
+            "TRO:Line:1_26": [
+                {"id": "TRO:ServiceJourney:26_1", "pointsOnLink": {"length": 1.0, "points": shape}},
+                {"id": "TRO:ServiceJourney:26_2", "pointsOnLink": {"length": 1.0, "points": shape}},  # Same shape
+            ],
+            "TRO:Line:1_34": [
+                {"id": "TRO:ServiceJourney:34_1", "pointsOnLink": None},
+                {"id": "TRO:ServiceJourney:34_2", "pointsOnLink": {"length": 1.0, "points": shape}},
+            ],
+        }
+        schema_path = os.path.join(self.tmp, "schema.json")
+        with open(schema_path, 'w') as f:
+            json.dump(introspection_from_schema(build_schema(VEHICLES_SDL)), f)
+        output = os.path.join(self.tmp, "routes.ndjson")
+
+        with StubUpstream(vehicles_graphql_responder(journeys)) as stub, \
+                override_settings(ENTUR_VEHICLES_URL=stub.url, ENTUR_VEHICLES_SCHEMA_PATH=schema_path):
+            call_command('fetch-coordinates', output=output, batch_size=1, stdout=io.StringIO())
+
+        # The lines query and one query per batch; no schema introspection
+        self.assertEqual(len(stub.requests), 3)
+        features = list(iter_features(output))
+        self.assertEqual([f["properties"]["route_id"] for f in features], ["26", "34"])
+        self.assertEqual(features[0]["geometry"]["coordinates"][0], [18.9553, 69.6496])
+
+
+class ImportBusRoutesTest(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.index_path = os.path.join(tmp.name, "route_index.bin")
+        self.enterContext(override_settings(ROUTE_INDEX_PATH=self.index_path, ROUTE_INDEX_REFRESH_SECONDS=0))
+
+    def test_imports_ndjson_routes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "routes.ndjson")
+            with FeatureWriter(path) as writer:
+                writer.write(route_feature("26", [[18.9553, 69.6496], [18.9600, 69.6510]]))
+                writer.write(route_feature("34", [[18.9600, 69.6510]]))  # Too short, skipped
+                writer.write(route_feature("34", [[18.9600, 69.6510], [18.9700, 69.6530]]))
+            out = io.StringIO()
+            call_command('import_bus_routes', path, stdout=out)
+        self.assertEqual(sorted(BusRoute.objects.values_list('route_id', flat=True)), ["26", "34"])
+        self.assertIn("Created: 2, Skipped: 1", out.getvalue())
+        # The route index matches the table, so the collision stage uses it
+        index = current_route_index()
+        self.assertEqual(sorted(index.route_id(i) for i in range(len(index))), ["26", "34"])
+
+    def import_routes(self, *features, **options):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "routes.ndjson")
+            with FeatureWriter(path) as writer:
+                for feature in features:
+                    writer.write(feature)
+            out = io.StringIO()
+            call_command('import_bus_routes', path, stdout=out, **options)
+        return out.getvalue()
+
+    @patch('map.management.commands.calculate_and_store_collisions.calculate_collisions_for_storage')
+    def test_reimport_only_touches_changed_shapes(self, calculate):
+        shape_26 = route_feature("26", [[18.9553, 69.6496], [18.9600, 69.6510]])
+        calculate.return_value = []
+        self.import_routes(shape_26, route_feature("34", [[18.96, 69.64], [18.96, 69.66]]))
+        route_26 = BusRoute.objects.get(route_id="26")
+        route_34 = BusRoute.objects.get(route_id="34")
+        situation = VtsSituation.objects.create(situation_id="S1", location=Point(18.96, 69.65, srid=4326))
+        for route in (route_26, route_34):
+            DetectedCollision.objects.create(
+                transit_information=situation, bus_route=route, transit_lon=18.96, transit_lat=69.65,
+                tolerance_meters=300, published_to_mqtt=True,
+            )
+
+        # Route 34 moved a little and still collides; route 42 is new
+        calculate.reset_mock()
+        calculate.return_value = [
+            {'transit_id': situation.id, 'route_id': route_34.pk, 'transit_lon': 18.96, 'transit_lat': 69.65, 'distance': 4.0},
+        ]
+        out = self.import_routes(
+            shape_26,
+            route_feature("34", [[18.9601, 69.64], [18.9601, 69.66]]),
+            route_feature("42", [[19.0, 69.7], [19.1, 69.7]]),
+        )
+        self.assertIn("Created: 1, Skipped: 0. Updated: 1, Deleted: 0, Unchanged: 1.", out)
+        route_42 = BusRoute.objects.get(route_id="42")
+        calculate.assert_called_once_with(300, [route_34.pk, route_42.pk])
+        self.assertEqual(BusRoute.objects.get(route_id="34").pk, route_34.pk)
+        self.assertAlmostEqual(BusRoute.objects.get(route_id="34").path.coords[0][0], 18.9601)
+        # Nothing to re-publish: the collisions that still hold kept their rows
+        self.assertEqual(DetectedCollision.objects.filter(published_to_mqtt=True).count(), 2)
+        self.assertFalse(DetectedCollision.objects.filter(published_to_mqtt=False).exists())
+        self.assertEqual(
+            DetectedCollision.objects.values_list('tolerance_meters', 'distance_meters').get(bus_route=route_34), (50, 4.0),
+        )
+
+        # Routes no longer in the file are deleted with their collisions
+        calculate.reset_mock()
+        out = self.import_routes(shape_26)
+        self.assertIn("Created: 0, Skipped: 0. Updated: 0, Deleted: 2, Unchanged: 1.", out)
+        calculate.assert_not_called()
+        self.assertEqual(list(BusRoute.objects.values_list('route_id', flat=True)), ["26"])
+        self.assertEqual(list(DetectedCollision.objects.values_list('bus_route_id', flat=True)), [route_26.pk])
+
+    def test_clearing_existing_routes_refreshes_their_summaries(self):
+        shape_26 = route_feature("26", [[18.9553, 69.6496], [18.9600, 69.6510]])
+        self.import_routes(shape_26, route_feature("34", [[18.96, 69.64], [18.96, 69.66]]), no_collisions=True)
+        situation = VtsSituation.objects.create(situation_id="S1", location=Point(18.96, 69.65, srid=4326))
+        DetectedCollision.objects.create(
+            transit_information=situation, bus_route=BusRoute.objects.get(route_id="34"), transit_lon=18.96, transit_lat=69.65,
+        )
+        refresh_route_summaries(["34"])
+        self.assertTrue(RouteCollisionSummary.objects.filter(route_id="34").exists())
+
+        self.import_routes(shape_26, clear_existing=True, no_collisions=True)
+        self.assertEqual(list(BusRoute.objects.values_list('route_id', flat=True)), ["26"])
+        self.assertFalse(RouteCollisionSummary.objects.exists())
+
+    def test_backfills_hashes_of_routes_imported_before(self):
+        route = BusRoute.objects.create(route_id="26", path=LineString((18.9553, 69.6496), (18.96, 69.651), srid=4326))
+        out = self.import_routes(route_feature("26", [[18.9553, 69.6496], [18.96, 69.651]]))
+        self.assertIn("Unchanged: 1.", out)
+        route.refresh_from_db()
+        self.assertEqual(route.shape_hash, shape_hash("26", [[18.9553, 69.6496], [18.96, 69.651]]))
+
+
+class PolylineDecodeTest(SimpleTestCase):
+
+    def test_matches_polyline_decode_in_lon_lat_order(self):
+        shapes = [
+            [(69.6496, 18.9553), (69.6510, 18.96), (69.653, 18.97)],
+            [],
+            [(-33.86882, 151.20929)],
+            [(69.0, 18.0), (68.99999, 18.00001), (70.5, 14.0)],
+        ]
+        encoded = [polyline.encode(points) if points else "" for points in shapes]
+        coords, offsets = decode_many(encoded, block_bytes=8)  # Several blocks
+        self.assertEqual(offsets.tolist(), [0, 3, 3, 4, 7])
+        for points, decoded in zip(encoded, split(coords, offsets)):
+            expected = [[lon, lat] for lat, lon in polyline.decode(points)] if points else []
+            self.assertEqual(decoded.tolist(), expected)
+
+    def test_invalid_encodings(self):
+        for encoded in ["_p~iF~ps|U_ulLnnqC_mqNvxq`", "_p~iF", "abc\x01"]:
+            with self.subTest(encoded=encoded), self.assertRaises(ValueError):
+                decode_polyline(encoded)
+
+
+def wiggly_route(points=500):
+    """A dense east-west route through Tromsø with metre-scale noise, as [lon, lat] rows."""
+    t = np.linspace(0.0, 1.0, points)
+    rng = np.random.default_rng(7)
+    return np.column_stack((18.90 + 0.1 * t, 69.65 + 0.01 * np.sin(t * 6) + rng.normal(0, 5e-6, points)))
+
+
+class RouteGeometryTest(SimpleTestCase):
+
+    def test_blob_round_trip_and_error_bound(self):
+        coords = wiggly_route()
+        geometry = RouteGeometry.from_lonlat(coords, tolerance=5)
+        self.assertLess(len(geometry), len(coords) // 5)
+        loaded = RouteGeometry.from_blob(memoryview(geometry.to_blob()))
+        self.assertEqual(loaded.tolerance, 5)
+        np.testing.assert_array_equal(loaded.xy, geometry.xy)
+        np.testing.assert_array_equal(loaded.lonlat, geometry.lonlat)
+        np.testing.assert_array_equal(loaded.segment_bboxes, geometry.segment_bboxes)
+
+        full = project_lonlat(coords)
+        points = full[::25] + [[0, 120], [80, -40]] * 10
+        exact = points_to_segments_distance(points, full[:-1], full[1:])
+        self.assertLessEqual(np.abs(loaded.points_distance(points, 300) - exact).max(), 5)
+        # Far points are left out
+        self.assertTrue(np.isinf(loaded.points_distance(full[:1] + [0, 5000], 300)).all())
+
+    def test_simplify_keeps_the_douglas_peucker_points(self):
+        # A peak, a shallow dent within the tolerance, a repeated point and a loop back to the start
+        coords = np.array([[0, 0], [10, 0], [20, 30], [30, 0], [40, 2], [50, 0], [50, 0], [60, 0], [0, 0]], float)
+        self.assertEqual(simplify(coords, 5).tolist(), [0, 1, 2, 3, 7, 8])
+        self.assertEqual(simplify(coords, 0).tolist(), [0, 1, 2, 3, 4, 5, 7, 8])
+        self.assertEqual(simplify(coords[:2], 5).tolist(), [0, 1])
+
+    def test_invalid_blob(self):
+        for blob in [b"", b"RTG1", RouteGeometry.from_lonlat(wiggly_route(10)).to_blob()[:-8]]:
+            with self.subTest(size=len(blob)), self.assertRaises(ValueError):
+                RouteGeometry.from_blob(blob)
+
+
+class SimplifiedRouteGeometryTest(TestCase):
+
+    def setUp(self):
+        self.route = BusRoute.objects.create(route_id="34", path=LineString(wiggly_route().tolist(), srid=4326))
+
+    def test_collisions_use_the_stored_geometry(self):
+        self.assertIsNotNone(self.route.simplified_geometry)
+        # About 100 m south of the route's first point
+        near = VtsSituation.objects.create(situation_id="NEAR", location=Point(18.90, 69.6491, srid=4326))
+        VtsSituation.objects.create(situation_id="FAR", location=Point(18.90, 69.70, srid=4326))
+        self.assertEqual([c['transit_id'] for c in calculate_collisions_for_storage(150)], [near.id])
+        self.assertEqual(calculate_collisions_for_storage(50), [])
+        self.assertEqual(calculate_collisions_for_storage(150, bus_route_ids=[self.route.pk + 1]), [])
+
+        # Rows written without save() fall back to the path
+        BusRoute.objects.filter(pk=self.route.pk).update(simplified_geometry=None)
+        self.assertEqual([c['transit_id'] for c in calculate_collisions_for_storage(150)], [near.id])
+
+    def test_busroute_serves_the_simplified_path(self):
+        [feature] = Client().get('/api/busroute/').json()["features"]
+        self.assertEqual(feature["id"], self.route.pk)
+        coordinates = feature["geometry"]["coordinates"]
+        self.assertLess(len(coordinates), 100)
+        self.assertEqual(coordinates[0], [18.9, round(self.route.path.coords[0][1], 6)])
+
+
+class RouteIndexTest(SimpleTestCase):
+
+    def routes(self, count=40, seed=3):
+        rng = np.random.default_rng(seed)
+        for n in range(count):
+            start = [18.8 + rng.random() * 0.4, 69.6 + rng.random() * 0.1]
+            coords = start + np.cumsum(rng.normal(0, 0.001, (50, 2)), axis=0)
+            yield n + 100, str(n % 7), RouteGeometry.from_lonlat(coords)
+
+    def test_pairs_match_brute_force(self):
+        routes = list(self.routes())
+        index = RouteIndex(pack_route_index(routes, cell_size=500))
+        self.assertEqual(len(index), 40)
+        self.assertEqual(index.route_id(8), "1")
+        points = project_lonlat(np.column_stack((np.linspace(18.8, 19.2, 60), np.linspace(69.6, 69.7, 60))))
+        point_index, route_index, distances = index.pairs_within(points, 300)
+
+        expected = {}
+        for r, (_, _, geometry) in enumerate(routes):
+            d = points_to_segments_distance(points, geometry.xy[:-1], geometry.xy[1:])
+            expected.update({(i, r): d[i] for i in np.flatnonzero(d <= 300)})
+        self.assertTrue(expected)
+        self.assertEqual(set(zip(point_index.tolist(), route_index.tolist())), set(expected))
+        for i, r, d in zip(point_index, route_index, distances):
+            self.assertAlmostEqual(d, expected[(i, r)])
+
+    def test_invalid_and_empty_index(self):
+        data = pack_route_index(self.routes(3))
+        for buffer in [b"", b"XXXX" + data[4:], data[:-16]]:
+            with self.subTest(size=len(buffer)), self.assertRaises(ValueError):
+                RouteIndex(buffer)
+        empty = RouteIndex(pack_route_index([]))
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(len(empty.pairs_within([[650000.0, 7730000.0]], 300)[0]), 0)
+
+    def test_index_file_is_versioned_and_hot_swapped(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "route_index.bin")
+            with override_settings(ROUTE_INDEX_PATH=path, ROUTE_INDEX_REFRESH_SECONDS=0):
+                self.assertIsNone(get_route_index())
+                first = write_route_index(path, self.routes(seed=1))
+                inode = os.stat(path).st_ino
+                self.assertEqual(write_route_index(path, self.routes(seed=1)), first)  # Same contents: not rewritten
+                self.assertEqual(os.stat(path).st_ino, inode)
+                old = get_route_index()
+                self.assertEqual(old.version, first)
+                self.assertIs(get_route_index(), old)
+
+                second = write_route_index(path, self.routes(count=5, seed=2))
+                self.assertNotEqual(second, first)
+                new = get_route_index()
+                self.assertEqual((new.version, len(new)), (second, 5))
+                # The old mapping stays readable for whoever still holds it
+                self.assertEqual(len(old), 40)
+                self.assertEqual(int(old.route_pks[-1]), 139)
+
+    def test_routes_near_view(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "route_index.bin")
+            route = ([18.95, 69.64], [18.95, 69.66])
+            with override_settings(ROUTE_INDEX_PATH=path, ROUTE_INDEX_REFRESH_SECONDS=0):
+                self.assertEqual(Client().get('/api/routes/near/', {'lon': 18.95, 'lat': 69.65}).status_code, 503)
+                write_route_index(path, [(7, "34", RouteGeometry.from_lonlat(route)), (8, "42", RouteGeometry.from_lonlat([[19.5, 69.9], [19.6, 69.9]]))])
+                response = Client().get('/api/routes/near/', {'lon': 18.952, 'lat': 69.65, 'distance': 200})
+                self.assertEqual(response.status_code, 200)
+                [match] = response.json()["routes"]
+                self.assertEqual((match["id"], match["route_id"]), (7, "34"))
+                self.assertAlmostEqual(match["distance_meters"], 77, delta=2)
+                self.assertEqual(Client().get('/api/routes/near/', {'lon': 'x', 'lat': 69.65}).status_code, 400)
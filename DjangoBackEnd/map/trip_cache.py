@@ -0,0 +1,188 @@
+"""
+TTL + LRU cache for decoded trip GeoJSON, with request coalescing.
+
+Popular origin/destination pairs are planned over and over. Entur plans from
+"now", so results are keyed by (from, to, num_trips, time bucket) and expire
+after a TTL no longer than the bucket. Concurrent identical requests wait for
+the one upstream call already in flight instead of issuing their own.
+
+The call in flight is a `concurrent.futures.Future`, so callers on other
+threads and event loops (async views under WSGI each run on their own loop)
+can wait for it. Async calls run as a task of their own: the leader's client
+disconnecting does not cancel the call the others wait for. If the call
+raises, every waiting caller gets the exception; if it is cancelled (its
+loop shut down), the waiting callers try again.
+
+Failed lookups (None) are never cached.
+"""
+import asyncio
+import concurrent.futures
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_TTL_SECONDS = 120
+DEFAULT_BUCKET_SECONDS = 300
+
+
+class TripCache:
+    """
+    Thread-safe TTL + LRU cache of decoded trip results.
+
+    Counters:
+        hits: answered from the cache.
+        misses: required an upstream call.
+        coalesced: waited for an identical call already in flight.
+        evictions: dropped to stay within `max_entries`.
+    """
+
+    def __init__(self, max_entries=None, ttl_seconds=None, bucket_seconds=None, clock=time.monotonic):
+        self.max_entries = max_entries or getattr(settings, 'TRIP_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)
+        self.ttl_seconds = ttl_seconds or getattr(settings, 'TRIP_CACHE_TTL_SECONDS', DEFAULT_TTL_SECONDS)
+        self.bucket_seconds = bucket_seconds or getattr(settings, 'TRIP_CACHE_BUCKET_SECONDS', DEFAULT_BUCKET_SECONDS)
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, value), oldest first
+        self._lock = threading.Lock()
+        self._pending = {}  # key -> concurrent.futures.Future of the upstream call in flight
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def key(self, from_place, to_place, num_trips, now=None):
+        """Cache key; the time bucket is based on wall-clock time because trips are planned from now."""
+        bucket = int((time.time() if now is None else now) // self.bucket_seconds)
+        return (from_place, to_place, int(num_trips), bucket)
+
+    def _get_locked(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put_locked(self, key, value):
+        self._entries[key] = (self._clock() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            return self._get_locked(key)
+
+    def put(self, key, value):
+        if value is None:
+            return
+        with self._lock:
+            self._put_locked(key, value)
+
+    def _claim(self, key):
+        """
+        Returns (cached value, None, False) on a hit, else (None, future of the
+        call in flight, whether the caller makes the call).
+        """
+        with self._lock:
+            value = self._get_locked(key)
+            if value is not None:
+                self.hits += 1
+                return value, None, False
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = concurrent.futures.Future()
+                self.misses += 1
+                return None, future, True
+            self.coalesced += 1
+            return None, future, False
+
+    def _settle(self, key, future, result=None, exception=None, cancelled=False):
+        """Cache and hand out the result of the call in flight (or its exception, or its cancellation)."""
+        if not cancelled and exception is None:
+            self.put(key, result)
+        with self._lock:
+            self._pending.pop(key, None)
+        if cancelled:
+            future.cancel()
+        elif exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def get_or_fetch(self, key, fetch):
+        """Return the cached value for `key`, or call `fetch()` once for all concurrent callers."""
+        value, future, leader = self._claim(key)
+        if future is None:
+            return value
+        if not leader:
+            try:
+                return future.result()
+            except concurrent.futures.CancelledError:
+                return self.get_or_fetch(key, fetch)  # The call was cancelled; make it again
+
+        try:
+            result = fetch()
+        except Exception as e:
+            self._settle(key, future, exception=e)
+            raise
+        except BaseException:
+            self._settle(key, future, cancelled=True)
+            raise
+        self._settle(key, future, result)
+        return result
+
+    async def get_or_fetch_async(self, key, fetch):
+        """Async version of `get_or_fetch`; `fetch` is a coroutine function."""
+        value, future, leader = self._claim(key)
+        if future is None:
+            return value
+        if not leader:
+            try:
+                # shield: one client disconnecting must not cancel the call the others wait for
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # This caller was cancelled
+                return await self.get_or_fetch_async(key, fetch)  # The call was cancelled; make it again
+
+        task = asyncio.ensure_future(fetch())
+        task.add_done_callback(lambda done: self._settle_task(key, future, done))
+        return await asyncio.shield(task)
+
+    def _settle_task(self, key, future, task):
+        if task.cancelled():
+            self._settle(key, future, cancelled=True)
+        elif task.exception() is not None:
+            self._settle(key, future, exception=task.exception())
+        else:
+            self._settle(key, future, task.result())
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hit_ratio": round((self.hits + self.coalesced) / lookups, 3) if lookups else None,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.coalesced = self.evictions = 0
+
+
+# One cache per process, shared by the sync and async trip paths.
+trip_cache = TripCache()
@@ -0,0 +1,211 @@
+"""
+Shared HTTP clients for upstream APIs (Entur, VTS DATEX II).
+
+Creating a client per call means a new TCP/TLS handshake for every request
+and no upper bound on how long a slow upstream can hold a worker. The clients
+here are created once and reused, with connection pooling and explicit
+timeouts taken from settings.
+
+All clients ask for gzip, and retry connection errors and 429/5xx answers
+with exponential backoff (`UPSTREAM_RETRIES`, `UPSTREAM_RETRY_BACKOFF_SECONDS`).
+Large downloads can be streamed with `stream=True` and read through
+`decoded_stream`, which decompresses as the parser reads instead of holding
+the compressed and decompressed body in memory.
+
+The async client is bound to its event loop and closed when that loop shuts
+down. Under ASGI there is one loop per worker, so connections are pooled
+across requests. Under WSGI (runserver, gunicorn sync workers) every async
+view runs on a loop of its own: its client only pools the requests of that
+view and is closed when the view returns.
+"""
+import asyncio
+import logging
+import threading
+import weakref
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT_SECONDS = 10.0
+DEFAULT_CONNECT_TIMEOUT_SECONDS = 5.0
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_BACKOFF_SECONDS = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# httpx.AsyncClient is bound to the event loop it was first used on, so keep one per loop:
+# loop -> (client, async generator that closes the client when the loop shuts down)
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def upstream_timeout():
+    """Timeout policy shared by all upstream calls."""
+    total = getattr(settings, 'UPSTREAM_TIMEOUT_SECONDS', DEFAULT_TIMEOUT_SECONDS)
+    connect = getattr(settings, 'UPSTREAM_CONNECT_TIMEOUT_SECONDS', DEFAULT_CONNECT_TIMEOUT_SECONDS)
+    return httpx.Timeout(total, connect=connect)
+
+
+def upstream_timeout_seconds():
+    """The same policy as a `(connect, read)` tuple for `requests` calls."""
+    total = getattr(settings, 'UPSTREAM_TIMEOUT_SECONDS', DEFAULT_TIMEOUT_SECONDS)
+    connect = getattr(settings, 'UPSTREAM_CONNECT_TIMEOUT_SECONDS', DEFAULT_CONNECT_TIMEOUT_SECONDS)
+    return connect, total
+
+
+def _retries():
+    return getattr(settings, 'UPSTREAM_RETRIES', DEFAULT_RETRIES)
+
+
+def _backoff():
+    return getattr(settings, 'UPSTREAM_RETRY_BACKOFF_SECONDS', DEFAULT_RETRY_BACKOFF_SECONDS)
+
+
+# --- requests (sync callers: management commands, WSGI views) ----------------
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def retry_policy():
+    """urllib3 retry policy for the shared session. GraphQL queries are read-only, so POST is retried too."""
+    return Retry(
+        total=_retries(),
+        backoff_factor=_backoff(),
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({'GET', 'POST'}),
+        respect_retry_after_header=True,
+        raise_on_status=False,  # Hand the last response back, raise_for_status() reports it
+    )
+
+
+def get_session():
+    """Return the process-wide pooled `requests.Session` (thread-safe for plain requests)."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            max_connections = getattr(settings, 'UPSTREAM_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS)
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max_connections, max_retries=retry_policy())
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers['Accept-Encoding'] = 'gzip'
+            _session = session
+            logger.debug(f"Created pooled upstream session (max {max_connections} connections per host).")
+        return _session
+
+
+def close_session():
+    """Close the shared session; the next `get_session()` builds a new one from current settings."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def decoded_stream(response):
+    """
+    File-like view of a `stream=True` response body that gunzips as it is read.
+
+    `response.raw.tell()` afterwards gives the bytes that came over the wire.
+    """
+    response.raw.decode_content = True
+    return response.raw
+
+
+class TeeReader:
+    """Binary reader that copies everything read from `stream` into each of `sinks`."""
+
+    def __init__(self, stream, *sinks):
+        self.stream = stream
+        self.sinks = sinks
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        if data:
+            for sink in self.sinks:
+                sink.write(data)
+        return data
+
+
+def graphql_transport(url, headers=None):
+    """gql `RequestsHTTPTransport` with the shared timeout, retry and compression policy."""
+    from gql.transport.requests import RequestsHTTPTransport
+
+    return RequestsHTTPTransport(
+        url=url,
+        headers={'Accept-Encoding': 'gzip', **(headers or {})},
+        timeout=getattr(settings, 'UPSTREAM_TIMEOUT_SECONDS', DEFAULT_TIMEOUT_SECONDS),
+        retries=_retries(),
+        retry_backoff_factor=_backoff(),
+        retry_status_forcelist=RETRY_STATUSES,
+    )
+
+
+# --- httpx (async views) ------------------------------------------------------
+
+async def _client_lifetime(client):
+    """
+    Closes `client` when its loop shuts down: `asyncio.run` (and asgiref's
+    `async_to_sync`) finalize the loop's open async generators with
+    `loop.shutdown_asyncgens()` before closing it.
+    """
+    try:
+        yield
+    finally:
+        await client.aclose()
+
+
+async def get_async_client():
+    """Return the pooled `httpx.AsyncClient` for the running event loop."""
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is None or entry[0].is_closed:
+        max_connections = getattr(settings, 'UPSTREAM_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS)
+        client = httpx.AsyncClient(
+            timeout=upstream_timeout(),
+            transport=httpx.AsyncHTTPTransport(
+                retries=_retries(),  # Connection errors only; status codes are retried in request_async
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            ),
+            headers={'Accept-Encoding': 'gzip'},
+        )
+        lifetime = _client_lifetime(client)
+        await lifetime.asend(None)  # Registers the generator with the loop
+        _async_clients[loop] = entry = (client, lifetime)
+        logger.debug(f"Created pooled async upstream client (max {max_connections} connections).")
+    return entry[0]
+
+
+async def close_async_clients():
+    """Close the client for the running loop (e.g. on ASGI shutdown or at the end of a load test)."""
+    entry = _async_clients.pop(asyncio.get_running_loop(), None)
+    if entry is not None:
+        await entry[1].aclose()  # Closes the client
+
+
+async def request_async(method, url, **kwargs):
+    """
+    Send a request with the pooled async client, retrying 429/5xx answers and
+    timeouts with exponential backoff. Returns the last response.
+    """
+    client = await get_async_client()
+    retries = _retries()
+    for attempt in range(retries + 1):
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TimeoutException:
+            if attempt == retries:
+                raise
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            await response.aclose()
+        delay = _backoff() * (2 ** attempt)
+        logger.info(f"Retrying {method} {url} in {delay:.1f}s (attempt {attempt + 2} of {retries + 1}).")
+        await asyncio.sleep(delay)
@@ -7,10 +7,16 @@ urlpatterns = [
     path('map/', views.map, name='map'),
     path('api/filter-options/', views.get_filter_options, name='filter_options'),
     path('trip/', views.trip, name='trip'),
+    path('api/trip-cache/stats/', views.trip_cache_stats, name='trip_cache_stats'),
     path('api/serve_geojson/', serve_geojson, name='serve_geojson'),
     path('api/location_geojson/', location_geojson, name='serve_geojson'),
     path('api/serve_bus/', serve_bus, name='serve_bus'),
     path('api/busroute/', busroute, name='busroute'),
     path('api/stored_collisions/', views.get_stored_collisions_view, name='api_get_collisions'),
+    path('api/routes/affected/', views.affected_routes_view, name='affected_routes'),
+    path('api/routes/near/', views.routes_near, name='routes_near'),
+    path('api/vehicles/tracks/', views.vehicle_tracks, name='vehicle_tracks'),
+    path('api/live/', views.live_events, name='live_events'),
+    path('metrics', views.prometheus_metrics, name='metrics'),
 
 ]
\ No newline at end of file
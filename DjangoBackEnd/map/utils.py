@@ -1,14 +1,25 @@
 import requests
-import json
-import polyline
+import httpx
+from map import polylines
 from map.models import BusRoute, VtsSituation
-from django.db import connection
+from map.upstream import get_session, request_async, upstream_timeout_seconds
+from map.trip_cache import trip_cache
+from map import metrics
+from django.conf import settings
 from django.contrib.gis.geos import Polygon
 import time
-def get_trip_geojson(from_place, to_place, num_trips=2):
-    url = "https://api.entur.io/journey-planner/v3/graphql"
+import numpy as np
+from map.geometry import project_lonlat
+from map.route_geometry import RouteGeometry
+from map.route_index import current_route_index
+JOURNEY_PLANNER_URL = "https://api.entur.io/journey-planner/v3/graphql"
+
+
+def _trip_request(from_place, to_place, num_trips):
+    """Build the (url, payload, headers) for an Entur journey-planner trip query."""
+    url = getattr(settings, 'ENTUR_JOURNEY_PLANNER_URL', JOURNEY_PLANNER_URL)
     headers = {
-        'ET-Client-Name': 'TromsøFylkeskommune-svipper-Studenter',
+        'ET-Client-Name': getattr(settings, 'ENTUR_CLIENT_NAME', 'TromsøFylkeskommune-svipper-Studenter'),
         'Content-Type': 'application/json'
     }
 
@@ -57,64 +68,137 @@ def get_trip_geojson(from_place, to_place, num_trips=2):
     """ % (from_place, to_place, num_trips)
 
     payload = {"query": query}
+    return url, payload, headers
+
+
+def _trip_geojson_from_response(data):
+    """Convert a journey-planner trip response into a GeoJSON FeatureCollection of legs."""
+    legs = [
+        leg for trip_pattern in data['data']['trip']['tripPatterns'] for leg in trip_pattern['legs']
+        if 'pointsOnLink' in leg and leg['pointsOnLink']
+    ]
+    # Decode the polylines of all legs at once, already in GeoJSON lng/lat order
+    coords, offsets = polylines.decode_many(leg['pointsOnLink']['points'] for leg in legs)
+    geojson_features = []
+    for leg, points in zip(legs, polylines.split(coords, offsets)):
+        line_name = leg['line'].get('name') if leg.get('line') else None
+        geojson_feature = {
+            "type": "Feature",
+            "geometry": {
+                "type": "LineString",
+                "coordinates": points.tolist()
+            },
+            "properties": {
+                "mode": leg['mode'].lower(),  # Lowercase for consistency
+                "lineName": line_name,
+                "distance": leg['distance']
+            }
+        }
+        geojson_features.append(geojson_feature)
+
+    geojson = {
+        "type": "FeatureCollection",
+        "features": geojson_features
+    }
+    return geojson
+
+
+def get_trip_geojson(from_place, to_place, num_trips=2):
+    """
+    Plan a trip and return its legs as GeoJSON, or None on error.
+
+    Results are served from `trip_cache` when the same trip was planned in
+    the current time bucket; concurrent identical calls share one request.
+    """
+    key = trip_cache.key(from_place, to_place, num_trips)
+    return trip_cache.get_or_fetch(key, lambda: _fetch_trip_geojson(from_place, to_place, num_trips))
+
+
+def _fetch_trip_geojson(from_place, to_place, num_trips):
+    url, payload, headers = _trip_request(from_place, to_place, num_trips)
 
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = get_session().post(url, json=payload, headers=headers, timeout=upstream_timeout_seconds())
         response.raise_for_status()
-        data = response.json()
-        geojson_features = []
-        for trip_pattern in data['data']['trip']['tripPatterns']:
-            for leg in trip_pattern['legs']:
-                if 'pointsOnLink' in leg and leg['pointsOnLink']:
-                    # Decode polyline points
-                    points = polyline.decode(leg['pointsOnLink']['points'])
-                    # Swap lat/lng to lng/lat for GeoJSON compliance
-                    points = [(lng, lat) for lat, lng in points]
-                    
-                    line_name = leg['line'].get('name') if leg.get('line') else None
-                    geojson_feature = {
-                        "type": "Feature",
-                        "geometry": {
-                            "type": "LineString",
-                            "coordinates": points
-                        },
-                        "properties": {
-                            "mode": leg['mode'].lower(),  # Lowercase for consistency
-                            "lineName": line_name,
-                            "distance": leg['distance']
-                        }
-                    }
-                    geojson_features.append(geojson_feature)
-
-        geojson = {
-            "type": "FeatureCollection",
-            "features": geojson_features
-        }
-        return geojson
+        return _trip_geojson_from_response(response.json())
 
-    except (requests.exceptions.RequestException, json.JSONDecodeError, KeyError, TypeError) as e:
+    except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:  # ValueError: bad JSON or polyline
         print(f"Error in get_trip_geojson: {e}")
         return None
+
+
+async def get_trip_geojson_async(from_place, to_place, num_trips=2):
+    """
+    Async version of `get_trip_geojson`, sharing the same `trip_cache`.
+
+    Uses the shared pooled client from `map.upstream` (with its retry
+    policy), so a slow journey planner only holds a coroutine, not a worker
+    thread.
+    """
+    key = trip_cache.key(from_place, to_place, num_trips)
+    return await trip_cache.get_or_fetch_async(key, lambda: _fetch_trip_geojson_async(from_place, to_place, num_trips))
+
+
+async def _fetch_trip_geojson_async(from_place, to_place, num_trips):
+    url, payload, headers = _trip_request(from_place, to_place, num_trips)
+
+    try:
+        response = await request_async('POST', url, json=payload, headers=headers)
+        response.raise_for_status()
+        return _trip_geojson_from_response(response.json())
+
+    except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:  # ValueError: bad JSON or polyline
+        print(f"Error in get_trip_geojson_async: {e}")
+        return None
 # --- Define your Area of Interest (AOI) ---
 # Replace with actual accurate coordinates for Troms
 TROMS_BBOX_COORDS = (14.0, 68.2, 22.0, 70.5) # (min_lon, min_lat, max_lon, max_lat)
 TROMS_BBOX_POLYGON = Polygon.from_bbox(TROMS_BBOX_COORDS)
 TROMS_BBOX_POLYGON.srid = 4326
 PROJECTED_SRID = 32633
+DEFAULT_COLLISION_TIERS_METERS = (50, 150, 300)
+
 
-def calculate_collisions_for_storage(distance_meters: int = 50) -> list:
+def collision_tiers(tiers=None):
+    """The proximity tiers in meters, ascending (`tiers`, or settings.COLLISION_TIERS_METERS)."""
+    if tiers is None:
+        tiers = getattr(settings, 'COLLISION_TIERS_METERS', DEFAULT_COLLISION_TIERS_METERS)
+    tiers = sorted({int(tier) for tier in tiers})
+    if not tiers or tiers[0] <= 0:
+        raise ValueError(f"Collision tiers must be positive distances in meters, got {tiers}.")
+    return tiers
+
+
+def collision_tier(distance, tiers):
+    """The smallest of the ascending `tiers` that `distance` is within, or None when it is beyond all of them."""
+    for tier in tiers:
+        if distance <= tier:
+            return tier
+    return None
+
+
+def calculate_collisions_for_storage(distance_meters: int = 50, bus_route_ids=None) -> list:
     """
-    Calculates collisions using Raw SQL (optimized with BBOX filter, using ST_Distance
-    and GeomFromText for SpatiaLite compatibility).
+    Calculates collisions between the VTS situation points inside the Troms
+    BBOX and the bus routes, using the simplified projected route geometry
+    stored with each BusRoute (see map/route_geometry.py): the situation
+    points are projected once, then each route checks only the points near
+    its bounding box against only the segments near them. When the
+    memory-mapped route index (map/route_index.py) matches the BusRoute
+    table, its grid finds the segments near each point instead.
     Returns details needed for storing in the DetectedCollision model.
-    Requires SpatiaLite + PROJ library correctly configured.
+
+    Distances are measured to the simplified route, so they are within
+    ROUTE_SIMPLIFY_TOLERANCE_METERS of the distance to the full path.
 
     Args:
         distance_meters (int): The tolerance distance in meters.
+        bus_route_ids: Only check these BusRoute primary keys (None checks all routes).
 
     Returns:
         list: A list of dictionaries, each containing:
-              {'transit_id': int, 'route_id': int, 'transit_lon': float, 'transit_lat': float}
+              {'transit_id': int, 'route_id': int, 'transit_lon': float, 'transit_lat': float,
+               'distance': float}  (meters from the situation point to the route)
               Returns an empty list if no collisions are found or on error.
     """
     collision_data_for_storage = []
@@ -122,65 +206,107 @@ def calculate_collisions_for_storage(distance_meters: int = 50) -> list:
     print(f"Calculating collisions for storage (Tolerance: {distance_meters}m, Area: Troms BBOX)...")
 
     try:
-        transit_table = VtsSituation._meta.db_table
-        route_table = BusRoute._meta.db_table
-        bbox_wkt = TROMS_BBOX_POLYGON.wkt
-        bbox_srid = TROMS_BBOX_POLYGON.srid # Should be 4326
-
-        with connection.cursor() as cursor:
-            # Use GeomFromText(wkt, srid) instead of ST_SetSRID(ST_GeomFromText(wkt), srid)
-            sql = f"""
-                SELECT
-                    t.id AS transit_id,
-                    r.id AS route_id,
-                    ST_X(t.location) AS transit_lon,
-                    ST_Y(t.location) AS transit_lat
-                FROM
-                    "{transit_table}" AS t
-                INNER JOIN
-                    "{route_table}" AS r ON t.location IS NOT NULL AND r.path IS NOT NULL
-                WHERE
-                    -- Filter 1: Transit location must be within the BBOX
-                    ST_Intersects(
-                        t.location,
-                        GeomFromText(%s, %s) -- Use GeomFromText with SRID parameter
+        # --- Situation points inside the BBOX, projected once ---
+        min_lon, min_lat, max_lon, max_lat = TROMS_BBOX_COORDS
+        transit_ids, transit_lonlat = [], []
+        for transit_id, location in VtsSituation.objects.filter(location__isnull=False).values_list('id', 'location').iterator():
+            lon, lat = location.coords[:2]
+            if min_lon <= lon <= max_lon and min_lat <= lat <= max_lat:
+                transit_ids.append(transit_id)
+                transit_lonlat.append((lon, lat))
+        if not transit_ids:
+            print("No situation points inside the Troms BBOX.")
+            return []
+        transit_xy = project_lonlat(transit_lonlat)
+
+        # --- Routes: the memory-mapped route index when it is current, else the BusRoute rows ---
+        index = current_route_index()
+        missing = []  # Saved without simplified geometry (e.g. bulk_create); computed from the path
+        if index is not None:
+            checked = len(index)
+            _collect_index_collisions(
+                index, bus_route_ids, transit_ids, transit_lonlat, transit_xy, distance_meters, collision_data_for_storage,
+            )
+        else:
+            routes = BusRoute.objects.filter(path__isnull=False)
+            if bus_route_ids is None:
+                route_querysets = [routes]
+            else:
+                # Route ids per query, well below SQLite's variable limit
+                bus_route_ids = sorted(set(bus_route_ids))
+                route_querysets = [
+                    routes.filter(pk__in=bus_route_ids[start:start + 500]) for start in range(0, len(bus_route_ids), 500)
+                ]
+            checked = 0
+            for queryset in route_querysets:
+                for route_id, blob in queryset.values_list('id', 'simplified_geometry').iterator():
+                    if blob is None:
+                        missing.append(route_id)
+                        continue
+                    checked += 1
+                    _collect_route_collisions(
+                        route_id, RouteGeometry.from_blob(blob), transit_ids, transit_lonlat, transit_xy,
+                        distance_meters, collision_data_for_storage,
                     )
-                    AND
-                    -- Filter 2: Bus route path must intersect the BBOX
-                    ST_Intersects(
-                        r.path,
-                        GeomFromText(%s, %s) -- Use GeomFromText with SRID parameter
+            for start in range(0, len(missing), 500):
+                for route_id, path in BusRoute.objects.filter(pk__in=missing[start:start + 500]).values_list('id', 'path'):
+                    checked += 1
+                    _collect_route_collisions(
+                        route_id, RouteGeometry.from_lonlat(path.coords), transit_ids, transit_lonlat, transit_xy,
+                        distance_meters, collision_data_for_storage,
                     )
-                    AND
-                    -- Proximity Check: Using ST_Distance on transformed geometries
-                    ST_Distance(
-                        ST_Transform(t.location, %s), -- Transform point to projected SRID
-                        ST_Transform(r.path, %s)      -- Transform path to projected SRID
-                    ) <= %s                           -- Distance tolerance in meters
-            """
-            # Parameters order must match the %s placeholders
-            params = [
-                bbox_wkt, bbox_srid,           # Parameters for first GeomFromText
-                bbox_wkt, bbox_srid,           # Parameters for second GeomFromText
-                PROJECTED_SRID, PROJECTED_SRID, # Parameters for ST_Transform
-                float(distance_meters)         # Parameter for ST_Distance comparison
-            ]
-            cursor.execute(sql, params)
-
-            # --- Process results (same as before) ---
-            columns = [col[0] for col in cursor.description]
-            rows = cursor.fetchall()
-            for row in rows:
-                result_dict = dict(zip(columns, row))
-                collision_data_for_storage.append(result_dict)
-            # --- End result processing ---
 
         end_calc_time = time.time()
-        print(f"Raw SQL calculation finished in {end_calc_time - start_calc_time:.2f} seconds. Found {len(collision_data_for_storage)} potential collisions.")
+        metrics.COLLISION_SECONDS.observe(end_calc_time - start_calc_time, tolerance=distance_meters)
+        metrics.COLLISION_CANDIDATES.observe(len(collision_data_for_storage), tolerance=distance_meters)
+        print(
+            f"Calculation over {checked} routes ({len(missing)} without simplified geometry) and "
+            f"{len(transit_ids)} situation points finished in {end_calc_time - start_calc_time:.2f} seconds. "
+            f"Found {len(collision_data_for_storage)} potential collisions."
+        )
         return collision_data_for_storage
 
     except Exception as e:
         print(f"An error occurred during collision calculation for storage: {e}")
         # import traceback
         # traceback.print_exc() # Uncomment for full details if it fails again
-        return []
\ No newline at end of file
+        return []
+
+
+def _collect_index_collisions(index, bus_route_ids, transit_ids, transit_lonlat, transit_xy, distance_meters, out):
+    """Append the storage dicts of the (situation point, route) pairs the route index finds within `distance_meters`."""
+    min_lon, min_lat, max_lon, max_lat = TROMS_BBOX_COORDS
+    point_index, route_index, distances = index.pairs_within(transit_xy, distance_meters)
+    boxes = index.route_lonlat_bboxes[route_index]
+    # The route must reach into the BBOX (by its own bbox)
+    keep = (boxes[:, 2] >= min_lon) & (boxes[:, 0] <= max_lon) & (boxes[:, 3] >= min_lat) & (boxes[:, 1] <= max_lat)
+    route_pks = index.route_pks[route_index]
+    if bus_route_ids is not None:
+        keep &= np.isin(route_pks, np.fromiter(bus_route_ids, dtype=np.int64))
+    for i, route_pk, distance in zip(point_index[keep].tolist(), route_pks[keep].tolist(), distances[keep].tolist()):
+        out.append({
+            'transit_id': transit_ids[i],
+            'route_id': route_pk,
+            'transit_lon': transit_lonlat[i][0],
+            'transit_lat': transit_lonlat[i][1],
+            'distance': distance,
+        })
+
+
+def _collect_route_collisions(route_id, geometry, transit_ids, transit_lonlat, transit_xy, distance_meters, out):
+    """Append the storage dicts of the situation points within `distance_meters` of one route."""
+    min_lon, min_lat, max_lon, max_lat = TROMS_BBOX_COORDS
+    lon = geometry.lonlat[:, 0]
+    lat = geometry.lonlat[:, 1]
+    # The route must reach into the BBOX (by its own bbox)
+    if lon.max() < min_lon or lon.min() > max_lon or lat.max() < min_lat or lat.min() > max_lat:
+        return
+    distances = geometry.points_distance(transit_xy, distance_meters)
+    for i in np.flatnonzero(distances <= distance_meters):
+        out.append({
+            'transit_id': transit_ids[i],
+            'route_id': route_id,
+            'transit_lon': transit_lonlat[i][0],
+            'transit_lat': transit_lonlat[i][1],
+            'distance': float(distances[i]),
+        })
@@ -0,0 +1,377 @@
+"""
+Realtime vehicle positions from the Entur vehicles GraphQL API.
+
+The fetch_vehicle_positions command polls `vehicles(codespaceId: "TRO")` and
+keeps the latest position of every vehicle in a `VehicleStore`: a handful of
+NumPy arrays indexed by slot (one per vehicle) instead of a dict per vehicle,
+so updating, expiring and checking a few thousand vehicles against the
+situations are vectorized passes.
+
+After every poll each vehicle is flagged with the nearest active situation
+within `VEHICLE_SITUATION_TOLERANCE_METERS` (`SituationIndex.points_near`), and
+the store is written atomically to `VEHICLE_POSITIONS_PATH`, the file
+`/api/serve_bus/` serves from memory (map/file_cache.py).
+
+Each position also goes into a `TrackBuffer`, a fixed-size ring of the last
+`VEHICLE_TRACK_MINUTES` of positions per vehicle, written to
+`VEHICLE_TRACKS_PATH` as one column array per vehicle. `/api/vehicles/tracks/`
+reads it (parsed once per file version, `TrackFile`) and returns the tracks
+of the requested lines downsampled with Douglas–Peucker or per time bucket,
+so it can be seen whether buses detoured around a collision without storing
+every ping in the database.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+from .file_cache import file_cache
+from .geometry import project_lonlat, simplify
+
+logger = logging.getLogger(__name__)
+
+VEHICLES_URL = "https://api.entur.io/realtime/v2/vehicles/graphql"
+DEFAULT_CODESPACE = 'TRO'
+DEFAULT_CAPACITY = 256
+
+VEHICLES_QUERY = """
+query {
+  vehicles(codespaceId: %s) {
+    vehicleId
+    line { lineRef }
+    lastUpdated
+    bearing
+    location { latitude longitude }
+  }
+}
+"""
+
+
+def vehicles_query(codespace=DEFAULT_CODESPACE):
+    return VEHICLES_QUERY % json.dumps(codespace)
+
+
+def parse_vehicles(data):
+    """
+    Yield (vehicle_id, line, lon, lat, updated_epoch, bearing) from a vehicles response.
+
+    Vehicles without an id, a location or a readable `lastUpdated` are skipped.
+    """
+    for vehicle in (data.get('data') or {}).get('vehicles') or []:
+        location = vehicle.get('location') or {}
+        vehicle_id = vehicle.get('vehicleId')
+        lat, lon = location.get('latitude'), location.get('longitude')
+        if not vehicle_id or lat is None or lon is None:
+            continue
+        try:
+            updated = datetime.fromisoformat(vehicle['lastUpdated']).timestamp()
+        except (KeyError, TypeError, ValueError):
+            continue
+        bearing = vehicle.get('bearing')
+        yield (
+            vehicle_id, (vehicle.get('line') or {}).get('lineRef'), float(lon), float(lat), updated,
+            np.nan if bearing is None else float(bearing),
+        )
+
+
+def fetch_vehicles(session, url=VEHICLES_URL, codespace=DEFAULT_CODESPACE, headers=None, timeout=None):
+    """POST the vehicles query and return the decoded response; GraphQL errors raise ValueError."""
+    response = session.post(url, json={'query': vehicles_query(codespace)}, headers=headers, timeout=timeout)
+    response.raise_for_status()
+    data = response.json()
+    if data.get('errors') and not (data.get('data') or {}).get('vehicles'):
+        raise ValueError(f"Vehicles query failed: {data['errors'][0].get('message')}")
+    return data
+
+
+class VehicleStore:
+    """
+    Latest position per vehicle as parallel arrays.
+
+    Slot `i` holds one vehicle: `lon`/`lat`, projected `xy` (metres),
+    `updated` (epoch seconds), `bearing` (NaN when unknown), `line` (code into
+    `lines`), and after `flag()` the index of the `near` situation (-1: none)
+    with its distance.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.ids = []  # slot -> vehicle id
+        self.slots = {}  # vehicle id -> slot
+        self.lines = []  # line code -> lineRef
+        self._line_codes = {}
+        self.near_situation_ids = []  # `near` code -> situation_id, from the last flag()
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        old = getattr(self, 'lon', None)
+        arrays = {
+            'lon': np.float64, 'lat': np.float64, 'updated': np.float64,
+            'bearing': np.float32, 'line': np.int32, 'near': np.int32, 'near_distance': np.float32,
+        }
+        for name, dtype in arrays.items():
+            array = np.empty(capacity, dtype=dtype)
+            if old is not None:
+                array[:len(self)] = getattr(self, name)[:len(self)]
+            setattr(self, name, array)
+        xy = np.empty((capacity, 2))
+        if old is not None:
+            xy[:len(self)] = self.xy[:len(self)]
+        self.xy = xy
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _line_code(self, line):
+        code = self._line_codes.get(line)
+        if code is None:
+            code = self._line_codes[line] = len(self.lines)
+            self.lines.append(line)
+        return code
+
+    def update(self, vehicles):
+        """
+        Upsert (vehicle_id, line, lon, lat, updated_epoch, bearing) tuples; older reports are ignored.
+
+        Returns:
+            The number of vehicles whose position was updated.
+        """
+        vehicles = list(vehicles)
+        if not vehicles:
+            return 0
+        slots = np.empty(len(vehicles), dtype=np.int64)
+        for n, (vehicle_id, *_) in enumerate(vehicles):
+            slot = self.slots.get(vehicle_id)
+            if slot is None:
+                slot = self.slots[vehicle_id] = len(self.ids)
+                self.ids.append(vehicle_id)
+                if slot >= len(self.lon):
+                    self._allocate(len(self.lon) * 2)
+                self.updated[slot] = -np.inf
+                self.near[slot] = -1
+                self.near_distance[slot] = np.inf
+            slots[n] = slot
+
+        _, lines, lons, lats, updated, bearings = zip(*vehicles)
+        updated = np.array(updated)
+        newer = updated >= self.updated[slots]
+        if not newer.any():
+            return 0
+        slots = slots[newer]
+        lonlat = np.column_stack((lons, lats))[newer]
+        self.lon[slots] = lonlat[:, 0]
+        self.lat[slots] = lonlat[:, 1]
+        self.xy[slots] = project_lonlat(lonlat)
+        self.updated[slots] = updated[newer]
+        self.bearing[slots] = np.array(bearings)[newer]
+        self.line[slots] = [self._line_code(line) for line, keep in zip(lines, newer) if keep]
+        return len(slots)
+
+    def expire(self, before):
+        """Drop vehicles last reported before epoch second `before`. Returns how many were dropped."""
+        count = len(self)
+        keep = np.flatnonzero(self.updated[:count] >= before)
+        if len(keep) == count:
+            return 0
+        for name in ('lon', 'lat', 'updated', 'bearing', 'line', 'near', 'near_distance', 'xy'):
+            array = getattr(self, name)
+            array[:len(keep)] = array[keep]
+        self.ids = [self.ids[i] for i in keep]
+        self.slots = {vehicle_id: slot for slot, vehicle_id in enumerate(self.ids)}
+        return count - len(keep)
+
+    def flag(self, index, tolerance_meters):
+        """
+        Mark every vehicle with the nearest situation of `index` (a `SituationIndex`) within the tolerance.
+
+        Returns:
+            The number of flagged vehicles.
+        """
+        count = len(self)
+        nearest, distances = index.points_near(self.xy[:count], tolerance_meters)
+        self.near[:count] = nearest
+        self.near_distance[:count] = distances
+        self.near_situation_ids = [properties['situation_id'] for properties, _ in index.entries]
+        return int((nearest >= 0).sum())
+
+    def records(self):
+        """The vehicles as dicts, in the `bus_positions.json` layout (plus bearing and situation flag)."""
+        records = []
+        for slot, vehicle_id in enumerate(self.ids):
+            near = int(self.near[slot])
+            bearing = float(self.bearing[slot])
+            records.append({
+                'vehicleId': vehicle_id,
+                'line': self.lines[self.line[slot]],
+                'latitude': float(self.lat[slot]),
+                'longitude': float(self.lon[slot]),
+                'bearing': None if np.isnan(bearing) else bearing,
+                'last_updated': datetime.fromtimestamp(self.updated[slot], timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'near_situation_id': self.near_situation_ids[near] if near >= 0 else None,
+                'near_situation_distance_meters': round(float(self.near_distance[slot]), 1) if near >= 0 else None,
+            })
+        return records
+
+
+def write_snapshot(path, data):
+    """Replace `path` with `data` as JSON in one rename, so readers never see a half-written file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.vehicles-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.chmod(tmp_path, 0o644)  # mkstemp creates 0600; the web server may run as another user
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class TrackBuffer:
+    """
+    The last `points` positions of every vehicle in one preallocated array.
+
+    `data[slot]` is a ring of (epoch seconds, lon, lat) rows; `head[slot]` is
+    the next row to write and `count[slot]` the number of valid rows. Memory
+    per vehicle is fixed (`points` x 3 floats) however long the daemon runs.
+    """
+
+    def __init__(self, points, capacity=DEFAULT_CAPACITY):
+        self.points = points
+        self.ids = []  # slot -> vehicle id
+        self.slots = {}  # vehicle id -> slot
+        self.lines = []  # slot -> lineRef
+        self.data = np.empty((capacity, points, 3))
+        self.head = np.zeros(capacity, dtype=np.int32)
+        self.count = np.zeros(capacity, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _slot(self, vehicle_id, line):
+        slot = self.slots.get(vehicle_id)
+        if slot is None:
+            slot = self.slots[vehicle_id] = len(self.ids)
+            self.ids.append(vehicle_id)
+            self.lines.append(line)
+            if slot >= len(self.data):
+                capacity = len(self.data) * 2
+                self.data = np.concatenate((self.data, np.empty((capacity - len(self.data), self.points, 3))))
+                self.head = np.concatenate((self.head, np.zeros(capacity - len(self.head), dtype=np.int32)))
+                self.count = np.concatenate((self.count, np.zeros(capacity - len(self.count), dtype=np.int32)))
+        else:
+            self.lines[slot] = line  # A vehicle can change line between trips
+        return slot
+
+    def append(self, vehicle_ids, lines, times, lons, lats):
+        """
+        Add one position per vehicle; a report no newer than the vehicle's last row is skipped.
+
+        Returns:
+            The number of positions added.
+        """
+        if not len(vehicle_ids):
+            return 0
+        slots = np.array([self._slot(vehicle_id, line) for vehicle_id, line in zip(vehicle_ids, lines)])
+        times = np.asarray(times, dtype=np.float64)
+        last = self.data[slots, (self.head[slots] - 1) % self.points, 0]
+        newer = (self.count[slots] == 0) | (times > last)
+        slots = slots[newer]
+        self.data[slots, self.head[slots]] = np.column_stack((times, lons, lats))[newer]
+        self.head[slots] = (self.head[slots] + 1) % self.points
+        self.count[slots] = np.minimum(self.count[slots] + 1, self.points)
+        return len(slots)
+
+    def append_store(self, store):
+        """Add the current position of every vehicle of a `VehicleStore`."""
+        count = len(store)
+        return self.append(
+            store.ids, [store.lines[code] for code in store.line[:count]],
+            store.updated[:count], store.lon[:count], store.lat[:count],
+        )
+
+    def track(self, slot):
+        """The (n, 3) rows of one vehicle, oldest first."""
+        if self.count[slot] < self.points:
+            return self.data[slot, :self.count[slot]]
+        return np.roll(self.data[slot], -self.head[slot], axis=0)
+
+    def expire(self, before):
+        """Drop vehicles whose last position is older than epoch second `before`. Returns how many were dropped."""
+        count = len(self)
+        last = self.data[np.arange(count), (self.head[:count] - 1) % self.points, 0]
+        keep = np.flatnonzero(last >= before)
+        if len(keep) == count:
+            return 0
+        for name in ('data', 'head', 'count'):
+            array = getattr(self, name)
+            array[:len(keep)] = array[keep]
+        self.ids = [self.ids[i] for i in keep]
+        self.lines = [self.lines[i] for i in keep]
+        self.slots = {vehicle_id: slot for slot, vehicle_id in enumerate(self.ids)}
+        return count - len(keep)
+
+    def snapshot(self, since=None):
+        """The tracks as JSON-ready column arrays, optionally only positions from epoch second `since` on."""
+        vehicles = []
+        for slot, vehicle_id in enumerate(self.ids):
+            rows = self.track(slot)
+            if since is not None:
+                rows = rows[rows[:, 0] >= since]
+            if len(rows):
+                vehicles.append({
+                    'vehicleId': vehicle_id,
+                    'line': self.lines[slot],
+                    't': rows[:, 0].astype(np.int64).tolist(),
+                    'lon': np.round(rows[:, 1], 6).tolist(),
+                    'lat': np.round(rows[:, 2], 6).tolist(),
+                })
+        return {'vehicles': vehicles}
+
+
+def downsample_track(times, lonlat, tolerance=None, bucket_seconds=None):
+    """
+    Indices of the points of one track to keep.
+
+    Args:
+        times: (n,) epoch seconds, ascending.
+        lonlat: (n, 2) positions.
+        tolerance: Douglas–Peucker tolerance in metres.
+        bucket_seconds: Keep the last position of every bucket of this many seconds
+            instead (applied first when both are given).
+    """
+    keep = np.arange(len(times))
+    if bucket_seconds:
+        buckets = np.floor_divide(np.asarray(times), bucket_seconds)
+        keep = np.flatnonzero(np.diff(buckets, append=np.inf) != 0)
+    if tolerance and len(keep) > 2:
+        keep = keep[simplify(project_lonlat(np.asarray(lonlat)[keep]), tolerance)]
+    return keep
+
+
+class TrackFile:
+    """The parsed tracks file, reparsed only when the cached file version changes."""
+
+    def __init__(self, cache=file_cache):
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._parsed = {}  # path -> (etag, data)
+
+    def get(self, path):
+        """The tracks file as `TrackBuffer.snapshot()` data, or None when it does not exist."""
+        entry = self.cache.get(path)
+        if entry is None:
+            return None
+        with self._lock:
+            etag, data = self._parsed.get(path, (None, None))
+            if etag != entry.etag:
+                data = json.loads(entry.body)
+                self._parsed[path] = (entry.etag, data)
+            return data
+
+
+track_file = TrackFile()
@@ -1,100 +1,100 @@
 from django.shortcuts import render
 from django.urls import path
-from django.http import HttpResponse,JsonResponse
+from django.http import HttpResponse,JsonResponse, StreamingHttpResponse
 from django.template import loader
+from django.views.decorators.http import condition
 from .models import VtsSituation, BusRoute, DetectedCollision
 from django.contrib.gis.measure import D
 import ast  # Safe alternative to eval() for string-to-list conversion
-from .utils import get_trip_geojson 
+from .utils import get_trip_geojson_async
+from asgiref.sync import sync_to_async
 from django.contrib.gis.db.models.functions import AsGeoJSON
-import os, json
+import os, json, math
+import numpy as np
+import base64
+from dateutil.parser import isoparse
+from datetime import timezone as dt_timezone
 from django.conf import settings
 from django.contrib.gis.db.models.functions import Transform, Distance
 from django.db.models import OuterRef, Exists
 from django.db.models import Q
 from django.db import connection
+from .live import hub, ClientFilter
+from .trip_cache import trip_cache
+from .collision_engine import annotate_trip_impacts
+from . import metrics
+from .route_summary import affected_routes as _affected_routes
+from .facets import filter_facets
+from .file_cache import file_response
+from .route_geometry import RouteGeometry
+from .route_index import get_route_index
+from .geometry import project_lonlat
+from .vehicles import downsample_track, track_file
 
 def serve_geojson(request):
     """Serve the pre-generated GeoJSON file instead of querying the database."""
     geojson_path = os.path.join(settings.BASE_DIR, 'output.geojson')
-    if os.path.exists(geojson_path):
-        with open(geojson_path, 'r') as file:
-            geojson_data = json.load(file)
-        return JsonResponse(geojson_data, safe=False)
-    else:
-        return JsonResponse({"error": "GeoJSON file not found"}, status=404)
+    return file_response(request, geojson_path, not_found="GeoJSON file not found")
 
 
 def serve_bus(request):
     '''
     the updated bus list is served here
     '''
-    buslist_path = os.path.join(settings.BASE_DIR,"bus_positions.json")
-    print(f"bus list path: {buslist_path}")
-    if os.path.exists(buslist_path):
-        with open(buslist_path,'r') as file:
-            buslist_data = json.load(file)
-        return JsonResponse(buslist_data,safe=False)
-    else:
-        return JsonResponse({"error": "buslist file not found"},status = 404)
-    
+    buslist_path = getattr(settings, 'VEHICLE_POSITIONS_PATH', os.path.join(settings.BASE_DIR,"bus_positions.json"))
+    return file_response(request, buslist_path, not_found="buslist file not found")
+
 def busroute_json(request):
     '''
     busroute
     '''
     route_path = os.path.join(settings.BASE_DIR,"route_coordinates.geojson")
-    print(f"bus list path: {route_path}")
-    if os.path.exists(route_path):
-        with open(route_path,'r') as file:
-            route_data = json.load(file)
-        return JsonResponse(route_data,safe=False)
-    else:
-        return JsonResponse({"error": "buslist file not found"},status = 404)
+    return file_response(request, route_path, not_found="buslist file not found")
+
+def _route_geometry_json(geometry):
+    return {"type": "LineString", "coordinates": np.round(geometry.lonlat, 6).tolist()}
+
 
 def busroute(request):
     """
     Serves BusRoute data from the database as a GeoJSON FeatureCollection.
+
+    The geometry is the simplified path stored with each route (see
+    map/route_geometry.py), within ROUTE_SIMPLIFY_TOLERANCE_METERS of the
+    imported shape, with coordinates rounded to 6 decimals (about 0.1 m).
     """
     try:
-        # Query all BusRoute objects from the database
-        # Use .iterator() for potentially large datasets to reduce memory usage
-        routes = BusRoute.objects.all().iterator()
+        # One query for the stored geometry; .iterator() keeps memory low for many routes
+        routes = BusRoute.objects.values_list('id', 'version', 'last_updated', 'simplified_geometry').iterator()
 
         # Prepare the list of GeoJSON features
         features = []
-        for route in routes:
-            # Ensure the path field is not null and actually contains geometry data
-            if route.path and route.path.coords:
-                # --- Method 1: Using the .geojson property (Recommended) ---
-                # GeoDjango geometry fields have a .geojson property that returns
-                # the geometry part as a GeoJSON string. We parse it back to a dict.
-                try:
-                    geometry_dict = json.loads(route.path.geojson)
-                except json.JSONDecodeError:
-                    print(f"Warning: Could not decode geojson geometry for route {route.pk}")
-                    # Skip this feature if geometry is invalid
-                    continue
-
-                # Construct the GeoJSON Feature object
-                feature = {
-                    "type": "Feature",
-                    "geometry": geometry_dict,
-                    "properties": {
-                        # Add any relevant non-geometry fields from your model here
-                        "version": route.version,
-                        # Format datetime to ISO 8601 string for standard JSON compatibility
-                        "last_updated": route.last_updated.isoformat() if route.last_updated else None,
-                        # You could add the primary key here if useful for the frontend
-                        # "database_id": route.pk,
-                    },
-                    # Use the database primary key as the feature ID
-                    "id": route.pk
-                }
-                features.append(feature)
+        missing = {}  # Routes saved without simplified geometry (e.g. bulk_create), by primary key
+        for route_pk, version, last_updated, blob in routes:
+            feature = {
+                "type": "Feature",
+                "geometry": None,
+                "properties": {
+                    # Add any relevant non-geometry fields from your model here
+                    "version": version,
+                    # Format datetime to ISO 8601 string for standard JSON compatibility
+                    "last_updated": last_updated.isoformat() if last_updated else None,
+                },
+                # Use the database primary key as the feature ID
+                "id": route_pk
+            }
+            if blob is None:
+                missing[route_pk] = feature
             else:
-                # Log or print a warning if a route has no path data
-                print(f"Warning: Skipping route {route.pk} because its path is null or empty.")
+                feature["geometry"] = _route_geometry_json(RouteGeometry.from_blob(blob))
+            features.append(feature)
 
+        if missing:
+            for route_pk, path in BusRoute.objects.filter(pk__in=list(missing)).values_list('id', 'path'):
+                if path and len(path.coords) >= 2:
+                    missing[route_pk]["geometry"] = _route_geometry_json(RouteGeometry.from_lonlat(path.coords))
+        # Skip routes without usable path data
+        features = [feature for feature in features if feature["geometry"] is not None]
 
         # Construct the final GeoJSON FeatureCollection dictionary
         geojson_data = {
@@ -129,118 +129,46 @@ def is_epsg_4326(lon, lat):
     return -180 <= lon <= 180 and -90 <= lat <= 90
 
 
-def get_filter_options_from_db(request):
-    '''
-    Retrieve unique filter options for transit information.
+def _filter_options_etag(request):
+    return filter_facets.get().etag
 
-    This function queries the database to retrieve unique values for **counties** and 
-    **situation types** from the `VtsSituation` model. The results are returned 
-    as a JSON response, making them useful for populating dropdown filters in a frontend UI.
 
-    Parameters
-    ----------
-    request : HttpRequest
-        The HTTP request object (not used in filtering, but required for Django views).
-
-    Returns
-    -------
-    JsonResponse
-        A JSON response containing two lists:
-        - `counties` (list of str): Unique county names.
-        - `situation_types` (list of str): Unique situation types.
+@condition(etag_func=_filter_options_etag)
+def get_filter_options(request):
+    """
+    Filter options for the map: the distinct counties, situation types and
+    severities, with situation counts per value (`counts`) and a `version`.
 
-    Notes
-    -----
-    - The function removes `None` or empty values from the lists before returning them.
-    - Uses `distinct()` to ensure uniqueness in both `counties` and `situation_types`.
+    They are computed once per ingest (see map/facets.py) and served from
+    memory; the version is the ETag, so unchanged options answer 304.
 
     Example
     -------
     Response:
     ```json
     {
-        "counties": ["Oslo", "Bergen", "Trondheim"],
-        "situation_types": ["roadwork", "accident", "closure"]
+        "counties": ["Finnmark", "Troms"],
+        "situation_types": ["Accident", "MaintenanceWorks"],
+        "severities": ["high", "low"],
+        "counts": {"counties": {"Finnmark": 3, "Troms": 12}, ...},
+        "version": 7
     }
     ```
-    '''
-    try:
-        counties = VtsSituation.objects.values_list('area_name', flat=True).distinct()
-        counties = [county for county in counties if county]
-        
-        situation_types = VtsSituation.objects.values_list('filter_used', flat=True).distinct()
-        situation_types = [type for type in situation_types if type]
-        
-        severities = VtsSituation.objects.values_list('severity', flat=True).distinct()
-        severities = [severity for severity in severities if severity]
-        
-        return JsonResponse({
-            'counties': list(counties),
-            'situation_types': list(situation_types),
-            'severities': list(severities)
-        })
-    except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
-def get_filter_options(request):
-    """
-    Retrieve unique filter options directly from the VtsSituation model.
     """
     try:
-        # Use distinct() on the database fields
-        counties_qs = VtsSituation.objects.values_list('area_name', flat=True).distinct().order_by('area_name')
-        counties = [county for county in counties_qs if county] # Remove None/empty
-
-        situation_types_qs = VtsSituation.objects.values_list('filter_used', flat=True).distinct().order_by('filter_used')
-        situation_types = [stype for stype in situation_types_qs if stype] # Remove None/empty
-
-        severities_qs = VtsSituation.objects.values_list('severity', flat=True).distinct().order_by('severity')
-        severities = [sev for sev in severities_qs if sev] # Remove None/empty
-
-        return JsonResponse({
-            'counties': list(counties),
-            'situation_types': list(situation_types),
-            'severities': list(severities)
-        })
+        return JsonResponse(filter_facets.get().payload)
     except Exception as e:
         # Log the exception for debugging
         print(f"Error fetching filter options: {e}") # Or use logging
         return JsonResponse({'error': 'Could not retrieve filter options.'}, status=500)
-def get_filter_options_geojson(request):
-    try:
-        # Read the geojson file
-        with open('output.geojson', 'r') as file:
-            geojson_data = json.load(file)
-
-        counties = set()
-        situation_types = set()
-        severities = set()
 
-        # Iterate over features in geojson
-        for feature in geojson_data.get('features', []):
-            properties = feature.get('properties', {})
 
-            # Collect unique values for counties, situation types, and severities
-            county = properties.get('county')
-            if county:
-                counties.add(county)
+# Older names of the same endpoint
+get_filter_options_from_db = get_filter_options
+get_filter_options_geojson = get_filter_options
 
-            situation_type = properties.get('situation_type')
-            if situation_type:
-                situation_types.add(situation_type)
 
-            severity = properties.get('severity')
-            if severity:
-                severities.add(severity)
-
-        # Convert sets to lists and return as JSON
-        return JsonResponse({
-            'counties': list(counties),
-            'situation_types': list(situation_types),
-            'severities': list(severities)
-        })
-    except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
-def location_geojson(request):
+async def location_geojson(request):
     '''
     Generate a GeoJSON FeatureCollection containing transit location data
     using GeoDjango model fields and functions.
@@ -263,6 +191,16 @@ def location_geojson(request):
     situation_type = request.GET.get('situation_type', None)
     severity = request.GET.get('severity', None)
 
+    # The ORM is sync-only; run the query on the shared thread-sensitive executor
+    geojson_data = await sync_to_async(_location_geojson_data, thread_sensitive=True)(county, situation_type, severity)
+
+    # Return the FeatureCollection as a JSON response
+    # safe=False is required because the top-level structure is a dictionary
+    return JsonResponse(geojson_data, safe=False)
+
+
+def _location_geojson_data(county, situation_type, severity):
+    """Build the FeatureCollection served by `location_geojson` (sync, touches the ORM)."""
     # Start with base queryset
     locations_qs = VtsSituation.objects.all()
 
@@ -357,18 +295,28 @@ def location_geojson(request):
         "features": features
         # Removed the separate "transit_list" as it's redundant
     }
+    return geojson_data
 
-    # Return the FeatureCollection as a JSON response
-    # safe=False is required because the top-level structure is a dictionary
-    return JsonResponse(geojson_data, safe=False)
-
-def trip(request):
+async def trip(request):
     if request.method == 'POST':
         from_place = request.POST.get('from')
         to_place = request.POST.get('to')
 
-        # Example GeoJSON generation (replace with your actual logic)
-        trip_data = get_trip_geojson(from_place,to_place,num_trips=1)
+        # List active situations near each leg, so riders see disruptions in the same response
+        try:
+            tolerance = float(request.POST.get('tolerance', getattr(settings, 'TRIP_IMPACT_TOLERANCE_METERS', 300)))
+        except ValueError:
+            return JsonResponse({"error": "tolerance must be a number"}, status=400)
+        if not math.isfinite(tolerance) or tolerance <= 0:
+            return JsonResponse({"error": "tolerance must be a positive number of meters"}, status=400)
+        # Every situation within the tolerance is listed with each leg, so keep it bounded
+        tolerance = min(tolerance, getattr(settings, 'TRIP_IMPACT_MAX_TOLERANCE_METERS', 1000))
+
+        # Awaiting the upstream call frees the worker while Entur responds
+        trip_data = await get_trip_geojson_async(from_place,to_place,num_trips=1)
+
+        if trip_data:
+            trip_data = await sync_to_async(annotate_trip_impacts, thread_sensitive=True)(trip_data, tolerance)
 
         return JsonResponse({
             'trip_data': trip_data,
@@ -377,6 +325,16 @@ def trip(request):
     # Render the trip planning page for GET requests
     return render(request, 'trip.html')
 
+def trip_cache_stats(request):
+    """Hit/miss counters of the trip planning cache for this process."""
+    return JsonResponse(trip_cache.stats())
+
+def prometheus_metrics(request):
+    """Prometheus metrics of this process and of the pipeline commands (see map/metrics.py)."""
+    if not metrics.enabled():
+        return HttpResponse("Metrics are disabled.", status=404, content_type="text/plain")
+    return HttpResponse(metrics.exposition(), content_type=metrics.CONTENT_TYPE)
+
 def find_all_collisions(distance_meters=20):
     """
     Finds collision pairs using Raw SQL with SpatiaLite functions.
@@ -526,30 +484,288 @@ def find_all_collisions_details(distance_meters=20):
         # import traceback
         # traceback.print_exc()
         return [] # Return empty list on error
-def get_stored_collisions_view(request):
+STORED_COLLISIONS_DEFAULT_LIMIT = 1000
+STORED_COLLISIONS_MAX_LIMIT = 5000
+STORED_COLLISION_FIELDS = (
+    'id',
+    'transit_information_id', # Gets the ID of the related VtsSituation object
+    'bus_route_id',           # Gets the ID of the related BusRoute object
+    'transit_lon',
+    'transit_lat',
+    'detection_timestamp',
+    'tolerance_meters',
+    'distance_meters',
+)
+# Optional embedded fields (?include=situation,route), read through the same join as the filters
+EMBEDDED_COLLISION_FIELDS = {
+    'situation': {
+        'situation_id': 'transit_information__situation_id',
+        'severity': 'transit_information__severity',
+        'situation_type': 'transit_information__filter_used',
+        'county': 'transit_information__area_name',
+        'road_number': 'transit_information__road_number',
+        'location_description': 'transit_information__location_description',
+    },
+    'route': {
+        'route_id': 'bus_route__route_id',
+    },
+}
+
+
+def _comma_list(request, name):
+    return [value for value in request.GET.get(name, '').split(',') if value]
+
+
+def _query_datetime(value):
+    """ISO 8601 query parameter as an aware datetime (UTC when no offset is given)."""
+    moment = isoparse(value)
+    return moment if moment.tzinfo else moment.replace(tzinfo=dt_timezone.utc)
+
+
+def encode_collision_cursor(detection_timestamp, collision_id):
+    """Opaque keyset cursor for the position after (detection_timestamp, id)."""
+    raw = f"{detection_timestamp.isoformat()}|{collision_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_collision_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, collision_id = raw.split('|')
+        return isoparse(timestamp), int(collision_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def stored_collisions_query(request):
+    """
+    Parse the query parameters of `get_stored_collisions_view`.
+
+    Returns:
+        (filters Q, cursor or None, limit, includes); raises ValueError on bad input.
+    """
+    filters = Q()
+    routes = _comma_list(request, 'route')
+    if routes:
+        filters &= Q(bus_route__route_id__in=routes)
+    severities = _comma_list(request, 'severity')
+    if severities:
+        filters &= Q(transit_information__severity__in=severities)
+    situations = _comma_list(request, 'situation')
+    if situations:
+        filters &= Q(transit_information__situation_id__in=situations)
+    if request.GET.get('tolerance'):
+        # Each pair is stored once with its smallest tier, so a tier includes the smaller ones
+        filters &= Q(tolerance_meters__lte=int(request.GET['tolerance']))
+    if request.GET.get('max_distance'):
+        filters &= Q(distance_meters__lte=float(request.GET['max_distance']))
+    if request.GET.get('since'):
+        filters &= Q(detection_timestamp__gte=_query_datetime(request.GET['since']))
+    if request.GET.get('until'):
+        filters &= Q(detection_timestamp__lt=_query_datetime(request.GET['until']))
+
+    cursor = decode_collision_cursor(request.GET['cursor']) if request.GET.get('cursor') else None
+    limit = int(request.GET.get('limit', STORED_COLLISIONS_DEFAULT_LIMIT))
+    if limit < 1:
+        raise ValueError("limit must be positive.")
+    limit = min(limit, STORED_COLLISIONS_MAX_LIMIT)
+
+    includes = _comma_list(request, 'include')
+    unknown = set(includes) - set(EMBEDDED_COLLISION_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown include: {', '.join(sorted(unknown))}.")
+    return filters, cursor, limit, includes
+
+
+async def get_stored_collisions_view(request):
     """
     API endpoint to retrieve pre-calculated and stored collision data
-    from the DetectedCollision table.
-    Supports optional filtering by detection timestamp.
+    from the DetectedCollision table, newest first, one page at a time.
+
+    Query Parameters (all optional, comma separated for several values):
+        route (str): BusRoute.route_id values.
+        severity (str): Situation severities.
+        situation (str): Situation IDs (situation_id).
+        tolerance (int): Only collisions in this proximity tier in meters
+            (the smallest of settings.COLLISION_TIERS_METERS they are within).
+        max_distance (float): Only collisions at most this many meters from the route.
+        since, until (ISO 8601): detection_timestamp >= since and < until.
+        include (str): Embed "situation" and/or "route" fields in every collision.
+        limit (int): Page size (default 1000, at most 5000).
+        cursor (str): `next_cursor` of the previous page.
+
+    The response has `next_cursor`, which is null on the last page.
     """
-    # Optional: Filter by tolerance if multiple tolerances are stored
-    # tolerance_filter = request.GET.get('tolerance', None)
+    try:
+        filters, cursor, limit, includes = stored_collisions_query(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    collision_data, next_cursor = await sync_to_async(_stored_collisions, thread_sensitive=True)(
+        filters, cursor, limit, includes,
+    )
 
-    # Start querying the storage model
-    queryset = DetectedCollision.objects.all()
+    # Return the data. The key "stored_collisions" clearly indicates the source.
+    return JsonResponse({"stored_collisions": collision_data, "next_cursor": next_cursor})
 
 
-    # Select only the fields needed for the API response using values() for efficiency
-    # Note: Django automatically gives you the foreign key ID when you access
-    # the ForeignKey field name in .values()
-    collision_data = list(queryset.values(
-        'transit_information_id', # Gets the ID of the related VtsSituation object
-        'bus_route_id',           # Gets the ID of the related BusRoute object
-        'transit_lon',
-        'transit_lat',
-        'detection_timestamp',
-        'tolerance_meters'
-    ))
+def _stored_collisions(filters=Q(), cursor=None, limit=STORED_COLLISIONS_DEFAULT_LIMIT, includes=()):
+    """
+    Read one page of stored collisions for `get_stored_collisions_view` (sync, touches the ORM).
 
-    # Return the data. The key "stored_collisions" clearly indicates the source.
-    return JsonResponse({"stored_collisions": collision_data})
\ No newline at end of file
+    Keyset pagination on (detection_timestamp, id): every page is an index range
+    scan, however deep, and at most `limit` + 1 rows are read.
+    """
+    queryset = DetectedCollision.objects.filter(filters)
+    if cursor is not None:
+        timestamp, collision_id = cursor
+        queryset = queryset.filter(
+            Q(detection_timestamp__lt=timestamp) | Q(detection_timestamp=timestamp, id__lt=collision_id)
+        )
+
+    embedded = {name: EMBEDDED_COLLISION_FIELDS[name] for name in includes}
+    lookups = [lookup for fields in embedded.values() for lookup in fields.values()]
+    rows = list(queryset.order_by('-detection_timestamp', '-id').values(*STORED_COLLISION_FIELDS, *lookups)[:limit + 1])
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_collision_cursor(rows[-1]['detection_timestamp'], rows[-1]['id'])
+    for row in rows:
+        for name, fields in embedded.items():
+            row[name] = {key: row.pop(lookup) for key, lookup in fields.items()}
+    return rows, next_cursor
+
+async def affected_routes_view(request):
+    """
+    Routes that currently collide with active situations, one entry per route
+    with the collision count, the highest severity and the latest situation IDs.
+
+    Query Parameters:
+        route (str, optional): Only these BusRoute.route_id values (comma separated).
+    """
+    route_ids = [value for value in request.GET.get('route', '').split(',') if value]
+    routes = await sync_to_async(_affected_routes, thread_sensitive=True)(route_ids)
+    return JsonResponse({"routes": routes})
+
+def vehicle_tracks(request):
+    """
+    Recent tracks of live vehicles as a GeoJSON FeatureCollection of LineStrings,
+    downsampled, from the ring buffer fetch_vehicle_positions maintains.
+
+    Query Parameters:
+        line (str, optional): Only these lineRefs, e.g. TRO:Line:1_26 (comma separated).
+        minutes (float, optional): Only positions from the last minutes before the newest one
+            (default: all that is kept).
+        tolerance (float, optional): Douglas–Peucker tolerance in meters
+            (default: VEHICLE_TRACK_TOLERANCE_METERS; 0 keeps every position).
+        bucket (float, optional): Keep only the last position per bucket of this many seconds.
+    """
+    try:
+        minutes = float(request.GET['minutes']) if request.GET.get('minutes') else None
+        tolerance = float(request.GET.get('tolerance', getattr(settings, 'VEHICLE_TRACK_TOLERANCE_METERS', 10)))
+        bucket = float(request.GET['bucket']) if request.GET.get('bucket') else None
+    except ValueError:
+        return JsonResponse({"error": "minutes, tolerance and bucket must be numbers"}, status=400)
+    if not all(math.isfinite(value) for value in (tolerance, bucket, minutes) if value is not None):
+        return JsonResponse({"error": "minutes, tolerance and bucket must be finite numbers"}, status=400)
+    if tolerance < 0 or (bucket is not None and bucket <= 0) or (minutes is not None and minutes <= 0):
+        return JsonResponse({"error": "minutes and bucket must be positive, tolerance not negative"}, status=400)
+
+    tracks_path = getattr(settings, 'VEHICLE_TRACKS_PATH', None) or os.path.join(settings.BASE_DIR, "vehicle_tracks.json")
+    data = track_file.get(tracks_path)
+    if data is None:
+        return JsonResponse({"error": "vehicle tracks file not found"}, status=404)
+
+    lines = set(_comma_list(request, 'line'))
+    since = max((vehicle['t'][-1] for vehicle in data['vehicles']), default=0) - minutes * 60 if minutes else None
+    features = []
+    for vehicle in data['vehicles']:
+        if lines and vehicle['line'] not in lines:
+            continue
+        times = np.asarray(vehicle['t'])
+        lonlat = np.column_stack((vehicle['lon'], vehicle['lat']))
+        if since is not None:
+            recent = times >= since
+            times, lonlat = times[recent], lonlat[recent]
+        if len(times) == 0:
+            continue
+        keep = downsample_track(times, lonlat, tolerance=tolerance, bucket_seconds=bucket)
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": lonlat[keep].tolist()},
+            "properties": {
+                "vehicleId": vehicle['vehicleId'],
+                "line": vehicle['line'],
+                "timestamps": times[keep].tolist(),
+                "positions": len(times),
+            },
+        })
+    return JsonResponse({"type": "FeatureCollection", "features": features})
+
+def routes_near(request):
+    """
+    Bus routes passing within `distance` meters of a point, nearest first,
+    from the memory-mapped route index (no database query).
+
+    Query Parameters:
+        lon, lat (float): The point (WGS84).
+        distance (float, optional): Meters, at most ROUTES_NEAR_MAX_DISTANCE_METERS (default 300).
+    """
+    try:
+        lon = float(request.GET['lon'])
+        lat = float(request.GET['lat'])
+        distance = float(request.GET.get('distance', 300))
+    except (KeyError, ValueError):
+        return JsonResponse({"error": "lon and lat are required numbers, distance must be a number"}, status=400)
+    max_distance = getattr(settings, 'ROUTES_NEAR_MAX_DISTANCE_METERS', 5000)
+    if not is_epsg_4326(lon, lat) or not 0 <= distance <= max_distance:
+        return JsonResponse({"error": f"lon/lat must be WGS84 and distance between 0 and {max_distance}"}, status=400)
+
+    index = get_route_index()
+    if index is None:
+        return JsonResponse({"error": "route index not built yet (run import_bus_routes)"}, status=503)
+    _, route_index, distances = index.pairs_within(project_lonlat([(lon, lat)]), distance)
+    routes = [
+        {"id": int(index.route_pks[i]), "route_id": index.route_id(i), "distance_meters": round(float(d), 1)}
+        for i, d in sorted(zip(route_index.tolist(), distances.tolist()), key=lambda pair: pair[1])
+    ]
+    return JsonResponse({"routes": routes, "index_version": f"{index.version:016x}"})
+
+async def live_events(request):
+    """
+    Server-Sent Events stream of situation and collision changes.
+
+    Query Parameters (all optional, comma separated for several values):
+        county (str): Only events for these area_name values.
+        severity (str): Only events with these severities.
+        route (str): Only events linked to these BusRoute.route_id values.
+
+    Each message is `event: <name>` with a JSON `data:` line. If the client
+    reads too slowly its oldest buffered events are dropped and an `overflow`
+    event reports how many were lost, so the client can reload via REST.
+    """
+    client = hub.subscribe(ClientFilter.from_query(request.GET))
+    hub.ensure_watcher()
+    keepalive = getattr(settings, 'LIVE_FEED_KEEPALIVE_SECONDS', 15)
+
+    async def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                batch = await client.next_batch(timeout=keepalive)
+                dropped = client.take_dropped()
+                if dropped:
+                    yield f"event: overflow\ndata: {json.dumps({'dropped': dropped})}\n\n"
+                if not batch:
+                    yield ": keepalive\n\n"
+                    continue
+                for event in batch:
+                    data = json.dumps(event.data, ensure_ascii=False, default=str)
+                    yield f"id: {event.seq}\nevent: {event.event}\ndata: {data}\n\n"
+        finally:
+            hub.unsubscribe(client)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop reverse proxies from buffering the stream
+    return response
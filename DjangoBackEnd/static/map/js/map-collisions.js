@@ -45,13 +45,20 @@ async function toggleCollisionPointsLayer() {
         toggleButton.textContent = 'Hide Collision Points';
         try {
             console.log("Fetching stored collision data for points...");
-            const response = await fetch(API_STORED_COLLISIONS); // Use constant from map-config.js
-            if (!response.ok) throw new Error(`HTTP error! Status: ${response.status}`);
-
-            const collisionApiResponse = await response.json();
-            const collisionData = collisionApiResponse.stored_collisions || []; // Use correct key from your API response
-
-            if (!Array.isArray(collisionData)) throw new Error("Invalid collision data format.");
+            // The API is paginated: follow next_cursor until the last page
+            const collisionData = [];
+            let cursor = null;
+            do {
+                const url = cursor ? `${API_STORED_COLLISIONS}?cursor=${encodeURIComponent(cursor)}` : API_STORED_COLLISIONS; // Use constant from map-config.js
+                const response = await fetch(url);
+                if (!response.ok) throw new Error(`HTTP error! Status: ${response.status}`);
+
+                const collisionApiResponse = await response.json();
+                const page = collisionApiResponse.stored_collisions || []; // Use correct key from your API response
+                if (!Array.isArray(page)) throw new Error("Invalid collision data format.");
+                collisionData.push(...page);
+                cursor = collisionApiResponse.next_cursor;
+            } while (cursor);
 
             console.log(`Received ${collisionData.length} stored collision records.`);
 
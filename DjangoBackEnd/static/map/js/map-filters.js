@@ -33,13 +33,17 @@ async function populateDropdowns() {
         }
         
         const data = await response.json();
+        const counts = data.counts || {};
+        // "Troms (12)": number of situations per option
+        const withCount = (label, facet, value) =>
+            counts[facet] && counts[facet][value] !== undefined ? `${label} (${counts[facet][value]})` : label;
         
         // Populate county dropdown
         const countyDropdown = document.getElementById("county-dropdown");
         data.counties.forEach(county => {
             const option = document.createElement("option");
             option.value = county;
-            option.textContent = county;
+            option.textContent = withCount(county, 'counties', county);
             countyDropdown.appendChild(option);
         });
         
@@ -48,7 +52,7 @@ async function populateDropdowns() {
         data.situation_types.forEach(type => {
             const option = document.createElement("option");
             option.value = type;
-            option.textContent = type;
+            option.textContent = withCount(type, 'situation_types', type);
             situationDropdown.appendChild(option);
         });
 
@@ -57,7 +61,7 @@ async function populateDropdowns() {
         data.severities.forEach(severity => {
             const option = document.createElement("option");
             option.value = severity;
-            option.textContent = severity.charAt(0).toUpperCase() + severity.slice(1);
+            option.textContent = withCount(severity.charAt(0).toUpperCase() + severity.slice(1), 'severities', severity);
             severityDropdown.appendChild(option);
         });
     } catch (error) {
@@ -3,6 +3,10 @@ ASGI config for univ project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with an ASGI server (e.g. ``uvicorn univ.asgi:application``) so the
+live feed at ``/api/live/`` can hold many streaming connections without tying
+up a worker per client.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "map.metrics.MetricsMiddleware",
+    "map.query_profiler.QueryProfilingMiddleware", # Only active with QUERY_PROFILING = True
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -116,6 +118,66 @@ MQTT_BROKER_PORT = 1883
 MQTT_USERNAME = None  # No username needed for default local setup
 MQTT_PASSWORD = None  # No password needed
 MQTT_BASE_COLLISION_TOPIC = 'vts/collisions' 
+# Upstream APIs (Entur, VTS). Shared pooled clients live in map/upstream.py
+ENTUR_JOURNEY_PLANNER_URL = "https://api.entur.io/journey-planner/v3/graphql"
+ENTUR_CLIENT_NAME = 'TromsøFylkeskommune-svipper-Studenter'
+# Live bus positions (fetch_vehicle_positions, map/vehicles.py), served at /api/serve_bus/
+ENTUR_VEHICLES_URL = "https://api.entur.io/realtime/v2/vehicles/graphql"
+VEHICLE_CODESPACE = 'TRO'
+VEHICLE_POSITIONS_PATH = BASE_DIR / "bus_positions.json"
+VEHICLE_POLL_SECONDS = 10
+VEHICLE_MAX_AGE_SECONDS = 600 # Vehicles not reported for this long are dropped
+VEHICLE_SITUATION_TOLERANCE_METERS = 100 # Vehicles this close to an active situation are flagged
+VEHICLE_TRACKS_PATH = BASE_DIR / "vehicle_tracks.json" # Recent tracks per vehicle, for /api/vehicles/tracks/
+VEHICLE_TRACK_MINUTES = 30 # History kept per vehicle (a fixed-size ring buffer)
+VEHICLE_TRACK_TOLERANCE_METERS = 10 # Default Douglas–Peucker tolerance of the returned tracks
+# Route shapes (fetch-coordinates): lines per GraphQL request, and the cached schema of the vehicles API
+ROUTE_FETCH_BATCH_SIZE = 20
+ENTUR_VEHICLES_SCHEMA_PATH = BASE_DIR / "data" / "vehicles_schema.json"
+ENTUR_SCHEMA_MAX_AGE_HOURS = 24 * 7 # Fetch the schema again after this long (or with --refresh-schema)
+UPSTREAM_TIMEOUT_SECONDS = 10 # Upper bound for any single upstream call
+UPSTREAM_CONNECT_TIMEOUT_SECONDS = 5
+UPSTREAM_MAX_CONNECTIONS = 20 # Pooled keep-alive connections per process
+UPSTREAM_RETRIES = 3 # Connection errors, timeouts and 429/5xx answers
+UPSTREAM_RETRY_BACKOFF_SECONDS = 0.5 # Doubled after each retry
+# VTS DATEX II situations (fetch_vts_situations). With DATEX_FILTERS empty the unfiltered snapshot is
+# fetched; otherwise each listed filter/<Type> feed is fetched concurrently with its own If-Modified-Since.
+DATEX_BASE_URL = "https://datex-server-get-v3-1.atlas.vegvesen.no/datexapi/GetSituation/pullsnapshotdata/"
+DATEX_FILTERS = [] # e.g. ['Accident', 'AbnormalTraffic', 'MaintenanceWorks', 'ConstructionWorks']
+DATEX_FETCH_WORKERS = 8
+# Opt-in raw snapshot archive for replay_snapshots (map/snapshot_archive.py), e.g. BASE_DIR / "data" / "datex_archive"
+DATEX_ARCHIVE_DIR = None
+DATEX_ARCHIVE_CODEC = None # 'zstd' (needs the zstandard package) or 'gzip'; default: zstd when installed
+# Trip planning cache (map/trip_cache.py), stats at /api/trip-cache/stats/
+TRIP_CACHE_MAX_ENTRIES = 512
+TRIP_CACHE_TTL_SECONDS = 120 # Keep at or below the bucket size
+TRIP_CACHE_BUCKET_SECONDS = 300 # Trips planned within the same 5 minutes share an entry
+# Trip impact check: situations within this distance of a trip leg are listed with the leg
+TRIP_IMPACT_TOLERANCE_METERS = 300
+TRIP_IMPACT_MAX_TOLERANCE_METERS = 1000 # Larger ?tolerance= values on /trip/ are clamped to this
+SITUATION_INDEX_REFRESH_SECONDS = 30 # How often the in-memory situation index checks for new data
+# Proximity tiers of stored collisions: calculate_and_store_collisions detects once at the largest tier and
+# stores each pair's distance and smallest tier (DetectedCollision.distance_meters / tolerance_meters)
+COLLISION_TIERS_METERS = [50, 150, 300]
+ROUTE_SIMPLIFY_TOLERANCE_METERS = 5 # Max error of the simplified BusRoute geometry used for collisions and /api/busroute/ (map/route_geometry.py)
+ROUTE_INDEX_PATH = BASE_DIR / "data" / "route_index.bin" # Memory-mapped route segment index written by import_bus_routes (map/route_index.py)
+ROUTE_INDEX_CELL_METERS = 1000 # Grid cell size of the route index
+ROUTE_INDEX_REFRESH_SECONDS = 30 # How often processes check for a new route index file
+FILTER_OPTIONS_REFRESH_SECONDS = 30 # How often the in-memory filter options (map/facets.py) check for a new ingest
+FILE_CACHE_STAT_INTERVAL_SECONDS = 0 # Seconds between stat() calls on the files served from memory (map/file_cache.py); 0 = every request
+# Live feed (Server-Sent Events at /api/live/, needs an ASGI server):
+LIVE_FEED_POLL_SECONDS = 5 # How often the web process checks the database for changes
+LIVE_FEED_CLIENT_BUFFER = 256 # Events buffered per client before the oldest are dropped
+LIVE_FEED_KEEPALIVE_SECONDS = 15 # Comment line sent when there is nothing to report
+# Prometheus metrics at /metrics (map/metrics.py). False turns every metric into a no-op.
+METRICS_ENABLED = True
+# Where management commands (run_cron) leave their metrics for /metrics, e.g. BASE_DIR / "data" / "metrics"
+METRICS_DIR = None
+# Per-request SQL profiling (map/query_profiler.py): Server-Timing header and periodic per-view reports
+QUERY_PROFILING = False
+QUERY_PROFILING_SLOW_MS = 500 # Statements slower than this are logged right away
+QUERY_PROFILING_REPORT_SECONDS = 300
+QUERY_PROFILING_REPORT_PATH = None # Also append each report as a JSON line here
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -1,18 +1,24 @@
 import requests
 import logging
 import json
-import xml.etree.ElementTree as ET
+from functools import lru_cache
+from itertools import groupby
+import numpy as np
 from pyproj import CRS, Transformer
 from dotenv import load_dotenv
 import os
+from map.datex import iter_records
 
 load_dotenv()
 
 username = os.getenv("brukernavn")
 password = os.getenv("passord")
 
-# Initialize transformer from EPSG:25833 to EPSG:4326
-transformer = Transformer.from_crs("EPSG:25833", "EPSG:4326", always_xy=True)
+
+@lru_cache(maxsize=None)
+def get_transformer():
+    """Transformer from EPSG:25833 to EPSG:4326, created on first use instead of at import."""
+    return Transformer.from_crs("EPSG:25833", "EPSG:4326", always_xy=True)
 
 def is_epsg_4326(lon, lat):
     """Check if coordinates are already in EPSG:4326 (lon/lat or lat/lon format)."""
@@ -25,6 +31,53 @@ def is_epsg_4326(lon, lat):
     return False
 
 
+def epsg_4326_mask(pairs):
+    """Vectorized `is_epsg_4326` over an (n, 2) array of coordinate pairs."""
+    first, second = np.abs(pairs[:, 0]), np.abs(pairs[:, 1])
+    return ((first <= 180) & (second <= 90)) | ((first <= 90) & (second <= 180))
+
+
+def parse_pos_list(text):
+    """Parse a posList string into an (n, 2) float array of coordinate pairs (an odd trailing value is dropped)."""
+    values = np.array(text.split(), dtype=np.float64)
+    return values[:len(values) // 2 * 2].reshape(-1, 2)
+
+
+def pos_lists_to_lonlat(pos_arrays):
+    """
+    Convert posList arrays to lists of (lon, lat) tuples.
+
+    WGS84 pairs come as (lat, lon) and are swapped. Other pairs are taken as
+    EPSG:25833 (easting, northing). The CRS check runs once per array, and all
+    pairs that need projecting, across every array, go through one
+    `transform` call.
+    """
+    results = []
+    pending = []  # (result index, row mask, projected pairs)
+    for pairs in pos_arrays:
+        mask = epsg_4326_mask(pairs)
+        lonlat = pairs[:, ::-1].copy()
+        if not mask.all():
+            pending.append((len(results), ~mask, pairs[~mask]))
+        results.append(lonlat)
+
+    if pending:
+        batch = np.concatenate([pairs for _, _, pairs in pending])
+        lons, lats = get_transformer().transform(batch[:, 0], batch[:, 1])
+        transformed = np.column_stack((lons, lats))
+        offset = 0
+        for index, rows, pairs in pending:
+            results[index][rows] = transformed[offset:offset + len(pairs)]
+            offset += len(pairs)
+
+    # (lon, lat) tuples from one flat tolist() per array: much cheaper than nested lists
+    converted = []
+    for lonlat in results:
+        flat = lonlat.ravel().tolist()
+        converted.append(list(zip(flat[0::2], flat[1::2])))
+    return converted
+
+
 # Function to read credentials from a text file
 def read_credentials(filename='credentials.txt'):
     try:
@@ -43,11 +96,6 @@ logging.basicConfig(level=logging.INFO)
 # Define URL
 url = "https://datex-server-get-v3-1.atlas.vegvesen.no/datexapi/GetSituation/pullsnapshotdata?srti=True"
 
-# If credentials are not found, exit
-if not username or not password:
-    logging.error("No valid credentials found. Exiting...")
-    exit(1)
-
 # Fetch XML data from the API
 def fetch_xml_data():
     logging.info("Fetching XML data from the API...")
@@ -60,140 +108,85 @@ def fetch_xml_data():
         logging.error(f"Error fetching XML data: {e}")
         return None
     
-# Function to parse XML and convert to GeoJSON
-def parse_xml_to_geojson(xml_data):
-    logging.info("Parsing XML data...")
-    try:
-        # Define namespaces
-        namespaces = {
-            'ns2': 'http://datex2.eu/schema/3/messageContainer',
-            'ns3': 'http://datex2.eu/schema/3/cisInformation',
-            'ns4': 'http://datex2.eu/schema/3/exchangeInformation',
-            'ns5': 'http://datex2.eu/schema/3/informationManagement',
-            'ns6': 'http://datex2.eu/schema/3/dataDictionaryExtension',
-            'ns7': 'http://datex2.eu/schema/3/cctvExtension',
-            'ns8': 'http://datex2.eu/schema/3/locationReferencing',
-            'ns9': 'http://datex2.eu/schema/3/alertCLocationCodeTableExtension',
-            'ns10': 'http://datex2.eu/schema/3/roadTrafficData',
-            'ns11': 'http://datex2.eu/schema/3/vms',
-            'ns12': 'http://datex2.eu/schema/3/situation',
-            'ns0': 'http://datex2.eu/schema/3/common'
-        }
+def group_by_situation(records):
+    """Group consecutive `SituationRecord`s into (situation_id, [records]) pairs."""
+    for situation_id, group in groupby(records, key=lambda record: record.situation_id):
+        yield situation_id or 'Unknown', list(group)
 
-        # Parse the XML data
-        root = ET.fromstring(xml_data)
 
-        # Find all situations
-        situations = root.findall('.//ns12:situation', namespaces)
+def first_of(records, field, default):
+    """The first non-empty value of `field` among a situation's records."""
+    for record in records:
+        value = getattr(record, field)
+        if value:
+            return value
+    return default
 
-        if not situations:
-            logging.warning("No situations found in the XML data.")
-            return None
 
+# Function to parse XML and convert to GeoJSON
+def parse_xml_to_geojson(xml_data):
+    logging.info("Parsing XML data...")
+    try:
         geojson_features = []
+        features_with_lines = []
 
-        for situation in situations:
-            situation_id = situation.attrib.get('id', 'Unknown')
+        # The shared parser walks each situationRecord once; records arrive in document order
+        for situation_id, records in group_by_situation(iter_records(xml_data)):
             logging.info(f"Processing situation with ID: {situation_id}")
 
-            # Extracting additional properties
-            severity = situation.find('.//ns12:severity', namespaces)
-            comments = situation.findall('.//ns12:generalPublicComment/ns12:comment', namespaces)
-            county = situation.find('.//ns8:namedArea/ns8:areaName/ns0:values/ns0:value', namespaces)
-            situation_type = situation.find('.//ns12:situationRecord/ns12:probabilityOfOccurrence', namespaces)
-            # Extract Road Name & Road Number
-            road_name_element = situation.find('.//ns8:roadInformation/ns8:roadName', namespaces)
-            road_number_element = situation.find('.//ns8:roadInformation/ns8:roadNumber', namespaces)
-            roadclose = situation.find('.//ns12:roadOrCarriagewayOrLaneManagementType', namespaces)
-
-            # Convert to text if element exists, otherwise use default
-            severity_text = severity.text if severity is not None else "Unknown"
-            roadclose_text = roadclose.text if roadclose is not None else "unknown"
-            county_text = county.text if county is not None else "Unknown"
-            situation_type_text = situation_type.text if situation_type is not None else "Unknown"
-            road_name_text = road_name_element.text if road_name_element is not None else "Unknown Road Name"
-            road_number_text = road_number_element.text if road_number_element is not None else "Unknown Road Number"
-
-            # Collect all location descriptions
-            location_description_text = []
-
-            # Extract locationDescriptions
-            location_descriptions = situation.findall('.//ns8:locationDescription', namespaces)
-
-            for location_description in location_descriptions:
-                values = location_description.find('.//ns0:values', namespaces)  # Ensure correct namespace
-                if values is not None:
-                    value = values.find('.//ns0:value', namespaces)
-                    if value is not None:
-                        location_description_text.append(value.text.strip())  # Strip leading/trailing spaces
-                    else:
-                        location_description_text.append("No value element found in values")
-                else:
-                    location_description_text.append("No values element found for location description.")
-
-            # Remove duplicates while maintaining order
-            location_description_text = list(dict.fromkeys(location_description_text))
-            # Collect all comments
-            comment_text = []
-
-            for comment in comments:
-                values = comment.find('.//ns0:values', namespaces)
-                if values is not None:
-                    value = values.find('.//ns0:value', namespaces)
-                    if value is not None:
-                        comment_text.append(value.text.strip())
-                    else:
-                        comment_text.append("no value found")
-                else:
-                    comment_text.append("no values found")
-                    
-            comment_text = list(dict.fromkeys(comment_text))
-                    
-            # Extract LineString coordinates (if available)
-            gml_line_elements = situation.findall('.//ns8:gmlLineString', namespaces)
-            coordinates = []
-
-            if gml_line_elements:
-                first_gml_line = gml_line_elements[0]  # Only process the first gmlLineString
-                pos_list = first_gml_line.find('.//ns8:posList', namespaces)
-                if pos_list is not None and pos_list.text:
-                    coord_list = list(map(float, pos_list.text.split()))
-                    extracted_coords = [(coord_list[i], coord_list[i+1]) for i in range(0, len(coord_list), 2)]
-
-                    transformed_coords = []
-                    for lat, lon in extracted_coords:
-                        if is_epsg_4326(lat, lon):
-                            transformed_coords.append((lon, lat))  # Already in EPSG:4326
-                        else:
-                            # Transform from EPSG:25833 to EPSG:4326
-                            new_lat, new_lon = transformer.transform(lat, lon)
-                            transformed_coords.append((new_lat, new_lon))
-            
-                    coordinates = transformed_coords
-                    logging.info(f"Extracted {len(coordinates)} coordinate pairs for situation {situation_id}.")
-    
-            # Extract Point
-            lat_element = situation.find('.//ns8:coordinatesForDisplay/ns8:latitude', namespaces)
-            lon_element = situation.find('.//ns8:coordinatesForDisplay/ns8:longitude', namespaces)
-            point_coordinates = [float(lon_element.text), float(lat_element.text)] if lat_element is not None and lon_element is not None else None
+            # Collect all location descriptions and comments (stripped), removing duplicates while maintaining order
+            location_description_text = list(dict.fromkeys(
+                text.strip() for record in records for text in record.location_descriptions))
+            comment_text = list(dict.fromkeys(text.strip() for record in records for text in record.comments))
+            county_names = [name for record in records for name in record.area_names]
+
+            # Extract LineString coordinates (if available); converted for all situations at once below
+            pos_array = None
+            pos_list = first_of(records, 'pos_list', None)  # Only process the first gmlLineString
+            if pos_list:
+                pos_array = parse_pos_list(pos_list)
+                if len(pos_array) == 0:
+                    pos_array = None
+
+            # Extract Point (coordinatesForDisplay only)
+            point_coordinates = None
+            for record in records:
+                if record.display_latitude and record.display_longitude:
+                    point_coordinates = [float(record.display_longitude), float(record.display_latitude)]
+                    break
 
             # Create GeoJSON feature
             feature = {
                 "type": "Feature",
                 "properties": {
                     "id": situation_id,
-                    "name": road_name_text, 
-                    "road_number" : road_number_text,
+                    "name": first_of(records, 'road_name', "Unknown Road Name"),
+                    "road_number" : first_of(records, 'road_number', "Unknown Road Number"),
                     "description": " | ".join(location_description_text),  # Concatenate descriptions
-                    "severity": severity_text,
+                    "severity": first_of(records, 'severity', "Unknown"),
                     "comment": "".join(comment_text),
-                    "county": county_text,
-                    "situation_type": situation_type_text,
-                    "road close" : roadclose_text
+                    "county": county_names[0] if county_names else "Unknown",
+                    "situation_type": first_of(records, 'probability_of_occurrence', "Unknown"),
+                    "road close" : first_of(records, 'road_management_type', "unknown")
                 },
                 "geometry": {}
             }
 
+            features_with_lines.append((feature, pos_array, point_coordinates))
+
+        if not features_with_lines:
+            logging.warning("No situations found in the XML data.")
+            return None
+
+        # One batched coordinate conversion for every posList in the snapshot
+        converted = iter(pos_lists_to_lonlat([pos_array for _, pos_array, _ in features_with_lines if pos_array is not None]))
+
+        for feature, pos_array, point_coordinates in features_with_lines:
+            situation_id = feature["properties"]["id"]
+            coordinates = next(converted) if pos_array is not None else []
+            if coordinates:
+                logging.info(f"Extracted {len(coordinates)} coordinate pairs for situation {situation_id}.")
+
             # Add geometry type based on available coordinates
             if coordinates and point_coordinates:
                 feature["geometry"]["type"] = "GeometryCollection"
@@ -245,6 +238,11 @@ def save_geojson(geojson, filename='output.geojson'):
 
 # Main function to orchestrate fetching, parsing, and saving data
 def main():
+    # If credentials are not found, exit
+    if not username or not password:
+        logging.error("No valid credentials found. Exiting...")
+        exit(1)
+
     # Fetch the XML data
     xml_data = fetch_xml_data()
     